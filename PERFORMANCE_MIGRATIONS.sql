@@ -0,0 +1,424 @@
+-- =====================================================================
+-- FINUCITY PERFORMANCE MIGRATIONS
+-- Run in Supabase SQL Editor after COMPLETE_DATABASE_SETUP.sql
+-- Every statement is idempotent and safe to re-run
+-- Author: Sumeet Sangwan
+-- =====================================================================
+
+-- =====================================================================
+-- PART 1: CHAT HISTORY EXPORT & CLEAR-HISTORY
+-- =====================================================================
+
+-- Keyset pagination for exports and batched purges: (user_id, created_at, id)
+CREATE INDEX IF NOT EXISTS idx_chat_queries_user_created_id
+    ON public.chat_queries(user_id, created_at, id);
+
+-- Clear-history tombstone: rows created at or before this are hidden
+-- while the background purge deletes them in batches
+ALTER TABLE public.profiles
+    ADD COLUMN IF NOT EXISTS history_cleared_at TIMESTAMP WITH TIME ZONE;
+
+-- =====================================================================
+-- PART 2: SERVER-SIDE CA AGGREGATES
+-- One row per CA; filter with ?ca_id=eq.<uuid> and the predicate is
+-- pushed below the GROUP BY, so cost follows the indexes, not history.
+-- Read by finucity/aggregates.py (falls back to Python when missing)
+-- =====================================================================
+
+CREATE INDEX IF NOT EXISTS idx_ca_earnings_ca_type_status
+    ON public.ca_earnings(ca_id, transaction_type, status);
+CREATE INDEX IF NOT EXISTS idx_ca_ratings_ca_published
+    ON public.ca_ratings(ca_id, is_published);
+CREATE INDEX IF NOT EXISTS idx_ca_reviews_ca_published
+    ON public.ca_reviews(ca_id, is_published);
+CREATE INDEX IF NOT EXISTS idx_consultations_ca_status
+    ON public.consultations(ca_id, status);
+CREATE INDEX IF NOT EXISTS idx_service_bookings_assigned_ca
+    ON public.service_bookings(assigned_ca_id, status);
+
+-- Earnings: lifetime credits/debits plus the current (UTC) month
+CREATE OR REPLACE VIEW public.ca_earnings_totals
+WITH (security_invoker = true) AS
+SELECT
+    ca_id,
+    COALESCE(SUM(amount) FILTER (WHERE transaction_type = 'credit' AND status = 'completed'), 0) AS total_earned,
+    COALESCE(SUM(amount) FILTER (WHERE transaction_type = 'debit' AND status = 'completed'), 0) AS total_withdrawn,
+    COALESCE(SUM(amount) FILTER (WHERE transaction_type = 'credit' AND status = 'approved'), 0) AS pending_amount,
+    COALESCE(SUM(amount) FILTER (
+        WHERE transaction_type = 'credit'
+          AND created_at >= date_trunc('month', NOW() AT TIME ZONE 'UTC') AT TIME ZONE 'UTC'
+    ), 0) AS this_month_earned,
+    COUNT(*) AS transaction_count
+FROM public.ca_earnings
+GROUP BY ca_id;
+
+-- Trust ratings: split by is_published so callers can pick either set
+CREATE OR REPLACE VIEW public.ca_rating_totals
+WITH (security_invoker = true) AS
+SELECT
+    ca_id,
+    is_published,
+    COUNT(*) AS total_reviews,
+    SUM(overall_rating) AS sum_overall,
+    COALESCE(SUM(communication_rating), 0) AS sum_communication,
+    COALESCE(SUM(expertise_rating), 0) AS sum_expertise,
+    COALESCE(SUM(timeliness_rating), 0) AS sum_timeliness,
+    COALESCE(SUM(value_rating), 0) AS sum_value,
+    COUNT(*) FILTER (WHERE overall_rating = 1) AS rating_1,
+    COUNT(*) FILTER (WHERE overall_rating = 2) AS rating_2,
+    COUNT(*) FILTER (WHERE overall_rating = 3) AS rating_3,
+    COUNT(*) FILTER (WHERE overall_rating = 4) AS rating_4,
+    COUNT(*) FILTER (WHERE overall_rating = 5) AS rating_5
+FROM public.ca_ratings
+GROUP BY ca_id, is_published;
+
+-- Dashboard reviews (published only)
+CREATE OR REPLACE VIEW public.ca_review_totals
+WITH (security_invoker = true) AS
+SELECT
+    ca_id,
+    COUNT(*) AS total_reviews,
+    COALESCE(SUM(rating), 0) AS sum_rating
+FROM public.ca_reviews
+WHERE is_published = TRUE
+GROUP BY ca_id;
+
+-- Consultation pipeline, response and completion inputs
+CREATE OR REPLACE VIEW public.ca_consultation_totals
+WITH (security_invoker = true) AS
+SELECT
+    ca_id,
+    COUNT(DISTINCT client_id) AS total_clients,
+    COUNT(*) FILTER (WHERE status IN ('accepted', 'in_progress')) AS active,
+    COUNT(*) FILTER (WHERE status = 'pending') AS pending,
+    COUNT(*) FILTER (WHERE status = 'completed') AS completed,
+    COUNT(*) FILTER (WHERE status <> 'pending') AS responded,
+    COUNT(*) FILTER (
+        WHERE status <> 'pending' AND updated_at - created_at <= INTERVAL '24 hours'
+    ) AS responded_within_24h
+FROM public.consultations
+GROUP BY ca_id;
+
+-- Service bookings completion
+CREATE OR REPLACE VIEW public.ca_booking_totals
+WITH (security_invoker = true) AS
+SELECT
+    assigned_ca_id AS ca_id,
+    COUNT(*) AS total_bookings,
+    COUNT(*) FILTER (WHERE status = 'completed') AS completed_bookings
+FROM public.service_bookings
+WHERE assigned_ca_id IS NOT NULL
+GROUP BY assigned_ca_id;
+
+GRANT SELECT ON public.ca_earnings_totals, public.ca_rating_totals, public.ca_review_totals,
+    public.ca_consultation_totals, public.ca_booking_totals TO authenticated, service_role;
+
+-- =====================================================================
+-- PART 3: CA EARNINGS LEDGER
+-- Append-only entries with a per-CA sequence and running balance,
+-- checkpoint snapshots every N entries, and RPCs that take a per-CA
+-- advisory lock so balance checks and writes cannot interleave.
+-- available = completed credits + adjustments - withdrawals not rejected
+-- Read/written by finucity/ledger.py
+-- =====================================================================
+
+CREATE TABLE IF NOT EXISTS public.ca_ledger_entries (
+    id BIGSERIAL PRIMARY KEY,
+    ca_id UUID NOT NULL REFERENCES public.profiles(id) ON DELETE CASCADE,
+    seq BIGINT NOT NULL,
+    entry_type TEXT NOT NULL CHECK (entry_type IN ('credit', 'adjustment', 'withdrawal_hold', 'withdrawal_release')),
+    amount NUMERIC(12, 2) NOT NULL,            -- signed effect on the available balance
+    balance_after NUMERIC(12, 2) NOT NULL,
+    reference_id UUID,                         -- ca_earnings.id
+    memo TEXT,
+    created_by UUID,
+    created_at TIMESTAMP WITH TIME ZONE DEFAULT NOW(),
+    UNIQUE (ca_id, seq),
+    UNIQUE (reference_id, entry_type)
+);
+
+CREATE TABLE IF NOT EXISTS public.ca_ledger_snapshots (
+    ca_id UUID NOT NULL REFERENCES public.profiles(id) ON DELETE CASCADE,
+    seq BIGINT NOT NULL,
+    balance NUMERIC(12, 2) NOT NULL,
+    taken_at TIMESTAMP WITH TIME ZONE DEFAULT NOW(),
+    PRIMARY KEY (ca_id, seq)
+);
+
+ALTER TABLE public.ca_ledger_entries ENABLE ROW LEVEL SECURITY;
+ALTER TABLE public.ca_ledger_snapshots ENABLE ROW LEVEL SECURITY;
+DROP POLICY IF EXISTS "CAs read own ledger" ON public.ca_ledger_entries;
+CREATE POLICY "CAs read own ledger" ON public.ca_ledger_entries FOR SELECT USING (auth.uid() = ca_id);
+REVOKE UPDATE, DELETE ON public.ca_ledger_entries FROM authenticated, anon;
+
+-- Entries are immutable; corrections are new adjustment entries
+CREATE OR REPLACE FUNCTION public.ca_ledger_reject_update() RETURNS TRIGGER AS $$
+BEGIN
+    RAISE EXCEPTION 'ca_ledger_entries is append-only';
+END;
+$$ LANGUAGE plpgsql;
+
+DROP TRIGGER IF EXISTS ca_ledger_entries_append_only ON public.ca_ledger_entries;
+CREATE TRIGGER ca_ledger_entries_append_only
+    BEFORE UPDATE ON public.ca_ledger_entries
+    FOR EACH ROW EXECUTE FUNCTION public.ca_ledger_reject_update();
+
+-- Current balance: latest snapshot + entries after it (at most N rows)
+CREATE OR REPLACE FUNCTION public.ledger_balance(p_ca_id UUID)
+RETURNS TABLE (balance NUMERIC, seq BIGINT, snapshot_seq BIGINT) AS $$
+    WITH snap AS (
+        SELECT s.seq, s.balance FROM public.ca_ledger_snapshots s
+        WHERE s.ca_id = p_ca_id ORDER BY s.seq DESC LIMIT 1
+    )
+    SELECT
+        COALESCE((SELECT snap.balance FROM snap), 0)
+            + COALESCE(SUM(e.amount), 0),
+        GREATEST(COALESCE(MAX(e.seq), 0), COALESCE((SELECT snap.seq FROM snap), 0)),
+        COALESCE((SELECT snap.seq FROM snap), 0)
+    FROM public.ca_ledger_entries e
+    WHERE e.ca_id = p_ca_id AND e.seq > COALESCE((SELECT snap.seq FROM snap), 0);
+$$ LANGUAGE sql STABLE;
+
+-- Append one entry under the CA's lock; idempotent per (reference_id, entry_type)
+CREATE OR REPLACE FUNCTION public.ledger_post(
+    p_ca_id UUID, p_entry_type TEXT, p_amount NUMERIC, p_reference_id UUID DEFAULT NULL,
+    p_memo TEXT DEFAULT NULL, p_created_by UUID DEFAULT NULL, p_require_funds BOOLEAN DEFAULT FALSE,
+    p_snapshot_every INTEGER DEFAULT 50
+) RETURNS public.ca_ledger_entries AS $$
+DECLARE
+    v_balance NUMERIC;
+    v_seq BIGINT;
+    v_entry public.ca_ledger_entries;
+BEGIN
+    PERFORM pg_advisory_xact_lock(hashtextextended('ca_ledger:' || p_ca_id::text, 0));
+
+    IF p_reference_id IS NOT NULL THEN
+        SELECT * INTO v_entry FROM public.ca_ledger_entries
+        WHERE reference_id = p_reference_id AND entry_type = p_entry_type;
+        IF FOUND THEN
+            RETURN v_entry;
+        END IF;
+    END IF;
+
+    SELECT b.balance, b.seq INTO v_balance, v_seq FROM public.ledger_balance(p_ca_id) b;
+    IF p_require_funds AND v_balance + p_amount < 0 THEN
+        RAISE EXCEPTION 'insufficient_funds: available %', v_balance USING ERRCODE = 'P0001';
+    END IF;
+
+    INSERT INTO public.ca_ledger_entries (ca_id, seq, entry_type, amount, balance_after, reference_id, memo, created_by)
+    VALUES (p_ca_id, v_seq + 1, p_entry_type, p_amount, v_balance + p_amount, p_reference_id, p_memo, p_created_by)
+    RETURNING * INTO v_entry;
+
+    IF v_entry.seq % p_snapshot_every = 0 THEN
+        INSERT INTO public.ca_ledger_snapshots (ca_id, seq, balance)
+        VALUES (p_ca_id, v_entry.seq, v_entry.balance_after)
+        ON CONFLICT DO NOTHING;
+    END IF;
+    RETURN v_entry;
+END;
+$$ LANGUAGE plpgsql;
+
+-- Withdrawal request: frozen check, earnings row and funds hold in one transaction
+CREATE OR REPLACE FUNCTION public.ledger_request_withdrawal(
+    p_ca_id UUID, p_amount NUMERIC, p_bank_account JSONB DEFAULT NULL, p_description TEXT DEFAULT NULL
+) RETURNS JSONB AS $$
+DECLARE
+    v_earning public.ca_earnings;
+    v_entry public.ca_ledger_entries;
+BEGIN
+    PERFORM pg_advisory_xact_lock(hashtextextended('ca_ledger:' || p_ca_id::text, 0));
+    IF EXISTS (SELECT 1 FROM public.profiles WHERE id = p_ca_id AND earnings_frozen) THEN
+        RAISE EXCEPTION 'earnings_frozen' USING ERRCODE = 'P0001';
+    END IF;
+
+    INSERT INTO public.ca_earnings (ca_id, amount, transaction_type, status, title, description, bank_account_details)
+    VALUES (p_ca_id, p_amount, 'debit', 'pending', 'Withdrawal Request', p_description, p_bank_account)
+    RETURNING * INTO v_earning;
+
+    v_entry := public.ledger_post(p_ca_id, 'withdrawal_hold', -p_amount, v_earning.id,
+                                  p_description, p_ca_id, TRUE);
+    RETURN jsonb_build_object('transaction', to_jsonb(v_earning), 'entry', to_jsonb(v_entry));
+END;
+$$ LANGUAGE plpgsql;
+
+-- Admin adjustment: completed earnings row plus its ledger entry
+CREATE OR REPLACE FUNCTION public.ledger_adjust(
+    p_ca_id UUID, p_amount NUMERIC, p_reason TEXT, p_admin_id UUID
+) RETURNS JSONB AS $$
+DECLARE
+    v_earning public.ca_earnings;
+    v_entry public.ca_ledger_entries;
+BEGIN
+    INSERT INTO public.ca_earnings (ca_id, transaction_type, amount, title, description, status,
+                                    approved_by, approved_at, processed_at)
+    VALUES (p_ca_id, 'adjustment', p_amount, 'Admin Adjustment', p_reason, 'completed',
+            p_admin_id, NOW(), NOW())
+    RETURNING * INTO v_earning;
+
+    v_entry := public.ledger_post(p_ca_id, 'adjustment', p_amount, v_earning.id, p_reason, p_admin_id);
+    RETURN jsonb_build_object('transaction', to_jsonb(v_earning), 'entry', to_jsonb(v_entry));
+END;
+$$ LANGUAGE plpgsql;
+
+-- Freeze/unfreeze under the same lock, so no withdrawal slips past a freeze
+CREATE OR REPLACE FUNCTION public.ledger_set_frozen(p_ca_id UUID, p_frozen BOOLEAN, p_role TEXT DEFAULT NULL)
+RETURNS SETOF public.profiles AS $$
+BEGIN
+    PERFORM pg_advisory_xact_lock(hashtextextended('ca_ledger:' || p_ca_id::text, 0));
+    RETURN QUERY
+        UPDATE public.profiles
+        SET earnings_frozen = p_frozen, last_admin_action_at = NOW()
+        WHERE id = p_ca_id AND (p_role IS NULL OR role = p_role)
+        RETURNING *;
+END;
+$$ LANGUAGE plpgsql;
+
+-- Ledger writes go through the app's service-role client only: PostgREST
+-- must not expose them to anon/authenticated (the withdrawal minimum and
+-- admin checks live in Python)
+REVOKE EXECUTE ON FUNCTION public.ledger_post(UUID, TEXT, NUMERIC, UUID, TEXT, UUID, BOOLEAN, INTEGER)
+    FROM PUBLIC, anon, authenticated;
+GRANT EXECUTE ON FUNCTION public.ledger_post(UUID, TEXT, NUMERIC, UUID, TEXT, UUID, BOOLEAN, INTEGER) TO service_role;
+REVOKE EXECUTE ON FUNCTION public.ledger_request_withdrawal(UUID, NUMERIC, JSONB, TEXT) FROM PUBLIC, anon, authenticated;
+GRANT EXECUTE ON FUNCTION public.ledger_request_withdrawal(UUID, NUMERIC, JSONB, TEXT) TO service_role;
+REVOKE EXECUTE ON FUNCTION public.ledger_adjust(UUID, NUMERIC, TEXT, UUID) FROM PUBLIC, anon, authenticated;
+GRANT EXECUTE ON FUNCTION public.ledger_adjust(UUID, NUMERIC, TEXT, UUID) TO service_role;
+REVOKE EXECUTE ON FUNCTION public.ledger_set_frozen(UUID, BOOLEAN, TEXT) FROM PUBLIC, anon, authenticated;
+GRANT EXECUTE ON FUNCTION public.ledger_set_frozen(UUID, BOOLEAN, TEXT) TO service_role;
+
+-- Credits (and adjustments written elsewhere) are posted as they complete.
+-- SECURITY DEFINER: the trigger still posts when the ca_earnings writer
+-- cannot execute ledger_post itself
+CREATE OR REPLACE FUNCTION public.ca_earnings_to_ledger() RETURNS TRIGGER AS $$
+BEGIN
+    IF NEW.transaction_type IN ('credit', 'adjustment') AND NEW.status = 'completed'
+       AND (TG_OP = 'INSERT' OR OLD.status IS DISTINCT FROM 'completed') THEN
+        PERFORM public.ledger_post(NEW.ca_id, NEW.transaction_type, NEW.amount, NEW.id, NEW.title);
+    END IF;
+    RETURN NEW;
+END;
+$$ LANGUAGE plpgsql SECURITY DEFINER SET search_path = public;
+
+DROP TRIGGER IF EXISTS ca_earnings_ledger ON public.ca_earnings;
+CREATE TRIGGER ca_earnings_ledger
+    AFTER INSERT OR UPDATE OF status ON public.ca_earnings
+    FOR EACH ROW EXECUTE FUNCTION public.ca_earnings_to_ledger();
+
+-- One-time backfill from existing ca_earnings (runs only while the ledger is empty)
+INSERT INTO public.ca_ledger_entries (ca_id, seq, entry_type, amount, balance_after, reference_id, memo, created_at)
+SELECT ca_id,
+       ROW_NUMBER() OVER w,
+       entry_type,
+       amount,
+       SUM(amount) OVER w,
+       id,
+       'backfill',
+       created_at
+FROM (
+    SELECT ca_id, id, created_at, transaction_type AS entry_type, amount, 0 AS step
+    FROM public.ca_earnings
+    WHERE transaction_type IN ('credit', 'adjustment') AND status = 'completed'
+    UNION ALL
+    SELECT ca_id, id, created_at, 'withdrawal_hold', -amount, 0
+    FROM public.ca_earnings
+    WHERE transaction_type = 'debit'
+    UNION ALL
+    SELECT ca_id, id, created_at, 'withdrawal_release', amount, 1
+    FROM public.ca_earnings
+    WHERE transaction_type = 'debit' AND status = 'rejected'
+) src
+WHERE NOT EXISTS (SELECT 1 FROM public.ca_ledger_entries)
+WINDOW w AS (PARTITION BY ca_id ORDER BY created_at, id, step);
+
+INSERT INTO public.ca_ledger_snapshots (ca_id, seq, balance)
+SELECT DISTINCT ON (ca_id) ca_id, seq, balance_after
+FROM public.ca_ledger_entries
+ORDER BY ca_id, seq DESC
+ON CONFLICT DO NOTHING;
+
+-- =====================================================================
+-- PART 4: BULK UPDATES
+-- Different partial updates for many rows in one call, matched on a key
+-- column. Called by finucity/bulk.py BulkWriter.update_many(); returns
+-- the keys that matched a row. Only allowlisted tables (keep in sync with
+-- BULK_UPDATE_TABLES) can be touched.
+-- =====================================================================
+
+CREATE OR REPLACE FUNCTION public.bulk_update_rows(p_table TEXT, p_key TEXT, p_rows JSONB)
+RETURNS JSONB AS $$
+DECLARE
+    v_row JSONB;
+    v_columns TEXT;
+    v_count INTEGER;
+    v_updated JSONB := '[]'::JSONB;
+BEGIN
+    IF p_table NOT IN ('service_catalog', 'notifications') THEN
+        RAISE EXCEPTION 'bulk_update_rows: table % is not allowed', p_table USING ERRCODE = '42501';
+    END IF;
+
+    FOR v_row IN SELECT * FROM jsonb_array_elements(p_rows) LOOP
+        SELECT string_agg(format('%I', k), ', ') INTO v_columns
+        FROM jsonb_object_keys(v_row - p_key) AS k;
+        CONTINUE WHEN v_columns IS NULL;
+
+        -- jsonb_populate_record casts every value to the column's own type
+        EXECUTE format(
+            'UPDATE public.%1$I t SET (%2$s) = (SELECT %2$s FROM jsonb_populate_record(NULL::public.%1$I, $1)) '
+            'WHERE t.%3$I::text = $1->>%4$L',
+            p_table, v_columns, p_key, p_key
+        ) USING v_row;
+        GET DIAGNOSTICS v_count = ROW_COUNT;
+        IF v_count > 0 THEN
+            v_updated := v_updated || jsonb_build_array(v_row -> p_key);
+        END IF;
+    END LOOP;
+    RETURN v_updated;
+END;
+$$ LANGUAGE plpgsql SECURITY DEFINER SET search_path = public;
+
+REVOKE EXECUTE ON FUNCTION public.bulk_update_rows(TEXT, TEXT, JSONB) FROM PUBLIC, anon, authenticated;
+GRANT EXECUTE ON FUNCTION public.bulk_update_rows(TEXT, TEXT, JSONB) TO service_role;
+
+-- =====================================================================
+-- PART 5: USERNAME ALLOCATION
+-- UserService.allocate_username() finds the lowest free `base`, `baseN`
+-- with one anchored regex (^base[0-9]*$) instead of one probe per
+-- suffix. text_pattern_ops lets Postgres answer the anchored prefix from
+-- the index; the UNIQUE index is what settles concurrent signups (the
+-- loser gets 23505 and re-scans).
+-- =====================================================================
+
+-- No-op where COMPLETE_DATABASE_SETUP.sql already created the constraint
+CREATE UNIQUE INDEX IF NOT EXISTS profiles_username_key
+    ON public.profiles(username);
+
+CREATE INDEX IF NOT EXISTS idx_profiles_username_pattern
+    ON public.profiles(username text_pattern_ops);
+
+-- =====================================================================
+-- PART 6: SESSION VERSIONS
+-- finucity.session_snapshot compares the version signed into each
+-- session snapshot with profiles.session_version. UserService
+-- invalidations (role change, suspension, logout) write a new value, so
+-- every host rejects older snapshots and restarts cannot reset it.
+-- =====================================================================
+
+ALTER TABLE public.profiles
+    ADD COLUMN IF NOT EXISTS session_version BIGINT NOT NULL DEFAULT 0;
+
+-- Only the app's service-role client may move it: a user resetting their
+-- own version would revive snapshots issued before a suspension
+CREATE OR REPLACE FUNCTION public.profiles_guard_session_version() RETURNS TRIGGER AS $$
+BEGIN
+    IF NEW.session_version IS DISTINCT FROM OLD.session_version
+       AND current_user IN ('anon', 'authenticated') THEN
+        RAISE EXCEPTION 'session_version is managed by the server' USING ERRCODE = '42501';
+    END IF;
+    RETURN NEW;
+END;
+$$ LANGUAGE plpgsql;
+
+DROP TRIGGER IF EXISTS profiles_session_version_guard ON public.profiles;
+CREATE TRIGGER profiles_session_version_guard
+    BEFORE UPDATE OF session_version ON public.profiles
+    FOR EACH ROW EXECUTE FUNCTION public.profiles_guard_session_version();
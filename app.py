@@ -10,12 +10,12 @@ from logging.handlers import RotatingFileHandler
 from flask import Flask, render_template, request, jsonify, g
 from flask_login import LoginManager
 from flask_limiter import Limiter
-from flask_limiter.util import get_remote_address
 from flask_wtf.csrf import CSRFProtect
 from dotenv import load_dotenv
-from supabase import create_client
+import hmac
 import html
 import time
+import click
 
 # =====================================================================
 # ENVIRONMENT SETUP
@@ -41,9 +41,8 @@ SUPABASE_ANON_KEY = os.environ["SUPABASE_ANON_KEY"]
 SUPABASE_SERVICE_KEY = os.environ["SUPABASE_SERVICE_KEY"]
 SUPABASE_JWT_SECRET = os.environ.get("SUPABASE_JWT_SECRET", "")
 
-def get_supabase_admin():
-    """Get Supabase client with admin privileges"""
-    return create_client(SUPABASE_URL, SUPABASE_SERVICE_KEY)
+# Service-role access goes through finucity.database.get_supabase(), which
+# shares one pooled client per worker instead of building a client per call
 
 # =====================================================================
 # FLASK APP INITIALIZATION
@@ -65,6 +64,12 @@ app.config['PERMANENT_SESSION_LIFETIME'] = 86400  # 24 hours
 app.config['MAX_CONTENT_LENGTH'] = 16 * 1024 * 1024  # 16MB upload limit
 app.config['WTF_CSRF_TIME_LIMIT'] = 3600  # 1 hour CSRF token validity
 
+# Feature flags (same env switches as config.py)
+app.config['ENABLE_CONVERSATION_EXPORT'] = os.getenv('ENABLE_CONVERSATION_EXPORT', 'true').lower() in ['true', '1', 'yes']
+app.config['ENABLE_BULK_OPERATIONS'] = os.getenv('ENABLE_BULK_OPERATIONS', 'true').lower() in ['true', '1', 'yes']
+app.config['ENABLE_WRITE_OUTBOX'] = os.getenv('ENABLE_WRITE_OUTBOX', 'true').lower() in ['true', '1', 'yes']
+app.config['ENABLE_SESSION_SNAPSHOT'] = os.getenv('ENABLE_SESSION_SNAPSHOT', 'false').lower() in ['true', '1', 'yes']
+
 # CSRF Protection
 csrf = CSRFProtect(app)
 # Note: Blueprint exemptions are applied after blueprint registration below
@@ -72,12 +77,17 @@ csrf = CSRFProtect(app)
 # =====================================================================
 # SECURITY: RATE LIMITING
 # =====================================================================
+from finucity.ratelimit import client_ip, rate_limiter
+
+# Shared by all workers on the host through finucity.ratelimit (sliding-window counters)
 limiter = Limiter(
     app=app,
-    key_func=get_remote_address,
+    key_func=client_ip,
     default_limits=["200 per day", "50 per hour"],
-    storage_uri="memory://"
+    storage_uri="finucity://",
+    strategy="sliding-window-counter"
 )
+rate_limiter.init_app(app)
 
 # =====================================================================
 # SECURITY: INPUT SANITIZATION & HEADERS
@@ -130,6 +140,23 @@ from finucity.models import User
 
 supabase_db.init_app(app)
 
+from finucity.history_purge import history_purge
+from finucity.archive import chat_archive
+from finucity.stats_snapshot import stats_snapshot
+from finucity.outbox import outbox
+from finucity.jwks import jwks_store
+from finucity.session_snapshot import session_snapshots
+from finucity.bulk import bulk_buffer
+history_purge.init_app(app)
+chat_archive.init_app(app)
+stats_snapshot.init_app(app)
+outbox.init_app(app)
+jwks_store.init_app(app)
+session_snapshots.init_app(app)
+bulk_buffer.init_app(app)
+# Archived turns predate any clear-history cutoff, so drop them with the rest
+history_purge.register_invalidator(chat_archive.forget_user)
+
 # =====================================================================
 # FLASK-LOGIN SETUP
 # =====================================================================
@@ -143,6 +170,8 @@ login_manager.login_message_category = 'info'
 def load_user(user_id):
     """Load user from Supabase for Flask-Login session"""
     try:
+        if session_snapshots.enabled:
+            return session_snapshots.load_user(user_id)
         user_data = UserService.get_by_id(user_id)
         if user_data:
             return User(user_data)
@@ -260,9 +289,74 @@ def health_check():
     return {
         'status': 'healthy',
         'service': 'finucity',
-        'database': 'supabase'
+        'database': 'supabase',
+        'database_pool': supabase_db.pool_stats()
     }, 200
 
+@app.route('/metrics')
+@limiter.exempt
+def metrics_endpoint():
+    """
+    Prometheus metrics for this worker. Requires the METRICS_TOKEN bearer;
+    without a token configured only direct loopback scrapes are served.
+    """
+    from finucity.metrics import metrics
+    token = os.getenv('METRICS_TOKEN')
+    if token:
+        if not hmac.compare_digest(request.headers.get('Authorization', ''), f'Bearer {token}'):
+            return jsonify({'error': 'Unauthorized'}), 401
+    elif request.remote_addr not in ('127.0.0.1', '::1') or 'X-Forwarded-For' in request.headers:
+        return jsonify({'error': 'Forbidden'}), 403
+    return app.response_class(metrics.render_prometheus(), mimetype='text/plain; version=0.0.4')
+
+# =====================================================================
+# MAINTENANCE COMMANDS
+# =====================================================================
+@app.cli.command('archive-chats')
+@click.option('--months', default=None, type=int, help='Archive queries older than this many months')
+@click.option('--max-batches', default=None, type=int, help='Stop after this many batches')
+@click.option('--delete-hot', is_flag=True, default=None,
+              help='Delete archived rows from chat_queries (only with a persistent, shared CHAT_ARCHIVE_DIR)')
+def archive_chats_command(months, max_batches, delete_hot):
+    """Copy old chat_queries rows to the local cold-tier archive"""
+    from finucity.archive import ARCHIVE_AFTER_MONTHS
+    result = chat_archive.archive_older_than(months or ARCHIVE_AFTER_MONTHS, max_batches=max_batches,
+                                             delete_hot=delete_hot)
+    print(f"✅ Archived {result['archived']} queries in {result['batches']} batches "
+          f"({result['deleted']} deleted from chat_queries)")
+    print(f"   Archive: {chat_archive.stats()}")
+
+@app.cli.command('compact-chat-archive')
+def compact_chat_archive_command():
+    """Rewrite archive segments, dropping forgotten conversations"""
+    result = chat_archive.compact()
+    print(f"✅ Compacted {result['segments']} segments, reclaimed {result['bytes_reclaimed']} bytes")
+
+@app.cli.command('reconcile-ledger')
+@click.option('--ca-id', default=None, help='Reconcile one CA (default: every CA)')
+@click.option('--backfill', is_flag=True, help='Post missing entries for existing ca_earnings rows first')
+def reconcile_ledger_command(ca_id, backfill):
+    """Verify ledger entries and snapshots against ca_earnings"""
+    from finucity.database import get_supabase
+    from finucity.ledger import LedgerService
+    if ca_id:
+        ca_ids = [ca_id]
+    else:
+        ca_ids = [row['id'] for row in get_supabase().table('profiles').select('id').eq('role', 'ca').execute().data or []]
+    failures = 0
+    for current in ca_ids:
+        if backfill:
+            posted = LedgerService.backfill(current)
+            if posted:
+                print(f"   {current}: backfilled {posted} entries")
+        report = LedgerService.reconcile(current)
+        if not report['ok']:
+            failures += 1
+            print(f"❌ {current}: balance {report['balance']} vs earnings {report['expected_balance']}")
+            for issue in report['issues']:
+                print(f"     - {issue}")
+    print(f"✅ Reconciled {len(ca_ids) - failures}/{len(ca_ids)} CA ledgers")
+
 # =====================================================================
 # APPLICATION STARTUP
 # =====================================================================
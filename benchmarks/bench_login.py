@@ -0,0 +1,96 @@
+"""
+Login Benchmark - sequential vs overlapped auth + profile read
+Runs concurrent email/password logins against the SQLite Supabase
+stand-in with injected auth and read latency. Half the accounts live in
+Supabase Auth, half only have a profile password_hash (the fallback
+path). Compares the old sequential flow with finucity.login_flow.
+Hashes use 1000 PBKDF2 iterations so the run measures round trips, not
+hashing CPU.
+
+Run: python benchmarks/bench_login.py [--logins 400] [--threads 16] [--auth-ms 80] [--read-ms 30]
+Author: Sumeet Sangwan
+"""
+
+import argparse
+import os
+import statistics
+import sys
+import time
+from concurrent.futures import ThreadPoolExecutor
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+from flask import Flask  # noqa: E402
+from werkzeug.security import check_password_hash, generate_password_hash  # noqa: E402
+
+from finucity.database import SupabaseClientManager, UserService, get_supabase, supabase_db  # noqa: E402
+from finucity.login_flow import authenticate  # noqa: E402
+
+PASSWORD = 'bench-password'
+
+
+def sequential_login(email: str, password: str) -> bool:
+    """The flow /auth/flask-login used before: auth, then the profile read"""
+    try:
+        response = get_supabase().auth.sign_in_with_password({'email': email, 'password': password})
+        return bool(response.user and UserService.get_by_email(email))
+    except Exception:
+        profile = UserService.get_by_email(email)
+        return bool(profile and check_password_hash(profile.get('password_hash') or '', password))
+
+
+def overlapped_login(email: str, password: str) -> bool:
+    return authenticate(email, password).error is None
+
+
+def run(label: str, login, app, emails, threads: int):
+    def one(email):
+        with app.app_context():
+            started = time.perf_counter()
+            assert login(email, PASSWORD), f'{label}: login failed for {email}'
+            return time.perf_counter() - started
+
+    started = time.perf_counter()
+    with ThreadPoolExecutor(max_workers=threads) as pool:
+        latencies = sorted(pool.map(one, emails))
+    wall = time.perf_counter() - started
+    p95 = latencies[int(len(latencies) * 0.95) - 1]
+    print(f"  {label:<28}p50 {statistics.median(latencies) * 1000:>7.1f}ms   "
+          f"p95 {p95 * 1000:>7.1f}ms   {len(latencies) / wall:>6.1f} logins/s")
+    return p95
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.split('\n')[1])
+    parser.add_argument('--logins', type=int, default=400)
+    parser.add_argument('--threads', type=int, default=16)
+    parser.add_argument('--auth-ms', type=float, default=80)
+    parser.add_argument('--read-ms', type=float, default=30)
+    args = parser.parse_args()
+
+    app = Flask(__name__)
+    supabase_db.manager = SupabaseClientManager('sqlite://', '')
+    client = supabase_db.manager.client()
+    standin = client.standin
+    password_hash = generate_password_hash(PASSWORD, method='pbkdf2:sha256:1000')
+    profiles = []
+    for i in range(50):
+        email = f'user{i}@bench.example'
+        if i % 2:
+            user_id = client.auth.sign_up({'email': email, 'password': PASSWORD}).user.id
+            profiles.append({'id': user_id, 'email': email, 'username': f'user{i}'})
+        else:
+            profiles.append({'id': f'local-{i}', 'email': email, 'username': f'user{i}',
+                             'password_hash': password_hash})
+    standin.seed('profiles', profiles)
+    standin.configure(latency={'auth': args.auth_ms / 1000, 'read': args.read_ms / 1000})
+    emails = [profiles[i % len(profiles)]['email'] for i in range(args.logins)]
+
+    print(f"\n{args.logins} logins on {args.threads} threads (auth={args.auth_ms:g}ms, read={args.read_ms:g}ms)")
+    slow = run('sequential (before)', sequential_login, app, emails, args.threads)
+    fast = run('finucity.login_flow', overlapped_login, app, emails, args.threads)
+    print(f"  p95 improvement: {slow / fast:.2f}x")
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,133 @@
+"""
+Projection Benchmark - select('*') dicts vs projected __slots__ rows
+Replays the payloads of the chat history page, /chat/api/conversations
+and the CA consultations dashboard with synthetic rows shaped like
+production (multi-KB AI responses), and reports transfer size, JSON
+decode time and retained memory for each variant.
+
+Run: python benchmarks/bench_projections.py [--rows 100] [--response-kb 4]
+Author: Sumeet Sangwan
+"""
+
+import argparse
+import json
+import os
+import sys
+import time
+import tracemalloc
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+from finucity.rows import ChatQueryRow, ChatTitleRow, ConsultationRow, ProfileRow  # noqa: E402
+
+
+def chat_row(i: int, response_kb: int) -> dict:
+    return {
+        'id': i, 'user_id': 'u-1', 'session_id': f's-{i // 4}', 'conversation_id': f'c-{i // 4}',
+        'question': f'How do I claim deduction {i} under section 80C for my parents?',
+        'response': ('Under the old regime you can claim up to Rs 1.5 lakh ... ' * 20)[:response_kb * 1024],
+        'category': 'tax', 'confidence_score': 0.92, 'response_time': 1.8, 'rating': 5 if i % 3 else 4,
+        'is_helpful': True, 'feedback_text': None, 'created_at': f'2024-03-{i % 28 + 1:02d}T10:00:00+00:00',
+    }
+
+
+def consultation_row(i: int) -> dict:
+    return {
+        'id': f'c-{i}', 'user_id': f'u-{i}', 'ca_id': 'ca-1', 'client_id': f'u-{i}', 'service_type': 'itr_filing',
+        'title': 'ITR filing', 'description': 'Need help filing ITR-2 with capital gains. ' * 8,
+        'min_budget': 2000, 'max_budget': 5000, 'budget_min': 2000, 'budget_max': 5000, 'currency': 'INR',
+        'status': 'pending', 'created_at': '2024-03-01T10:00:00+00:00', 'updated_at': '2024-03-01T10:00:00+00:00',
+        'accepted_at': None, 'started_at': None, 'completed_at': None, 'notes': 'Internal notes ' * 20,
+        'attachments': [{'name': 'form16.pdf', 'url': 'https://example.com/' + 'x' * 80}] * 3,
+        'profiles': {'full_name': 'Asha Rao', 'city': 'Pune', 'avatar_url': None},
+    }
+
+
+def profile_row() -> dict:
+    return {
+        'id': 'u-1', 'email': 'asha@example.com', 'username': 'asha', 'first_name': 'Asha', 'last_name': 'Rao',
+        'full_name': 'Asha Rao', 'phone': '9999999999', 'profession': 'Engineer', 'city': 'Pune',
+        'state': 'MH', 'role': 'ca', 'is_active': True, 'email_verified': True,
+        'created_at': '2024-01-01T00:00:00+00:00', 'last_login': None, 'last_seen': None,
+        'history_cleared_at': None, 'bio': 'Chartered accountant with 12 years of practice. ' * 10,
+        'specializations': ['income_tax', 'gst', 'audit'], 'languages': ['en', 'hi', 'mr'],
+        'verification_status': 'verified', 'avatar_url': 'https://example.com/' + 'a' * 80,
+    }
+
+
+def project(rows, row_type, extra=()):
+    keep = set(row_type.columns().split(', ')) | set(extra)
+    return [{k: v for k, v in row.items() if k in keep} for row in rows]
+
+
+def measure(label: str, *responses, repeat: int = 50):
+    """`responses` are (payload bytes, build) pairs - one per round trip"""
+    def run():
+        return [build(json.loads(payload)) for payload, build in responses]
+
+    started = time.perf_counter()
+    for _ in range(repeat):
+        run()
+    decode_ms = (time.perf_counter() - started) / repeat * 1000
+    tracemalloc.start()
+    kept = run()
+    current, _ = tracemalloc.get_traced_memory()
+    tracemalloc.stop()
+    del kept
+    return {'label': label, 'bytes': sum(len(payload) for payload, _ in responses),
+            'decode_ms': decode_ms, 'retained_bytes': current}
+
+
+def compare(title: str, before: dict, after: dict):
+    print(f"\n{title}")
+    print(f"  {'variant':<34}{'transfer':>12}{'decode+build':>15}{'retained':>12}")
+    for result in (before, after):
+        print(f"  {result['label']:<34}{result['bytes'] / 1024:>10.1f}KB{result['decode_ms']:>13.2f}ms"
+              f"{result['retained_bytes'] / 1024:>10.1f}KB")
+    print(f"  saved: {1 - after['bytes'] / before['bytes']:.0%} transfer, "
+          f"{1 - after['retained_bytes'] / max(before['retained_bytes'], 1):.0%} memory")
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.split('\n')[1])
+    parser.add_argument('--rows', type=int, default=100)
+    parser.add_argument('--response-kb', type=int, default=4)
+    args = parser.parse_args()
+
+    chats = [chat_row(i, args.response_kb) for i in range(args.rows)]
+    wide = json.dumps(chats).encode()
+    titles = json.dumps(project(chats, ChatTitleRow)).encode()
+    page = json.dumps(project(chats[:20], ChatQueryRow)).encode()
+
+    compare(
+        f"/chat/history ({args.rows} rows listed, 20 rendered)",
+        measure("select('*') dicts", (wide, list)),
+        measure('titles + 20 full ChatQueryRow', (titles, ChatTitleRow.from_rows), (page, ChatQueryRow.from_rows)),
+    )
+    compare(
+        "/chat/api/conversations (50 rows)",
+        measure("select('*') dicts", (json.dumps(chats[:50]).encode(), list)),
+        measure('list_titles -> ChatTitleRow',
+                (json.dumps(project(chats[:50], ChatTitleRow)).encode(), ChatTitleRow.from_rows)),
+    )
+
+    consultations = [consultation_row(i) for i in range(50)]
+    compare(
+        "/api/ca/consultations (50 rows)",
+        measure("select('*') dicts", (json.dumps(consultations).encode(), list)),
+        measure('projected ConsultationRow',
+                (json.dumps(project(consultations, ConsultationRow, extra=('profiles',))).encode(),
+                 ConsultationRow.from_rows)),
+    )
+
+    profiles = [profile_row() for _ in range(1000)]
+    compare(
+        "profile cache (1000 sessions)",
+        measure("select('*') dicts", (json.dumps(profiles).encode(), list), repeat=5),
+        measure('projected ProfileRow',
+                (json.dumps(project(profiles, ProfileRow)).encode(), ProfileRow.from_rows), repeat=5),
+    )
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,70 @@
+"""
+Stand-in Benchmark - round-trip costs measured offline
+Runs common write and read patterns against the SQLite Supabase stand-in
+with injected per-operation latency, so round-trip savings (bulk writes,
+request identity map) show up as wall-clock time without a live project.
+
+Run: python benchmarks/bench_standin.py [--rows 200] [--read-ms 4] [--write-ms 8]
+Author: Sumeet Sangwan
+"""
+
+import argparse
+import os
+import sys
+import time
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+from flask import Flask  # noqa: E402
+
+from finucity.bulk import BulkWriter  # noqa: E402
+from finucity.database import SupabaseClientManager, get_supabase, supabase_db  # noqa: E402
+
+
+def timed(label: str, fn, standin):
+    before = dict(standin.stats['requests'])
+    started = time.perf_counter()
+    fn()
+    elapsed = time.perf_counter() - started
+    trips = sum(standin.stats['requests'].values()) - sum(before.values())
+    print(f"  {label:<40}{elapsed * 1000:>10.1f}ms{trips:>8} round trips")
+    return elapsed
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.split('\n')[1])
+    parser.add_argument('--rows', type=int, default=200)
+    parser.add_argument('--read-ms', type=float, default=4)
+    parser.add_argument('--write-ms', type=float, default=8)
+    args = parser.parse_args()
+
+    app = Flask(__name__)
+    app.config['ENABLE_BULK_OPERATIONS'] = True
+    supabase_db.manager = SupabaseClientManager('sqlite://', '')
+    standin = supabase_db.manager.client().standin
+    standin.configure(latency={'read': args.read_ms / 1000, 'write': args.write_ms / 1000})
+    rows = [{'user_id': f'u-{i % 10}', 'title': f'Notice {i}', 'is_read': False} for i in range(args.rows)]
+
+    print(f"\nnotifications insert ({args.rows} rows, write={args.write_ms:g}ms)")
+    with app.app_context():
+        slow = timed('one insert per row', lambda: [get_supabase().table('notifications').insert(row).execute()
+                                                   for row in rows], standin)
+        fast = timed('BulkWriter.insert', lambda: BulkWriter.insert('notifications', rows), standin)
+    print(f"  speedup: {slow / fast:.1f}x")
+
+    print(f"\nrepeated profile reads (20 per request, read={args.read_ms:g}ms)")
+    standin.seed('profiles', [{'id': 'u-1', 'email': 'asha@example.com', 'username': 'asha'}])
+
+    def read_profile():
+        for _ in range(20):
+            get_supabase().table('profiles').select('*').eq('id', 'u-1').execute()
+
+    with app.app_context():
+        slow = timed('no request context (no identity map)', read_profile, standin)
+    with app.test_request_context('/'):
+        fast = timed('inside a request (identity map)', read_profile, standin)
+    print(f"  speedup: {slow / fast:.1f}x")
+
+
+if __name__ == '__main__':
+    main()
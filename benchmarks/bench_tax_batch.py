@@ -0,0 +1,84 @@
+"""
+Batch Tax Benchmark - payroll-sized income tax runs
+Generates --rows synthetic employees (log-normal salaries, mixed age
+groups, a share on the old regime with 80C/80D/HRA claims) and times
+FinancialCalculators.income_tax_batch against calling
+income_tax_calculator once per employee. Reports incomes per second and
+the largest difference between the two paths.
+
+Run: python benchmarks/bench_tax_batch.py [--rows 1000000] [--scalar-rows 20000] [--old-share 0.3]
+Author: Sumeet Sangwan
+"""
+
+import argparse
+import os
+import sys
+import time
+
+import numpy as np
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+from finucity.services.calculators import FinancialCalculators  # noqa: E402
+
+
+def payroll(rows: int, old_share: float, seed: int = 7):
+    rng = np.random.default_rng(seed)
+    incomes = np.round(rng.lognormal(mean=13.6, sigma=0.7, size=rows), -2)
+    ages = rng.choice(['below_60', '60_to_80', 'above_80'], size=rows, p=[0.9, 0.08, 0.02])
+    regimes = np.where(rng.random(rows) < old_share, 'old', 'new')
+    deductions = {
+        '80c': rng.choice([0, 50000, 150000], size=rows),
+        '80d': rng.choice([0, 25000], size=rows),
+        'hra': np.round(incomes * rng.uniform(0, 0.15, size=rows), -2),
+    }
+    return incomes, ages, regimes, deductions
+
+
+def scalar_run(incomes, ages, regimes, deductions, rows: int):
+    totals = np.empty(rows)
+    for i in range(rows):
+        claims = {key: float(column[i]) for key, column in deductions.items()}
+        totals[i] = FinancialCalculators.income_tax_calculator(
+            float(incomes[i]), str(ages[i]), str(regimes[i]), claims)['total_tax']
+    return totals
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.split('\n')[1])
+    parser.add_argument('--rows', type=int, default=1_000_000)
+    parser.add_argument('--scalar-rows', type=int, default=20_000, help='rows timed on the scalar path')
+    parser.add_argument('--old-share', type=float, default=0.3)
+    parser.add_argument('--repeat', type=int, default=5)
+    args = parser.parse_args()
+
+    incomes, ages, regimes, deductions = payroll(args.rows, args.old_share)
+
+    best = float('inf')
+    for _ in range(args.repeat):
+        started = time.perf_counter()
+        batch = FinancialCalculators.income_tax_batch(incomes, ages, regimes, deductions)
+        best = min(best, time.perf_counter() - started)
+    uniform = float('inf')
+    for _ in range(args.repeat):
+        started = time.perf_counter()
+        FinancialCalculators.income_tax_batch(incomes)
+        uniform = min(uniform, time.perf_counter() - started)
+
+    sample = min(args.scalar_rows, args.rows)
+    started = time.perf_counter()
+    scalar = scalar_run(incomes, ages, regimes, deductions, sample)
+    scalar_elapsed = time.perf_counter() - started
+    drift = float(np.max(np.abs(scalar - batch['total_tax'][:sample])))
+
+    scalar_rate = sample / scalar_elapsed
+    print(f"rows: {args.rows:,} ({args.old_share:.0%} old regime, mixed age groups)")
+    print(f"  batch, mixed        {best * 1000:9.1f} ms   {args.rows / best:14,.0f} incomes/s")
+    print(f"  batch, new regime   {uniform * 1000:9.1f} ms   {args.rows / uniform:14,.0f} incomes/s")
+    print(f"  scalar ({sample:,} rows) {scalar_elapsed * 1000:7.1f} ms   {scalar_rate:14,.0f} incomes/s")
+    print(f"  speed-up (mixed)    {args.rows / best / scalar_rate:9.0f}x")
+    print(f"  max |batch - scalar| total_tax: {drift:.2e}")
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,76 @@
+"""
+Username Allocation Benchmark - colliding signups
+Creates --signups profiles that all derive their username from the same
+email prefix ("rahul@..."), against the SQLite Supabase stand-in with
+injected latency, first with the old probe-per-suffix loop and then with
+UserService.create_with_username (one prefix query per signup).
+The old loop is quadratic: 1000 signups cost ~500k round trips, so the
+default run takes a while; --signups 300 gives the picture in minutes.
+
+Run: python benchmarks/bench_usernames.py [--signups 1000] [--read-ms 2] [--write-ms 4]
+Author: Sumeet Sangwan
+"""
+
+import argparse
+import os
+import sys
+import time
+import uuid
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+from flask import Flask  # noqa: E402
+
+from finucity.database import SupabaseClientManager, UserService, get_supabase, supabase_db  # noqa: E402
+
+
+def probe_loop(base: str, index: int):
+    """The allocation loop signup used before: one select per taken suffix"""
+    sb = get_supabase()
+    username, counter = base, 1
+    while sb.table('profiles').select('id').eq('username', username).limit(1).execute().data:
+        username = f"{base}{counter}"
+        counter += 1
+    sb.table('profiles').insert({'id': str(uuid.uuid4()), 'email': f'{base}.{index}@old.example',
+                                 'username': username}).execute()
+
+
+def run(label: str, signup, signups: int, standin):
+    standin.reset()
+    before = sum(standin.stats['requests'].values())
+    started = time.perf_counter()
+    for index in range(signups):
+        signup('rahul', index)
+    elapsed = time.perf_counter() - started
+    trips = sum(standin.stats['requests'].values()) - before
+    names = {row['username'] for row in standin.rows('profiles')}
+    assert len(names) == signups, 'duplicate usernames allocated'
+    print(f"  {label:<36}{elapsed * 1000:>10.0f}ms{trips:>10} round trips{trips / signups:>8.1f}/signup")
+    return elapsed
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.split('\n')[1])
+    parser.add_argument('--signups', type=int, default=1000)
+    parser.add_argument('--read-ms', type=float, default=2)
+    parser.add_argument('--write-ms', type=float, default=4)
+    args = parser.parse_args()
+
+    app = Flask(__name__)
+    supabase_db.manager = SupabaseClientManager('sqlite://', '')
+    standin = supabase_db.manager.client().standin
+    standin.configure(latency={'read': args.read_ms / 1000, 'write': args.write_ms / 1000})
+
+    def allocate(base: str, index: int):
+        UserService.create_with_username({'id': str(uuid.uuid4()), 'email': f'{base}.{index}@new.example'}, base)
+
+    print(f"\n{args.signups} signups from the same email prefix "
+          f"(read={args.read_ms:g}ms, write={args.write_ms:g}ms)")
+    with app.app_context():
+        slow = run('probe per suffix (before)', probe_loop, args.signups, standin)
+        fast = run('UserService.create_with_username', allocate, args.signups, standin)
+    print(f"  speedup: {slow / fast:.1f}x")
+
+
+if __name__ == '__main__':
+    main()
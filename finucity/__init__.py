@@ -6,11 +6,12 @@ import os
 from flask import Flask, render_template, redirect, url_for
 from flask_login import LoginManager, current_user, login_required
 from flask_limiter import Limiter
-from flask_limiter.util import get_remote_address
+
+from .ratelimit import client_ip
 
 # Initialize extensions globally
 login_manager = LoginManager()
-limiter = Limiter(key_func=get_remote_address)
+limiter = Limiter(key_func=client_ip, storage_uri="finucity://", strategy="sliding-window-counter")
 
 # Configure login manager
 login_manager.login_view = 'auth.login'
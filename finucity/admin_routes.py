@@ -9,6 +9,7 @@ from flask_login import login_required, current_user
 from datetime import datetime, timedelta
 from functools import wraps
 from finucity.database import get_supabase
+from finucity.bulk import BulkWriter, bulk_buffer
 
 admin_enhanced_bp = Blueprint('admin_enhanced', __name__, url_prefix='/admin')
 
@@ -306,13 +307,13 @@ def update_booking_status(booking_id):
         if result.data:
             # Create notification for user
             booking = result.data[0]
-            supabase.table('notifications').insert({
+            bulk_buffer.add('notifications', {
                 'user_id': booking['user_id'],
                 'notification_type': 'booking_update',
                 'title': 'Booking Status Updated',
                 'message': f'Your booking #{booking["booking_number"]} is now {new_status}',
                 'booking_id': booking_id
-            }).execute()
+            })
             
             return jsonify({'success': True, 'booking': booking})
         else:
@@ -343,13 +344,13 @@ def assign_ca(booking_id):
         
         if result.data:
             # Notify CA
-            supabase.table('notifications').insert({
+            bulk_buffer.add('notifications', {
                 'user_id': ca_id,
                 'notification_type': 'ca_assigned',
                 'title': 'New Service Assigned',
                 'message': f'You have been assigned to booking #{result.data[0]["booking_number"]}',
                 'booking_id': booking_id
-            }).execute()
+            })
             
             return jsonify({'success': True})
         else:
@@ -515,13 +516,13 @@ def resolve_dispute(booking_id):
         if result.data:
             # Notify user
             booking = result.data[0]
-            supabase.table('notifications').insert({
+            bulk_buffer.add('notifications', {
                 'user_id': booking['user_id'],
                 'notification_type': 'dispute_resolved',
                 'title': 'Dispute Resolved',
                 'message': f'Your dispute for booking #{booking["booking_number"]} has been resolved',
                 'booking_id': booking_id
-            }).execute()
+            })
             
             return jsonify({'success': True})
         else:
@@ -564,18 +565,26 @@ def bulk_update_pricing():
         data = request.json
         updates = data.get('updates', [])
         
-        supabase = get_supabase()
-        
-        for update in updates:
-            supabase.table('service_catalog')\
-                .update({
+        rows, invalid = [], {}
+        for i, update in enumerate(updates):
+            try:
+                rows.append((i, {
+                    'id': update['service_id'],
                     'base_price': int(update['base_price']),
                     'discount_percentage': int(update.get('discount_percentage', 0))
-                })\
-                .eq('id', update['service_id'])\
-                .execute()
-        
-        return jsonify({'success': True, 'updated': len(updates)})
+                }))
+            except (KeyError, TypeError, ValueError) as e:
+                invalid[i] = f"invalid update: {e}"
+        
+        # One round trip per chunk instead of one per service
+        result = BulkWriter.update_many('service_catalog', [row for _, row in rows])
+        errors = {**invalid, **{rows[i][0]: reason for i, reason in result.errors.items()}}
+        
+        return jsonify({
+            'success': not errors,
+            'updated': result.succeeded,
+            'errors': [{'index': i, 'error': reason} for i, reason in sorted(errors.items())]
+        })
     except Exception as e:
         return jsonify({'error': str(e)}), 500
 
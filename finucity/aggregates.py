@@ -0,0 +1,270 @@
+"""
+CA Aggregates - SUM/AVG/COUNT pushed into Postgres
+Typed accessors over the per-CA views in PERFORMANCE_MIGRATIONS.sql
+(PART 2). Each view returns one small row per CA, so payload and latency
+no longer grow with a CA's history. When a view is missing (migration not
+applied yet, or the local stand-in database) the same totals are folded
+in Python from the base table.
+
+AGGREGATES_MODE: 'auto' (view, Python fallback), 'sql' (view only) or
+'python' (always fold locally).
+Author: Sumeet Sangwan
+"""
+
+import os
+import threading
+from dataclasses import dataclass, field, fields
+from datetime import datetime, timedelta
+from typing import Dict, List, Optional
+
+from flask import current_app
+from postgrest import APIError
+
+from finucity.database import get_supabase
+
+AGGREGATES_MODE = os.getenv('AGGREGATES_MODE', 'auto').lower()
+
+# PostgREST / Postgres codes for "relation does not exist"
+_MISSING_RELATION_CODES = {'42P01', 'PGRST205'}
+_missing_views = set()
+_missing_lock = threading.Lock()
+
+
+# =====================================================================
+# TYPED RESULTS
+# =====================================================================
+
+@dataclass(frozen=True)
+class EarningsTotals:
+    """ca_earnings_totals for one CA"""
+    total_earned: float = 0
+    total_withdrawn: float = 0
+    pending_amount: float = 0
+    this_month_earned: float = 0
+    transaction_count: int = 0
+
+    @property
+    def available_balance(self) -> float:
+        return self.total_earned - self.total_withdrawn - self.pending_amount
+
+
+@dataclass(frozen=True)
+class RatingTotals:
+    """ca_rating_totals (trust ratings) for one CA"""
+    total_reviews: int = 0
+    sum_overall: int = 0
+    sum_communication: int = 0
+    sum_expertise: int = 0
+    sum_timeliness: int = 0
+    sum_value: int = 0
+    distribution: Dict[int, int] = field(default_factory=lambda: {r: 0 for r in range(1, 6)})
+
+    @property
+    def average_rating(self) -> float:
+        return self.sum_overall / self.total_reviews if self.total_reviews else 0
+
+    def average_of(self, aspect: str) -> float:
+        """Per-aspect average over all reviews (unrated aspects count as 0)"""
+        return getattr(self, f'sum_{aspect}') / self.total_reviews if self.total_reviews else 0
+
+
+@dataclass(frozen=True)
+class ReviewTotals:
+    """ca_review_totals (published dashboard reviews) for one CA"""
+    total_reviews: int = 0
+    sum_rating: int = 0
+
+    @property
+    def average_rating(self) -> float:
+        return round(self.sum_rating / self.total_reviews, 1) if self.total_reviews else 0.0
+
+
+@dataclass(frozen=True)
+class ConsultationTotals:
+    """ca_consultation_totals for one CA"""
+    total_clients: int = 0
+    active: int = 0
+    pending: int = 0
+    completed: int = 0
+    responded: int = 0
+    responded_within_24h: int = 0
+
+    @property
+    def response_rate(self) -> int:
+        """Share of answered requests answered within 24 hours"""
+        return round(self.responded_within_24h / self.responded * 100) if self.responded else 100
+
+    @property
+    def completion_rate(self) -> int:
+        return round(self.completed / self.responded * 100) if self.responded else 100
+
+
+@dataclass(frozen=True)
+class BookingTotals:
+    """ca_booking_totals for one CA"""
+    total_bookings: int = 0
+    completed_bookings: int = 0
+
+    @property
+    def completion_rate(self) -> float:
+        return self.completed_bookings / self.total_bookings * 100 if self.total_bookings else 0
+
+
+def _build(cls, row: Optional[Dict]):
+    if not row:
+        return cls()
+    return cls(**{f.name: row[f.name] for f in fields(cls) if row.get(f.name) is not None})
+
+
+# =====================================================================
+# PYTHON FALLBACKS (same semantics as the SQL views)
+# =====================================================================
+
+def _parse(value: str) -> datetime:
+    return datetime.fromisoformat(value.replace('Z', '+00:00'))
+
+
+def _fold_earnings(rows: List[Dict]) -> List[Dict]:
+    month_start = datetime.utcnow().replace(day=1, hour=0, minute=0, second=0, microsecond=0)
+    totals = {'total_earned': 0, 'total_withdrawn': 0, 'pending_amount': 0,
+              'this_month_earned': 0, 'transaction_count': len(rows)}
+    for row in rows:
+        amount = row.get('amount') or 0
+        kind, status = row.get('transaction_type'), row.get('status')
+        if kind == 'credit' and status == 'completed':
+            totals['total_earned'] += amount
+        elif kind == 'debit' and status == 'completed':
+            totals['total_withdrawn'] += amount
+        elif kind == 'credit' and status == 'approved':
+            totals['pending_amount'] += amount
+        if kind == 'credit' and row.get('created_at') and \
+                _parse(row['created_at']).replace(tzinfo=None) >= month_start:
+            totals['this_month_earned'] += amount
+    return [totals]
+
+
+def _fold_ratings(rows: List[Dict]) -> List[Dict]:
+    groups: Dict[bool, Dict] = {}
+    for row in rows:
+        group = groups.setdefault(bool(row.get('is_published')), {
+            'is_published': bool(row.get('is_published')), 'total_reviews': 0, 'sum_overall': 0,
+            'sum_communication': 0, 'sum_expertise': 0, 'sum_timeliness': 0, 'sum_value': 0,
+            **{f'rating_{r}': 0 for r in range(1, 6)},
+        })
+        group['total_reviews'] += 1
+        group['sum_overall'] += row['overall_rating']
+        for aspect in ('communication', 'expertise', 'timeliness', 'value'):
+            group[f'sum_{aspect}'] += row.get(f'{aspect}_rating') or 0
+        group[f"rating_{row['overall_rating']}"] += 1
+    return list(groups.values())
+
+
+def _fold_reviews(rows: List[Dict]) -> List[Dict]:
+    published = [row for row in rows if row.get('is_published')]
+    return [{'total_reviews': len(published), 'sum_rating': sum(row['rating'] for row in published)}]
+
+
+def _fold_consultations(rows: List[Dict]) -> List[Dict]:
+    answered = [row for row in rows if row.get('status') is not None and row['status'] != 'pending']
+    return [{
+        'total_clients': len({row['client_id'] for row in rows if row.get('client_id')}),
+        'active': sum(1 for row in rows if row.get('status') in ('accepted', 'in_progress')),
+        'pending': sum(1 for row in rows if row.get('status') == 'pending'),
+        'completed': sum(1 for row in rows if row.get('status') == 'completed'),
+        'responded': len(answered),
+        'responded_within_24h': sum(
+            1 for row in answered
+            if _parse(row['updated_at']) - _parse(row['created_at']) <= timedelta(hours=24)
+        ),
+    }]
+
+
+def _fold_bookings(rows: List[Dict]) -> List[Dict]:
+    return [{
+        'total_bookings': len(rows),
+        'completed_bookings': sum(1 for row in rows if row.get('status') == 'completed'),
+    }]
+
+
+# view -> (base table, CA column, columns to fetch, fold)
+_FALLBACKS: Dict[str, tuple] = {
+    'ca_earnings_totals': ('ca_earnings', 'ca_id', 'amount, transaction_type, status, created_at', _fold_earnings),
+    'ca_rating_totals': ('ca_ratings', 'ca_id',
+                         'is_published, overall_rating, communication_rating, expertise_rating, '
+                         'timeliness_rating, value_rating', _fold_ratings),
+    'ca_review_totals': ('ca_reviews', 'ca_id', 'rating, is_published', _fold_reviews),
+    'ca_consultation_totals': ('consultations', 'ca_id', 'client_id, status, created_at, updated_at',
+                               _fold_consultations),
+    'ca_booking_totals': ('service_bookings', 'assigned_ca_id', 'status', _fold_bookings),
+}
+
+
+def _is_missing_relation(error: APIError) -> bool:
+    return str(getattr(error, 'code', '')) in _MISSING_RELATION_CODES
+
+
+def _view_rows(view: str, ca_id: str) -> List[Dict]:
+    """Rows of an aggregate view for one CA, folded locally if the view is unavailable"""
+    sb = get_supabase()
+    if AGGREGATES_MODE != 'python' and view not in _missing_views:
+        try:
+            return sb.table(view).select('*').eq('ca_id', ca_id).execute().data or []
+        except APIError as e:
+            if AGGREGATES_MODE == 'sql' or not _is_missing_relation(e):
+                raise
+            with _missing_lock:
+                _missing_views.add(view)
+            current_app.logger.warning(f"Aggregate view {view} missing; folding in Python until restart")
+    table, column, columns, fold = _FALLBACKS[view]
+    rows = sb.table(table).select(columns).eq(column, ca_id).execute().data or []
+    return fold(rows)
+
+
+# =====================================================================
+# ACCESSORS
+# =====================================================================
+
+class CAAggregates:
+    """Per-CA totals; each call is one small query (raises on failure)"""
+
+    @staticmethod
+    def earnings(ca_id: str) -> EarningsTotals:
+        rows = _view_rows('ca_earnings_totals', ca_id)
+        return _build(EarningsTotals, rows[0] if rows else None)
+
+    @staticmethod
+    def ratings(ca_id: str, published_only: bool = True) -> RatingTotals:
+        rows = [row for row in _view_rows('ca_rating_totals', ca_id)
+                if row.get('is_published') or not published_only]
+        if not rows:
+            return RatingTotals()
+        merged = {name: sum(row.get(name) or 0 for row in rows)
+                  for name in ('total_reviews', 'sum_overall', 'sum_communication',
+                               'sum_expertise', 'sum_timeliness', 'sum_value')}
+        merged['distribution'] = {r: sum(row.get(f'rating_{r}') or 0 for row in rows) for r in range(1, 6)}
+        return RatingTotals(**merged)
+
+    @staticmethod
+    def reviews(ca_id: str) -> ReviewTotals:
+        rows = _view_rows('ca_review_totals', ca_id)
+        return _build(ReviewTotals, rows[0] if rows else None)
+
+    @staticmethod
+    def consultations(ca_id: str) -> ConsultationTotals:
+        rows = _view_rows('ca_consultation_totals', ca_id)
+        return _build(ConsultationTotals, rows[0] if rows else None)
+
+    @staticmethod
+    def bookings(ca_id: str) -> BookingTotals:
+        rows = _view_rows('ca_booking_totals', ca_id)
+        return _build(BookingTotals, rows[0] if rows else None)
+
+
+__all__ = [
+    'CAAggregates',
+    'EarningsTotals',
+    'RatingTotals',
+    'ReviewTotals',
+    'ConsultationTotals',
+    'BookingTotals',
+]
@@ -0,0 +1,406 @@
+"""
+Cold-Tier Chat Archive
+Moves old chat_queries rows out of Supabase into compressed, append-only
+segment files on local disk, with a small SQLite index per host so a
+single conversation can be rehydrated with one seek + one decompress.
+
+Layout under CHAT_ARCHIVE_DIR:
+    index.sqlite              member offsets and query_id -> member map
+    segment-000001.jsonl.gz   concatenated compressed members
+Each member holds one conversation slice in columnar form:
+    {"user_id": ..., "session_id": ..., "columns": {"id": [...], ...}}
+
+Durability: the segments are only as durable as CHAT_ARCHIVE_DIR and are
+only visible to the hosts that mount it. On an ephemeral or per-dyno
+filesystem (the Procfile's Heroku-style deploy) the directory is wiped on
+restart, so by default the job only copies rows and leaves chat_queries
+untouched. Deleting the archived hot rows is an explicit opt-in
+(CHAT_ARCHIVE_DELETE_HOT=true or `flask archive-chats --delete-hot`) for
+deployments where CHAT_ARCHIVE_DIR is a persistent volume shared by every
+host that serves chat reads.
+Author: Sumeet Sangwan
+"""
+
+import gzip
+import heapq
+import itertools
+import json
+import os
+import sqlite3
+import threading
+from datetime import datetime, timedelta, timezone
+from typing import Dict, Iterator, List, Optional, Tuple
+
+try:
+    import zstandard
+except ImportError:  # zstd is optional; gzip members are the fallback
+    zstandard = None
+
+from finucity.database import ChatService, get_supabase
+
+ARCHIVE_AFTER_MONTHS = int(os.getenv('CHAT_ARCHIVE_AFTER_MONTHS', '6'))
+ARCHIVE_BATCH_SIZE = int(os.getenv('CHAT_ARCHIVE_BATCH_SIZE', '500'))
+ARCHIVE_SEGMENT_BYTES = int(os.getenv('CHAT_ARCHIVE_SEGMENT_BYTES', str(64 * 1024 * 1024)))
+ARCHIVE_DELETE_HOT = os.getenv('CHAT_ARCHIVE_DELETE_HOT', 'false').lower() in ['true', '1', 'yes']
+
+ARCHIVE_COLUMNS = [
+    'id', 'user_id', 'session_id', 'conversation_id', 'question', 'response',
+    'category', 'confidence_score', 'response_time', 'rating', 'is_helpful', 'created_at',
+]
+
+_SCHEMA = """
+CREATE TABLE IF NOT EXISTS archive_members (
+    id INTEGER PRIMARY KEY AUTOINCREMENT,
+    user_id TEXT NOT NULL,
+    session_id TEXT,
+    segment TEXT NOT NULL,
+    offset INTEGER NOT NULL,
+    length INTEGER NOT NULL,
+    row_count INTEGER NOT NULL,
+    first_created_at TEXT,
+    last_created_at TEXT
+);
+CREATE INDEX IF NOT EXISTS idx_archive_members_user_session
+    ON archive_members(user_id, session_id);
+CREATE TABLE IF NOT EXISTS archive_queries (
+    query_id TEXT PRIMARY KEY,
+    member_id INTEGER NOT NULL,
+    user_id TEXT NOT NULL
+);
+CREATE INDEX IF NOT EXISTS idx_archive_queries_user ON archive_queries(user_id);
+"""
+
+
+class ChatArchive:
+    """Append-only compressed segments plus a per-user offset index"""
+
+    def __init__(self, app=None, directory: Optional[str] = None):
+        self.directory = directory
+        self._local = threading.local()
+        self._codec = 'zst' if zstandard else 'gz'
+        if app:
+            self.init_app(app)
+
+    def init_app(self, app):
+        """Resolve the archive directory and plug into ChatService reads"""
+        if not self.directory:
+            self.directory = os.getenv('CHAT_ARCHIVE_DIR') or os.path.join(app.instance_path, 'chat_archive')
+        os.makedirs(self.directory, exist_ok=True)
+        app.extensions['chat_archive'] = self
+        ChatService.cold_store = self
+
+    # ----- storage primitives -----
+
+    def _db(self) -> sqlite3.Connection:
+        conn = getattr(self._local, 'conn', None)
+        if conn is None or getattr(self._local, 'pid', None) != os.getpid():
+            os.makedirs(self.directory, exist_ok=True)
+            conn = sqlite3.connect(os.path.join(self.directory, 'index.sqlite'), timeout=30,
+                                   isolation_level=None)
+            conn.execute('PRAGMA journal_mode=WAL')
+            conn.execute('PRAGMA synchronous=NORMAL')
+            conn.executescript(_SCHEMA)
+            self._local.conn = conn
+            self._local.pid = os.getpid()
+        return conn
+
+    def _compress(self, payload: bytes) -> bytes:
+        if self._codec == 'zst':
+            return zstandard.ZstdCompressor(level=10).compress(payload)
+        return gzip.compress(payload, compresslevel=6)
+
+    @staticmethod
+    def _decompress(segment: str, data: bytes) -> bytes:
+        if segment.endswith('.zst'):
+            if not zstandard:
+                raise RuntimeError(f"zstandard is required to read {segment}")
+            return zstandard.ZstdDecompressor().decompress(data)
+        return gzip.decompress(data)
+
+    def _current_segment(self, conn: sqlite3.Connection) -> str:
+        row = conn.execute('SELECT segment FROM archive_members ORDER BY id DESC LIMIT 1').fetchone()
+        if row and row[0].endswith(self._codec):
+            path = os.path.join(self.directory, row[0])
+            if not os.path.exists(path) or os.path.getsize(path) < ARCHIVE_SEGMENT_BYTES:
+                return row[0]
+        existing = [name for name in os.listdir(self.directory) if name.startswith('segment-')]
+        number = max([int(name.split('-')[1].split('.')[0]) for name in existing] or [0]) + 1
+        return f'segment-{number:06d}.jsonl.{self._codec}'
+
+    @staticmethod
+    def _to_columns(rows: List[Dict]) -> Dict[str, List]:
+        return {column: [row.get(column) for row in rows] for column in ARCHIVE_COLUMNS}
+
+    @staticmethod
+    def _from_columns(columns: Dict[str, List]) -> List[Dict]:
+        names = list(columns)
+        return [dict(zip(names, values)) for values in zip(*(columns[name] for name in names))]
+
+    # ----- writes -----
+
+    def append(self, rows: List[Dict]) -> List[str]:
+        """
+        Append rows to the archive, one member per (user, session).
+        Rows already indexed are skipped, so a job interrupted between
+        archiving and deleting can simply be re-run.
+        Returns the IDs that are now safely archived.
+        """
+        if not rows:
+            return []
+        conn = self._db()
+        conn.execute('BEGIN IMMEDIATE')  # serialises writers across workers
+        try:
+            ids = [str(row['id']) for row in rows]
+            placeholders = ','.join('?' * len(ids))
+            known = {r[0] for r in conn.execute(
+                f'SELECT query_id FROM archive_queries WHERE query_id IN ({placeholders})', ids)}
+
+            groups: Dict[Tuple[str, Optional[str]], List[Dict]] = {}
+            for row in rows:
+                if str(row['id']) not in known:
+                    groups.setdefault((str(row.get('user_id')), row.get('session_id')), []).append(row)
+
+            segment = self._current_segment(conn)
+            path = os.path.join(self.directory, segment)
+            with open(path, 'ab') as fh:
+                for (user_id, session_id), group in groups.items():
+                    group.sort(key=lambda r: (r.get('created_at') or '', str(r.get('id'))))
+                    payload = json.dumps({
+                        'user_id': user_id,
+                        'session_id': session_id,
+                        'columns': self._to_columns(group),
+                    }, ensure_ascii=False, separators=(',', ':'), default=str).encode()
+                    blob = self._compress(payload)
+                    offset = fh.seek(0, os.SEEK_END)
+                    fh.write(blob)
+                    member_id = conn.execute(
+                        'INSERT INTO archive_members (user_id, session_id, segment, offset, length, '
+                        'row_count, first_created_at, last_created_at) VALUES (?,?,?,?,?,?,?,?)',
+                        (user_id, session_id, segment, offset, len(blob), len(group),
+                         group[0].get('created_at'), group[-1].get('created_at'))
+                    ).lastrowid
+                    conn.executemany(
+                        'INSERT OR IGNORE INTO archive_queries (query_id, member_id, user_id) VALUES (?,?,?)',
+                        [(str(r['id']), member_id, user_id) for r in group]
+                    )
+                fh.flush()
+                os.fsync(fh.fileno())
+            conn.execute('COMMIT')
+        except Exception:
+            conn.execute('ROLLBACK')
+            raise
+        return ids
+
+    def forget_user(self, user_id: str):
+        """Drop a user's index entries; their bytes go on the next compact()"""
+        conn = self._db()
+        conn.execute('BEGIN IMMEDIATE')
+        conn.execute('DELETE FROM archive_queries WHERE user_id = ?', (str(user_id),))
+        conn.execute('DELETE FROM archive_members WHERE user_id = ?', (str(user_id),))
+        conn.execute('COMMIT')
+
+    def compact(self) -> Dict[str, int]:
+        """Rewrite segments keeping only members still referenced by the index"""
+        conn = self._db()
+        conn.execute('BEGIN IMMEDIATE')
+        reclaimed = 0
+        try:
+            live = conn.execute('SELECT id, segment, offset, length FROM archive_members ORDER BY id').fetchall()
+            by_segment: Dict[str, List[Tuple]] = {}
+            for member in live:
+                by_segment.setdefault(member[1], []).append(member)
+            current = {name for name in os.listdir(self.directory) if name.startswith('segment-')}
+            for segment in current:
+                path = os.path.join(self.directory, segment)
+                members = by_segment.get(segment, [])
+                before = os.path.getsize(path)
+                tmp_path = path + '.compact'
+                with open(path, 'rb') as src, open(tmp_path, 'wb') as dst:
+                    for member_id, _, offset, length in members:
+                        src.seek(offset)
+                        new_offset = dst.tell()
+                        dst.write(src.read(length))
+                        conn.execute('UPDATE archive_members SET offset = ? WHERE id = ?', (new_offset, member_id))
+                    dst.flush()
+                    os.fsync(dst.fileno())
+                if members:
+                    os.replace(tmp_path, path)
+                else:
+                    os.remove(tmp_path)
+                    os.remove(path)
+                reclaimed += before - (os.path.getsize(path) if members else 0)
+            conn.execute('COMMIT')
+        except Exception:
+            conn.execute('ROLLBACK')
+            raise
+        return {'segments': len(by_segment), 'bytes_reclaimed': reclaimed}
+
+    # ----- reads -----
+
+    def _read_member(self, segment: str, offset: int, length: int) -> List[Dict]:
+        with open(os.path.join(self.directory, segment), 'rb') as fh:
+            fh.seek(offset)
+            data = fh.read(length)
+        return self._from_columns(json.loads(self._decompress(segment, data))['columns'])
+
+    def get_query(self, query_id) -> Optional[Dict]:
+        """Rehydrate a single archived query by ID"""
+        member = self._db().execute(
+            'SELECT m.segment, m.offset, m.length FROM archive_queries q '
+            'JOIN archive_members m ON m.id = q.member_id WHERE q.query_id = ?',
+            (str(query_id),)
+        ).fetchone()
+        if not member:
+            return None
+        for row in self._read_member(*member):
+            if str(row.get('id')) == str(query_id):
+                return row
+        return None
+
+    def get_queries(self, query_ids: List) -> Dict[str, Dict]:
+        """Rehydrate many archived queries by ID, reading each member once; {id: row}"""
+        wanted = {str(query_id) for query_id in query_ids}
+        if not wanted:
+            return {}
+        placeholders = ','.join('?' * len(wanted))
+        members = self._db().execute(
+            'SELECT DISTINCT m.segment, m.offset, m.length FROM archive_queries q '
+            f'JOIN archive_members m ON m.id = q.member_id WHERE q.query_id IN ({placeholders})',
+            list(wanted)
+        ).fetchall()
+        found: Dict[str, Dict] = {}
+        for member in members:
+            for row in self._read_member(*member):
+                if str(row.get('id')) in wanted:
+                    found[str(row.get('id'))] = row
+        return found
+
+    def get_session(self, user_id: str, session_id: str) -> List[Dict]:
+        """Rehydrate every archived query of one conversation, oldest first"""
+        members = self._db().execute(
+            'SELECT segment, offset, length FROM archive_members '
+            'WHERE user_id = ? AND session_id = ? ORDER BY first_created_at, id',
+            (str(user_id), session_id)
+        ).fetchall()
+        rows: List[Dict] = []
+        for member in members:
+            rows.extend(self._read_member(*member))
+        return rows
+
+    @staticmethod
+    def _key(row: Dict) -> Tuple[str, str]:
+        return (row.get('created_at') or '', str(row.get('id')))
+
+    def recent_queries(self, user_id: str, limit: int) -> List[Dict]:
+        """A user's newest `limit` archived queries, newest first"""
+        if limit <= 0:
+            return []
+        members = self._db().execute(
+            'SELECT segment, offset, length, last_created_at FROM archive_members '
+            'WHERE user_id = ? ORDER BY last_created_at DESC, id DESC',
+            (str(user_id),)
+        ).fetchall()
+        rows: List[Dict] = []
+        for segment, offset, length, last_created_at in members:
+            # Sessions overlap in time: stop once a member ends before the oldest row kept
+            if len(rows) >= limit:
+                rows = heapq.nlargest(limit, rows, key=self._key)
+                if (last_created_at or '') < self._key(rows[-1])[0]:
+                    break
+            rows.extend(self._read_member(segment, offset, length))
+        return heapq.nlargest(limit, rows, key=self._key)
+
+    def iter_user_queries(self, user_id: str, after: Optional[Dict] = None) -> Iterator[Dict]:
+        """
+        A user's archived queries in (created_at, id) order, after the
+        keyset position `after`. Members are read as the merge reaches
+        them, so only the members overlapping in time are held at once.
+        """
+        after_key = self._key(after) if after and after.get('created_at') is not None else None
+        members = self._db().execute(
+            'SELECT segment, offset, length, first_created_at FROM archive_members '
+            'WHERE user_id = ? AND COALESCE(last_created_at, \'\') >= ? ORDER BY first_created_at, id',
+            (str(user_id), after_key[0] if after_key else '')
+        ).fetchall()
+        pending: List[Tuple] = []
+        order = itertools.count()
+        position = 0
+        while position < len(members) or pending:
+            while position < len(members) and (
+                    not pending or (members[position][3] or '') <= pending[0][0][0]):
+                segment, offset, length, _ = members[position]
+                for row in self._read_member(segment, offset, length):
+                    key = self._key(row)
+                    if after_key is None or key > after_key:
+                        heapq.heappush(pending, (key, next(order), row))
+                position += 1
+            if pending:
+                yield heapq.heappop(pending)[2]
+
+    def stats(self) -> Dict[str, int]:
+        """Archive size for monitoring"""
+        conn = self._db()
+        members, rows = conn.execute('SELECT COUNT(*), COALESCE(SUM(row_count), 0) FROM archive_members').fetchone()
+        size = sum(os.path.getsize(os.path.join(self.directory, name))
+                   for name in os.listdir(self.directory) if name.startswith('segment-'))
+        return {'members': members, 'rows': rows, 'bytes': size}
+
+    # ----- archival job -----
+
+    def _fetch_cold_batch(self, cutoff: str, limit: int, after: Optional[Dict] = None) -> List[Dict]:
+        sb = get_supabase()
+        query = sb.table('chat_queries')\
+            .select(','.join(ARCHIVE_COLUMNS))\
+            .lt('created_at', cutoff)
+        if after:
+            # Copy-only runs leave the rows in place: page past the last one copied
+            created_at, row_id = after['created_at'], after['id']
+            query = query.or_(
+                f'created_at.gt."{created_at}",'
+                f'and(created_at.eq."{created_at}",id.gt."{row_id}")'
+            )
+        result = query\
+            .order('created_at', desc=False)\
+            .order('id', desc=False)\
+            .limit(limit)\
+            .execute()
+        return result.data if result.data else []
+
+    def archive_older_than(self, months: int = ARCHIVE_AFTER_MONTHS,
+                           batch_size: int = ARCHIVE_BATCH_SIZE,
+                           max_batches: Optional[int] = None,
+                           delete_hot: Optional[bool] = None) -> Dict[str, int]:
+        """
+        Copy rows older than `months` into the archive in batches.
+        With `delete_hot` (default ARCHIVE_DELETE_HOT) the hot rows are then
+        deleted from chat_queries; each batch is fsynced to a segment and
+        indexed first, so a crash never loses data, but the archive
+        directory must survive restarts and be shared by every host.
+        Must run inside an app context.
+        """
+        delete_hot = ARCHIVE_DELETE_HOT if delete_hot is None else delete_hot
+        cutoff = (datetime.now(timezone.utc) - timedelta(days=30 * months)).isoformat()
+        archived = batches = deleted = 0
+        after = None
+        while max_batches is None or batches < max_batches:
+            rows = self._fetch_cold_batch(cutoff, batch_size, after)
+            if not rows:
+                break
+            self.append(rows)
+            if delete_hot:
+                by_user: Dict[str, List] = {}
+                for row in rows:
+                    by_user.setdefault(row['user_id'], []).append(row['id'])
+                for user_id, ids in by_user.items():
+                    deleted += ChatService.delete_by_ids(user_id, ids)
+            else:
+                after = {'created_at': rows[-1]['created_at'], 'id': rows[-1]['id']}
+            archived += len(rows)
+            batches += 1
+        return {'archived': archived, 'batches': batches, 'deleted': deleted}
+
+
+# Global instance
+chat_archive = ChatArchive()
+
+__all__ = ['ChatArchive', 'chat_archive', 'ARCHIVE_COLUMNS', 'ARCHIVE_DELETE_HOT']
@@ -0,0 +1,310 @@
+"""
+Bulk Writes - multi-row insert, upsert and batched update
+One PostgREST round trip per chunk instead of one per row. When a chunk is
+rejected (PostgREST applies each request atomically) its rows are replayed
+one at a time so the caller gets an error per row, not per batch.
+
+BulkBuffer coalesces fire-and-forget rows written by request handlers
+(notifications, audit logs, calculator history) across requests and
+flushes them as multi-row inserts.
+
+ENABLE_BULK_OPERATIONS=false falls back to one write per row (same API,
+same per-row results), and the buffer writes through immediately.
+When the app has a write outbox (finucity.outbox, initialised first)
+buffered rows are queued there instead, so they survive restarts and
+Supabase outages.
+Author: Sumeet Sangwan
+"""
+
+import atexit
+import os
+import threading
+from dataclasses import dataclass, field
+from typing import Any, Callable, Dict, List, Optional, Sequence
+
+from flask import current_app, has_app_context
+from postgrest import APIError
+
+from finucity.database import get_supabase
+from finucity.metrics import metrics
+
+BULK_CHUNK_SIZE = int(os.getenv('BULK_CHUNK_SIZE', '500'))
+BULK_FLUSH_INTERVAL = float(os.getenv('BULK_FLUSH_INTERVAL', '1.0'))  # seconds
+BULK_BUFFER_MAX_ROWS = int(os.getenv('BULK_BUFFER_MAX_ROWS', '200'))   # flush early at this size
+
+# Tables bulk_update_rows() may touch - keep in sync with PERFORMANCE_MIGRATIONS.sql PART 4
+BULK_UPDATE_TABLES = ('service_catalog', 'notifications')
+
+_MISSING_FUNCTION_CODES = {'PGRST202', '42883'}
+_missing_rpcs = set()
+
+
+def bulk_enabled() -> bool:
+    """ENABLE_BULK_OPERATIONS from the app config (env outside an app context)"""
+    if has_app_context():
+        return bool(current_app.config.get('ENABLE_BULK_OPERATIONS', True))
+    return os.getenv('ENABLE_BULK_OPERATIONS', 'true').lower() in ['true', '1', 'yes']
+
+
+def _error_text(error: Exception) -> str:
+    return getattr(error, 'message', None) or str(error)
+
+
+@dataclass
+class BulkResult:
+    """Outcome of a bulk write; `errors` maps input index -> reason"""
+    rows: List[Dict] = field(default_factory=list)
+    errors: Dict[int, str] = field(default_factory=dict)
+    round_trips: int = 0
+
+    @property
+    def ok(self) -> bool:
+        return not self.errors
+
+    @property
+    def succeeded(self) -> int:
+        return len(self.rows)
+
+    def to_dict(self) -> Dict[str, Any]:
+        return {
+            'succeeded': self.succeeded,
+            'failed': len(self.errors),
+            'errors': [{'index': i, 'error': reason} for i, reason in sorted(self.errors.items())],
+            'round_trips': self.round_trips,
+        }
+
+
+class BulkWriter:
+    """Chunked writes with per-row error reporting"""
+
+    @staticmethod
+    def _chunk_size(chunk_size: Optional[int]) -> int:
+        return max(1, chunk_size or BULK_CHUNK_SIZE) if bulk_enabled() else 1
+
+    @staticmethod
+    def _write(rows: Sequence[Dict], chunk_size: Optional[int],
+               send: Callable[[List[Dict]], List[Dict]], result: BulkResult) -> BulkResult:
+        size = BulkWriter._chunk_size(chunk_size)
+        for start in range(0, len(rows), size):
+            chunk = list(rows[start:start + size])
+            result.round_trips += 1
+            try:
+                result.rows.extend(send(chunk) or [])
+                continue
+            except Exception as e:
+                if len(chunk) == 1:
+                    result.errors[start] = _error_text(e)
+                    continue
+            # The chunk was rolled back as a whole: find the offending rows
+            for i, row in enumerate(chunk):
+                result.round_trips += 1
+                try:
+                    result.rows.extend(send([row]) or [])
+                except Exception as e:
+                    result.errors[start + i] = _error_text(e)
+        return result
+
+    @staticmethod
+    def insert(table: str, rows: Sequence[Dict], chunk_size: Optional[int] = None) -> BulkResult:
+        """Multi-row INSERT; returns inserted rows and per-row errors"""
+        sb = get_supabase()
+        result = BulkWriter._write(rows, chunk_size, lambda chunk: sb.table(table).insert(chunk).execute().data,
+                                   BulkResult())
+        BulkWriter._record(table, 'insert', result)
+        return result
+
+    @staticmethod
+    def upsert(table: str, rows: Sequence[Dict], on_conflict: str = 'id',
+               chunk_size: Optional[int] = None) -> BulkResult:
+        """INSERT ... ON CONFLICT (on_conflict) DO UPDATE, chunked"""
+        sb = get_supabase()
+        result = BulkWriter._write(
+            rows, chunk_size,
+            lambda chunk: sb.table(table).upsert(chunk, on_conflict=on_conflict).execute().data,
+            BulkResult(),
+        )
+        BulkWriter._record(table, 'upsert', result)
+        return result
+
+    @staticmethod
+    def update_many(table: str, rows: Sequence[Dict], key: str = 'id',
+                    chunk_size: Optional[int] = None) -> BulkResult:
+        """
+        Apply a different partial update to each row, matched on `key`.
+        Uses the bulk_update_rows() RPC (one call per chunk) for allowlisted
+        tables, else one UPDATE per row. Rows whose key matches nothing are
+        reported as 'not found'.
+        """
+        sb = get_supabase()
+        result = BulkResult()
+        valid = []
+        for i, row in enumerate(rows):
+            if row.get(key) is None:
+                result.errors[i] = f"missing {key}"
+            elif len(row) < 2:
+                result.errors[i] = 'nothing to update'
+            else:
+                valid.append((i, row))
+
+        def update_one(i: int, row: Dict):
+            result.round_trips += 1
+            try:
+                changes = {k: v for k, v in row.items() if k != key}
+                data = sb.table(table).update(changes).eq(key, row[key]).execute().data
+                if data:
+                    result.rows.append(row)
+                else:
+                    result.errors[i] = 'not found'
+            except Exception as e:
+                result.errors[i] = _error_text(e)
+
+        use_rpc = bulk_enabled() and table in BULK_UPDATE_TABLES and 'bulk_update_rows' not in _missing_rpcs
+        size = BulkWriter._chunk_size(chunk_size)
+        for start in range(0, len(valid), size):
+            chunk = valid[start:start + size]
+            if use_rpc:
+                result.round_trips += 1
+                try:
+                    updated = sb.rpc('bulk_update_rows', {
+                        'p_table': table, 'p_key': key, 'p_rows': [row for _, row in chunk],
+                    }).execute().data or []
+                    found = {str(k) for k in updated}
+                    for i, row in chunk:
+                        if str(row[key]) in found:
+                            result.rows.append(row)
+                        else:
+                            result.errors[i] = 'not found'
+                    continue
+                except APIError as e:
+                    if str(getattr(e, 'code', '')) in _MISSING_FUNCTION_CODES:
+                        _missing_rpcs.add('bulk_update_rows')
+                        use_rpc = False
+                        current_app.logger.warning("bulk_update_rows() missing; updating row by row until restart")
+                    # Fall through: replay this chunk row by row for per-row errors
+                except Exception:
+                    pass
+            for i, row in chunk:
+                update_one(i, row)
+        BulkWriter._record(table, 'update', result)
+        return result
+
+    @staticmethod
+    def _record(table: str, op: str, result: BulkResult):
+        metrics.inc('finucity_bulk_rows_total', result.succeeded, help='Rows written through bulk APIs',
+                    table=table, op=op)
+        if result.errors:
+            metrics.inc('finucity_bulk_row_errors_total', len(result.errors), help='Rows rejected in bulk writes',
+                        table=table, op=op)
+
+
+# =====================================================================
+# WRITE-BEHIND BUFFER
+# =====================================================================
+
+class BulkBuffer:
+    """
+    Per-process buffer for rows nobody reads back in the same request.
+    Flushed every BULK_FLUSH_INTERVAL seconds, at BULK_BUFFER_MAX_ROWS,
+    and at interpreter exit. Rows a flush could not write are logged
+    with their payload.
+    """
+
+    def __init__(self, app=None, interval: float = BULK_FLUSH_INTERVAL, max_rows: int = BULK_BUFFER_MAX_ROWS):
+        self.app = None
+        self.interval = interval
+        self.max_rows = max_rows
+        self._pending: Dict[str, List[Dict]] = {}
+        self._lock = threading.Lock()
+        self._flush_lock = threading.Lock()
+        self._wake = threading.Event()
+        self._thread: Optional[threading.Thread] = None
+        self._pid = None
+        self.stats = {'queued': 0, 'written': 0, 'failed': 0, 'flushes': 0}
+        self.outbox = None
+        if app:
+            self.init_app(app)
+
+    def init_app(self, app):
+        self.app = app
+        app.extensions['bulk_buffer'] = self
+        self.outbox = app.extensions.get('outbox')
+        atexit.register(self.flush)
+        metrics.register_collector(self.metric_samples)
+
+    def add(self, table: str, row: Dict) -> bool:
+        """Queue one row (written immediately when bulk operations are off)"""
+        if self.outbox is not None and self.outbox.enabled:
+            # Durable, and the dispatcher batches per table just like flush()
+            self.outbox.enqueue(table, row)
+            return True
+        if self.app is None or not bulk_enabled():
+            return BulkWriter.insert(table, [row]).ok
+        with self._lock:
+            rows = self._pending.setdefault(table, [])
+            rows.append(row)
+            self.stats['queued'] += 1
+            full = sum(len(r) for r in self._pending.values()) >= self.max_rows
+        self._ensure_thread()
+        if full:
+            self._wake.set()
+        return True
+
+    def pending(self) -> int:
+        with self._lock:
+            return sum(len(rows) for rows in self._pending.values())
+
+    def flush(self) -> Dict[str, BulkResult]:
+        """Write everything queued so far; one multi-row insert per table"""
+        with self._flush_lock:
+            with self._lock:
+                batch, self._pending = self._pending, {}
+            if not batch or self.app is None:
+                return {}
+            results = {}
+            with self.app.app_context():
+                for table, rows in batch.items():
+                    try:
+                        result = BulkWriter.insert(table, rows)
+                    except Exception as e:
+                        result = BulkResult(errors={i: _error_text(e) for i in range(len(rows))})
+                    results[table] = result
+                    self.stats['written'] += result.succeeded
+                    self.stats['failed'] += len(result.errors)
+                    for i, reason in result.errors.items():
+                        self.app.logger.error(f"Buffered {table} row dropped ({reason}): {rows[i]}")
+            self.stats['flushes'] += 1
+            return results
+
+    def _ensure_thread(self):
+        # Threads do not survive a gunicorn fork, so check the owning PID too
+        if self._thread and self._thread.is_alive() and self._pid == os.getpid():
+            return
+        with self._lock:
+            if self._thread and self._thread.is_alive() and self._pid == os.getpid():
+                return
+            self._pid = os.getpid()
+            self._thread = threading.Thread(target=self._run, name='bulk-buffer', daemon=True)
+            self._thread.start()
+
+    def _run(self):
+        while True:
+            self._wake.wait(timeout=self.interval)
+            self._wake.clear()
+            try:
+                self.flush()
+            except Exception as e:
+                self.app.logger.error(f"Bulk buffer flush failed: {e}")
+
+    def metric_samples(self):
+        """Samples for finucity.metrics collectors"""
+        yield ('finucity_bulk_buffer_pending', 'gauge', 'Rows waiting in the write-behind buffer',
+               self.pending(), {})
+        yield ('finucity_bulk_buffer_written_total', 'counter', 'Buffered rows written', self.stats['written'], {})
+        yield ('finucity_bulk_buffer_failed_total', 'counter', 'Buffered rows dropped after a failed write',
+               self.stats['failed'], {})
+
+
+# Global instance
+bulk_buffer = BulkBuffer()
+
+__all__ = ['BulkWriter', 'BulkResult', 'BulkBuffer', 'bulk_buffer', 'bulk_enabled', 'BULK_UPDATE_TABLES']
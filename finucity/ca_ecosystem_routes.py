@@ -7,10 +7,11 @@ Author: Sumeet Sangwan (Fintech-grade implementation)
 from flask import Blueprint, request, jsonify, current_app, g
 from flask_login import login_required, current_user
 from functools import wraps
-import time
+import math
 from datetime import datetime
 from finucity.services.ca_ecosystem import CAEcosystemService, ComplaintService, DocumentService
 from finucity.database import get_supabase
+from finucity.ratelimit import client_ip, rate_limiter
 
 # Create blueprint
 ca_ecosystem_bp = Blueprint('ca_ecosystem', __name__, url_prefix='/api/ca-ecosystem')
@@ -20,33 +21,15 @@ ca_ecosystem_bp = Blueprint('ca_ecosystem', __name__, url_prefix='/api/ca-ecosys
 # =====================================================
 
 def rate_limit(max_requests=60, window=60):
-    """Simple rate limiting decorator"""
+    """Per-endpoint, per-client sliding-window limit shared by all workers (finucity.ratelimit)"""
     def decorator(f):
         @wraps(f)
         def decorated_function(*args, **kwargs):
-            # Store request timestamps in memory (for demo - use Redis in production)
-            if not hasattr(current_app, 'rate_limit_store'):
-                current_app.rate_limit_store = {}
-            
-            client_ip = request.environ.get('HTTP_X_FORWARDED_FOR', request.remote_addr)
-            now = time.time()
-            
-            # Clean old requests
-            if client_ip in current_app.rate_limit_store:
-                current_app.rate_limit_store[client_ip] = [
-                    req_time for req_time in current_app.rate_limit_store[client_ip]
-                    if now - req_time < window
-                ]
-            else:
-                current_app.rate_limit_store[client_ip] = []
-            
-            # Check limit
-            if len(current_app.rate_limit_store[client_ip]) >= max_requests:
-                return jsonify({'error': 'Rate limit exceeded'}), 429
-            
-            # Add current request
-            current_app.rate_limit_store[client_ip].append(now)
-            
+            result = rate_limiter.hit(f"{request.endpoint}:{client_ip()}", max_requests, window)
+            if not result.allowed:
+                response = jsonify({'error': 'Rate limit exceeded'})
+                response.headers['Retry-After'] = str(max(1, math.ceil(min(result.retry_after, window))))
+                return response, 429
             return f(*args, **kwargs)
         return decorated_function
     return decorator
@@ -73,7 +56,7 @@ def verified_ca_required(f):
 
 def log_client_info():
     """Log client information for audit"""
-    g.client_ip = request.environ.get('HTTP_X_FORWARDED_FOR', request.remote_addr)
+    g.client_ip = client_ip()
     g.user_agent = request.headers.get('User-Agent', '')
 
 # =====================================================
@@ -0,0 +1,188 @@
+"""
+In-Process Caches
+Small per-worker read-through caches for hot lookups.
+Author: Sumeet Sangwan
+"""
+
+import threading
+import time
+from collections import OrderedDict
+from typing import Any, Callable, Dict, Hashable, Iterable, Optional
+
+_MISSING = object()
+
+
+class TTLCache:
+    """
+    Bounded LRU cache with TTL, negative caching and stampede protection.
+
+    - Found values live for `ttl` seconds, "not found" (None) results for
+      `negative_ttl` seconds, so unknown IDs do not hammer the database.
+    - Concurrent misses on the same key share one loader call
+      (single-flight); other threads wait for its result.
+    - Loader exceptions are never cached.
+    - Optionally bounded by weight too: with `weigher` (e.g. len) the
+      cached values never weigh more than `max_weight` in total, and a
+      single heavier value is returned without being cached.
+    """
+
+    def __init__(self, name: str, ttl: float = 30.0, negative_ttl: float = 5.0,
+                 max_size: int = 10000, weigher: Optional[Callable[[Any], int]] = None,
+                 max_weight: Optional[int] = None):
+        self.name = name
+        self.ttl = ttl
+        self.negative_ttl = negative_ttl
+        self.max_size = max_size
+        self.weigher = weigher
+        self.max_weight = max_weight
+        self.weight = 0
+        self._data: "OrderedDict[Hashable, tuple]" = OrderedDict()
+        self._lock = threading.Lock()
+        self._inflight: Dict[Hashable, threading.Event] = {}
+        self._generation: Dict[Hashable, int] = {}
+        self.stats = {
+            'hits': 0,
+            'negative_hits': 0,
+            'misses': 0,
+            'loads': 0,
+            'load_errors': 0,
+            'coalesced': 0,
+            'invalidations': 0,
+            'evictions': 0,
+            'load_seconds_total': 0.0,
+        }
+
+    def _weigh(self, value: Any) -> int:
+        return self.weigher(value) if self.weigher and value is not None else 0
+
+    def _drop(self, key: Hashable):
+        entry = self._data.pop(key, None)
+        if entry is not None:
+            self.weight -= self._weigh(entry[0])
+
+    def _lookup(self, key: Hashable) -> Any:
+        entry = self._data.get(key)
+        if entry is None:
+            return _MISSING
+        value, expires_at = entry
+        if expires_at < time.monotonic():
+            self._drop(key)
+            return _MISSING
+        self._data.move_to_end(key)
+        return value
+
+    def _store(self, key: Hashable, value: Any):
+        ttl = self.negative_ttl if value is None else self.ttl
+        if ttl <= 0:
+            return
+        weight = self._weigh(value)
+        if self.max_weight is not None and weight > self.max_weight:
+            return
+        self._drop(key)
+        self._data[key] = (value, time.monotonic() + ttl)
+        self.weight += weight
+        while len(self._data) > self.max_size or (self.max_weight is not None and self.weight > self.max_weight):
+            self._drop(next(iter(self._data)))
+            self.stats['evictions'] += 1
+
+    def get(self, key: Hashable, default: Any = None) -> Any:
+        """Cached value or `default`, without loading"""
+        with self._lock:
+            value = self._lookup(key)
+        return default if value is _MISSING else value
+
+    def get_or_load(self, key: Hashable, loader: Callable[[], Any]) -> Any:
+        """Return the cached value, calling `loader` at most once per miss"""
+        while True:
+            with self._lock:
+                value = self._lookup(key)
+                if value is not _MISSING:
+                    self.stats['negative_hits' if value is None else 'hits'] += 1
+                    return value
+                waiter = self._inflight.get(key)
+                if waiter is None:
+                    self.stats['misses'] += 1
+                    event = self._inflight[key] = threading.Event()
+                    generation = self._generation.get(key, 0)
+                    break
+                self.stats['coalesced'] += 1
+            # Another thread is loading this key; wait for it and re-check
+            waiter.wait(timeout=max(self.ttl, 1.0))
+
+        started = time.perf_counter()
+        try:
+            value = loader()
+        except Exception:
+            with self._lock:
+                self.stats['load_errors'] += 1
+                self._inflight.pop(key, None)
+            event.set()
+            raise
+        with self._lock:
+            self.stats['loads'] += 1
+            self.stats['load_seconds_total'] += time.perf_counter() - started
+            # Skip the store if the key was invalidated while we were loading
+            if self._generation.get(key, 0) == generation:
+                self._store(key, value)
+            self._inflight.pop(key, None)
+        event.set()
+        return value
+
+    def set(self, key: Hashable, value: Any):
+        """Prime the cache with a known value"""
+        with self._lock:
+            self._store(key, value)
+
+    def invalidate(self, key: Hashable):
+        """Drop one key (and fence any load already in flight)"""
+        with self._lock:
+            self._drop(key)
+            self._generation[key] = self._generation.get(key, 0) + 1
+            if len(self._generation) > self.max_size:
+                self._generation.clear()
+            self.stats['invalidations'] += 1
+
+    def clear(self):
+        """Drop everything"""
+        with self._lock:
+            self._data.clear()
+            self._generation.clear()
+            self.weight = 0
+
+    def __len__(self) -> int:
+        return len(self._data)
+
+    @property
+    def hit_ratio(self) -> float:
+        hits = self.stats['hits'] + self.stats['negative_hits']
+        total = hits + self.stats['misses']
+        return hits / total if total else 0.0
+
+    @property
+    def avg_load_seconds(self) -> float:
+        return self.stats['load_seconds_total'] / self.stats['loads'] if self.stats['loads'] else 0.0
+
+    def metric_samples(self) -> Iterable[tuple]:
+        """Samples for finucity.metrics collectors"""
+        labels = {'cache': self.name}
+        hits = self.stats['hits'] + self.stats['negative_hits']
+        yield ('finucity_cache_hits_total', 'counter', 'Cache hits (including negative hits)', hits, labels)
+        yield ('finucity_cache_negative_hits_total', 'counter', 'Hits on cached not-found results',
+               self.stats['negative_hits'], labels)
+        yield ('finucity_cache_misses_total', 'counter', 'Cache misses', self.stats['misses'], labels)
+        yield ('finucity_cache_coalesced_total', 'counter', 'Misses served by another in-flight load',
+               self.stats['coalesced'], labels)
+        yield ('finucity_cache_load_errors_total', 'counter', 'Loader failures (not cached)',
+               self.stats['load_errors'], labels)
+        yield ('finucity_cache_invalidations_total', 'counter', 'Explicit invalidations',
+               self.stats['invalidations'], labels)
+        yield ('finucity_cache_entries', 'gauge', 'Entries currently cached', len(self._data), labels)
+        if self.weigher:
+            yield ('finucity_cache_weight', 'gauge', 'Total weight of cached values (e.g. bytes)', self.weight, labels)
+        yield ('finucity_cache_hit_ratio', 'gauge', 'Hits / (hits + misses)', round(self.hit_ratio, 4), labels)
+        yield ('finucity_cache_saved_seconds_total', 'counter',
+               'Estimated database time saved (hits x average load latency)',
+               round(hits * self.avg_load_seconds, 6), labels)
+
+
+__all__ = ['TTLCache']
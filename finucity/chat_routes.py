@@ -4,7 +4,7 @@ Maintains clean separation between frontend and backend
 Author: Sumeet Sangwan
 """
 
-from flask import Blueprint, render_template, request, jsonify, session, current_app
+from flask import Blueprint, render_template, request, jsonify, session, current_app, Response, stream_with_context
 from flask_login import login_required, current_user
 from datetime import datetime, timedelta
 import uuid
@@ -14,8 +14,11 @@ import random
 import requests
 
 from finucity.models import User
-from finucity.database import ChatService, UserService, get_supabase
+from finucity.database import ChatService, UserService
 from finucity.ai import get_ai_response, detect_category
+from finucity.exports import EXPORT_FORMATS, decode_cursor, stream_export
+from finucity.history_purge import history_purge
+from finucity.middleware import feature_required
 
 # Create blueprint
 chat_bp = Blueprint('chat', __name__, url_prefix='/chat')
@@ -135,13 +138,14 @@ def chat_history():
     page = request.args.get('page', 1, type=int)
     per_page = 20
     
-    # Get conversations from Supabase
-    all_conversations = ChatService.get_user_queries(current_user.id, limit=100)
+    # Titles only for the whole list; full responses just for the visible page
+    all_conversations = ChatService.list_titles(current_user.id, limit=100)
     
     # Simple pagination
     start = (page - 1) * per_page
     end = start + per_page
-    conversations_page = all_conversations[start:end] if all_conversations else []
+    page_ids = [q.id for q in all_conversations[start:end]]
+    conversations_page = ChatService.get_queries_by_ids(current_user.id, page_ids)
     
     # Create pagination object-like structure
     class Pagination:
@@ -376,8 +380,8 @@ def api_send_message():
 def api_get_conversations():
     """Get user's conversation list"""
     try:
-        # Get conversations from Supabase
-        queries = ChatService.get_user_queries(current_user.id, limit=50)
+        # Get conversations from Supabase (titles only, no responses)
+        queries = ChatService.list_titles(current_user.id, limit=50)
         
         # Group by session_id
         conversation_dict = {}
@@ -508,14 +512,17 @@ def api_delete_conversation(conversation_id):
 @chat_bp.route('/api/clear-history', methods=['POST'])
 @login_required
 def api_clear_history():
-    """Clear all chat history for the current user"""
+    """
+    Clear all chat history for the current user.
+    History is hidden immediately; rows are deleted in batches in the background.
+    """
     try:
-        sb = get_supabase()
-        sb.table('chat_queries').delete().eq('user_id', current_user.id).execute()
+        job = history_purge.request_clear(current_user.id)
         return jsonify({
             'success': True,
-            'message': 'Chat history cleared successfully'
-        })
+            'message': 'Chat history cleared successfully',
+            'purge': job
+        }), 202
     except Exception as e:
         current_app.logger.error(f"Clear history API error: {e}")
         return jsonify({
@@ -523,6 +530,60 @@ def api_clear_history():
             'error': 'Failed to clear history'
         }), 500
 
+@chat_bp.route('/api/clear-history/status')
+@login_required
+def api_clear_history_status():
+    """Progress of the current user's background history purge"""
+    job = history_purge.status(current_user.id)
+    return jsonify({
+        'success': True,
+        'purge': job
+    })
+
+@chat_bp.route('/api/export')
+@login_required
+@feature_required('ENABLE_CONVERSATION_EXPORT')
+def api_export_history():
+    """
+    Stream the user's full chat history as NDJSON, CSV, Markdown or PDF.
+    Rows are paged from Supabase and written as they arrive; every row
+    carries a cursor, and ?cursor=<token> resumes just after that row.
+    """
+    fmt = request.args.get('format', 'ndjson').lower()
+    if fmt not in EXPORT_FORMATS:
+        return jsonify({
+            'success': False,
+            'error': f"Unsupported format. Use one of: {', '.join(sorted(EXPORT_FORMATS))}"
+        }), 400
+    
+    try:
+        after = decode_cursor(request.args.get('cursor'))
+    except ValueError:
+        return jsonify({
+            'success': False,
+            'error': 'Invalid export cursor'
+        }), 400
+    
+    user_id = current_user.id
+    title = f"Finucity Chat History - {current_user.full_name}"
+    
+    def generate():
+        rows = ChatService.iter_user_queries(user_id, after=after)
+        try:
+            for chunk in stream_export(fmt, rows, title):
+                yield chunk
+        except Exception as e:
+            # Headers are already sent; the client resumes from the last cursor it saw
+            current_app.logger.error(f"Export stream error for user {user_id}: {e}")
+    
+    mimetype, extension = EXPORT_FORMATS[fmt]
+    filename = f"finucity-chat-history-{datetime.utcnow().strftime('%Y%m%d')}.{extension}"
+    response = Response(stream_with_context(generate()), mimetype=mimetype)
+    response.headers['Content-Disposition'] = f'attachment; filename="{filename}"'
+    response.headers['Cache-Control'] = 'no-store'
+    response.headers['X-Accel-Buffering'] = 'no'  # don't let nginx buffer the stream
+    return response
+
 @chat_bp.route('/api/conversation/<int:conversation_id>/rename', methods=['PUT'])
 @login_required
 def api_rename_conversation(conversation_id):
@@ -4,11 +4,444 @@ Finucity uses ONLY Supabase for all data storage
 Author: Sumeet Sangwan (Refactored for production)
 """
 
+import copy
 import os
-from typing import Optional, Dict, List, Any
+import random
+import re
+import threading
+import time
+from concurrent.futures import Future, ThreadPoolExecutor, TimeoutError as FutureTimeout
+from datetime import datetime, timezone
+from typing import Optional, Dict, List, Any, Callable
+
+import httpx
+from httpx import Headers, QueryParams
+from postgrest import APIError, SyncRequestBuilder, SyncRPCFilterRequestBuilder
 from supabase import create_client, Client
 from functools import wraps
-from flask import g, current_app
+from flask import g, current_app, has_request_context
+from flask_login import current_user
+
+from finucity.ai import CATEGORY_KEYWORDS
+from finucity.cache import TTLCache
+from finucity.exports import check_cursor
+from finucity.metrics import metrics
+from finucity.query_trace import query_tracer, DB_DEBUG_HEADERS
+from finucity.rows import ProfileRow, ChatTitleRow, ChatQueryRow, fetch_projected
+from finucity.standin import StandInClient, create_standin, is_standin_url
+
+# =====================================================================
+# MANAGED CLIENT - pooled transport, per-operation timeouts, read retries
+# =====================================================================
+
+SUPABASE_POOL_SIZE = int(os.getenv('SUPABASE_POOL_SIZE', '20'))
+SUPABASE_POOL_KEEPALIVE = int(os.getenv('SUPABASE_POOL_KEEPALIVE', '10'))
+SUPABASE_KEEPALIVE_EXPIRY = float(os.getenv('SUPABASE_KEEPALIVE_EXPIRY', '30'))
+SUPABASE_CONNECT_TIMEOUT = float(os.getenv('SUPABASE_CONNECT_TIMEOUT', '5'))
+SUPABASE_TIMEOUTS = {
+    'read': float(os.getenv('SUPABASE_READ_TIMEOUT', '10')),
+    'write': float(os.getenv('SUPABASE_WRITE_TIMEOUT', '15')),
+    'rpc': float(os.getenv('SUPABASE_RPC_TIMEOUT', '30')),
+}
+SUPABASE_READ_RETRIES = int(os.getenv('SUPABASE_READ_RETRIES', '3'))
+SUPABASE_RETRY_BASE_DELAY = 0.1   # seconds, doubled per attempt
+SUPABASE_RETRY_MAX_DELAY = 2.0
+USERNAME_ALLOCATION_ATTEMPTS = int(os.getenv('USERNAME_ALLOCATION_ATTEMPTS', '5'))
+
+# Only these are safe to replay; writes and RPCs (POST) run exactly once
+_IDEMPOTENT_METHODS = ('GET', 'HEAD')
+# Gateway errors and PostgREST "could not reach / pool exhausted" codes
+_RETRYABLE_API_CODES = {'502', '503', '504', 'PGRST000', 'PGRST001', 'PGRST002', 'PGRST003'}
+
+
+def _is_retryable(error: Exception) -> bool:
+    if isinstance(error, httpx.TransportError):  # connect/read timeouts, dropped keep-alives
+        return True
+    return isinstance(error, APIError) and str(error.code) in _RETRYABLE_API_CODES
+
+
+# =====================================================================
+# IDENTITY MAP - request-scoped dedupe of identical reads
+# =====================================================================
+
+ENABLE_IDENTITY_MAP = os.getenv('ENABLE_IDENTITY_MAP', 'true').lower() == 'true'
+IDENTITY_MAP_MAX_ENTRIES = int(os.getenv('IDENTITY_MAP_MAX_ENTRIES', '128'))
+
+# Headers that change what a GET returns (.single(), count=, range)
+_IDENTITY_HEADERS = ('accept', 'prefer', 'range', 'range-unit')
+_MISS = object()
+
+
+class IdentityMap:
+    """
+    Unit-of-work cache for one request.
+
+    Identical single-row lookups - same table, filters and projection -
+    hit PostgREST once; later calls get a copy of the first response.
+    Only reads bounded to one row (an `id=eq.` filter, limit(1) or
+    .single()) are kept, and at most IDENTITY_MAP_MAX_ENTRIES of them
+    (oldest dropped first), so list and paged reads never pile up here.
+    Any write to a
+    table drops that table's entries, and an RPC (unknown side effects)
+    drops everything.
+    """
+
+    def __init__(self, max_entries: Optional[int] = None):
+        self._entries: Dict[tuple, Any] = {}
+        self.max_entries = max_entries or IDENTITY_MAP_MAX_ENTRIES
+        self.hits = 0
+        self.misses = 0
+        self.invalidations = 0
+
+    @staticmethod
+    def key(table: str, builder) -> Optional[tuple]:
+        """(table, filter, projection) key, or None unless the read returns at most one row"""
+        params = getattr(builder, 'params', None)
+        if not isinstance(params, QueryParams):
+            return None
+        headers = getattr(builder, 'headers', None) or {}
+        single_row = (any(value.startswith('eq.') for value in params.get_list('id'))
+                      or params.get('limit') == '1'
+                      or 'vnd.pgrst.object' in (headers.get('accept') or ''))
+        if not single_row:
+            return None
+        return (
+            table,
+            str(getattr(builder, 'path', '')),
+            tuple(sorted(params.multi_items())),
+            tuple((name, headers.get(name)) for name in _IDENTITY_HEADERS if headers.get(name)),
+        )
+
+    def get(self, key: tuple) -> Any:
+        if key not in self._entries:
+            self.misses += 1
+            return _MISS
+        self.hits += 1
+        return copy.deepcopy(self._entries[key])
+
+    def put(self, key: tuple, result: Any):
+        # Callers are free to mutate what they get back, so keep our own copy
+        self._entries.pop(key, None)
+        while self._entries and len(self._entries) >= self.max_entries:
+            del self._entries[next(iter(self._entries))]
+        self._entries[key] = copy.deepcopy(result)
+
+    def invalidate(self, table: Optional[str] = None):
+        """Drop entries for `table` (every entry when None)"""
+        stale = [k for k in self._entries if table is None or k[0] == table]
+        for k in stale:
+            del self._entries[k]
+        if stale:
+            self.invalidations += 1
+
+    def __len__(self) -> int:
+        return len(self._entries)
+
+    def stats(self) -> Dict[str, int]:
+        return {'saved': self.hits, 'misses': self.misses,
+                'invalidations': self.invalidations, 'entries': len(self._entries)}
+
+
+def current_identity_map() -> Optional[IdentityMap]:
+    """The identity map for the active request (None outside a request or when disabled)"""
+    if not ENABLE_IDENTITY_MAP or not has_request_context():
+        return None
+    identity = g.get('_identity_map')
+    if identity is None:
+        identity = g._identity_map = IdentityMap()
+    return identity
+
+
+def report_identity_map(response):
+    """after_request hook: count saved round trips, expose them in debug"""
+    identity = g.get('_identity_map')
+    if identity is None:
+        return response
+    if identity.hits:
+        metrics.inc('finucity_db_identity_map_saved_total', identity.hits,
+                    help='PostgREST round trips served from the request identity map')
+    if current_app.debug or DB_DEBUG_HEADERS:
+        response.headers['X-DB-Roundtrips-Saved'] = str(identity.hits)
+        current_app.logger.debug(
+            f"identity map [{g.get('request_id', '-')}]: saved {identity.hits}, "
+            f"misses {identity.misses}, invalidations {identity.invalidations}"
+        )
+    return response
+
+
+class SupabaseClientManager:
+    """
+    Owns the service-role client and one HTTP connection pool per process.
+
+    - All PostgREST traffic shares a single httpx transport with a bounded,
+      keep-alive pool; it is rebuilt after a gunicorn fork (PID change).
+    - Each operation kind (read / write / rpc) gets its own timeout.
+    - Idempotent reads are retried with exponential backoff and full jitter;
+      writes are never replayed.
+    """
+    
+    def __init__(self, url: str, key: str):
+        self.url = url
+        self.key = key
+        self.raw: Optional[Client] = None
+        self._pid = None
+        self._lock = threading.Lock()
+        self._transport: Optional[httpx.HTTPTransport] = None
+        self._sessions: Dict[float, httpx.Client] = {}
+        self._base_url = None
+        self._headers = None
+        self._managed = None
+        self.stats = {'requests': 0, 'errors': 0, 'retries': 0, 'rebuilds': 0}
+        self.latency: Dict[str, List[float]] = {}  # op -> [count, total_seconds]
+    
+    def _ensure(self):
+        if self._pid == os.getpid() and self.raw is not None:
+            return
+        with self._lock:
+            if self._pid == os.getpid() and self.raw is not None:
+                return
+            if self._pid is not None:
+                self.stats['rebuilds'] += 1
+            # Service role client for backend operations (bypasses RLS);
+            # sqlite: URLs get the local stand-in (finucity.standin)
+            self.raw = create_standin(self.url, self.key) if is_standin_url(self.url) \
+                else create_client(self.url, self.key)
+            session = getattr(getattr(self.raw, 'postgrest', None), 'session', None)
+            if isinstance(session, httpx.Client):
+                # Snapshot the service-role headers now, before any auth call
+                # on the raw client can swap its PostgREST token
+                self._base_url = str(session.base_url)
+                self._headers = dict(session.headers)
+                self._transport = self.raw.transport if isinstance(self.raw, StandInClient) \
+                    else httpx.HTTPTransport(limits=httpx.Limits(
+                        max_connections=SUPABASE_POOL_SIZE,
+                        max_keepalive_connections=SUPABASE_POOL_KEEPALIVE,
+                        keepalive_expiry=SUPABASE_KEEPALIVE_EXPIRY,
+                    ))
+            else:
+                self._transport = None  # non-httpx stand-in: pass builders through untouched
+            self._sessions = {}
+            self._managed = ManagedClient(self, self.raw)
+            self._pid = os.getpid()
+    
+    def client(self) -> 'ManagedClient':
+        """The managed client for this process"""
+        self._ensure()
+        return self._managed
+    
+    def session(self, op: str, timeout: Optional[float] = None) -> Optional[httpx.Client]:
+        """httpx client on the shared pool with the timeout for `op`"""
+        self._ensure()
+        if self._transport is None:
+            return None
+        seconds = float(timeout or SUPABASE_TIMEOUTS.get(op, SUPABASE_TIMEOUTS['read']))
+        session = self._sessions.get(seconds)
+        if session is None:
+            with self._lock:
+                session = self._sessions.get(seconds)
+                if session is None:
+                    session = httpx.Client(
+                        base_url=self._base_url,
+                        headers=self._headers,
+                        transport=self._transport,
+                        timeout=httpx.Timeout(seconds, connect=min(seconds, SUPABASE_CONNECT_TIMEOUT)),
+                        event_hooks={'response': [query_tracer.capture_response]},
+                    )
+                    self._sessions[seconds] = session
+        return session
+    
+    @staticmethod
+    def operation(builder) -> str:
+        """Classify a builder as read / write / rpc"""
+        if str(getattr(builder, 'path', '')).startswith('/rpc/'):
+            return 'rpc'
+        return 'read' if getattr(builder, 'http_method', 'GET') in _IDEMPOTENT_METHODS else 'write'
+    
+    def execute(self, builder, table: str, timeout: Optional[float] = None, fresh: bool = False,
+                no_identity: bool = False):
+        """Run a PostgREST builder on the pool, retrying idempotent reads"""
+        op = self.operation(builder)
+        identity, key = current_identity_map(), None
+        if identity is not None:
+            if op == 'read':
+                key = None if no_identity else identity.key(table, builder)
+                if key is not None and not fresh:
+                    cached = identity.get(key)
+                    if cached is not _MISS:
+                        query_tracer.record(table, op, builder, cached, cached=True)
+                        return cached
+            else:
+                identity.invalidate(None if op == 'rpc' else table)
+        exchanges = query_tracer.begin()
+        started = time.perf_counter()
+        try:
+            result = self._execute(builder, op, timeout)
+        except Exception as e:
+            query_tracer.record(table, op, builder, seconds=time.perf_counter() - started,
+                                exchanges=exchanges, error=e)
+            raise
+        query_tracer.record(table, op, builder, result, time.perf_counter() - started, exchanges)
+        if key is not None:
+            identity.put(key, result)
+        return result
+    
+    def _execute(self, builder, op: str, timeout: Optional[float] = None):
+        session = self.session(op, timeout)
+        if session is not None:
+            builder.session = session
+        retryable = getattr(builder, 'http_method', None) in _IDEMPOTENT_METHODS
+        attempts = 1 + (SUPABASE_READ_RETRIES if retryable else 0)
+        for attempt in range(attempts):
+            started = time.perf_counter()
+            try:
+                result = builder.execute()
+                self._record(op, time.perf_counter() - started)
+                return result
+            except Exception as e:
+                self._record(op, time.perf_counter() - started, failed=True)
+                if attempt + 1 >= attempts or not _is_retryable(e):
+                    raise
+                self.stats['retries'] += 1
+                delay = random.uniform(0, min(SUPABASE_RETRY_MAX_DELAY, SUPABASE_RETRY_BASE_DELAY * 2 ** attempt))
+                time.sleep(delay)
+    
+    def _record(self, op: str, seconds: float, failed: bool = False):
+        with self._lock:
+            self.stats['requests'] += 1
+            if failed:
+                self.stats['errors'] += 1
+            bucket = self.latency.setdefault(op, [0, 0.0])
+            bucket[0] += 1
+            bucket[1] += seconds
+    
+    def pool_stats(self) -> Dict[str, Any]:
+        """Connection pool health for this process"""
+        connections = []
+        pool = getattr(self._transport, '_pool', None)
+        try:
+            connections = list(getattr(pool, 'connections', None) or [])
+        except Exception:
+            pass
+        idle = sum(1 for c in connections if getattr(c, 'is_idle', lambda: False)())
+        return {
+            'pid': self._pid,
+            'pooled': self._transport is not None,
+            'max_connections': SUPABASE_POOL_SIZE,
+            'max_keepalive': SUPABASE_POOL_KEEPALIVE,
+            'connections': len(connections),
+            'idle': idle,
+            'active': len(connections) - idle,
+            'timeouts': dict(SUPABASE_TIMEOUTS),
+            **self.stats,
+            'latency_ms': {op: round(total / count * 1000, 2) if count else 0.0
+                           for op, (count, total) in self.latency.items()},
+        }
+    
+    def metric_samples(self):
+        """Samples for finucity.metrics collectors"""
+        health = self.pool_stats()
+        yield ('finucity_db_pool_connections', 'gauge', 'Open pooled connections', health['connections'], {})
+        yield ('finucity_db_pool_idle', 'gauge', 'Idle keep-alive connections', health['idle'], {})
+        yield ('finucity_db_pool_max', 'gauge', 'Pool connection limit', health['max_connections'], {})
+        yield ('finucity_db_requests_total', 'counter', 'PostgREST requests executed', health['requests'], {})
+        yield ('finucity_db_errors_total', 'counter', 'PostgREST requests that failed', health['errors'], {})
+        yield ('finucity_db_retries_total', 'counter', 'Idempotent reads retried', health['retries'], {})
+        for op, (count, total) in list(self.latency.items()):
+            yield ('finucity_db_latency_seconds_total', 'counter', 'Time spent in PostgREST calls',
+                   round(total, 6), {'op': op})
+
+
+class ManagedQuery:
+    """Wraps a postgrest builder so that .execute() goes through the manager"""
+    
+    def __init__(self, manager: SupabaseClientManager, builder, table: str, timeout: Optional[float] = None):
+        self._manager = manager
+        self._builder = builder
+        self._table = table
+        self._timeout = timeout
+        self._fresh = False
+        self._no_identity = False
+    
+    def _derive(self, builder, timeout: Optional[float]) -> 'ManagedQuery':
+        query = ManagedQuery(self._manager, builder, self._table, timeout)
+        query._fresh = self._fresh
+        query._no_identity = self._no_identity
+        return query
+    
+    def _wrap(self, value):
+        if hasattr(value, 'path') and hasattr(value, 'session'):
+            return self._derive(value, self._timeout)
+        return value
+    
+    def __getattr__(self, name):
+        attr = getattr(self._builder, name)
+        if callable(attr):
+            def call(*args, **kwargs):
+                return self._wrap(attr(*args, **kwargs))
+            return call
+        return self._wrap(attr)  # e.g. the `.not_` property
+
+    def or_(self, filters: str, reference_table: Optional[str] = None) -> 'ManagedQuery':
+        """PostgREST or=(...) filter (the pinned postgrest 0.13 builders lack .or_())"""
+        native = getattr(self._builder, 'or_', None)
+        if native is not None:
+            return self._wrap(native(filters, reference_table=reference_table) if reference_table
+                              else native(filters))
+        key = f'{reference_table}.or' if reference_table else 'or'
+        self._builder.params = self._builder.params.add(key, f'({filters})')
+        return self
+
+    def with_timeout(self, seconds: float) -> 'ManagedQuery':
+        """Override the per-operation timeout for this query"""
+        return self._derive(self._builder, seconds)
+    
+    def fresh(self) -> 'ManagedQuery':
+        """Bypass the request identity map (e.g. re-reading after an RPC elsewhere)"""
+        query = self._derive(self._builder, self._timeout)
+        query._fresh = True
+        return query
+    
+    def no_identity(self) -> 'ManagedQuery':
+        """Neither serve nor remember this read in the identity map (exports, paged scans)"""
+        query = self._derive(self._builder, self._timeout)
+        query._no_identity = True
+        return query
+    
+    def execute(self):
+        return self._manager.execute(self._builder, self._table, self._timeout, fresh=self._fresh,
+                                     no_identity=self._no_identity)
+
+
+class ManagedClient:
+    """
+    Drop-in replacement for supabase.Client used by every service.
+    table()/rpc() are served from the shared pool; anything else
+    (auth, storage, functions) falls through to the underlying client.
+    """
+    
+    def __init__(self, manager: SupabaseClientManager, raw: Client):
+        self._manager = manager
+        self._raw = raw
+    
+    def table(self, table_name: str) -> ManagedQuery:
+        session = self._manager.session('read')
+        builder = SyncRequestBuilder(session, f"/{table_name}") if session is not None \
+            else self._raw.table(table_name)
+        return ManagedQuery(self._manager, builder, table_name)
+    
+    from_ = table
+    
+    def rpc(self, fn: str, params: Dict[Any, Any]) -> ManagedQuery:
+        session = self._manager.session('rpc')
+        if session is not None:
+            builder = SyncRPCFilterRequestBuilder(session, f"/rpc/{fn}", "POST", Headers(), QueryParams(), json=params)
+        else:
+            builder = self._raw.rpc(fn, params)
+        return ManagedQuery(self._manager, builder, f"rpc:{fn}")
+    
+    def __getattr__(self, name):
+        return getattr(self._raw, name)
+
 
 class SupabaseDB:
     """
@@ -17,7 +450,7 @@ class SupabaseDB:
     """
     
     def __init__(self, app=None):
-        self.client: Optional[Client] = None
+        self.manager: Optional[SupabaseClientManager] = None
         if app:
             self.init_app(app)
     
@@ -26,60 +459,209 @@ class SupabaseDB:
         supabase_url = os.getenv('SUPABASE_URL')
         supabase_service_key = os.getenv('SUPABASE_SERVICE_KEY')
         
-        if not supabase_url or not supabase_service_key:
+        if not supabase_url or not (supabase_service_key or is_standin_url(supabase_url)):
             raise RuntimeError(
                 "SUPABASE_URL and SUPABASE_SERVICE_KEY must be set. "
                 "Finucity requires Supabase as the database."
             )
+        if is_standin_url(supabase_url):
+            app.logger.warning(f"Using the local Supabase stand-in at {supabase_url} (not for production)")
         
-        # Service role client for backend operations (bypasses RLS)
-        self.client = create_client(supabase_url, supabase_service_key)
+        self.manager = SupabaseClientManager(supabase_url, supabase_service_key or '')
+        metrics.register_collector(self.manager.metric_samples)
         
-        app.config['SUPABASE_CLIENT'] = self.client
+        app.config['SUPABASE_CLIENT'] = self.get_client()
+        app.after_request(report_identity_map)
+        query_tracer.init_app(app)
         app.teardown_appcontext(self.teardown)
     
     def teardown(self, exception):
         """Cleanup on request end"""
         pass
     
-    def get_client(self) -> Client:
-        """Get Supabase client instance"""
-        if not self.client:
+    @property
+    def client(self) -> Optional['ManagedClient']:
+        return self.manager.client() if self.manager else None
+    
+    def get_client(self) -> 'ManagedClient':
+        """Get Supabase client instance (shared pool for this process)"""
+        if not self.manager:
             raise RuntimeError("Supabase client not initialized")
-        return self.client
+        return self.manager.client()
+    
+    def pool_stats(self) -> Dict[str, Any]:
+        """Connection pool health for /health and /metrics"""
+        return self.manager.pool_stats() if self.manager else {}
 
 # Global instance
 supabase_db = SupabaseDB()
 
-def get_supabase() -> Client:
+def get_supabase() -> 'ManagedClient':
     """Get Supabase client for current request"""
     if not hasattr(g, 'supabase'):
         g.supabase = supabase_db.get_client()
     return g.supabase
 
+# =====================================================================
+# PARALLEL QUERIES - fan out independent reads, latency = max not sum
+# =====================================================================
+
+FANOUT_MAX_WORKERS = int(os.getenv('DB_FANOUT_MAX_WORKERS', '8'))
+FANOUT_TIMEOUT = float(os.getenv('DB_FANOUT_TIMEOUT', '8'))
+
+_fanout_lock = threading.Lock()
+_fanout_executor: Optional[ThreadPoolExecutor] = None
+_fanout_pid = None
+_fanout_local = threading.local()
+
+
+def _get_fanout_executor() -> ThreadPoolExecutor:
+    global _fanout_executor, _fanout_pid
+    if _fanout_executor is None or _fanout_pid != os.getpid():
+        with _fanout_lock:
+            if _fanout_executor is None or _fanout_pid != os.getpid():
+                _fanout_executor = ThreadPoolExecutor(max_workers=FANOUT_MAX_WORKERS,
+                                                      thread_name_prefix='db-fanout')
+                _fanout_pid = os.getpid()
+    return _fanout_executor
+
+
+class FanoutResult(dict):
+    """name -> value for every query; failures and timeouts are listed in `.errors`"""
+    
+    def __init__(self):
+        super().__init__()
+        self.errors: Dict[str, str] = {}
+    
+    @property
+    def ok(self) -> bool:
+        return not self.errors
+
+
+def _bind_context(fn: Callable[[], Any]) -> Callable[[], Any]:
+    """Wrap `fn` to run on a fan-out worker in the caller's app context, request id and trace"""
+    app = current_app._get_current_object()
+    parent_request_id = getattr(g, 'request_id', None) if has_request_context() else None
+    parent_trace = query_tracer.current()
+    
+    def run():
+        _fanout_local.active = True
+        try:
+            with app.app_context():
+                g.request_id = parent_request_id
+                g._query_trace = parent_trace
+                return fn()
+        finally:
+            _fanout_local.active = False
+    return run
+
+
+def submit_query(fn: Callable[[], Any]) -> Future:
+    """
+    Start one query on the fan-out pool and return its Future, so the
+    calling thread can do other work (an auth call, say) meanwhile.
+    Inside a fan-out worker it runs inline and returns a finished Future.
+    """
+    if getattr(_fanout_local, 'active', False):
+        future = Future()
+        try:
+            future.set_result(fn())
+        except Exception as e:
+            future.set_exception(e)
+        return future
+    return _get_fanout_executor().submit(_bind_context(fn))
+
+
+def run_parallel(queries: Dict[str, Any], timeout: Optional[float] = None,
+                 defaults: Optional[Dict[str, Any]] = None) -> FanoutResult:
+    """
+    Run independent query callables concurrently on a bounded, per-process
+    thread pool and gather their results by name.
+    
+    - `queries` maps a name to a zero-argument callable, or to a
+      (callable, timeout_seconds) tuple for a per-query deadline.
+    - A query that raises or misses its deadline does not fail the batch:
+      its name maps to `defaults.get(name)` and the reason is in `.errors`.
+    - Each callable runs in its own app context, so get_supabase() works.
+      Called from inside a fan-out worker, queries run inline to avoid
+      exhausting the pool.
+    """
+    defaults = defaults or {}
+    result = FanoutResult()
+    specs = {}
+    for name, spec in queries.items():
+        fn, query_timeout = spec if isinstance(spec, tuple) else (spec, None)
+        specs[name] = (fn, query_timeout or timeout or FANOUT_TIMEOUT)
+    
+    if getattr(_fanout_local, 'active', False) or len(specs) <= 1:
+        for name, (fn, _) in specs.items():
+            try:
+                result[name] = fn()
+            except Exception as e:
+                result[name] = defaults.get(name)
+                result.errors[name] = str(e)
+        return result
+    
+    executor = _get_fanout_executor()
+    started = time.monotonic()
+    futures = {name: executor.submit(_bind_context(fn)) for name, (fn, _) in specs.items()}
+    for name, future in futures.items():
+        remaining = specs[name][1] - (time.monotonic() - started)
+        try:
+            result[name] = future.result(timeout=max(remaining, 0))
+        except FutureTimeout:
+            future.cancel()
+            result[name] = defaults.get(name)
+            result.errors[name] = f"timed out after {specs[name][1]}s"
+        except Exception as e:
+            result[name] = defaults.get(name)
+            result.errors[name] = str(e)
+    
+    if result.errors:
+        metrics.inc('finucity_db_fanout_errors_total', len(result.errors),
+                    help='Fan-out queries that failed or timed out')
+        current_app.logger.warning(f"Parallel query partial failure: {result.errors}")
+    return result
+
+
+# Per-worker profile cache for the Flask-Login hot path (load_user runs on every request)
+profile_cache = TTLCache(
+    'profiles',
+    ttl=float(os.getenv('PROFILE_CACHE_TTL', '30')),
+    negative_ttl=float(os.getenv('PROFILE_CACHE_NEGATIVE_TTL', '5')),
+    max_size=int(os.getenv('PROFILE_CACHE_MAX_SIZE', '10000')),
+)
+metrics.register_collector(profile_cache.metric_samples)
+
 # User Operations
 class UserService:
     """User management via Supabase"""
     
+    # Called with a user_id after every profile write (e.g. session snapshot versions)
+    _invalidators: List[Callable[[str], None]] = []
+    
     @staticmethod
-    def get_by_id(user_id: str) -> Optional[Dict]:
-        """Get user by ID"""
+    def register_invalidator(fn: Callable[[str], None]):
+        """Run `fn(user_id)` whenever a cached profile is invalidated"""
+        if fn not in UserService._invalidators:
+            UserService._invalidators.append(fn)
+    
+    @staticmethod
+    def _fetch_by_id(user_id: str) -> Optional[ProfileRow]:
+        """Uncached profile read (raises on failure so errors are never cached)"""
+        sb = supabase_db.get_client()
+        result = fetch_projected(ProfileRow, lambda columns: sb.table('profiles')
+                                 .select(columns).eq('id', user_id).limit(1).execute())
+        return ProfileRow.from_row(result.data[0]) if result.data else None
+    
+    @staticmethod
+    def get_by_id(user_id: str) -> Optional[ProfileRow]:
+        """Get user by ID (served from the per-worker profile cache)"""
         try:
-            sb = supabase_db.get_client()
-            result = sb.table('profiles').select('*').eq('id', user_id).limit(1).execute()
-            return result.data[0] if result.data else None
+            return profile_cache.get_or_load(str(user_id), lambda: UserService._fetch_by_id(user_id))
         except Exception as e:
+            # Transient failures were already retried by the client manager
             current_app.logger.error(f"Error getting user by ID: {e}")
-            # Try reconnecting on connection error
-            try:
-                supabase_url = os.getenv('SUPABASE_URL')
-                supabase_service_key = os.getenv('SUPABASE_SERVICE_KEY')
-                if supabase_url and supabase_service_key:
-                    supabase_db.client = create_client(supabase_url, supabase_service_key)
-                    result = supabase_db.client.table('profiles').select('*').eq('id', user_id).limit(1).execute()
-                    return result.data[0] if result.data else None
-            except Exception as retry_error:
-                current_app.logger.error(f"Retry failed: {retry_error}")
             return None
     
     @staticmethod
@@ -99,22 +681,89 @@ class UserService:
         try:
             sb = get_supabase()
             result = sb.table('profiles').insert(user_data).execute()
+            if user_data.get('id'):
+                UserService.invalidate_cache(user_data['id'])  # clear any negative entry
+            PlatformStatsService.mark_stale()
             return result.data[0] if result.data else None
         except Exception as e:
             current_app.logger.error(f"Error creating user: {e}")
             return None
     
+    @staticmethod
+    def allocate_username(base: str, first_suffix: int = 1, taken: Optional[set] = None) -> str:
+        """
+        Lowest free name in `base`, `base{first_suffix}`, `base{first_suffix+1}`...
+        One prefix query (indexed, see PERFORMANCE_MIGRATIONS.sql PART 5)
+        returns every taken name of that shape instead of probing one
+        candidate per round trip.
+        """
+        base = base.lower()
+        sb = get_supabase()
+        result = sb.table('profiles').select('username')\
+            .filter('username', 'match', f"^{re.escape(base)}[0-9]*$").execute()
+        taken = {row['username'] for row in (result.data or []) if row.get('username')} | (taken or set())
+        if base not in taken:
+            return base
+        suffix = first_suffix
+        while f"{base}{suffix}" in taken:
+            suffix += 1
+        return f"{base}{suffix}"
+    
+    @staticmethod
+    def create_with_username(user_data: Dict, base: str, first_suffix: int = 1) -> Optional[Dict]:
+        """
+        Create a profile under the lowest free username derived from `base`.
+        The unique index on profiles.username settles concurrent signups:
+        a loser of the race re-scans and takes the next free name. The last
+        attempt falls back to a random suffix.
+        """
+        taken = set()
+        for attempt in range(USERNAME_ALLOCATION_ATTEMPTS):
+            try:
+                if attempt < USERNAME_ALLOCATION_ATTEMPTS - 1:
+                    username = UserService.allocate_username(base, first_suffix, taken)
+                else:
+                    username = f"{base.lower()}{random.randint(10000, 99999)}"
+                result = get_supabase().table('profiles').insert({**user_data, 'username': username}).execute()
+            except APIError as e:
+                if str(e.code) == '23505' and 'username' in f"{e.message} {e.details}":
+                    taken.add(username)
+                    metrics.inc('finucity_username_collisions_total', help='Username inserts lost to a concurrent signup')
+                    continue
+                current_app.logger.error(f"Error creating user: {e}")
+                return None
+            except Exception as e:
+                current_app.logger.error(f"Error creating user: {e}")
+                return None
+            if user_data.get('id'):
+                UserService.invalidate_cache(user_data['id'])  # clear any negative entry
+            PlatformStatsService.mark_stale()
+            return result.data[0] if result.data else None
+        current_app.logger.error(f"Error creating user: no free username for {base!r}")
+        return None
+    
     @staticmethod
     def update(user_id: str, updates: Dict) -> Optional[Dict]:
         """Update user profile"""
         try:
             sb = get_supabase()
             result = sb.table('profiles').update(updates).eq('id', user_id).execute()
+            UserService.invalidate_cache(user_id)
+            if 'role' in updates:
+                PlatformStatsService.mark_stale()
             return result.data[0] if result.data else None
         except Exception as e:
             current_app.logger.error(f"Error updating user: {e}")
+            UserService.invalidate_cache(user_id)
             return None
     
+    @staticmethod
+    def invalidate_cache(user_id: str):
+        """Drop a cached profile after any write to it (role, status, logout)"""
+        profile_cache.invalidate(str(user_id))
+        for invalidator in UserService._invalidators:
+            invalidator(str(user_id))
+    
     @staticmethod
     def get_all(limit: int = 100, offset: int = 0) -> List[Dict]:
         """Get all users (admin only)"""
@@ -126,17 +775,69 @@ class UserService:
             current_app.logger.error(f"Error getting all users: {e}")
             return []
 
+# Clear-history tombstones known to this worker: user_id -> ISO cutoff.
+# Rows created at or before the cutoff are hidden while the purge runs.
+_history_cutoffs: Dict[str, str] = {}
+
+
+def _parse_timestamp(value: Any) -> Optional[datetime]:
+    """Parse a Supabase timestamp string, tolerating a trailing Z"""
+    if not value:
+        return None
+    try:
+        parsed = datetime.fromisoformat(str(value).replace('Z', '+00:00'))
+    except ValueError:
+        return None
+    return parsed if parsed.tzinfo else parsed.replace(tzinfo=timezone.utc)
+
+
 # Chat/Message Operations
 class ChatService:
     """Chat query management via Supabase"""
     
+    # Optional cold-tier archive (finucity.archive.ChatArchive) consulted on hot misses
+    cold_store = None
+    
+    @staticmethod
+    def hide_history(user_id: str, cutoff: str) -> bool:
+        """
+        Hide every query created up to `cutoff` for a user.
+        Only the profile tombstone is written here; the rows themselves
+        are deleted later in batches by the history purge worker.
+        """
+        _history_cutoffs[user_id] = cutoff
+        return UserService.update(user_id, {'history_cleared_at': cutoff}) is not None
+    
+    @staticmethod
+    def history_cutoff(user_id: str) -> Optional[str]:
+        """Get the clear-history cutoff for a user, if any"""
+        if user_id in _history_cutoffs:
+            return _history_cutoffs[user_id]
+        if has_request_context() and getattr(current_user, 'id', None) == user_id:
+            return getattr(current_user, 'history_cleared_at', None)
+        return None
+    
+    @staticmethod
+    def _is_hidden(row: Optional[Dict]) -> bool:
+        """True if a row falls behind its owner's clear-history cutoff"""
+        if not row:
+            return False
+        cutoff = _parse_timestamp(ChatService.history_cutoff(row.get('user_id')))
+        created_at = _parse_timestamp(row.get('created_at'))
+        return bool(cutoff and created_at and created_at <= cutoff)
+    
+    @staticmethod
+    def _visible(query, user_id: str):
+        """Apply the clear-history cutoff to a chat_queries select"""
+        cutoff = ChatService.history_cutoff(user_id)
+        return query.gt('created_at', cutoff) if cutoff else query
+    
     @staticmethod
     def create_query(user_id: str, question: str, response: str, 
                     session_id: Optional[str] = None, 
                     category: str = 'general') -> Optional[Dict]:
         """Store chat query"""
         try:
-            sb = get_supabase()
             data = {
                 'user_id': user_id,
                 'question': question,
@@ -144,6 +845,9 @@ class ChatService:
                 'session_id': session_id,
                 'category': category
             }
+            # Written synchronously (not through the outbox): feedback, history and
+            # the sidebar read this row back on the next request
+            sb = get_supabase()
             result = sb.table('chat_queries').insert(data).execute()
             return result.data[0] if result.data else None
         except Exception as e:
@@ -155,22 +859,133 @@ class ChatService:
         """Get user's chat history"""
         try:
             sb = get_supabase()
-            result = sb.table('chat_queries')\
+            query = sb.table('chat_queries')\
                 .select('*')\
-                .eq('user_id', user_id)\
+                .eq('user_id', user_id)
+            result = ChatService._visible(query, user_id)\
                 .order('created_at', desc=True)\
                 .limit(limit)\
                 .execute()
-            return result.data if result.data else []
+            return ChatService._with_archived(user_id, result.data or [], limit)
         except Exception as e:
             current_app.logger.error(f"Error getting chat history: {e}")
             return []
     
+    @staticmethod
+    def _with_archived(user_id: str, rows: List[Dict], limit: int) -> List[Dict]:
+        """
+        Top up a newest-first page with archived queries. Only rows past
+        the archive cutoff get archived, so a full hot page is never older
+        than the archive and needs no merge.
+        """
+        if ChatService.cold_store is None or len(rows) >= limit:
+            return rows
+        archived = [r for r in ChatService.cold_store.recent_queries(user_id, limit)
+                    if not ChatService._is_hidden(r)]
+        if not archived:
+            return rows
+        merged = {str(r.get('id')): r for r in archived}
+        merged.update({str(r.get('id')): r for r in rows})  # hot copies win on overlap
+        return sorted(merged.values(), key=lambda r: (r.get('created_at') or '', str(r.get('id'))),
+                      reverse=True)[:limit]
+    
     @staticmethod
     def get_user_queries(user_id: str, limit: int = 100) -> List[Dict]:
         """Get user's queries (alias for get_user_history)"""
         return ChatService.get_user_history(user_id, limit)
     
+    @staticmethod
+    def list_titles(user_id: str, limit: int = 50) -> List[ChatTitleRow]:
+        """Newest-first query list without the (multi-KB) AI responses"""
+        try:
+            sb = get_supabase()
+            
+            def run(columns):
+                query = sb.table('chat_queries').select(columns).eq('user_id', user_id)
+                return ChatService._visible(query, user_id)\
+                    .order('created_at', desc=True)\
+                    .limit(limit)\
+                    .execute()
+            
+            rows = fetch_projected(ChatTitleRow, run).data or []
+            return ChatTitleRow.from_rows(ChatService._with_archived(user_id, rows, limit))
+        except Exception as e:
+            current_app.logger.error(f"Error listing chat titles: {e}")
+            return []
+    
+    @staticmethod
+    def get_queries_by_ids(user_id: str, query_ids: List[int]) -> List[ChatQueryRow]:
+        """Full rows for the given IDs, in the order the IDs were given"""
+        if not query_ids:
+            return []
+        try:
+            sb = get_supabase()
+            
+            def run(columns):
+                query = sb.table('chat_queries').select(columns).eq('user_id', user_id).in_('id', query_ids)
+                return ChatService._visible(query, user_id).execute()
+            
+            rows = {str(row['id']): row for row in fetch_projected(ChatQueryRow, run).data or []}
+            missing = [i for i in query_ids if str(i) not in rows]
+            if missing and ChatService.cold_store is not None:
+                # list_titles pages mix in archived queries: read those from the archive
+                for query_id, row in ChatService.cold_store.get_queries(missing).items():
+                    if str(row.get('user_id')) == str(user_id) and not ChatService._is_hidden(row):
+                        rows[query_id] = row
+            return [ChatQueryRow.from_row(rows[str(i)]) for i in query_ids if str(i) in rows]
+        except Exception as e:
+            current_app.logger.error(f"Error getting queries by ID: {e}")
+            return []
+    
+    @staticmethod
+    def get_user_queries_page(user_id: str, after: Optional[Dict] = None,
+                              page_size: int = 200) -> List[Dict]:
+        """
+        Get one page of a user's queries in (created_at, id) order.
+        `after` is the last row of the previous page (keyset pagination),
+        so each page costs the same no matter how deep the export is.
+        Raises on failure so callers streaming a response can stop cleanly.
+        """
+        sb = get_supabase()
+        query = sb.table('chat_queries')\
+            .select('*')\
+            .eq('user_id', user_id)
+        query = ChatService._visible(query, user_id)
+        if after and after.get('created_at') is not None:
+            after = check_cursor(after['created_at'], after.get('id'))
+            created_at = after['created_at']
+            query = query.or_(
+                f'created_at.gt."{created_at}",'
+                f'and(created_at.eq."{created_at}",id.gt."{after["id"]}")'
+            )
+        result = query\
+            .order('created_at', desc=False)\
+            .order('id', desc=False)\
+            .limit(page_size)\
+            .no_identity()\
+            .execute()
+        return result.data if result.data else []
+
+    @staticmethod
+    def iter_user_queries(user_id: str, after: Optional[Dict] = None,
+                          page_size: int = 200):
+        """Yield every query for a user, one page in memory at a time"""
+        if ChatService.cold_store is not None:
+            # Archived rows are older than every hot row: stream them first, then
+            # resume the hot keyset after the last one (skips rows mid-archival)
+            for row in ChatService.cold_store.iter_user_queries(user_id, after):
+                if not ChatService._is_hidden(row):
+                    yield row
+                after = {'created_at': row.get('created_at'), 'id': row.get('id')}
+        while True:
+            with query_tracer.expect_repeats():
+                page = ChatService.get_user_queries_page(user_id, after, page_size)
+            for row in page:
+                yield row
+            if len(page) < page_size:
+                return
+            after = {'created_at': page[-1].get('created_at'), 'id': page[-1].get('id')}
+
     @staticmethod
     def get_by_session(session_id: str) -> List[Dict]:
         """Get all messages in a session"""
@@ -181,7 +996,7 @@ class ChatService:
                 .eq('session_id', session_id)\
                 .order('created_at', asc=True)\
                 .execute()
-            return result.data if result.data else []
+            return [row for row in (result.data or []) if not ChatService._is_hidden(row)]
         except Exception as e:
             current_app.logger.error(f"Error getting session messages: {e}")
             return []
@@ -196,7 +1011,10 @@ class ChatService:
                 .eq('id', query_id)\
                 .limit(1)\
                 .execute()
-            return result.data[0] if result.data else None
+            row = result.data[0] if result.data else None
+            if row is None and ChatService.cold_store is not None:
+                row = ChatService.cold_store.get_query(query_id)
+            return None if ChatService._is_hidden(row) else row
         except Exception as e:
             current_app.logger.error(f"Error getting query by ID: {e}")
             return None
@@ -206,17 +1024,52 @@ class ChatService:
         """Get all queries in a session for a specific user"""
         try:
             sb = get_supabase()
-            result = sb.table('chat_queries')\
+            query = sb.table('chat_queries')\
                 .select('*')\
                 .eq('session_id', session_id)\
-                .eq('user_id', user_id)\
+                .eq('user_id', user_id)
+            result = ChatService._visible(query, user_id)\
                 .order('created_at', desc=False)\
                 .execute()
-            return result.data if result.data else []
+            rows = result.data if result.data else []
+            if ChatService.cold_store is not None:
+                archived = ChatService.cold_store.get_session(user_id, session_id)
+                if archived:
+                    # Old turns live in the archive; hot copies win on overlap
+                    merged = {str(r.get('id')): r for r in archived if not ChatService._is_hidden(r)}
+                    merged.update({str(r.get('id')): r for r in rows})
+                    rows = sorted(merged.values(), key=lambda r: (r.get('created_at') or '', str(r.get('id'))))
+            return rows
         except Exception as e:
             current_app.logger.error(f"Error getting queries by session: {e}")
             return []
     
+    @staticmethod
+    def get_query_ids_before(user_id: str, cutoff: str, limit: int = 500) -> List[int]:
+        """Get up to `limit` query IDs created at or before `cutoff` (raises on failure)"""
+        sb = get_supabase()
+        result = sb.table('chat_queries')\
+            .select('id')\
+            .eq('user_id', user_id)\
+            .lte('created_at', cutoff)\
+            .order('id', desc=False)\
+            .limit(limit)\
+            .execute()
+        return [row['id'] for row in (result.data or [])]
+    
+    @staticmethod
+    def delete_by_ids(user_id: str, query_ids: List[int]) -> int:
+        """Delete a bounded batch of a user's queries by ID (raises on failure)"""
+        if not query_ids:
+            return 0
+        sb = get_supabase()
+        sb.table('chat_queries')\
+            .delete()\
+            .eq('user_id', user_id)\
+            .in_('id', query_ids)\
+            .execute()
+        return len(query_ids)
+    
     @staticmethod
     def delete_by_session(session_id: str, user_id: str) -> bool:
         """Delete all queries in a session for a specific user"""
@@ -254,6 +1107,21 @@ class FeedbackService:
             current_app.logger.error(f"Error creating feedback: {e}")
             return None
     
+    @staticmethod
+    def create_feedback(user_id: str, query_id: str, rating: Optional[int] = None,
+                        is_helpful: Optional[bool] = None, feedback_text: Optional[str] = None) -> Optional[Dict]:
+        """Rate an AI answer (stored on its chat_queries row)"""
+        changes = {'rating': rating, 'is_helpful': is_helpful}
+        if feedback_text:
+            changes['feedback_text'] = feedback_text
+        try:
+            sb = get_supabase()
+            result = sb.table('chat_queries').update(changes).eq('id', query_id).eq('user_id', user_id).execute()
+            return result.data[0] if result.data else None
+        except Exception as e:
+            current_app.logger.error(f"Error saving feedback: {e}")
+            return None
+    
     @staticmethod
     def get_all(limit: int = 100) -> List[Dict]:
         """Get all feedback (admin only)"""
@@ -331,13 +1199,109 @@ class CAApplicationService:
             current_app.logger.error(f"Error rejecting application: {e}")
             return False
 
-# Platform Stats (Real-time)
-class PlatformStatsService:
-    """Fetches real-time platform statistics from Supabase"""
+# Platform Stats (background snapshot)
+# Every value chat_queries.category can hold: detect_category's categories,
+# 'general', and 'tax' (still accepted from the chat UI's category picker)
+STATS_CATEGORIES = tuple(CATEGORY_KEYWORDS) + ('tax', 'general')
+
 
+class PlatformStatsService:
+    """
+    Platform-wide aggregates served from a shared snapshot.
+    
+    compute_snapshot() runs the exact-count queries; the stats_snapshot
+    store (finucity.stats_snapshot) recomputes it in the background and
+    every endpoint reads the stored copy instead of scanning tables.
+    """
+    
+    snapshot = None  # set by StatsSnapshot.init_app
+    
+    @staticmethod
+    def compute_snapshot() -> Dict[str, Any]:
+        """Recompute the raw aggregates; raises if any query fails so a partial result is never published"""
+        sb = supabase_db.get_client()
+        
+        def count(table, **filters):
+            # limit(1): the total comes back in Content-Range, not as rows
+            def run():
+                query = sb.table(table).select('id', count='exact')
+                for column, value in filters.items():
+                    query = query.eq(column, value)
+                return query.limit(1).execute()
+            return run
+        
+        queries = {
+            'total_users': count('profiles'),
+            'total_queries': count('chat_queries'),
+            'total_cas': count('profiles', role='ca'),
+            'pending_cas': count('profiles', role='ca_pending'),
+            'helpful_queries': count('chat_queries', is_helpful=True),
+            'rated_queries': lambda: sb.table('chat_queries').select('id', count='exact').not_.is_('rating', 'null').limit(1).execute(),
+            'feedback_total': count('user_feedback'),
+        }
+        for rating in range(1, 6):
+            queries[f'query_rating_{rating}'] = count('chat_queries', rating=rating)
+            queries[f'feedback_rating_{rating}'] = count('user_feedback', rating=rating)
+        for category in STATS_CATEGORIES:
+            queries[f'category_{category}'] = count('chat_queries', category=category)
+        
+        results = run_parallel(queries)
+        if results.errors:
+            raise RuntimeError(f"Stats snapshot incomplete: {results.errors}")
+        
+        def total(name):
+            return results[name].count or 0
+        
+        categories = {category: total(f'category_{category}') for category in STATS_CATEGORIES}
+        
+        return {
+            'total_users': total('total_users'),
+            'total_queries': total('total_queries'),
+            'total_cas': total('total_cas'),
+            'pending_cas': total('pending_cas'),
+            'helpful_queries': total('helpful_queries'),
+            'rated_queries': total('rated_queries'),
+            'query_ratings': {str(r): total(f'query_rating_{r}') for r in range(1, 6)},
+            'feedback_total': total('feedback_total'),
+            'feedback_ratings': {str(r): total(f'feedback_rating_{r}') for r in range(1, 6)},
+            'categories': {category: n for category, n in categories.items() if n},
+        }
+    
+    @staticmethod
+    def get_snapshot() -> Optional[Dict[str, Any]]:
+        """{'data': aggregates, 'last_updated': iso timestamp} or None if unavailable"""
+        try:
+            if PlatformStatsService.snapshot is not None:
+                return PlatformStatsService.snapshot.read('platform')
+            return {
+                'data': PlatformStatsService.compute_snapshot(),
+                'last_updated': datetime.now(timezone.utc).isoformat(),
+            }
+        except Exception as e:
+            current_app.logger.error(f"Error reading platform stats snapshot: {e}")
+            return None
+    
+    @staticmethod
+    def mark_stale():
+        """Ask for an early refresh after a change that moves the headline numbers"""
+        if PlatformStatsService.snapshot is not None:
+            try:
+                PlatformStatsService.snapshot.mark_stale('platform')
+            except Exception as e:
+                current_app.logger.warning(f"Could not mark stats snapshot stale: {e}")
+    
+    @staticmethod
+    def average_rating(histogram: Dict[str, int], total: Optional[int] = None) -> Optional[float]:
+        """Mean of a {'1': n, ..., '5': n} histogram; `total` counts unrated rows as 0"""
+        rated = sum(histogram.values())
+        total = rated if total is None else total
+        if not total:
+            return None
+        return sum(int(rating) * n for rating, n in histogram.items()) / total
+    
     @staticmethod
     def get_stats() -> Dict[str, Any]:
-        """Get real-time platform stats for About / marketing pages."""
+        """Get platform stats for About / marketing pages."""
         stats = {
             'total_users': 0,
             'total_queries': 0,
@@ -345,40 +1309,20 @@ class PlatformStatsService:
             'satisfaction_rate': 0,
             'total_cas': 0,
             'total_services': 6,       # financial service pages
+            'last_updated': None,
         }
-        try:
-            sb = supabase_db.get_client()
-
-            # Total registered users
-            users_resp = sb.table('profiles').select('id', count='exact').execute()
-            stats['total_users'] = users_resp.count if hasattr(users_resp, 'count') and users_resp.count else len(users_resp.data or [])
-
-            # Total AI queries
-            queries_resp = sb.table('chat_queries').select('id', count='exact').execute()
-            stats['total_queries'] = queries_resp.count if hasattr(queries_resp, 'count') and queries_resp.count else len(queries_resp.data or [])
-
-            # Average satisfaction (from user_feedback ratings 1-5)
-            try:
-                fb_resp = sb.table('user_feedback').select('rating').not_.is_('rating', 'null').execute()
-                if fb_resp.data:
-                    ratings = [r['rating'] for r in fb_resp.data if r.get('rating')]
-                    if ratings:
-                        stats['satisfaction_rate'] = round(sum(ratings) / len(ratings) / 5 * 100, 1)
-            except Exception:
-                pass
-
-            # Total approved CAs
-            try:
-                ca_resp = sb.table('profiles').select('id', count='exact').eq('role', 'ca').execute()
-                stats['total_cas'] = ca_resp.count if hasattr(ca_resp, 'count') and ca_resp.count else len(ca_resp.data or [])
-            except Exception:
-                pass
-
-        except Exception as e:
-            try:
-                current_app.logger.error(f"Error fetching platform stats: {e}")
-            except Exception:
-                print(f"Error fetching platform stats: {e}")
+        snapshot = PlatformStatsService.get_snapshot()
+        if not snapshot:
+            return stats
+        data = snapshot['data']
+        stats['total_users'] = data.get('total_users', 0)
+        stats['total_queries'] = data.get('total_queries', 0)
+        stats['total_cas'] = data.get('total_cas', 0)
+        # Average satisfaction (from user_feedback ratings 1-5)
+        average = PlatformStatsService.average_rating(data.get('feedback_ratings', {}))
+        if average:
+            stats['satisfaction_rate'] = round(average / 5 * 100, 1)
+        stats['last_updated'] = snapshot['last_updated']
         return stats
 
 
@@ -542,11 +1486,19 @@ DEFAULT_BLOG_POSTS = [
 __all__ = [
     'supabase_db',
     'get_supabase',
+    'SupabaseClientManager',
+    'ManagedClient',
+    'IdentityMap',
+    'current_identity_map',
+    'run_parallel',
+    'FanoutResult',
+    'profile_cache',
     'UserService',
     'ChatService',
     'FeedbackService',
     'CAApplicationService',
     'PlatformStatsService',
+    'STATS_CATEGORIES',
     'BlogService',
     'DEFAULT_BLOG_POSTS',
 ]
@@ -0,0 +1,271 @@
+"""
+Conversation Export - streaming writers for chat history
+Each writer consumes an iterator of chat_queries rows and yields output
+chunks, so only one row (or one PDF page) is held in memory at a time.
+Author: Sumeet Sangwan
+"""
+
+import base64
+import csv
+import io
+import json
+import textwrap
+import uuid
+from datetime import datetime
+from typing import Dict, Iterable, Iterator, Optional
+
+# format -> (mimetype, file extension)
+EXPORT_FORMATS = {
+    'ndjson': ('application/x-ndjson', 'ndjson'),
+    'json': ('application/x-ndjson', 'ndjson'),
+    'csv': ('text/csv', 'csv'),
+    'md': ('text/markdown', 'md'),
+    'markdown': ('text/markdown', 'md'),
+    'pdf': ('application/pdf', 'pdf'),
+}
+
+EXPORT_FIELDS = ['id', 'session_id', 'category', 'question', 'response', 'created_at']
+
+
+# ===== RESUME CURSORS =====
+
+def encode_cursor(row: Dict) -> str:
+    """Opaque resume token pointing just after this row"""
+    payload = json.dumps({'c': row.get('created_at'), 'i': row.get('id')}, separators=(',', ':'))
+    return base64.urlsafe_b64encode(payload.encode()).decode().rstrip('=')
+
+
+def check_cursor(created_at, row_id) -> Dict:
+    """
+    Keyset position with a timestamp `created_at` and a UUID `id`; raises
+    ValueError otherwise. Cursor values end up inside a PostgREST or=(...)
+    filter, so nothing else may get through.
+    """
+    if not isinstance(created_at, str) or not isinstance(row_id, str):
+        raise ValueError("Cursor values must be strings")
+    datetime.fromisoformat(created_at)
+    return {'created_at': created_at, 'id': str(uuid.UUID(row_id))}
+
+
+def decode_cursor(token: Optional[str]) -> Optional[Dict]:
+    """Decode a resume token; raises ValueError if it is malformed"""
+    if not token:
+        return None
+    try:
+        padded = token + '=' * (-len(token) % 4)
+        payload = json.loads(base64.urlsafe_b64decode(padded.encode()).decode())
+        return check_cursor(payload['c'], payload['i'])
+    except Exception as e:
+        raise ValueError(f"Invalid export cursor: {e}")
+
+
+# ===== TEXT FORMATS =====
+
+def stream_ndjson(rows: Iterable[Dict]) -> Iterator[str]:
+    """One JSON object per line, each carrying its own resume cursor"""
+    for row in rows:
+        record = {field: row.get(field) for field in EXPORT_FIELDS}
+        record['cursor'] = encode_cursor(row)
+        yield json.dumps(record, ensure_ascii=False, default=str) + '\n'
+
+
+def stream_csv(rows: Iterable[Dict]) -> Iterator[str]:
+    """CSV with a header row; a single small buffer is reused per row"""
+    buffer = io.StringIO()
+    writer = csv.writer(buffer)
+
+    def drain():
+        data = buffer.getvalue()
+        buffer.seek(0)
+        buffer.truncate(0)
+        return data
+
+    writer.writerow(EXPORT_FIELDS + ['cursor'])
+    yield drain()
+    for row in rows:
+        writer.writerow([row.get(field) for field in EXPORT_FIELDS] + [encode_cursor(row)])
+        yield drain()
+
+
+def stream_markdown(rows: Iterable[Dict], title: str = 'Finucity Chat History') -> Iterator[str]:
+    """Markdown grouped by conversation, with a cursor comment after each entry"""
+    yield f"# {title}\n\n"
+    current_session = object()
+    for row in rows:
+        session_id = row.get('session_id')
+        if session_id != current_session:
+            current_session = session_id
+            yield f"## Conversation {session_id or 'untitled'}\n\n"
+        yield (
+            f"### {row.get('created_at', '')} · {row.get('category') or 'general'}\n\n"
+            f"**You:** {row.get('question') or ''}\n\n"
+            f"**Finucity AI:** {row.get('response') or ''}\n\n"
+            f"<!-- cursor: {encode_cursor(row)} -->\n\n"
+        )
+
+
+# ===== PDF =====
+
+class PDFStreamWriter:
+    """
+    Minimal PDF 1.4 writer that emits each page as soon as it is full.
+    Only byte offsets and page object numbers are kept until the end,
+    where the page tree, catalog and xref table are written.
+    """
+
+    PAGE_WIDTH = 595   # A4 in points
+    PAGE_HEIGHT = 842
+    MARGIN = 50
+    FONT_SIZE = 10
+    LEADING = 13
+    WRAP_WIDTH = 95
+    LINES_PER_PAGE = (PAGE_HEIGHT - 2 * MARGIN) // LEADING - 2  # leave room for footer
+
+    CATALOG_ID = 1
+    PAGES_ID = 2
+    FONT_ID = 3
+
+    def __init__(self, title: str = 'Finucity Chat History'):
+        self.title = title
+        self.offset = 0
+        self.offsets: Dict[int, int] = {}
+        self.page_ids = []
+        self.next_id = 4
+        self.lines = []
+        self.last_cursor = ''
+
+    def _emit(self, data: bytes) -> bytes:
+        self.offset += len(data)
+        return data
+
+    def _object(self, obj_id: int, body: bytes) -> bytes:
+        self.offsets[obj_id] = self.offset
+        return self._emit(f"{obj_id} 0 obj\n".encode() + body + b"\nendobj\n")
+
+    @staticmethod
+    def _escape(text: str) -> bytes:
+        text = text.replace('₹', 'Rs.')
+        text = text.replace('\\', '\\\\').replace('(', '\\(').replace(')', '\\)')
+        return text.encode('latin-1', 'replace')
+
+    def begin(self) -> bytes:
+        """PDF header and the shared font object"""
+        data = self._emit(b"%PDF-1.4\n%\xe2\xe3\xcf\xd3\n")
+        data += self._object(
+            self.FONT_ID,
+            b"<< /Type /Font /Subtype /Type1 /BaseFont /Helvetica /Encoding /WinAnsiEncoding >>"
+        )
+        self.lines = [self.title, '']
+        return data
+
+    def write_row(self, row: Dict) -> bytes:
+        """Lay out one chat entry; returns bytes for any pages it completed"""
+        out = b''
+        entry = [
+            f"[{row.get('created_at', '')}] {row.get('category') or 'general'}",
+            f"You: {row.get('question') or ''}",
+            f"Finucity AI: {row.get('response') or ''}",
+        ]
+        for paragraph in entry:
+            for raw_line in str(paragraph).splitlines() or ['']:
+                for line in textwrap.wrap(raw_line, self.WRAP_WIDTH) or ['']:
+                    self.lines.append(line)
+                    if len(self.lines) >= self.LINES_PER_PAGE:
+                        out += self._flush_page()
+        self.lines.append('')
+        self.last_cursor = encode_cursor(row)
+        return out
+
+    def _flush_page(self) -> bytes:
+        page_number = len(self.page_ids) + 1
+        top = self.PAGE_HEIGHT - self.MARGIN
+        parts = [f"BT /F1 {self.FONT_SIZE} Tf {self.LEADING} TL {self.MARGIN} {top} Td".encode()]
+        for line in self.lines:
+            parts.append(b"(" + self._escape(line) + b") '")
+        parts.append(b"ET")
+        footer = f"Page {page_number}"
+        if self.last_cursor:
+            footer += f"  -  resume cursor: {self.last_cursor}"
+        parts.append(
+            f"BT /F1 7 Tf {self.MARGIN} {self.MARGIN // 2} Td (".encode()
+            + self._escape(footer) + b") Tj ET"
+        )
+        stream = b"\n".join(parts)
+
+        content_id, page_id = self.next_id, self.next_id + 1
+        self.next_id += 2
+        self.page_ids.append(page_id)
+        self.lines = []
+
+        data = self._object(
+            content_id,
+            f"<< /Length {len(stream)} >>\nstream\n".encode() + stream + b"\nendstream"
+        )
+        data += self._object(
+            page_id,
+            (f"<< /Type /Page /Parent {self.PAGES_ID} 0 R "
+             f"/MediaBox [0 0 {self.PAGE_WIDTH} {self.PAGE_HEIGHT}] "
+             f"/Resources << /Font << /F1 {self.FONT_ID} 0 R >> >> "
+             f"/Contents {content_id} 0 R >>").encode()
+        )
+        return data
+
+    def close(self) -> bytes:
+        """Flush the last page and write the page tree, catalog and xref"""
+        data = b''
+        if self.lines or not self.page_ids:
+            data += self._flush_page()
+        kids = ' '.join(f"{pid} 0 R" for pid in self.page_ids)
+        data += self._object(
+            self.PAGES_ID,
+            f"<< /Type /Pages /Kids [{kids}] /Count {len(self.page_ids)} >>".encode()
+        )
+        data += self._object(self.CATALOG_ID, f"<< /Type /Catalog /Pages {self.PAGES_ID} 0 R >>".encode())
+
+        xref_offset = self.offset
+        size = self.next_id
+        xref = [f"xref\n0 {size}\n", "0000000000 65535 f \n"]
+        for obj_id in range(1, size):
+            xref.append(f"{self.offsets.get(obj_id, 0):010d} 00000 n \n")
+        xref.append(f"trailer\n<< /Size {size} /Root {self.CATALOG_ID} 0 R >>\nstartxref\n{xref_offset}\n%%EOF\n")
+        data += self._emit(''.join(xref).encode())
+        return data
+
+
+def stream_pdf(rows: Iterable[Dict], title: str = 'Finucity Chat History') -> Iterator[bytes]:
+    """PDF rendered page by page"""
+    writer = PDFStreamWriter(title)
+    yield writer.begin()
+    for row in rows:
+        chunk = writer.write_row(row)
+        if chunk:
+            yield chunk
+    yield writer.close()
+
+
+def stream_export(fmt: str, rows: Iterable[Dict], title: str = 'Finucity Chat History') -> Iterator:
+    """Dispatch to the writer for `fmt` (a key of EXPORT_FORMATS)"""
+    fmt = fmt.lower()
+    if fmt in ('ndjson', 'json'):
+        return stream_ndjson(rows)
+    if fmt == 'csv':
+        return stream_csv(rows)
+    if fmt in ('md', 'markdown'):
+        return stream_markdown(rows, title)
+    if fmt == 'pdf':
+        return stream_pdf(rows, title)
+    raise ValueError(f"Unsupported export format: {fmt}")
+
+
+__all__ = [
+    'EXPORT_FORMATS',
+    'encode_cursor',
+    'check_cursor',
+    'decode_cursor',
+    'stream_ndjson',
+    'stream_csv',
+    'stream_markdown',
+    'stream_pdf',
+    'stream_export',
+    'PDFStreamWriter',
+]
@@ -0,0 +1,160 @@
+"""
+Background Chat History Purge
+Clear-history hides a user's rows at once (profile tombstone) and a
+worker thread deletes them in bounded batches, so no request ever runs
+one unbounded DELETE against chat_queries.
+Author: Sumeet Sangwan
+"""
+
+import logging
+import os
+import queue
+import threading
+import time
+from datetime import datetime, timezone
+from typing import Callable, Dict, List, Optional
+
+from finucity.database import ChatService
+
+PURGE_BATCH_SIZE = int(os.getenv('HISTORY_PURGE_BATCH_SIZE', '500'))
+PURGE_BATCH_PAUSE = float(os.getenv('HISTORY_PURGE_BATCH_PAUSE', '0.05'))  # seconds between batches
+PURGE_MAX_RETRIES = 3
+
+
+class HistoryPurgeWorker:
+    """Per-process queue of clear-history jobs drained by one daemon thread"""
+
+    def __init__(self, app=None, batch_size: int = PURGE_BATCH_SIZE,
+                 pause: float = PURGE_BATCH_PAUSE):
+        self.app = None
+        self.batch_size = batch_size
+        self.pause = pause
+        self._queue: "queue.Queue[str]" = queue.Queue()
+        self._jobs: Dict[str, Dict] = {}
+        self._lock = threading.Lock()
+        self._thread: Optional[threading.Thread] = None
+        self._pid = None
+        self._invalidators: List[Callable[[str], None]] = []
+        if app:
+            self.init_app(app)
+
+    def init_app(self, app):
+        """Attach to the Flask app; the thread starts lazily on first job"""
+        self.app = app
+        app.extensions['history_purge'] = self
+
+    def register_invalidator(self, callback: Callable[[str], None]):
+        """Register a callback(user_id) run when a user's history changes"""
+        self._invalidators.append(callback)
+
+    def invalidate(self, user_id: str):
+        """Run every invalidation hook for a user, never raising"""
+        for callback in self._invalidators:
+            try:
+                callback(user_id)
+            except Exception as e:
+                self._log('warning', f"History invalidation hook failed for {user_id}: {e}")
+
+    def request_clear(self, user_id: str) -> Dict:
+        """Hide the user's history now and queue the batched delete"""
+        cutoff = datetime.now(timezone.utc).isoformat()
+        persisted = ChatService.hide_history(user_id, cutoff)
+        self.invalidate(user_id)
+
+        with self._lock:
+            job = self._jobs.get(user_id)
+            if job and job['state'] in ('queued', 'running'):
+                # Already purging; widen the cutoff and let the running job pick it up
+                job['cutoff'] = cutoff
+                return dict(job)
+            job = {
+                'user_id': user_id,
+                'state': 'queued',
+                'cutoff': cutoff,
+                'deleted': 0,
+                'batches': 0,
+                'tombstone_persisted': persisted,
+                'queued_at': cutoff,
+                'started_at': None,
+                'finished_at': None,
+                'error': None,
+            }
+            self._jobs[user_id] = job
+        self._queue.put(user_id)
+        self._ensure_thread()
+        return dict(job)
+
+    def status(self, user_id: str) -> Optional[Dict]:
+        """Progress snapshot for a user's latest clear-history job"""
+        with self._lock:
+            job = self._jobs.get(user_id)
+            return dict(job) if job else None
+
+    # ----- worker -----
+
+    def _ensure_thread(self):
+        # Threads do not survive a gunicorn fork, so check the owning PID too
+        if self._thread and self._thread.is_alive() and self._pid == os.getpid():
+            return
+        with self._lock:
+            if self._thread and self._thread.is_alive() and self._pid == os.getpid():
+                return
+            self._pid = os.getpid()
+            self._thread = threading.Thread(target=self._run, name='history-purge', daemon=True)
+            self._thread.start()
+
+    def _run(self):
+        while True:
+            user_id = self._queue.get()
+            try:
+                with self.app.app_context():
+                    self.purge(user_id)
+            except Exception as e:
+                self._log('error', f"History purge crashed for {user_id}: {e}")
+            finally:
+                self._queue.task_done()
+
+    def purge(self, user_id: str):
+        """Delete a user's hidden rows batch by batch, updating progress"""
+        job = self._jobs.get(user_id)
+        if not job:
+            return
+        self._update(job, state='running', started_at=datetime.now(timezone.utc).isoformat())
+        failures = 0
+        while True:
+            try:
+                ids = ChatService.get_query_ids_before(user_id, job['cutoff'], self.batch_size)
+                if not ids:
+                    break
+                deleted = ChatService.delete_by_ids(user_id, ids)
+            except Exception as e:
+                failures += 1
+                if failures > PURGE_MAX_RETRIES:
+                    # Rows stay hidden by the tombstone; clearing again resumes the purge
+                    self._update(job, state='failed', error=str(e),
+                                 finished_at=datetime.now(timezone.utc).isoformat())
+                    self._log('error', f"History purge failed for {user_id}: {e}")
+                    return
+                time.sleep(min(2 ** failures * self.pause, 5))
+                continue
+            failures = 0
+            self._update(job, deleted=job['deleted'] + deleted, batches=job['batches'] + 1)
+            self.invalidate(user_id)
+            if self.pause:
+                time.sleep(self.pause)
+        self._update(job, state='completed', finished_at=datetime.now(timezone.utc).isoformat())
+        self._log('info', f"History purge finished for {user_id}: {job['deleted']} rows in {job['batches']} batches")
+
+    def _update(self, job: Dict, **changes):
+        with self._lock:
+            job.update(changes)
+
+    def _log(self, level: str, message: str):
+        logger = self.app.logger if self.app else logging.getLogger(__name__)
+        getattr(logger, level)(message)
+
+
+# Global instance
+history_purge = HistoryPurgeWorker()
+
+__all__ = ['HistoryPurgeWorker', 'history_purge']
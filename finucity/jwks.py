@@ -0,0 +1,201 @@
+"""
+JWKS Key Store - local verification of Supabase access tokens
+One process-wide cache of the project's signing keys, so verifying a
+token is a dictionary lookup plus a signature check instead of an HTTP
+round trip to /auth/v1/jwks per login.
+
+- Keys are cached by `kid` as ready-to-use key objects for JWKS_TTL
+  seconds. Past JWKS_REFRESH_AFTER of that they are still served while
+  a background thread refetches (stale-while-revalidate).
+- A token with an unknown `kid` (key rotation) triggers a synchronous
+  refetch, at most once per JWKS_MIN_REFETCH_INTERVAL, so forged kids
+  cannot turn the endpoint into a fetch amplifier.
+- The algorithm comes from the token header and must match the key it
+  names: HS256 uses SUPABASE_JWT_SECRET (legacy projects), asymmetric
+  algorithms use the JWKS key. No trial-and-error between them.
+Author: Sumeet Sangwan
+"""
+
+import os
+import threading
+import time
+from typing import Any, Dict, Optional, Tuple
+
+import httpx
+import jwt
+from flask import current_app, has_app_context
+
+from finucity.metrics import metrics
+
+JWKS_TTL = float(os.getenv('JWKS_TTL', '3600'))                   # seconds a fetched key set is trusted
+JWKS_REFRESH_AFTER = float(os.getenv('JWKS_REFRESH_AFTER', '2700'))  # start background refresh
+JWKS_MIN_REFETCH_INTERVAL = float(os.getenv('JWKS_MIN_REFETCH_INTERVAL', '30'))
+JWKS_FETCH_TIMEOUT = float(os.getenv('JWKS_FETCH_TIMEOUT', '3'))
+JWT_LEEWAY = 600  # seconds of clock skew tolerated (unchanged from the old decoder)
+
+_ASYMMETRIC_ALGORITHMS = {'RS256', 'RS384', 'RS512', 'ES256', 'ES384', 'ES512', 'PS256', 'PS384', 'PS512', 'EdDSA'}
+
+
+_EC_CURVES = {'P-256': 'ES256', 'P-384': 'ES384', 'P-521': 'ES512'}
+
+
+def _algorithm_for(jwk: Dict[str, Any]) -> Optional[str]:
+    """Signing algorithm of a published key (its `alg`, else implied by kty/crv)"""
+    kty = jwk.get('kty')
+    alg = jwk.get('alg') or {'RSA': 'RS256', 'OKP': 'EdDSA'}.get(kty) or \
+        (_EC_CURVES.get(jwk.get('crv', 'P-256')) if kty == 'EC' else None)
+    return alg if alg in _ASYMMETRIC_ALGORITHMS else None  # never accept symmetric keys from JWKS
+
+
+def _log(level: str, message: str):
+    if has_app_context():
+        getattr(current_app.logger, level)(message)
+
+
+class JWKSKeyStore:
+    """kid -> key object cache with TTL, background refresh and rate-limited refetch"""
+
+    def __init__(self, url: Optional[str] = None):
+        self._url = url
+        self._keys: Dict[str, Tuple[Any, str]] = {}  # kid -> (key object, algorithm)
+        self._fetched_at = 0.0
+        self._attempted_at = 0.0
+        self._lock = threading.Lock()
+        self._fetch_lock = threading.Lock()
+        self._refreshing = False
+        self.stats = {'fetches': 0, 'fetch_errors': 0, 'refetch_throttled': 0, 'hits': 0}
+
+    def init_app(self, app):
+        app.extensions['jwks_store'] = self
+        metrics.register_collector(self.metric_samples)
+        if self.url:
+            self._refresh_in_background()  # warm the cache before the first login
+
+    @property
+    def url(self) -> Optional[str]:
+        if self._url:
+            return self._url
+        explicit = os.getenv('SUPABASE_JWKS_URL')
+        if explicit:
+            return explicit
+        base = os.getenv('SUPABASE_URL', '').rstrip('/')
+        return f"{base}/auth/v1/jwks" if base.startswith('http') else None
+
+    # ----- fetching -----
+
+    def fetch(self) -> bool:
+        """Load the key set now; returns False (and keeps the old keys) on failure"""
+        url = self.url
+        if not url:
+            return False
+        with self._fetch_lock:
+            self._attempted_at = time.time()
+            try:
+                response = httpx.get(url, timeout=JWKS_FETCH_TIMEOUT,
+                                     headers={'apikey': os.getenv('SUPABASE_ANON_KEY', '')})
+                response.raise_for_status()
+                keys = {}
+                for data in response.json().get('keys', []):
+                    algorithm = _algorithm_for(data)
+                    if not data.get('kid') or not algorithm:
+                        continue
+                    try:
+                        keys[data['kid']] = (jwt.PyJWK(data, algorithm).key, algorithm)  # parsed once
+                    except (jwt.PyJWKError, jwt.InvalidKeyError):
+                        continue  # unsupported key: skip it, keep the rest
+            except Exception as e:
+                self.stats['fetch_errors'] += 1
+                metrics.inc('finucity_jwks_fetches_total', help='JWKS fetches', result='error')
+                _log('warning', f"JWKS fetch from {url} failed: {e}")
+                return False
+            with self._lock:
+                self._keys = keys
+                self._fetched_at = time.time()
+            self.stats['fetches'] += 1
+            metrics.inc('finucity_jwks_fetches_total', help='JWKS fetches', result='ok')
+            return True
+
+    def _refresh_in_background(self):
+        with self._lock:
+            if self._refreshing:
+                return
+            self._refreshing = True
+
+        def run():
+            try:
+                self.fetch()
+            finally:
+                self._refreshing = False
+
+        threading.Thread(target=run, name='jwks-refresh', daemon=True).start()
+
+    # ----- lookup -----
+
+    def get(self, kid: Optional[str]) -> Optional[Tuple[Any, str]]:
+        """The key for `kid`, fetching at most once per refetch interval when unknown"""
+        age = time.time() - self._fetched_at
+        key = self._keys.get(kid) if kid else None
+        if key is not None and age < JWKS_TTL:
+            self.stats['hits'] += 1
+            if age >= JWKS_REFRESH_AFTER:
+                self._refresh_in_background()
+            return key
+        # Unknown kid (rotation) or an expired key set: synchronous refetch, rate limited
+        if time.time() - self._attempted_at < JWKS_MIN_REFETCH_INTERVAL:
+            self.stats['refetch_throttled'] += 1
+            return key  # an expired key beats no key while the endpoint is throttled or down
+        self.fetch()
+        return self._keys.get(kid) if kid else None
+
+    def clear(self):
+        with self._lock:
+            self._keys = {}
+            self._fetched_at = self._attempted_at = 0.0
+
+    def metric_samples(self):
+        """Samples for finucity.metrics collectors"""
+        yield ('finucity_jwks_keys', 'gauge', 'Signing keys cached from JWKS', len(self._keys), {})
+        yield ('finucity_jwks_age_seconds', 'gauge', 'Age of the cached key set',
+               round(time.time() - self._fetched_at, 1) if self._fetched_at else -1, {})
+        yield ('finucity_jwks_refetch_throttled_total', 'counter', 'Unknown-kid refetches skipped by the rate limit',
+               self.stats['refetch_throttled'], {})
+
+
+# Global instance
+jwks_store = JWKSKeyStore()
+
+
+def decode_supabase_token(token: str, store: Optional[JWKSKeyStore] = None) -> Tuple[Optional[Dict[str, Any]],
+                                                                                     Optional[str]]:
+    """Verify a Supabase access token -> (claims, None) or (None, error)"""
+    store = store or jwks_store
+    try:
+        header = jwt.get_unverified_header(token)
+    except jwt.PyJWTError as e:
+        return None, f"invalid token: {e}"
+    alg, kid = header.get('alg'), header.get('kid')
+    if alg == 'HS256':
+        secret = os.getenv('SUPABASE_JWT_SECRET')
+        if not secret:
+            return None, "server misconfigured: missing SUPABASE_JWT_SECRET for an HS256 token"
+        key, algorithm = secret, 'HS256'
+    elif alg in _ASYMMETRIC_ALGORITHMS:
+        signing_key = store.get(kid)
+        if signing_key is None:
+            metrics.inc('finucity_jwt_verifications_total', help='Access token verifications', alg=alg,
+                        result='unknown_kid')
+            return None, f"invalid token: no signing key for kid {kid!r}"
+        # The key decides the algorithm; a header naming another one is rejected
+        key, algorithm = signing_key
+    else:
+        return None, f"invalid token: unsupported algorithm {alg!r}"
+    try:
+        claims = jwt.decode(token, key, algorithms=[algorithm], options={'verify_aud': False}, leeway=JWT_LEEWAY)
+    except jwt.PyJWTError as e:
+        metrics.inc('finucity_jwt_verifications_total', help='Access token verifications', alg=alg, result='invalid')
+        return None, f"invalid token: {e}"
+    metrics.inc('finucity_jwt_verifications_total', help='Access token verifications', alg=alg, result='ok')
+    return claims, None
+
+
+__all__ = ['JWKSKeyStore', 'jwks_store', 'decode_supabase_token']
@@ -0,0 +1,409 @@
+"""
+CA Earnings Ledger
+Append-only balance entries with a per-CA sequence, checkpoint snapshots
+every LEDGER_SNAPSHOT_EVERY entries and O(1) balance reads (latest
+snapshot + the few entries after it).
+
+    available = completed credits + adjustments - withdrawals not rejected
+
+Writes go through the RPCs in PERFORMANCE_MIGRATIONS.sql (PART 3), which
+take a per-CA advisory lock so "check balance, then write" cannot race.
+Without those functions (migration pending, local stand-in database) the
+same steps run here under a per-process lock; the UNIQUE (ca_id, seq)
+constraint still rejects interleaved writers from other processes.
+That fallback cannot rely on the ca_earnings_to_ledger trigger either, so
+completed credits it has not posted are added to the available balance,
+and without the ledger tables at all the balance is the old sum over
+ca_earnings.
+Author: Sumeet Sangwan
+"""
+
+import os
+import re
+import threading
+from collections import defaultdict
+from dataclasses import dataclass
+from typing import Dict, List, Optional
+
+from flask import current_app
+from postgrest import APIError
+
+from finucity.database import get_supabase
+
+LEDGER_SNAPSHOT_EVERY = int(os.getenv('LEDGER_SNAPSHOT_EVERY', '50'))
+
+# PostgREST / Postgres codes for "function does not exist" / "table does not exist"
+_MISSING_FUNCTION_CODES = {'PGRST202', '42883'}
+_MISSING_TABLE_CODES = {'PGRST205', '42P01'}
+_missing_rpcs = set()
+_ledger_tables: Dict[str, bool] = {}  # 'deployed' -> whether ca_ledger_entries exists
+_ca_locks: Dict[str, threading.RLock] = defaultdict(threading.RLock)
+_ca_locks_guard = threading.Lock()
+
+
+class LedgerError(Exception):
+    """Business rule violation: 'insufficient_funds' or 'earnings_frozen'"""
+
+    def __init__(self, code: str, message: str = '', available: Optional[float] = None):
+        super().__init__(message or code)
+        self.code = code
+        self.available = available
+
+
+@dataclass(frozen=True)
+class LedgerBalance:
+    balance: float = 0
+    seq: int = 0            # last entry sequence number
+    snapshot_seq: int = 0   # sequence of the snapshot the read started from
+
+
+def _money(value) -> float:
+    return round(float(value or 0), 2)
+
+
+def _lock_for(ca_id: str) -> threading.RLock:
+    with _ca_locks_guard:
+        return _ca_locks[str(ca_id)]
+
+
+def _single(data):
+    """RPC payloads come back as an object or a one-element list"""
+    if isinstance(data, list):
+        return data[0] if data else None
+    return data
+
+
+def _raise_business_error(error: APIError):
+    message = str(getattr(error, 'message', '') or error)
+    if 'insufficient_funds' in message:
+        match = re.search(r'available\s+(-?[\d.]+)', message)
+        raise LedgerError('insufficient_funds', message,
+                          available=_money(match.group(1)) if match else None) from error
+    if 'earnings_frozen' in message:
+        raise LedgerError('earnings_frozen', message) from error
+
+
+class LedgerService:
+    """Ledger reads, writes and reconciliation (static, like the other services)"""
+
+    @staticmethod
+    def _rpc(name: str, params: Dict, fallback):
+        """Call an RPC, or `fallback()` if the function is not deployed"""
+        if name not in _missing_rpcs:
+            try:
+                return get_supabase().rpc(name, params).execute().data
+            except APIError as e:
+                _raise_business_error(e)
+                if str(getattr(e, 'code', '')) not in _MISSING_FUNCTION_CODES:
+                    raise
+                _missing_rpcs.add(name)
+                current_app.logger.warning(f"Ledger RPC {name} missing; using the in-process fallback")
+        return fallback()
+
+    @staticmethod
+    def _tables_deployed() -> bool:
+        """Whether the PART 3 ledger tables exist (checked once per process)"""
+        if 'deployed' not in _ledger_tables:
+            try:
+                get_supabase().table('ca_ledger_entries').select('seq').limit(1).execute()
+                _ledger_tables['deployed'] = True
+            except APIError as e:
+                if str(getattr(e, 'code', '')) not in _MISSING_TABLE_CODES:
+                    raise
+                _ledger_tables['deployed'] = False
+                current_app.logger.warning(
+                    "Ledger tables missing; balances use ca_earnings until "
+                    "PERFORMANCE_MIGRATIONS.sql PART 3 is applied")
+        return _ledger_tables['deployed']
+
+    # ----- reads -----
+
+    @staticmethod
+    def _earnings_rows(ca_id: str) -> List[Dict]:
+        return get_supabase().table('ca_earnings').select('id, transaction_type, status, amount')\
+            .eq('ca_id', ca_id).execute().data or []
+
+    @staticmethod
+    def _unposted_credits(ca_id: str) -> float:
+        """Completed credits and adjustments with no ledger entry (what the trigger would post)"""
+        credits = {key: amount for key, amount in
+                   LedgerService._expected_from_earnings(LedgerService._earnings_rows(ca_id)).items()
+                   if key[1] in ('credit', 'adjustment')}
+        if not credits:
+            return 0.0
+        posted = {(e.get('reference_id'), e['entry_type'])
+                  for e in get_supabase().table('ca_ledger_entries').select('reference_id, entry_type')
+                  .eq('ca_id', ca_id).execute().data or []}
+        return _money(sum(amount for key, amount in credits.items() if key not in posted))
+
+    @staticmethod
+    def _available_local(ca_id: str) -> LedgerBalance:
+        """
+        Available balance without the PART 3 functions: ledger entries plus
+        completed credits the missing trigger did not post, or the sum over
+        ca_earnings when there is no ledger at all.
+        """
+        if not LedgerService._tables_deployed():
+            expected = LedgerService._expected_from_earnings(LedgerService._earnings_rows(ca_id))
+            return LedgerBalance(balance=_money(sum(expected.values())))
+        current = LedgerService._balance_local(ca_id)
+        return LedgerBalance(balance=_money(current.balance + LedgerService._unposted_credits(ca_id)),
+                             seq=current.seq, snapshot_seq=current.snapshot_seq)
+
+    @staticmethod
+    def _balance_local(ca_id: str) -> LedgerBalance:
+        sb = get_supabase()
+        snapshot = sb.table('ca_ledger_snapshots').select('seq, balance').eq('ca_id', ca_id)\
+            .order('seq', desc=True).limit(1).execute().data
+        snapshot_seq = snapshot[0]['seq'] if snapshot else 0
+        balance = _money(snapshot[0]['balance']) if snapshot else 0.0
+        delta = sb.table('ca_ledger_entries').select('seq, amount').eq('ca_id', ca_id)\
+            .gt('seq', snapshot_seq).order('seq').execute().data or []
+        for entry in delta:
+            balance += _money(entry['amount'])
+        return LedgerBalance(balance=_money(balance), seq=delta[-1]['seq'] if delta else snapshot_seq,
+                             snapshot_seq=snapshot_seq)
+
+    @staticmethod
+    def balance(ca_id: str) -> LedgerBalance:
+        """Current available balance from the latest snapshot plus the delta since"""
+        row = _single(LedgerService._rpc('ledger_balance', {'p_ca_id': ca_id},
+                                         lambda: LedgerService._available_local(ca_id)))
+        if isinstance(row, LedgerBalance):
+            return row
+        if not row:
+            return LedgerBalance()
+        return LedgerBalance(balance=_money(row.get('balance')), seq=row.get('seq') or 0,
+                             snapshot_seq=row.get('snapshot_seq') or 0)
+
+    @staticmethod
+    def entries(ca_id: str, after_seq: int = 0, limit: Optional[int] = None) -> List[Dict]:
+        """Entries in sequence order"""
+        query = get_supabase().table('ca_ledger_entries').select('*').eq('ca_id', ca_id)\
+            .gt('seq', after_seq).order('seq')
+        if limit:
+            query = query.limit(limit)
+        return query.execute().data or []
+
+    # ----- writes -----
+
+    @staticmethod
+    def _post_local(ca_id: str, entry_type: str, amount: float, reference_id: Optional[str] = None,
+                    memo: Optional[str] = None, created_by: Optional[str] = None,
+                    require_funds: bool = False) -> Optional[Dict]:
+        if not LedgerService._tables_deployed():
+            # Nothing to post: the balance is read from ca_earnings
+            if require_funds:
+                available = LedgerService._available_local(ca_id).balance
+                if available + amount < 0:
+                    raise LedgerError('insufficient_funds', available=available)
+            return None
+        sb = get_supabase()
+        with _lock_for(ca_id):
+            if reference_id:
+                existing = sb.table('ca_ledger_entries').select('*').eq('reference_id', reference_id)\
+                    .eq('entry_type', entry_type).limit(1).execute().data
+                if existing:
+                    return existing[0]
+            current = LedgerService._balance_local(ca_id)
+            if require_funds:
+                available = _money(current.balance + LedgerService._unposted_credits(ca_id))
+                if available + amount < 0:
+                    raise LedgerError('insufficient_funds', available=available)
+            entry = sb.table('ca_ledger_entries').insert({
+                'ca_id': ca_id,
+                'seq': current.seq + 1,
+                'entry_type': entry_type,
+                'amount': _money(amount),
+                'balance_after': _money(current.balance + amount),
+                'reference_id': reference_id,
+                'memo': memo,
+                'created_by': created_by,
+            }).execute().data[0]
+            if entry['seq'] % LEDGER_SNAPSHOT_EVERY == 0:
+                sb.table('ca_ledger_snapshots').insert({
+                    'ca_id': ca_id, 'seq': entry['seq'], 'balance': entry['balance_after']
+                }).execute()
+            return entry
+
+    @staticmethod
+    def post(ca_id: str, entry_type: str, amount: float, reference_id: Optional[str] = None,
+             memo: Optional[str] = None, created_by: Optional[str] = None,
+             require_funds: bool = False) -> Dict:
+        """Append one entry (idempotent per reference_id + entry_type)"""
+        return _single(LedgerService._rpc('ledger_post', {
+            'p_ca_id': ca_id,
+            'p_entry_type': entry_type,
+            'p_amount': _money(amount),
+            'p_reference_id': reference_id,
+            'p_memo': memo,
+            'p_created_by': created_by,
+            'p_require_funds': require_funds,
+            'p_snapshot_every': LEDGER_SNAPSHOT_EVERY,
+        }, lambda: LedgerService._post_local(ca_id, entry_type, amount, reference_id,
+                                             memo, created_by, require_funds)))
+
+    @staticmethod
+    def request_withdrawal(ca_id: str, amount: float, bank_account: Optional[Dict] = None,
+                           description: Optional[str] = None) -> Dict:
+        """Create a pending debit and hold its funds; raises LedgerError"""
+        def local():
+            sb = get_supabase()
+            with _lock_for(ca_id):
+                profile = sb.table('profiles').select('earnings_frozen').eq('id', ca_id)\
+                    .limit(1).execute().data
+                if profile and profile[0].get('earnings_frozen'):
+                    raise LedgerError('earnings_frozen')
+                current = LedgerService._available_local(ca_id)
+                if current.balance < amount:
+                    raise LedgerError('insufficient_funds', available=current.balance)
+                transaction = sb.table('ca_earnings').insert({
+                    'ca_id': ca_id,
+                    'amount': amount,
+                    'transaction_type': 'debit',
+                    'status': 'pending',
+                    'title': 'Withdrawal Request',
+                    'description': description,
+                    'bank_account_details': bank_account,
+                }).execute().data[0]
+                entry = LedgerService._post_local(ca_id, 'withdrawal_hold', -amount, transaction['id'],
+                                                  description, ca_id)
+                return {'transaction': transaction, 'entry': entry}
+
+        return _single(LedgerService._rpc('ledger_request_withdrawal', {
+            'p_ca_id': ca_id,
+            'p_amount': _money(amount),
+            'p_bank_account': bank_account,
+            'p_description': description,
+        }, local))
+
+    @staticmethod
+    def release_withdrawal(transaction: Dict, admin_id: Optional[str] = None) -> Dict:
+        """Return a rejected withdrawal's held funds"""
+        return LedgerService.post(transaction['ca_id'], 'withdrawal_release', _money(transaction['amount']),
+                                  transaction['id'], 'Withdrawal rejected', admin_id)
+
+    @staticmethod
+    def adjust(ca_id: str, amount: float, reason: str, admin_id: str) -> Dict:
+        """Completed adjustment row plus its ledger entry (amount may be negative)"""
+        def local():
+            from datetime import datetime
+            now = datetime.utcnow().isoformat()
+            transaction = get_supabase().table('ca_earnings').insert({
+                'ca_id': ca_id,
+                'transaction_type': 'adjustment',
+                'amount': amount,
+                'title': 'Admin Adjustment',
+                'description': reason,
+                'status': 'completed',
+                'approved_by': admin_id,
+                'approved_at': now,
+                'processed_at': now,
+            }).execute().data[0]
+            entry = LedgerService._post_local(ca_id, 'adjustment', amount, transaction['id'], reason, admin_id)
+            return {'transaction': transaction, 'entry': entry}
+
+        return _single(LedgerService._rpc('ledger_adjust', {
+            'p_ca_id': ca_id, 'p_amount': _money(amount), 'p_reason': reason, 'p_admin_id': admin_id,
+        }, local))
+
+    @staticmethod
+    def set_frozen(ca_id: str, frozen: bool, role: Optional[str] = None) -> Optional[Dict]:
+        """Freeze/unfreeze under the CA's ledger lock; returns the profile or None"""
+        def local():
+            from datetime import datetime
+            with _lock_for(ca_id):
+                query = get_supabase().table('profiles').update({
+                    'earnings_frozen': frozen,
+                    'last_admin_action_at': datetime.utcnow().isoformat()
+                }).eq('id', ca_id)
+                if role:
+                    query = query.eq('role', role)
+                return query.execute().data
+
+        return _single(LedgerService._rpc('ledger_set_frozen', {
+            'p_ca_id': ca_id, 'p_frozen': frozen, 'p_role': role,
+        }, local))
+
+    # ----- reconciliation -----
+
+    @staticmethod
+    def _expected_from_earnings(rows: List[Dict]) -> Dict[tuple, float]:
+        """(reference_id, entry_type) -> amount the ledger should hold for these earnings rows"""
+        expected = {}
+        for row in rows:
+            kind, status = row.get('transaction_type'), row.get('status')
+            if kind in ('credit', 'adjustment') and status == 'completed':
+                expected[(row['id'], kind)] = _money(row['amount'])
+            elif kind == 'debit':
+                expected[(row['id'], 'withdrawal_hold')] = -_money(row['amount'])
+                if status == 'rejected':
+                    expected[(row['id'], 'withdrawal_release')] = _money(row['amount'])
+        return expected
+
+    @staticmethod
+    def reconcile(ca_id: str) -> Dict:
+        """Verify sequence, running balances and snapshots against the raw entries and ca_earnings"""
+        sb = get_supabase()
+        entries = LedgerService.entries(ca_id)
+        snapshots = sb.table('ca_ledger_snapshots').select('seq, balance').eq('ca_id', ca_id)\
+            .order('seq').execute().data or []
+        earnings = sb.table('ca_earnings').select('id, transaction_type, status, amount')\
+            .eq('ca_id', ca_id).execute().data or []
+
+        issues = []
+        running = 0.0
+        balance_at = {}
+        for expected_seq, entry in enumerate(entries, start=1):
+            if entry['seq'] != expected_seq:
+                issues.append(f"sequence gap: expected {expected_seq}, found {entry['seq']}")
+            running = _money(running + _money(entry['amount']))
+            balance_at[entry['seq']] = running
+            if abs(running - _money(entry['balance_after'])) > 0.005:
+                issues.append(f"seq {entry['seq']}: balance_after {entry['balance_after']} != running {running}")
+        for snapshot in snapshots:
+            actual = balance_at.get(snapshot['seq'])
+            if actual is None or abs(actual - _money(snapshot['balance'])) > 0.005:
+                issues.append(f"snapshot at seq {snapshot['seq']}: {snapshot['balance']} != entries {actual}")
+
+        expected = LedgerService._expected_from_earnings(earnings)
+        posted = {(e.get('reference_id'), e['entry_type']): _money(e['amount'])
+                  for e in entries if e.get('reference_id')}
+        missing = [key for key in expected if key not in posted]
+        for reference_id, entry_type in missing:
+            issues.append(f"earnings {reference_id} has no {entry_type} entry")
+        for key, amount in expected.items():
+            if key in posted and abs(posted[key] - amount) > 0.005:
+                issues.append(f"earnings {key[0]} {key[1]}: ledger {posted[key]} != earnings {amount}")
+
+        live = LedgerService.balance(ca_id)
+        if abs(live.balance - running) > 0.005:
+            issues.append(f"balance read {live.balance} != replayed {running}")
+
+        return {
+            'ca_id': ca_id,
+            'ok': not issues,
+            'entries': len(entries),
+            'snapshots': len(snapshots),
+            'balance': running,
+            'expected_balance': _money(sum(expected.values())),
+            'missing': len(missing),
+            'issues': issues,
+        }
+
+    @staticmethod
+    def backfill(ca_id: str) -> int:
+        """Post entries for earnings rows the ledger does not have yet; returns how many"""
+        rows = get_supabase().table('ca_earnings').select('id, transaction_type, status, amount, title, created_at')\
+            .eq('ca_id', ca_id).order('created_at').execute().data or []
+        posted = {(e.get('reference_id'), e['entry_type']) for e in LedgerService.entries(ca_id)}
+        count = 0
+        for (reference_id, entry_type), amount in LedgerService._expected_from_earnings(rows).items():
+            if (reference_id, entry_type) in posted:
+                continue
+            LedgerService.post(ca_id, entry_type, amount, reference_id, 'backfill')
+            count += 1
+        return count
+
+
+__all__ = ['LedgerService', 'LedgerBalance', 'LedgerError', 'LEDGER_SNAPSHOT_EVERY']
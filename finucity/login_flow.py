@@ -0,0 +1,137 @@
+"""
+Login Flow - one latency budget for email/password sign-in
+The profile read no longer waits for Supabase Auth: the profile-by-email
+lookup starts on the DB fan-out pool while the request thread calls
+sign_in_with_password, and the profile is fetched exactly once, whichever
+way the login goes.
+
+- Supabase Auth accepts the password: the profile fetched alongside is
+  used as is (re-read by id only if it belongs to another auth user).
+- Supabase Auth rejects it: the same profile's password_hash is checked
+  (manually created accounts). Hash checks run on a small bounded
+  executor (LOGIN_HASH_WORKERS); beyond LOGIN_HASH_QUEUE waiting checks
+  logins are shed instead of queueing CPU work without limit.
+- Every stage (auth, profile, hash, total) is observed in the
+  finucity_login_stage_seconds histogram and returned with the result.
+Author: Sumeet Sangwan
+"""
+
+import os
+import threading
+import time
+from concurrent.futures import ThreadPoolExecutor, TimeoutError as FutureTimeout
+from dataclasses import dataclass, field
+from typing import Any, Dict, Optional
+
+from flask import current_app
+from werkzeug.security import check_password_hash
+
+from finucity.database import FANOUT_TIMEOUT, UserService, get_supabase, submit_query
+from finucity.metrics import metrics
+
+LOGIN_HASH_WORKERS = int(os.getenv('LOGIN_HASH_WORKERS', '2'))
+LOGIN_HASH_QUEUE = int(os.getenv('LOGIN_HASH_QUEUE', '16'))        # checks running or waiting per worker
+LOGIN_HASH_TIMEOUT = float(os.getenv('LOGIN_HASH_TIMEOUT', '5'))
+
+_hash_executor: Optional[ThreadPoolExecutor] = None
+_hash_pid = None
+_hash_lock = threading.Lock()
+_hash_slots = threading.BoundedSemaphore(LOGIN_HASH_QUEUE)
+
+
+def _get_hash_executor() -> ThreadPoolExecutor:
+    global _hash_executor, _hash_pid
+    if _hash_executor is None or _hash_pid != os.getpid():
+        with _hash_lock:
+            if _hash_executor is None or _hash_pid != os.getpid():
+                _hash_executor = ThreadPoolExecutor(max_workers=LOGIN_HASH_WORKERS,
+                                                    thread_name_prefix='login-hash')
+                _hash_pid = os.getpid()
+    return _hash_executor
+
+
+def verify_password_hash(password_hash: Optional[str], password: str) -> Optional[bool]:
+    """Check a werkzeug hash on the bounded executor; None when the executor is saturated"""
+    if not password_hash:
+        return False
+    if not _hash_slots.acquire(blocking=False):
+        metrics.inc('finucity_login_shed_total', help='Password checks refused because the hash pool was full')
+        return None
+    try:
+        future = _get_hash_executor().submit(check_password_hash, password_hash, password)
+        return future.result(timeout=LOGIN_HASH_TIMEOUT)
+    except FutureTimeout:
+        return None
+    finally:
+        _hash_slots.release()
+
+
+@dataclass
+class LoginResult:
+    """Outcome of authenticate(); `error` is None, 'invalid' or 'busy'"""
+    user_data: Optional[Dict[str, Any]] = None
+    method: Optional[str] = None          # 'supabase' or 'password_hash'
+    auth_user_id: Optional[str] = None    # set when Supabase Auth accepted the password
+    error: Optional[str] = None
+    timings: Dict[str, float] = field(default_factory=dict)
+
+
+def _timed(timings: Dict[str, float], stage: str, fn):
+    def run():
+        started = time.perf_counter()
+        try:
+            return fn()
+        finally:
+            timings[stage] = time.perf_counter() - started
+    return run
+
+
+def _sign_in(email: str, password: str):
+    """sign_in_with_password as a value: the response, or the exception it raised"""
+    try:
+        return get_supabase().auth.sign_in_with_password({'email': email, 'password': password})
+    except Exception as e:
+        return e
+
+
+def authenticate(email: str, password: str) -> LoginResult:
+    """Verify email/password against Supabase Auth, falling back to the profile's password_hash"""
+    started = time.perf_counter()
+    result = LoginResult()
+    timings = result.timings
+    pending_profile = submit_query(_timed(timings, 'profile', lambda: UserService.get_by_email(email)))
+    auth_response = _timed(timings, 'auth', lambda: _sign_in(email, password))()
+    try:
+        profile = pending_profile.result(timeout=FANOUT_TIMEOUT)
+    except FutureTimeout:
+        # Pool saturated or the read is stuck: one more try on this thread
+        pending_profile.cancel()
+        current_app.logger.warning(f"Login profile read timed out after {FANOUT_TIMEOUT}s, reading inline")
+        profile = UserService.get_by_email(email)
+    auth_user = getattr(auth_response, 'user', None) if not isinstance(auth_response, Exception) else None
+
+    if auth_user is not None:
+        result.method, result.auth_user_id = 'supabase', str(auth_user.id)
+        if profile and str(profile.get('id')) != result.auth_user_id:
+            profile = UserService.get_by_id(result.auth_user_id)  # email shared across accounts: trust the id
+        result.user_data = profile
+    else:
+        if isinstance(auth_response, Exception):
+            current_app.logger.info(f"Supabase auth failed, trying password hash: {auth_response}")
+        hash_started = time.perf_counter()
+        verified = verify_password_hash(profile.get('password_hash') if profile else None, password)
+        timings['hash'] = time.perf_counter() - hash_started
+        if verified:
+            result.method, result.user_data = 'password_hash', profile
+        else:
+            result.error = 'busy' if verified is None else 'invalid'
+
+    timings['total'] = time.perf_counter() - started
+    for stage, seconds in timings.items():
+        metrics.observe('finucity_login_stage_seconds', seconds, help='Login latency by stage', stage=stage)
+    metrics.inc('finucity_logins_total', help='Login attempts by outcome',
+                outcome=result.error or result.method)
+    return result
+
+
+__all__ = ['LoginResult', 'authenticate', 'verify_password_hash']
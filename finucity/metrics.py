@@ -0,0 +1,106 @@
+"""
+Process Metrics - counters, gauges and histograms in Prometheus text format
+Each gunicorn worker keeps its own registry; scrape every worker or
+aggregate by the `pid` label.
+Author: Sumeet Sangwan
+"""
+
+import os
+import threading
+from typing import Callable, Dict, Iterable, List, Optional, Tuple
+
+# (name, type, help, value, labels)
+Sample = Tuple[str, str, str, float, Dict[str, str]]
+
+# Latency buckets in seconds (upper bounds; +Inf is implied)
+DEFAULT_BUCKETS = (0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1.0, 2.5, 5.0, 10.0)
+
+
+class MetricsRegistry:
+    """Thread-safe counters plus pull-style collectors"""
+
+    def __init__(self):
+        self._lock = threading.Lock()
+        self._counters: Dict[Tuple[str, Tuple], float] = {}
+        self._help: Dict[str, Tuple[str, str]] = {}
+        self._collectors: List[Callable[[], Iterable[Sample]]] = []
+        # (name, labels) -> [bucket bounds, per-bucket counts, sum, count]
+        self._histograms: Dict[Tuple[str, Tuple], list] = {}
+
+    def inc(self, name: str, value: float = 1.0, help: str = '', **labels):
+        """Increment a counter"""
+        key = (name, tuple(sorted(labels.items())))
+        with self._lock:
+            self._counters[key] = self._counters.get(key, 0.0) + value
+            self._help.setdefault(name, ('counter', help))
+
+    def observe(self, name: str, value: float, help: str = '', buckets: Tuple[float, ...] = DEFAULT_BUCKETS,
+                **labels):
+        """Record one observation in a histogram"""
+        key = (name, tuple(sorted(labels.items())))
+        with self._lock:
+            histogram = self._histograms.get(key)
+            if histogram is None:
+                histogram = self._histograms[key] = [buckets, [0] * len(buckets), 0.0, 0]
+                self._help.setdefault(name, ('histogram', help))
+            for i, bound in enumerate(histogram[0]):
+                if value <= bound:
+                    histogram[1][i] += 1
+                    break
+            histogram[2] += value
+            histogram[3] += 1
+
+    def register_collector(self, collector: Callable[[], Iterable[Sample]]):
+        """Register a callable returning samples at scrape time"""
+        self._collectors.append(collector)
+
+    def samples(self) -> List[Sample]:
+        """Snapshot of every counter and collector sample"""
+        with self._lock:
+            out = [(name, *self._help.get(name, ('counter', '')), value, dict(labels))
+                   for (name, labels), value in self._counters.items()]
+            for (name, labels), (bounds, counts, total, count) in self._histograms.items():
+                help_text = self._help.get(name, ('histogram', ''))[1]
+                cumulative = 0
+                for bound, bucket_count in zip(bounds, counts):
+                    cumulative += bucket_count
+                    out.append((f"{name}_bucket", 'histogram', help_text, cumulative, dict(labels, le=str(bound))))
+                out.append((f"{name}_bucket", 'histogram', help_text, count, dict(labels, le='+Inf')))
+                out.append((f"{name}_sum", 'histogram', help_text, total, dict(labels)))
+                out.append((f"{name}_count", 'histogram', help_text, count, dict(labels)))
+        for collector in self._collectors:
+            try:
+                out.extend(collector())
+            except Exception:
+                continue
+        return out
+
+    def value(self, name: str, **labels) -> Optional[float]:
+        """Current value of one sample (for tests and health checks)"""
+        for sample_name, _, _, value, sample_labels in self.samples():
+            if sample_name == name and all(sample_labels.get(k) == v for k, v in labels.items()):
+                return value
+        return None
+
+    def render_prometheus(self) -> str:
+        """Render all samples in the Prometheus text exposition format"""
+        lines = []
+        seen = set()
+        pid = str(os.getpid())
+        for name, kind, help_text, value, labels in sorted(self.samples(), key=lambda s: s[0]):
+            family = name.rsplit('_', 1)[0] if kind == 'histogram' else name  # x_bucket/x_sum/x_count -> x
+            if family not in seen:
+                seen.add(family)
+                if help_text:
+                    lines.append(f"# HELP {family} {help_text}")
+                lines.append(f"# TYPE {family} {kind}")
+            labels = dict(labels, pid=pid)
+            label_text = ','.join(f'{k}="{v}"' for k, v in sorted(labels.items()))
+            lines.append(f"{name}{{{label_text}}} {value}")
+        return '\n'.join(lines) + '\n'
+
+
+# Global instance
+metrics = MetricsRegistry()
+
+__all__ = ['MetricsRegistry', 'metrics']
@@ -4,6 +4,7 @@ Centralized auth checks, input validation, and request processing
 """
 
 import html
+import os
 import re
 from functools import wraps
 from flask import request, jsonify, abort, current_app
@@ -65,7 +66,7 @@ def api_auth_required(f):
 
 
 # =====================================================================
-# INPUT VALIDATION
+# FEATURE FLAGS & INPUT VALIDATION
 # =====================================================================
 
 def sanitize_string(text, max_length=10000):
@@ -111,6 +112,31 @@ def validate_password_strength(password):
     return issues
 
 
+def feature_enabled(flag_name):
+    """Check a feature flag from app config, falling back to the environment"""
+    value = current_app.config.get(flag_name)
+    if value is None:
+        value = os.getenv(flag_name, 'true')
+    if isinstance(value, str):
+        return value.lower() in ['true', '1', 'yes']
+    return bool(value)
+
+
+def feature_required(flag_name):
+    """Decorator to return 404 when a feature flag is switched off"""
+    def decorator(f):
+        @wraps(f)
+        def decorated(*args, **kwargs):
+            if not feature_enabled(flag_name):
+                return jsonify({
+                    'success': False,
+                    'error': 'This feature is not enabled'
+                }), 404
+            return f(*args, **kwargs)
+        return decorated
+    return decorator
+
+
 def validate_json_request(*required_fields):
     """Decorator to validate JSON request body has required fields"""
     def decorator(f):
@@ -35,6 +35,9 @@ SUPABASE TABLES:
    - created_at: TIMESTAMP (default now())
    - last_login: TIMESTAMP
    - last_seen: TIMESTAMP
+   - history_cleared_at: TIMESTAMP (clear-history tombstone)
+   - ca_status: TEXT (active|suspended|banned, set by admins)
+   - verification_status: TEXT (none|pending|verified|suspended|blacklisted)
    
 2. chat_queries
    - id: UUID (primary key)
@@ -120,6 +123,9 @@ class User(UserMixin):
         self.created_at = user_data.get('created_at')
         self.last_login = user_data.get('last_login')
         self.last_seen = user_data.get('last_seen')
+        self.history_cleared_at = user_data.get('history_cleared_at')
+        self.ca_status = user_data.get('ca_status')
+        self.verification_status = user_data.get('verification_status')
         
         # Store original data
         self._data = user_data
@@ -144,6 +150,11 @@ class User(UserMixin):
         """Check if user is admin"""
         return self.role == 'admin'
     
+    @property
+    def ca_verification_status(self) -> Optional[str]:
+        """CA verification state shown in the CA workspace"""
+        return self.verification_status
+    
     @property
     def is_ca(self) -> bool:
         """Check if user is CA"""
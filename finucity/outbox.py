@@ -0,0 +1,395 @@
+"""
+Write Outbox - durable local queue for write-tolerant operations
+Fire-and-forget writes (calculator history, notifications and audit logs,
+via BulkBuffer) are committed to an SQLite (WAL) file on the worker host,
+so the request path pays one local fsync instead of a PostgREST round
+trip, and keeps working while Supabase is slow or down. Rows the app
+reads back right away (chat_queries, chat feedback) are not queued here.
+A background dispatcher drains the file into Supabase:
+
+- Per-entity ordering: entries sharing an `entity` key are delivered in
+  enqueue order; a failing entry holds back later entries of its entity
+  only. Independent inserts into one table go out as one multi-row insert.
+- Retries: connection errors, timeouts and 5xx back off exponentially
+  (with jitter) up to OUTBOX_MAX_ATTEMPTS, then the entry is dead-lettered.
+  Errors Postgres will repeat (constraint, type, unknown column) are
+  dead-lettered at once. Dead letters keep their payload and last error
+  and can be requeued.
+- One dispatcher per file: gunicorn workers sharing a host take a lease,
+  so only one drains at a time and ordering holds across processes.
+- finucity_outbox_drain_lag_seconds is the age of the oldest undelivered
+  entry (0 when drained).
+
+Delivery is at-least-once; rows carrying an `id` are upserted with
+ignore-duplicates so a replay after a lost response is a no-op.
+
+ENABLE_WRITE_OUTBOX=false writes through to Supabase as before.
+Author: Sumeet Sangwan
+"""
+
+import atexit
+import json
+import os
+import random
+import socket
+import sqlite3
+import threading
+import time
+from typing import Any, Dict, List, Optional
+
+from flask import current_app, has_app_context
+from postgrest import APIError
+from postgrest.types import ReturnMethod
+
+from finucity.database import get_supabase, _is_retryable
+from finucity.metrics import metrics
+
+OUTBOX_PATH = os.getenv('OUTBOX_PATH', os.path.join('instance', 'outbox.sqlite'))
+OUTBOX_SYNCHRONOUS = os.getenv('OUTBOX_SYNCHRONOUS', 'FULL').upper()  # FULL: fsync every enqueue
+OUTBOX_BATCH_SIZE = int(os.getenv('OUTBOX_BATCH_SIZE', '200'))
+OUTBOX_POLL_INTERVAL = float(os.getenv('OUTBOX_POLL_INTERVAL', '1.0'))   # seconds
+OUTBOX_MAX_ATTEMPTS = int(os.getenv('OUTBOX_MAX_ATTEMPTS', '20'))
+OUTBOX_RETRY_BASE_DELAY = float(os.getenv('OUTBOX_RETRY_BASE_DELAY', '0.5'))   # doubled per attempt
+OUTBOX_RETRY_MAX_DELAY = float(os.getenv('OUTBOX_RETRY_MAX_DELAY', '300'))
+OUTBOX_LEASE_SECONDS = float(os.getenv('OUTBOX_LEASE_SECONDS', '30'))
+
+OPERATIONS = ('insert', 'upsert', 'update')
+
+_SCHEMA = """
+CREATE TABLE IF NOT EXISTS outbox (
+    id INTEGER PRIMARY KEY AUTOINCREMENT,
+    entity TEXT,
+    tbl TEXT NOT NULL,
+    op TEXT NOT NULL,
+    payload TEXT NOT NULL,
+    match TEXT,
+    on_conflict TEXT,
+    status TEXT NOT NULL DEFAULT 'pending',
+    attempts INTEGER NOT NULL DEFAULT 0,
+    created_at REAL NOT NULL,
+    next_attempt_at REAL NOT NULL,
+    last_error TEXT
+);
+CREATE INDEX IF NOT EXISTS outbox_pending ON outbox (status, id);
+CREATE TABLE IF NOT EXISTS outbox_lease (
+    name TEXT PRIMARY KEY,
+    owner TEXT NOT NULL,
+    expires_at REAL NOT NULL
+);
+"""
+
+
+class _Unavailable(Exception):
+    """Supabase could not take the write right now; stop this drain cycle"""
+
+
+def _permanent(error: Exception) -> bool:
+    """Postgres rejected the data itself - retrying will fail the same way"""
+    return isinstance(error, APIError) and not _is_retryable(error)
+
+
+def _error_text(error: Exception) -> str:
+    return (getattr(error, 'message', None) or str(error) or type(error).__name__)[:500]
+
+
+class Outbox:
+    """SQLite-backed outbox plus its dispatcher thread"""
+
+    def __init__(self, app=None, path: str = OUTBOX_PATH):
+        self.app = None
+        self.path = path
+        self.owner = f"{socket.gethostname()}:{os.getpid()}:{id(self):x}"
+        self._conn: Optional[sqlite3.Connection] = None
+        self._conn_pid = None
+        self._lock = threading.RLock()
+        self._drain_lock = threading.Lock()
+        self._wake = threading.Event()
+        self._thread: Optional[threading.Thread] = None
+        self._pid = None
+        self.stats = {'enqueued': 0, 'delivered': 0, 'retried': 0, 'dead_lettered': 0, 'write_through': 0}
+        if app:
+            self.init_app(app)
+
+    def init_app(self, app):
+        self.app = app
+        app.extensions['outbox'] = self
+        atexit.register(self._drain_at_exit)
+        metrics.register_collector(self.metric_samples)
+
+    @property
+    def enabled(self) -> bool:
+        if self.app is None:
+            return False
+        return bool(self.app.config.get('ENABLE_WRITE_OUTBOX', True))
+
+    # ----- storage -----
+
+    def _db(self) -> sqlite3.Connection:
+        # SQLite connections must not cross a fork: reopen per PID
+        if self._conn is None or self._conn_pid != os.getpid():
+            with self._lock:
+                if self._conn is None or self._conn_pid != os.getpid():
+                    if self.path != ':memory:' and os.path.dirname(self.path):
+                        os.makedirs(os.path.dirname(self.path), exist_ok=True)
+                    conn = sqlite3.connect(self.path, check_same_thread=False, isolation_level=None, timeout=5)
+                    conn.execute('PRAGMA journal_mode=WAL')
+                    conn.execute(f'PRAGMA synchronous={OUTBOX_SYNCHRONOUS}')
+                    conn.executescript(_SCHEMA)
+                    self._conn, self._conn_pid = conn, os.getpid()
+        return self._conn
+
+    # ----- request path -----
+
+    def enqueue(self, table: str, row: Dict, op: str = 'insert', entity: Optional[str] = None,
+                match: Optional[Dict] = None, on_conflict: str = 'id') -> Optional[int]:
+        """
+        Durably queue one write and return its outbox id.
+        `op` 'update' applies `row` to the rows matching `match` (column -> value).
+        With the outbox disabled, or if the local file cannot be written,
+        the write goes straight to Supabase and None is returned.
+        """
+        if op not in OPERATIONS:
+            raise ValueError(f"Unsupported outbox operation: {op}")
+        if op == 'update' and not match:
+            raise ValueError("Outbox updates need a `match` filter")
+        if not self.enabled:
+            return self._write_through(table, row, op, match, on_conflict)
+        now = time.time()
+        try:
+            with self._lock:
+                cursor = self._db().execute(
+                    'INSERT INTO outbox (entity, tbl, op, payload, match, on_conflict, created_at, next_attempt_at) '
+                    'VALUES (?, ?, ?, ?, ?, ?, ?, ?)',
+                    (entity, table, op, json.dumps(row, default=str),
+                     json.dumps(match, default=str) if match else None, on_conflict, now, now))
+                self.stats['enqueued'] += 1
+        except sqlite3.Error as e:
+            self.app.logger.error(f"Outbox enqueue failed ({e}); writing {table} directly")
+            return self._write_through(table, row, op, match, on_conflict)
+        self._ensure_thread()
+        self._wake.set()
+        return cursor.lastrowid
+
+    def _write_through(self, table: str, row: Dict, op: str, match: Optional[Dict], on_conflict: str) -> None:
+        self.stats['write_through'] += 1
+        try:
+            self._send(get_supabase(), table, op, [row], match, on_conflict)
+        except Exception as e:
+            if has_app_context():
+                current_app.logger.error(f"Direct {op} into {table} failed: {_error_text(e)}")
+        return None
+
+    # ----- delivery -----
+
+    @staticmethod
+    def _send(sb, table: str, op: str, rows: List[Dict], match: Optional[Dict], on_conflict: str):
+        if op == 'update':
+            query = sb.table(table).update(rows[0], returning=ReturnMethod.minimal)
+            for column, value in match.items():
+                query = query.eq(column, value)
+            return query.execute()
+        if op == 'upsert' or all(row.get('id') is not None for row in rows):
+            # Rows with an id are replay-safe: a duplicate means an earlier attempt landed
+            return sb.table(table).upsert(rows, returning=ReturnMethod.minimal, on_conflict=on_conflict,
+                                          ignore_duplicates=op == 'insert').execute()
+        return sb.table(table).insert(rows, returning=ReturnMethod.minimal).execute()
+
+    def _acquire_lease(self, conn: sqlite3.Connection) -> bool:
+        now = time.time()
+        conn.execute('BEGIN IMMEDIATE')
+        try:
+            lease = conn.execute("SELECT owner, expires_at FROM outbox_lease WHERE name = 'dispatcher'").fetchone()
+            mine = lease is None or lease[0] == self.owner or lease[1] < now
+            if mine:
+                conn.execute("INSERT OR REPLACE INTO outbox_lease (name, owner, expires_at) "
+                             "VALUES ('dispatcher', ?, ?)", (self.owner, now + OUTBOX_LEASE_SECONDS))
+        finally:
+            conn.execute('COMMIT')
+        return mine
+
+    def _due(self, conn: sqlite3.Connection, limit: int) -> List[Dict[str, Any]]:
+        """Next deliverable entries in id order, at most one per entity"""
+        now, due, blocked = time.time(), [], set()
+        rows = conn.execute(
+            "SELECT id, entity, tbl, op, payload, match, on_conflict, attempts, next_attempt_at "
+            "FROM outbox WHERE status = 'pending' ORDER BY id LIMIT ?", (limit * 4,)).fetchall()
+        for entry_id, entity, table, op, payload, match, on_conflict, attempts, next_at in rows:
+            key = entity or f'#{entry_id}'
+            if key in blocked:
+                continue
+            blocked.add(key)  # later entries of this entity wait for this one
+            if next_at > now:
+                continue
+            due.append({'id': entry_id, 'entity': key, 'table': table, 'op': op, 'row': json.loads(payload),
+                        'match': json.loads(match) if match else None, 'on_conflict': on_conflict or 'id',
+                        'attempts': attempts})
+            if len(due) >= limit:
+                break
+        return due
+
+    def drain(self, limit: int = OUTBOX_BATCH_SIZE) -> Dict[str, int]:
+        """Deliver what is due; returns counts for this cycle"""
+        result = {'delivered': 0, 'retried': 0, 'dead': 0}
+        if self.app is None:
+            return result
+        with self._drain_lock, self.app.app_context():
+            conn = self._db()
+            with self._lock:
+                if not self._acquire_lease(conn):
+                    return result
+                due = self._due(conn, limit)
+            if not due:
+                return result
+            sb = get_supabase()
+            runs: List[List[Dict]] = []
+            for entry in due:
+                # Consecutive plain inserts into one table share a round trip
+                if runs and entry['op'] == 'insert' and runs[-1][0]['op'] == 'insert' \
+                        and runs[-1][0]['table'] == entry['table']:
+                    runs[-1].append(entry)
+                else:
+                    runs.append([entry])
+            settled = set()
+            for index, run in enumerate(runs):
+                try:
+                    self._deliver(sb, run, result, settled)
+                except _Unavailable as e:
+                    # Supabase is down or slow: back off everything not settled yet
+                    for entry in [entry for later in runs[index:] for entry in later]:
+                        if entry['id'] not in settled:
+                            self._retry(entry, e.__cause__ or e, result)
+                    break
+        self.stats['delivered'] += result['delivered']
+        self.stats['retried'] += result['retried']
+        self.stats['dead_lettered'] += result['dead']
+        return result
+
+    def _deliver(self, sb, run: List[Dict], result: Dict[str, int], settled: set):
+        first = run[0]
+        try:
+            self._send(sb, first['table'], first['op'], [entry['row'] for entry in run], first['match'],
+                       first['on_conflict'])
+            self._done([entry['id'] for entry in run])
+            settled.update(entry['id'] for entry in run)
+            result['delivered'] += len(run)
+            return
+        except Exception as e:
+            if not _permanent(e):
+                raise _Unavailable() from e
+            if len(run) == 1:
+                self._dead(first, e, result)
+                settled.add(first['id'])
+                return
+        # One row poisoned the multi-row insert: find it
+        for entry in run:
+            self._deliver(sb, [entry], result, settled)
+
+    def _done(self, ids: List[int]):
+        with self._lock:
+            self._db().executemany('DELETE FROM outbox WHERE id = ?', [(i,) for i in ids])
+
+    def _retry(self, entry: Dict, error: Exception, result: Dict[str, int]):
+        attempts = entry['attempts'] + 1
+        if attempts >= OUTBOX_MAX_ATTEMPTS:
+            self._dead(entry, error, result, attempts)
+            return
+        delay = min(OUTBOX_RETRY_MAX_DELAY, OUTBOX_RETRY_BASE_DELAY * 2 ** (attempts - 1))
+        with self._lock:
+            self._db().execute(
+                'UPDATE outbox SET attempts = ?, next_attempt_at = ?, last_error = ? WHERE id = ?',
+                (attempts, time.time() + random.uniform(delay / 2, delay), _error_text(error), entry['id']))
+        result['retried'] += 1
+
+    def _dead(self, entry: Dict, error: Exception, result: Dict[str, int], attempts: Optional[int] = None):
+        with self._lock:
+            self._db().execute(
+                "UPDATE outbox SET status = 'dead', attempts = ?, last_error = ? WHERE id = ?",
+                (attempts or entry['attempts'] + 1, _error_text(error), entry['id']))
+        result['dead'] += 1
+        metrics.inc('finucity_outbox_dead_letters_total', help='Outbox entries given up on', table=entry['table'])
+        current_app.logger.error(f"Outbox entry {entry['id']} ({entry['op']} {entry['table']}) dead-lettered: "
+                                 f"{_error_text(error)}")
+
+    # ----- operations -----
+
+    def pending(self) -> int:
+        with self._lock:
+            return self._db().execute("SELECT COUNT(*) FROM outbox WHERE status = 'pending'").fetchone()[0]
+
+    def lag_seconds(self) -> float:
+        """Age of the oldest undelivered entry"""
+        with self._lock:
+            oldest = self._db().execute("SELECT MIN(created_at) FROM outbox WHERE status = 'pending'").fetchone()[0]
+        return max(0.0, time.time() - oldest) if oldest else 0.0
+
+    def dead_letters(self, limit: int = 100) -> List[Dict[str, Any]]:
+        with self._lock:
+            rows = self._db().execute(
+                "SELECT id, entity, tbl, op, payload, attempts, last_error, created_at FROM outbox "
+                "WHERE status = 'dead' ORDER BY id LIMIT ?", (limit,)).fetchall()
+        return [{'id': i, 'entity': entity, 'table': table, 'op': op, 'row': json.loads(payload),
+                 'attempts': attempts, 'error': error, 'created_at': created}
+                for i, entity, table, op, payload, attempts, error, created in rows]
+
+    def requeue(self, ids: Optional[List[int]] = None) -> int:
+        """Move dead letters (all, or `ids`) back to pending"""
+        sql = "UPDATE outbox SET status = 'pending', attempts = 0, next_attempt_at = ? WHERE status = 'dead'"
+        args: List[Any] = [time.time()]
+        if ids is not None:
+            sql += f" AND id IN ({', '.join('?' * len(ids))})"
+            args += list(ids)
+        with self._lock:
+            count = self._db().execute(sql, args).rowcount
+        self._wake.set()
+        return count
+
+    # ----- dispatcher thread -----
+
+    def _ensure_thread(self):
+        # Threads do not survive a gunicorn fork, so check the owning PID too
+        if self._thread and self._thread.is_alive() and self._pid == os.getpid():
+            return
+        with self._lock:
+            if self._thread and self._thread.is_alive() and self._pid == os.getpid():
+                return
+            self._pid = os.getpid()
+            self._thread = threading.Thread(target=self._run, name='outbox-dispatcher', daemon=True)
+            self._thread.start()
+
+    def _run(self):
+        while True:
+            self._wake.wait(timeout=OUTBOX_POLL_INTERVAL)
+            self._wake.clear()
+            try:
+                while self.drain()['delivered']:
+                    pass  # the next entry of a delivered entity may be due now
+            except Exception as e:
+                self.app.logger.error(f"Outbox dispatcher failed: {e}")
+
+    def _drain_at_exit(self):
+        if self._conn is not None and self._conn_pid == os.getpid():
+            try:
+                self.drain()
+            except Exception:
+                pass
+
+    def metric_samples(self):
+        """Samples for finucity.metrics collectors"""
+        if self._conn is None:
+            return
+        with self._lock:
+            counts = dict(self._db().execute('SELECT status, COUNT(*) FROM outbox GROUP BY status').fetchall())
+        yield ('finucity_outbox_pending', 'gauge', 'Writes waiting in the local outbox', counts.get('pending', 0), {})
+        yield ('finucity_outbox_dead', 'gauge', 'Dead-lettered outbox writes', counts.get('dead', 0), {})
+        yield ('finucity_outbox_drain_lag_seconds', 'gauge', 'Age of the oldest undelivered outbox write',
+               round(self.lag_seconds(), 3), {})
+        yield ('finucity_outbox_delivered_total', 'counter', 'Outbox writes delivered to Supabase',
+               self.stats['delivered'], {})
+        yield ('finucity_outbox_retries_total', 'counter', 'Outbox delivery attempts deferred for retry',
+               self.stats['retried'], {})
+
+
+# Global instance
+outbox = Outbox()
+
+__all__ = ['Outbox', 'outbox', 'OUTBOX_PATH']
@@ -0,0 +1,296 @@
+"""
+Query Tracing - per-request accounting of PostgREST round trips
+Every .execute() issued through get_supabase() / supabase_db.get_client()
+passes SupabaseClientManager.execute, which reports it here: table,
+operation, filter shape, rows, payload bytes and latency.
+
+- Totals are kept per request (tied to g.request_id, shared with run_parallel
+  workers) and emitted as a log line and metrics when the request ends.
+- Queries of the same shape repeated within a request (N+1 loops, e.g.
+  probing profiles.username one candidate at a time) are flagged, except
+  inside query_tracer.expect_repeats() (keyset paging walks one shape on
+  purpose).
+- Queries slower than QUERY_SLOW_MS are logged, sampled at
+  QUERY_SLOW_SAMPLE_RATE.
+
+Filter values are never logged, only their shape (column=operator).
+Author: Sumeet Sangwan
+"""
+
+import logging
+import os
+import random
+import threading
+from collections import Counter
+from contextlib import contextmanager
+from dataclasses import dataclass
+from typing import Any, Dict, List, Optional, Tuple
+
+from flask import current_app, g, has_app_context, has_request_context, request
+from httpx import QueryParams
+
+from finucity.metrics import metrics
+
+QUERY_SLOW_MS = float(os.getenv('QUERY_SLOW_MS', '500'))
+QUERY_SLOW_SAMPLE_RATE = float(os.getenv('QUERY_SLOW_SAMPLE_RATE', '1.0'))
+QUERY_N1_THRESHOLD = int(os.getenv('QUERY_N1_THRESHOLD', '5'))        # same-shape queries per request
+QUERY_REQUEST_BUDGET = int(os.getenv('QUERY_REQUEST_BUDGET', '30'))   # round trips before warning
+QUERY_TRACE_MAX_RECORDS = 500
+DB_DEBUG_HEADERS = os.getenv('DB_DEBUG_HEADERS', 'false').lower() == 'true'
+
+# Query-string keys that shape the result rather than filter it
+_NON_FILTER_PARAMS = {'select', 'order', 'limit', 'offset', 'on_conflict', 'columns'}
+
+Shape = Tuple[str, ...]
+
+
+def filter_shape(builder) -> Shape:
+    """Filters as 'column=operator' (values dropped), or the RPC argument names"""
+    params = getattr(builder, 'params', None)
+    if isinstance(params, QueryParams):
+        shape = []
+        for name, value in params.multi_items():
+            if name in _NON_FILTER_PARAMS:
+                continue
+            operator = value.split('.', 1)[0] if '.' in value else value
+            shape.append(f"{name}={operator}" if name not in ('or', 'and') else name)
+        if shape or not str(getattr(builder, 'path', '')).startswith('/rpc/'):
+            return tuple(sorted(shape))
+    payload = getattr(builder, 'json', None)
+    return tuple(sorted(payload)) if isinstance(payload, dict) else ()
+
+
+def _row_count(result) -> int:
+    data = getattr(result, 'data', None)
+    if isinstance(data, list):
+        return len(data)
+    return 1 if data else 0
+
+
+@dataclass
+class QueryRecord:
+    """One PostgREST call as seen by the manager"""
+    table: str
+    op: str
+    method: str
+    shape: Shape
+    rows: int = 0
+    request_bytes: int = 0
+    response_bytes: int = 0
+    seconds: float = 0.0
+    cached: bool = False
+    error: Optional[str] = None
+    expected: bool = False   # issued inside expect_repeats(): not an N+1 candidate
+
+    @property
+    def fingerprint(self) -> tuple:
+        return (self.table, self.method, self.shape)
+
+    def describe(self) -> str:
+        where = f" where {', '.join(self.shape)}" if self.shape else ''
+        return f"{self.method} {self.table}{where}"
+
+
+class QueryTrace:
+    """Round trips made while serving one request"""
+
+    def __init__(self, request_id: Optional[str] = None):
+        self.request_id = request_id
+        self.records: List[QueryRecord] = []
+        self.queries = 0
+        self.deduped = 0
+        self.errors = 0
+        self.rows = 0
+        self.bytes = 0
+        self.seconds = 0.0
+        self.flagged: Dict[tuple, int] = {}
+        self._shapes: Counter = Counter()
+        self._lock = threading.Lock()
+
+    def add(self, record: QueryRecord) -> Optional[int]:
+        """Account one record; returns the repeat count when it trips the N+1 detector"""
+        with self._lock:
+            if len(self.records) < QUERY_TRACE_MAX_RECORDS:
+                self.records.append(record)
+            if record.cached:
+                self.deduped += 1
+                return None
+            self.queries += 1
+            self.rows += record.rows
+            self.bytes += record.request_bytes + record.response_bytes
+            self.seconds += record.seconds
+            if record.error:
+                self.errors += 1
+            if record.expected:
+                return None
+            self._shapes[record.fingerprint] += 1
+            count = self._shapes[record.fingerprint]
+            if count >= QUERY_N1_THRESHOLD:
+                first = record.fingerprint not in self.flagged
+                self.flagged[record.fingerprint] = count
+                return count if first else None
+            return None
+
+    def summary(self) -> Dict[str, Any]:
+        return {
+            'request_id': self.request_id,
+            'queries': self.queries,
+            'deduped': self.deduped,
+            'errors': self.errors,
+            'rows': self.rows,
+            'bytes': self.bytes,
+            'db_ms': round(self.seconds * 1000, 2),
+            'n_plus_one': [
+                {'table': table, 'method': method, 'shape': list(shape), 'count': count}
+                for (table, method, shape), count in self.flagged.items()
+            ],
+        }
+
+
+class QueryTracer:
+    """Collects QueryRecords from the client manager and reports per request"""
+
+    def __init__(self, app=None):
+        self.app = None
+        self._local = threading.local()
+        if app:
+            self.init_app(app)
+
+    def init_app(self, app):
+        self.app = app
+        app.after_request(self.emit)
+        app.extensions['query_tracer'] = self
+
+    # ----- per-request state -----
+
+    @staticmethod
+    def current() -> Optional[QueryTrace]:
+        """The active trace; run_parallel workers share their parent request's"""
+        if not has_app_context():
+            return None
+        trace = g.get('_query_trace')
+        if trace is None and has_request_context():
+            trace = g._query_trace = QueryTrace(g.get('request_id'))
+        return trace
+
+    @contextmanager
+    def expect_repeats(self):
+        """Queries issued by this thread inside the block repeat one shape by design (paging)"""
+        self._local.expected_repeats = getattr(self._local, 'expected_repeats', 0) + 1
+        try:
+            yield
+        finally:
+            self._local.expected_repeats -= 1
+
+    # ----- payload capture (httpx event hooks on the pooled sessions) -----
+
+    def begin(self) -> list:
+        """Start capturing the HTTP exchanges made by this thread"""
+        self._local.exchanges = []
+        return self._local.exchanges
+
+    def capture_response(self, response):
+        exchanges = getattr(self._local, 'exchanges', None)
+        if exchanges is not None:
+            exchanges.append(response)
+
+    @staticmethod
+    def _payload_bytes(exchanges: Optional[list]) -> Tuple[int, int]:
+        sent = received = 0
+        for response in exchanges or ():
+            try:
+                sent += len(response.request.content)
+            except Exception:
+                pass
+            try:
+                received += len(response.content)
+            except Exception:
+                received += int(response.headers.get('content-length') or 0)
+        return sent, received
+
+    # ----- recording -----
+
+    def record(self, table: str, op: str, builder, result=None, seconds: float = 0.0,
+               exchanges: Optional[list] = None, cached: bool = False,
+               error: Optional[Exception] = None):
+        """Account one execute(); never raises into the query path"""
+        try:
+            sent, received = self._payload_bytes(exchanges)
+            record = QueryRecord(
+                table=table,
+                op=op,
+                method=str(getattr(builder, 'http_method', op)).upper(),
+                shape=filter_shape(builder),
+                rows=_row_count(result),
+                request_bytes=sent,
+                response_bytes=received,
+                seconds=seconds,
+                cached=cached,
+                error=type(error).__name__ if error else None,
+                expected=getattr(self._local, 'expected_repeats', 0) > 0,
+            )
+            self._local.exchanges = None
+            if not cached:
+                metrics.inc('finucity_db_queries_total', help='PostgREST calls by table and operation',
+                            table=table, op=op)
+                if received or sent:
+                    metrics.inc('finucity_db_payload_bytes_total', sent + received,
+                                help='Request plus response body bytes', table=table)
+                if seconds * 1000 >= QUERY_SLOW_MS:
+                    self._slow(record)
+            trace = self.current()
+            if trace is not None:
+                repeats = trace.add(record)
+                if repeats:
+                    metrics.inc('finucity_db_n_plus_one_total', help='Requests repeating one query shape',
+                                table=table)
+                    self._log('warning', f"Possible N+1: {repeats}x {record.describe()} "
+                                         f"[rid={trace.request_id or 'unknown'}]")
+            return record
+        except Exception as e:
+            self._log('debug', f"Query trace failed: {e}")
+            return None
+
+    def _slow(self, record: QueryRecord):
+        metrics.inc('finucity_db_slow_queries_total', help=f'PostgREST calls slower than {QUERY_SLOW_MS:g}ms',
+                    table=record.table)
+        if random.random() >= QUERY_SLOW_SAMPLE_RATE:
+            return
+        rid = g.get('request_id', 'unknown') if has_app_context() else 'unknown'
+        self._log('warning', f"Slow query: {record.describe()} took {record.seconds * 1000:.0f}ms, "
+                             f"{record.rows} rows, {record.response_bytes}B [rid={rid}]")
+
+    # ----- end of request -----
+
+    def emit(self, response):
+        """after_request hook: log and export this request's totals"""
+        trace = g.get('_query_trace')
+        if trace is None:
+            return response
+        endpoint = request.endpoint or 'unknown'
+        metrics.inc('finucity_db_traced_requests_total', help='Requests that touched the database',
+                    endpoint=endpoint)
+        metrics.inc('finucity_db_request_queries_total', trace.queries,
+                    help='PostgREST round trips made while serving requests', endpoint=endpoint)
+        metrics.inc('finucity_db_request_seconds_total', round(trace.seconds, 6),
+                    help='Time requests spent waiting on PostgREST', endpoint=endpoint)
+        message = (f"DB {request.method} {request.path}: {trace.queries} queries "
+                   f"({trace.deduped} deduped, {trace.errors} failed), {trace.seconds * 1000:.1f}ms, "
+                   f"{trace.rows} rows, {trace.bytes / 1024:.1f}KB [rid={trace.request_id or 'unknown'}]")
+        self._log('warning' if trace.queries > QUERY_REQUEST_BUDGET or trace.flagged else 'debug', message)
+        if current_app.debug or DB_DEBUG_HEADERS:
+            response.headers['X-DB-Queries'] = str(trace.queries)
+            response.headers['Server-Timing'] = (
+                f'db;dur={trace.seconds * 1000:.1f};desc="{trace.queries} queries"'
+            )
+        return response
+
+    def _log(self, level: str, message: str):
+        logger = current_app.logger if has_app_context() else logging.getLogger(__name__)
+        getattr(logger, level)(message)
+
+
+# Global instance
+query_tracer = QueryTracer()
+
+__all__ = ['QueryTracer', 'QueryTrace', 'QueryRecord', 'query_tracer', 'filter_shape']
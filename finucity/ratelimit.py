@@ -0,0 +1,282 @@
+"""
+Shared Rate Limiter - one sliding-window backend for every worker
+Rate-limit state lives in an SQLite (WAL) file on the worker host
+(RATE_LIMIT_PATH), so the gunicorn workers share one budget per client
+instead of each granting the full limit.
+
+- Sliding-window counter: a key stores only the counts of the current
+  and previous fixed window; the estimate weighs the previous count by
+  how much of it still overlaps the sliding window. O(1) memory per key,
+  and a check-and-increment is one short IMMEDIATE transaction.
+- Bounded: rows of idle keys expire after two windows, and past
+  RATE_LIMIT_MAX_KEYS the least recently used keys are evicted.
+- Clients are identified by client_ip(): X-Forwarded-For is only trusted
+  for the RATE_LIMIT_TRUSTED_PROXIES hops our own proxies appended, so a
+  client cannot pick its own key by sending the header.
+
+`rate_limit` (finucity.ca_ecosystem_routes) calls hit() directly;
+flask-limiter uses the same file through the `finucity://` storage.
+Author: Sumeet Sangwan
+"""
+
+import math
+import os
+import sqlite3
+import threading
+import time
+from dataclasses import dataclass
+from typing import Optional, Tuple
+
+from flask import request
+from limits.storage import Storage
+from limits.storage.base import SlidingWindowCounterSupport
+
+from finucity.metrics import metrics
+
+RATE_LIMIT_PATH = os.getenv('RATE_LIMIT_PATH', os.path.join('instance', 'ratelimit.sqlite'))
+RATE_LIMIT_MAX_KEYS = int(os.getenv('RATE_LIMIT_MAX_KEYS', '100000'))
+RATE_LIMIT_SWEEP_EVERY = int(os.getenv('RATE_LIMIT_SWEEP_EVERY', '1000'))   # writes between sweeps
+RATE_LIMIT_TRUSTED_PROXIES = int(os.getenv('RATE_LIMIT_TRUSTED_PROXIES', '1'))  # proxies appending to XFF
+
+_SCHEMA = """
+CREATE TABLE IF NOT EXISTS rate_windows (
+    key TEXT PRIMARY KEY,
+    start REAL NOT NULL,
+    prev INTEGER NOT NULL,
+    curr INTEGER NOT NULL,
+    expires_at REAL NOT NULL,
+    touched REAL NOT NULL
+);
+CREATE INDEX IF NOT EXISTS rate_windows_touched ON rate_windows (touched);
+CREATE INDEX IF NOT EXISTS rate_windows_expires ON rate_windows (expires_at);
+"""
+
+
+def client_ip() -> str:
+    """The client address as seen by the first trusted proxy"""
+    forwarded = request.headers.get('X-Forwarded-For', '')
+    if forwarded and RATE_LIMIT_TRUSTED_PROXIES > 0:
+        hops = [hop.strip() for hop in forwarded.split(',') if hop.strip()]
+        if hops:
+            # Our proxies append; anything left of their entries is client-supplied
+            return hops[-min(RATE_LIMIT_TRUSTED_PROXIES, len(hops))]
+    return request.remote_addr or 'unknown'
+
+
+@dataclass(frozen=True)
+class RateLimitResult:
+    allowed: bool
+    limit: int
+    remaining: int
+    retry_after: float   # seconds until a request of the same cost would pass (0 when allowed)
+    reset_after: float   # seconds until the current window rolls over
+
+
+class SlidingWindowLimiter:
+    """Sliding-window counters in a host-local SQLite file"""
+
+    def __init__(self, path: str = RATE_LIMIT_PATH, max_keys: int = RATE_LIMIT_MAX_KEYS):
+        self.path = path
+        self.max_keys = max_keys
+        self._conn: Optional[sqlite3.Connection] = None
+        self._conn_pid = None
+        self._lock = threading.RLock()
+        self._writes = 0
+        self.stats = {'allowed': 0, 'denied': 0, 'evicted': 0}
+
+    def init_app(self, app):
+        app.extensions['rate_limiter'] = self
+        metrics.register_collector(self.metric_samples)
+
+    def _db(self) -> sqlite3.Connection:
+        # SQLite connections must not cross a fork: reopen per PID
+        if self._conn is None or self._conn_pid != os.getpid():
+            with self._lock:
+                if self._conn is None or self._conn_pid != os.getpid():
+                    if self.path != ':memory:' and os.path.dirname(self.path):
+                        os.makedirs(os.path.dirname(self.path), exist_ok=True)
+                    conn = sqlite3.connect(self.path, check_same_thread=False, isolation_level=None, timeout=5)
+                    conn.execute('PRAGMA journal_mode=WAL')
+                    conn.execute('PRAGMA synchronous=OFF')  # counters need no durability
+                    conn.executescript(_SCHEMA)
+                    self._conn, self._conn_pid = conn, os.getpid()
+        return self._conn
+
+    # ----- sliding window -----
+
+    @staticmethod
+    def _window(row: Optional[tuple], window: float, now: float) -> Tuple[float, int, int]:
+        """(current window start, previous count, current count) at `now`"""
+        start = math.floor(now / window) * window
+        if row is None:
+            return start, 0, 0
+        stored_start, prev, curr = row
+        if stored_start == start:
+            return start, prev, curr
+        if stored_start == start - window:
+            return start, curr, 0  # rolled over once: current becomes previous
+        return start, 0, 0
+
+    def hit(self, key: str, limit: int, window: float, cost: int = 1) -> RateLimitResult:
+        """Count `cost` against `key` if it fits in `limit` per sliding `window` seconds"""
+        now = time.time()
+        with self._lock:
+            db = self._db()
+            db.execute('BEGIN IMMEDIATE')  # check-and-increment is atomic across workers
+            try:
+                row = db.execute('SELECT start, prev, curr FROM rate_windows WHERE key = ?', (key,)).fetchone()
+                start, prev, curr = self._window(row, window, now)
+                weight = 1 - (now - start) / window  # share of the previous window still inside
+                allowed = cost <= limit and math.floor(prev * weight + curr) + cost <= limit
+                if allowed:
+                    curr += cost
+                if allowed or row is not None:
+                    db.execute('INSERT INTO rate_windows (key, start, prev, curr, expires_at, touched) '
+                               'VALUES (?, ?, ?, ?, ?, ?) ON CONFLICT(key) DO UPDATE SET start = excluded.start, '
+                               'prev = excluded.prev, curr = excluded.curr, expires_at = excluded.expires_at, '
+                               'touched = excluded.touched',
+                               (key, start, prev, curr, start + 2 * window, now))
+                db.execute('COMMIT')
+            except BaseException:
+                db.execute('ROLLBACK')
+                raise
+            self._writes += 1
+            if self._writes % RATE_LIMIT_SWEEP_EVERY == 0:
+                self.sweep(now)
+
+        estimate = prev * weight + curr
+        reset_after = start + window - now
+        retry_after = 0.0
+        if not allowed:
+            if cost > limit:
+                retry_after = math.inf
+            elif curr + cost > limit:
+                # Blocked by this window alone: wait for the rollover plus its decay
+                retry_after = reset_after + window * max(0.0, 1 - (limit - cost + 1) / curr)
+            else:
+                # Wait until the previous window's weight decays enough
+                retry_after = max(0.0, (weight - (limit - curr - cost + 1) / prev) * window) if prev else reset_after
+        self.stats['allowed' if allowed else 'denied'] += 1
+        return RateLimitResult(allowed, limit, max(0, limit - math.floor(estimate)), retry_after, reset_after)
+
+    def sweep(self, now: Optional[float] = None) -> int:
+        """Drop expired keys, then the least recently used ones above max_keys"""
+        now = now or time.time()
+        with self._lock:
+            db = self._db()
+            removed = db.execute('DELETE FROM rate_windows WHERE expires_at <= ?', (now,)).rowcount
+            excess = db.execute('SELECT COUNT(*) FROM rate_windows').fetchone()[0] - self.max_keys
+            if excess > 0:
+                removed += db.execute('DELETE FROM rate_windows WHERE key IN '
+                                      '(SELECT key FROM rate_windows ORDER BY touched LIMIT ?)', (excess,)).rowcount
+        self.stats['evicted'] += removed
+        return removed
+
+    # ----- fixed window (flask-limiter's incr/get contract) -----
+
+    def incr(self, key: str, expiry: float, amount: int = 1) -> int:
+        now = time.time()
+        with self._lock:
+            db = self._db()
+            db.execute('BEGIN IMMEDIATE')
+            try:
+                row = db.execute('SELECT curr, expires_at FROM rate_windows WHERE key = ?', (key,)).fetchone()
+                if row is None or row[1] <= now:
+                    count, expires_at = amount, now + expiry
+                else:
+                    count, expires_at = row[0] + amount, row[1]
+                db.execute('INSERT OR REPLACE INTO rate_windows (key, start, prev, curr, expires_at, touched) '
+                           'VALUES (?, ?, 0, ?, ?, ?)', (key, expires_at - expiry, count, expires_at, now))
+                db.execute('COMMIT')
+            except BaseException:
+                db.execute('ROLLBACK')
+                raise
+        return count
+
+    def get(self, key: str) -> Tuple[int, float]:
+        """(count, expires_at) of a fixed-window key"""
+        with self._lock:
+            row = self._db().execute('SELECT curr, expires_at FROM rate_windows WHERE key = ?', (key,)).fetchone()
+        if row is None or row[1] <= time.time():
+            return 0, time.time()
+        return row
+
+    def window_state(self, key: str, window: float) -> Tuple[int, float, int, float]:
+        """(previous count, its remaining weight in seconds, current count, seconds to expiry)"""
+        now = time.time()
+        with self._lock:
+            row = self._db().execute('SELECT start, prev, curr FROM rate_windows WHERE key = ?', (key,)).fetchone()
+        start, prev, curr = self._window(row, window, now)
+        return prev, (start + window - now) if prev else 0.0, curr, start + 2 * window - now
+
+    def clear(self, key: Optional[str] = None):
+        with self._lock:
+            if key is None:
+                self._db().execute('DELETE FROM rate_windows')
+            else:
+                self._db().execute('DELETE FROM rate_windows WHERE key = ?', (key,))
+
+    def __len__(self) -> int:
+        with self._lock:
+            return self._db().execute('SELECT COUNT(*) FROM rate_windows').fetchone()[0]
+
+    def metric_samples(self):
+        """Samples for finucity.metrics collectors"""
+        for outcome in ('allowed', 'denied'):
+            yield ('finucity_rate_limit_requests_total', 'counter', 'Rate-limited requests by outcome',
+                   self.stats[outcome], {'outcome': outcome})
+        yield ('finucity_rate_limit_evictions_total', 'counter', 'Idle rate-limit keys evicted',
+               self.stats['evicted'], {})
+
+
+class SharedLimiterStorage(Storage, SlidingWindowCounterSupport):
+    """flask-limiter / limits storage backed by the shared limiter (storage_uri="finucity://")"""
+
+    STORAGE_SCHEME = ['finucity']
+
+    def __init__(self, uri: Optional[str] = None, wrap_exceptions: bool = False, **options):
+        self.limiter = rate_limiter
+        super().__init__(uri, wrap_exceptions=wrap_exceptions, **options)
+
+    @property
+    def base_exceptions(self):
+        return sqlite3.Error
+
+    def incr(self, key: str, expiry: int, amount: int = 1) -> int:
+        return self.limiter.incr(key, expiry, amount)
+
+    def get(self, key: str) -> int:
+        return self.limiter.get(key)[0]
+
+    def get_expiry(self, key: str) -> float:
+        return self.limiter.get(key)[1]
+
+    def check(self) -> bool:
+        try:
+            len(self.limiter)
+            return True
+        except sqlite3.Error:
+            return False
+
+    def reset(self) -> Optional[int]:
+        count = len(self.limiter)
+        self.limiter.clear()
+        return count
+
+    def clear(self, key: str) -> None:
+        self.limiter.clear(key)
+
+    def acquire_sliding_window_entry(self, key: str, limit: int, expiry: int, amount: int = 1) -> bool:
+        return self.limiter.hit(key, limit, expiry, amount).allowed
+
+    def get_sliding_window(self, key: str, expiry: int) -> Tuple[int, float, int, float]:
+        return self.limiter.window_state(key, expiry)
+
+    def clear_sliding_window(self, key: str, expiry: int) -> None:
+        self.limiter.clear(key)
+
+
+# Global instance
+rate_limiter = SlidingWindowLimiter()
+
+__all__ = ['RateLimitResult', 'SlidingWindowLimiter', 'SharedLimiterStorage', 'client_ip', 'rate_limiter']
@@ -9,11 +9,15 @@ import uuid
 import re
 from datetime import datetime
 import os
-import jwt
 import html
 
 from .models import User
-from .database import UserService, ChatService, FeedbackService, get_supabase, PlatformStatsService, BlogService, DEFAULT_BLOG_POSTS
+from .database import UserService, ChatService, FeedbackService, get_supabase, run_parallel, PlatformStatsService, BlogService, DEFAULT_BLOG_POSTS
+from .aggregates import CAAggregates, ConsultationTotals, EarningsTotals, ReviewTotals
+from .ledger import LedgerService, LedgerError
+from .rows import ConsultationRow, fetch_projected
+from .jwks import decode_supabase_token
+from .login_flow import authenticate
 
 # Rate limiting is handled at app level via flask-limiter
 # Individual route limits can be applied via the app's limiter instance
@@ -76,43 +80,8 @@ def validate_file_upload(file):
 # ==================== HELPERS ====================
 
 def decode_supabase_jwt(token: str):
-    """Decode and validate Supabase JWT token."""
-    supabase_url = os.getenv('SUPABASE_URL', '').rstrip('/')
-    legacy_secret = os.getenv('SUPABASE_JWT_SECRET')
-
-    if supabase_url: 
-        jwks_url = f"{supabase_url}/auth/v1/jwks"
-        try:
-            from jwt import PyJWKClient
-            jwk_client = PyJWKClient(jwks_url)
-            signing_key = jwk_client.get_signing_key_from_jwt(token).key
-            claims = jwt.decode(
-                token,
-                signing_key,
-                algorithms=["RS256"],
-                audience=None,
-                options={"verify_aud": False},
-                leeway=600,
-            )
-            return claims, None
-        except Exception as e:
-            rs_error = str(e)
-    else:
-        rs_error = "no_supabase_url"
-
-    if not legacy_secret: 
-        return None, f"server misconfigured: missing SUPABASE_JWT_SECRET (RS error: {rs_error})"
-    try:
-        claims = jwt.decode(
-            token,
-            legacy_secret,
-            algorithms=["HS256"],
-            options={"verify_aud": False},
-            leeway=600,
-        )
-        return claims, None
-    except Exception as e:
-        return None, f"invalid token (RS error: {rs_error}); HS error: {e}"
+    """Decode and validate Supabase JWT token (keys cached by finucity.jwks)."""
+    return decode_supabase_token(token)
 
 
 def ensure_local_user_from_claims(claims, role='user'):
@@ -130,30 +99,17 @@ def ensure_local_user_from_claims(claims, role='user'):
     user_data = UserService.get_by_email(email.lower())
     
     if not user_data:
-        # Create new user profile in Supabase
-        base_username = email.split("@")[0]
-        candidate = base_username
-        i = 1
-        # Check for username uniqueness
-        sb = get_supabase()
-        while True:
-            existing = sb.table('profiles').select('id').eq('username', candidate.lower()).limit(1).execute()
-            if not existing.data:
-                break
-            i += 1
-            candidate = f"{base_username}{i}"
-        
         # Create profile data
         profile_data = {
             'id': claims.get('sub'),  # Use Supabase auth user ID
             'email': email.lower(),
-            'username': candidate.lower(),
             'first_name': first_name.title() if first_name else "",
             'last_name': last_name.title() if last_name else "",
             'role': role
         }
         
-        user_data = UserService.create(profile_data)
+        # Create new user profile in Supabase under a unique username (base, base2, base3...)
+        user_data = UserService.create_with_username(profile_data, email.split("@")[0], first_suffix=2)
         if not user_data:
             raise Exception("Failed to create user profile")
     else:
@@ -1018,79 +974,33 @@ def admin_auth_login():
         if not email or not password:
             return jsonify({'success': False, 'error': 'Email and password required'}), 400
 
-        sb = get_supabase()
-        
-        # Try Supabase Auth login first
-        try:
-            auth_response = sb.auth.sign_in_with_password({
-                'email': email,
-                'password': password
-            })
-            
-            if auth_response and auth_response.user:
-                user_id = auth_response.user.id
-                
-                # Get user profile and verify admin role
-                profile_response = sb.table('profiles').select('*').eq('id', user_id).single().execute()
-                
-                if profile_response.data:
-                    user_data = profile_response.data
-                    
-                    # CRITICAL: Check if user is admin
-                    if user_data.get('role') != 'admin':
-                        return jsonify({
-                            'success': False, 
-                            'error': 'Access denied. Admin privileges required.'
-                        }), 403
-                    
-                    # Create Flask-Login user and login
-                    user = User(user_data)
-                    login_user(user, remember=True)
-                    
-                    return jsonify({
-                        'success': True,
-                        'message': 'Admin login successful',
-                        'redirect': url_for('main.admin_dashboard')
-                    })
-                else:
-                    return jsonify({'success': False, 'error': 'Admin profile not found'}), 404
-                    
-        except Exception as auth_error:
-            print(f"Admin Supabase auth failed: {auth_error}")
-            
-            # Fallback: Check local password hash
-            try:
-                user_response = sb.table('profiles').select('*').eq('email', email).single().execute()
-                
-                if user_response.data:
-                    user_data = user_response.data
-                    
-                    # Verify admin role
-                    if user_data.get('role') != 'admin':
-                        return jsonify({
-                            'success': False,
-                            'error': 'Access denied. Admin privileges required.'
-                        }), 403
-                    
-                    # Check password hash
-                    password_hash = user_data.get('password_hash')
-                    if password_hash and check_password_hash(password_hash, password):
-                        user = User(user_data)
-                        login_user(user, remember=True)
-                        
-                        return jsonify({
-                            'success': True,
-                            'message': 'Admin login successful',
-                            'redirect': url_for('main.admin_dashboard')
-                        })
-                    else:
-                        return jsonify({'success': False, 'error': 'Invalid admin credentials'}), 401
-                else:
-                    return jsonify({'success': False, 'error': 'Admin account not found'}), 404
-                    
-            except Exception as db_error:
-                print(f"Admin database check failed: {db_error}")
-                return jsonify({'success': False, 'error': 'Authentication failed'}), 500
+        # Supabase Auth and the profile read run concurrently; password hash is the fallback
+        result = authenticate(email, password)
+        if result.error == 'busy':
+            return jsonify({'success': False, 'error': 'Login is busy, please try again'}), 503
+        if result.error:
+            # Same answer for a wrong password and an unknown email: no account probing
+            return jsonify({'success': False, 'error': 'Invalid admin credentials'}), 401
+        user_data = result.user_data
+        if not user_data:
+            return jsonify({'success': False, 'error': 'Admin profile not found'}), 404
+
+        # CRITICAL: Check if user is admin
+        if user_data.get('role') != 'admin':
+            return jsonify({
+                'success': False,
+                'error': 'Access denied. Admin privileges required.'
+            }), 403
+
+        # Create Flask-Login user and login
+        user = User(user_data)
+        login_user(user, remember=True)
+
+        return jsonify({
+            'success': True,
+            'message': 'Admin login successful',
+            'redirect': url_for('main.admin_dashboard')
+        })
 
     except Exception as e:
         print(f"Admin login error: {e}")
@@ -1195,6 +1105,7 @@ def api_admin_approve_ca(application_id):
         sb.table('profiles').update({
             'role': 'ca'
         }).eq('id', user_id).execute()
+        UserService.invalidate_cache(user_id)
         
         return jsonify({
             'success': True,
@@ -1384,8 +1295,6 @@ def supabase_login():
 def flask_login():
     """Handle email/password login via Flask."""
     try:
-        from werkzeug.security import check_password_hash
-        
         data = request.get_json()
         email = data.get('email', '').strip().lower()
         password = data.get('password', '')
@@ -1394,83 +1303,46 @@ def flask_login():
         if not email or not password:
             return jsonify({'success': False, 'error': 'Email and password are required'}), 400
 
-        # Try Supabase Auth first
-        sb = get_supabase()
-        try:
-            auth_response = sb.auth.sign_in_with_password({
-                "email": email,
-                "password": password
-            })
-            
-            if auth_response.user:
-                # Get or create profile
-                user_data = UserService.get_by_email(email)
-                if not user_data:
-                    # Create profile for auth user
-                    user_data = UserService.create({
-                        'id': auth_response.user.id,
-                        'email': email,
-                        'username': email.split('@')[0],
-                        'role': 'user'
-                    })
-                
-                user = User(user_data)
-                login_user(user, remember=True)
-                
-                user_role = getattr(user, 'role', 'user')
-                if user_role == 'admin':
-                    redirect_url = url_for('main.admin_dashboard')
-                elif user_role in ['ca']:
-                    redirect_url = url_for('main.ca_dashboard')
-                elif user_role == 'ca_pending':
-                    redirect_url = url_for('auth.ca_pending')
-                else:
-                    redirect_url = url_for('main.user_dashboard')
-                
-                return jsonify({
-                    'success': True,
-                    'ok': True,
-                    'message': 'Login successful',
-                    'id': user.id,
-                    'email': user.email,
-                    'role': user_role,
-                    'redirect_url': redirect_url
-                })
-        except Exception as supabase_error:
-            print(f"Supabase auth failed, trying password hash: {supabase_error}")
-            # Fallback to password hash check for manually created users
-            user_data = UserService.get_by_email(email)
-            
+        # Supabase Auth and the profile read run concurrently; password hash is the fallback
+        result = authenticate(email, password)
+        if result.error == 'busy':
+            return jsonify({'success': False, 'error': 'Login is busy, please try again'}), 503
+        if result.error:
+            return jsonify({'success': False, 'error': 'Invalid email or password'}), 401
+
+        user_data = result.user_data
+        if not user_data:
+            # Create profile for auth user under a unique username (base, base2, base3...)
+            user_data = UserService.create_with_username({
+                'id': result.auth_user_id,
+                'email': email,
+                'role': 'user'
+            }, email.split('@')[0], first_suffix=2)
             if not user_data:
-                return jsonify({'success': False, 'error': 'Invalid email or password'}), 401
-            
-            # Check password hash
-            password_hash = user_data.get('password_hash')
-            if not password_hash or not check_password_hash(password_hash, password):
-                return jsonify({'success': False, 'error': 'Invalid email or password'}), 401
-            
-            user = User(user_data)
-            login_user(user, remember=True)
-            
-            user_role = getattr(user, 'role', 'user')
-            if user_role == 'admin':
-                redirect_url = url_for('main.admin_dashboard')
-            elif user_role in ['ca']:
-                redirect_url = url_for('main.ca_dashboard')
-            elif user_role == 'ca_pending':
-                redirect_url = url_for('auth.ca_pending')
-            else:
-                redirect_url = url_for('main.user_dashboard')
-            
-            return jsonify({
-                'success': True,
-                'ok': True,
-                'message': 'Login successful',
-                'id': user.id,
-                'email': user.email,
-                'role': user_role,
-                'redirect_url': redirect_url
-            })
+                return jsonify({'success': False, 'error': 'Could not create your profile, please try again'}), 500
+
+        user = User(user_data)
+        login_user(user, remember=True)
+
+        user_role = getattr(user, 'role', 'user')
+        if user_role == 'admin':
+            redirect_url = url_for('main.admin_dashboard')
+        elif user_role in ['ca']:
+            redirect_url = url_for('main.ca_dashboard')
+        elif user_role == 'ca_pending':
+            redirect_url = url_for('auth.ca_pending')
+        else:
+            redirect_url = url_for('main.user_dashboard')
+
+        return jsonify({
+            'success': True,
+            'ok': True,
+            'message': 'Login successful',
+            'id': user.id,
+            'email': user.email,
+            'role': user_role,
+            'redirect_url': redirect_url
+        })
 
     except Exception as e:
         print(f"Flask login error: {e}")
@@ -1529,30 +1401,19 @@ def flask_signup():
             # Generate UUID for manual user creation
             user_id = str(uuid.uuid4())
 
-        # Generate unique username
+        # Create profile in Supabase profiles table (unique username: base, base1, base2...)
         base_username = email.split('@')[0]
-        username = base_username
-        counter = 1
-        while True:
-            existing = sb.table('profiles').select('id').eq('username', username.lower()).limit(1).execute()
-            if not existing.data:
-                break
-            username = f"{base_username}{counter}"
-            counter += 1
-
-        # Create profile in Supabase profiles table
         user_data = {
             'id': user_id,
             'email': email,
-            'username': username.lower(),
-            'first_name': first_name if first_name else username.title(),
+            'first_name': first_name if first_name else base_username.title(),
             'last_name': last_name,
             'role': 'user',
             'password_hash': generate_password_hash(password),
             'email_verified': False
         }
 
-        created_user = UserService.create(user_data)
+        created_user = UserService.create_with_username(user_data, base_username)
         if not created_user:
             return jsonify({'success': False, 'error': 'Failed to create account'}), 500
 
@@ -1659,6 +1520,7 @@ def register():
 def logout():
     """Handles user logout."""
     user_name = current_user.first_name if current_user.first_name else 'User'
+    UserService.invalidate_cache(current_user.id)
     logout_user()
     flash(f'Goodbye, {user_name}!  You have been successfully logged out.', 'info')
     return redirect(url_for('main.home'))
@@ -1726,41 +1588,32 @@ def api_me():
 
 @api_bp.route('/homepage-stats', methods=['GET'])
 def homepage_stats():
-    """Get real-time homepage statistics."""
+    """Get homepage statistics from the shared stats snapshot."""
     try:
-        supabase = get_supabase_admin()
-        
-        # Count active users (all registered users)
-        users_response = supabase.table('profiles').select('id', count='exact').execute()
-        active_users = users_response.count if users_response.count else 0
-        
-        # Count total chat queries
-        queries_response = supabase.table('chat_queries').select('id', count='exact').execute()
-        total_queries = queries_response.count if queries_response.count else 0
+        # Served from the shared background snapshot; no table scans per page view
+        snapshot = PlatformStatsService.get_snapshot()
+        if not snapshot:
+            raise RuntimeError('platform stats snapshot unavailable')
+        data = snapshot['data']
         
-        # Count verified CAs (users with role='ca')
-        ca_response = supabase.table('profiles').select('id', count='exact').eq('role', 'ca').execute()
-        verified_cas = ca_response.count if ca_response.count else 0
+        active_users = data.get('total_users', 0)
+        total_queries = data.get('total_queries', 0)
+        verified_cas = data.get('total_cas', 0)
         
-        # Calculate accuracy rate (placeholder - can be enhanced with actual feedback data)
-        # For now, if we have queries, use feedback data; otherwise default to 0
+        # Accuracy rate from feedback ratings (unrated feedback counts as 0); 0 until there is data
         accuracy_rate = 0
         if total_queries > 0:
-            feedback_response = supabase.table('user_feedback').select('rating', count='exact').execute()
-            if feedback_response.count and feedback_response.count > 0:
-                # Calculate average rating and convert to percentage
-                ratings = [item.get('rating', 0) for item in feedback_response.data]
-                avg_rating = sum(ratings) / len(ratings) if ratings else 0
+            avg_rating = PlatformStatsService.average_rating(data.get('feedback_ratings', {}),
+                                                             data.get('feedback_total', 0))
+            if avg_rating:
                 accuracy_rate = round((avg_rating / 5) * 100, 1)
-            else:
-                # No feedback yet, default to 0
-                accuracy_rate = 0
         
         return jsonify({
             'active_users': active_users,
             'total_queries': total_queries,
             'accuracy_rate': accuracy_rate,
-            'verified_cas': verified_cas
+            'verified_cas': verified_cas,
+            'last_updated': snapshot['last_updated']
         })
     except Exception as e:
         print(f"Error fetching homepage stats: {str(e)}")
@@ -1827,7 +1680,7 @@ def update_user_role(user_id):
         if new_role not in ['user', 'ca', 'ca_pending', 'admin']:
             return jsonify({'error': 'Invalid role'}), 400
         
-        # Update user role in Supabase
+        # Update user role in Supabase (UserService.update drops the cached profile)
         updated = UserService.update(user_id, {'role': new_role})
         
         if updated:
@@ -1848,35 +1701,30 @@ def update_user_role(user_id):
 @api_bp.route('/admin/stats', methods=['GET'])
 @login_required
 def api_admin_stats():
-    """Get admin dashboard statistics - REAL-TIME from Supabase."""
+    """Get admin dashboard statistics from the shared stats snapshot."""
     if not check_admin_access():
         return jsonify({'success': False, 'error': 'Access denied'}), 403
     
     try:
-        sb = get_supabase()
-        
-        # Total users
-        users_response = sb.table('profiles').select('id', count='exact').execute()
-        total_users = users_response.count if hasattr(users_response, 'count') else 0
-        
-        # Total queries
-        queries_response = sb.table('chat_queries').select('id', count='exact').execute()
-        total_queries = queries_response.count if hasattr(queries_response, 'count') else 0
-        
-        # Active CAs
-        cas_response = sb.table('profiles').select('id', count='exact').eq('role', 'ca').execute()
-        active_cas = cas_response.count if hasattr(cas_response, 'count') else 0
+        # ?refresh=1 recomputes the shared snapshot before reading it
+        if request.args.get('refresh') == '1' and PlatformStatsService.snapshot is not None:
+            PlatformStatsService.snapshot.refresh('platform')
+        snapshot = PlatformStatsService.get_snapshot()
+        if not snapshot:
+            raise RuntimeError('platform stats snapshot unavailable')
+        data = snapshot['data']
         
-        # Pending CA applications
-        pending_response = sb.table('profiles').select('id', count='exact').eq('role', 'ca_pending').execute()
-        pending_applications = pending_response.count if hasattr(pending_response, 'count') else 0
+        total_users = data.get('total_users', 0)
+        total_queries = data.get('total_queries', 0)
+        active_cas = data.get('total_cas', 0)
+        pending_applications = data.get('pending_cas', 0)
         
         stats = {
             'total_users': total_users,
             'total_queries': total_queries,
             'active_cas': active_cas,
             'pending_applications': pending_applications,
-            'last_updated': datetime.utcnow().isoformat()
+            'last_updated': snapshot['last_updated']
         }
         
         return jsonify({'success': True, 'data': stats})
@@ -1936,6 +1784,7 @@ def admin_suspend_ca():
             'suspension_reason': reason,
             'last_admin_action_at': datetime.utcnow().isoformat()
         }).eq('id', ca_id).eq('role', 'ca').execute()
+        UserService.invalidate_cache(ca_id)
         
         if not update_response.data:
             return jsonify({'error': 'Failed to suspend CA'}), 500
@@ -1982,6 +1831,7 @@ def admin_unsuspend_ca():
             'suspension_reason': None,
             'last_admin_action_at': datetime.utcnow().isoformat()
         }).eq('id', ca_id).execute()
+        UserService.invalidate_cache(ca_id)
         
         if not update_response.data:
             return jsonify({'error': 'Failed to unsuspend CA'}), 500
@@ -2023,13 +1873,11 @@ def admin_freeze_earnings():
         if not ca_id:
             return jsonify({'error': 'CA ID required'}), 400
         
-        # Freeze earnings
-        update_response = sb.table('profiles').update({
-            'earnings_frozen': True,
-            'last_admin_action_at': datetime.utcnow().isoformat()
-        }).eq('id', ca_id).eq('role', 'ca').execute()
+        # Freeze earnings (under the ledger lock, so no withdrawal slips past it)
+        profile = LedgerService.set_frozen(ca_id, True, role='ca')
+        UserService.invalidate_cache(ca_id)
         
-        if not update_response.data:
+        if not profile:
             return jsonify({'error': 'Failed to freeze earnings'}), 500
         
         # Log admin action
@@ -2067,12 +1915,10 @@ def admin_unfreeze_earnings():
             return jsonify({'error': 'CA ID required'}), 400
         
         # Unfreeze earnings
-        update_response = sb.table('profiles').update({
-            'earnings_frozen': False,
-            'last_admin_action_at': datetime.utcnow().isoformat()
-        }).eq('id', ca_id).execute()
+        profile = LedgerService.set_frozen(ca_id, False)
+        UserService.invalidate_cache(ca_id)
         
-        if not update_response.data:
+        if not profile:
             return jsonify({'error': 'Failed to unfreeze earnings'}), 500
         
         # Log admin action
@@ -2115,6 +1961,7 @@ def admin_revoke_verification():
             'verification_revoked': True,
             'last_admin_action_at': datetime.utcnow().isoformat()
         }).eq('id', ca_id).eq('role', 'ca').execute()
+        UserService.invalidate_cache(ca_id)
         
         if not update_response.data:
             return jsonify({'error': 'Failed to revoke verification'}), 500
@@ -2158,6 +2005,7 @@ def admin_restore_verification():
             'verification_revoked': False,
             'last_admin_action_at': datetime.utcnow().isoformat()
         }).eq('id', ca_id).execute()
+        UserService.invalidate_cache(ca_id)
         
         if not update_response.data:
             return jsonify({'error': 'Failed to restore verification'}), 500
@@ -2205,6 +2053,7 @@ def admin_ban_ca():
             'verification_revoked': True,
             'last_admin_action_at': datetime.utcnow().isoformat()
         }).eq('id', ca_id).eq('role', 'ca').execute()
+        UserService.invalidate_cache(ca_id)
         
         if not update_response.data:
             return jsonify({'error': 'Failed to ban CA'}), 500
@@ -2307,6 +2156,9 @@ def admin_reject_withdrawal():
         
         transaction = update_response.data[0]
         
+        # Return the held funds to the CA's available balance
+        LedgerService.release_withdrawal(transaction, current_user.id)
+        
         # Log admin action
         sb.table('ca_admin_actions').insert({
             'admin_id': current_user.id,
@@ -2343,20 +2195,10 @@ def admin_earnings_adjustment():
         if not ca_id or amount is None:
             return jsonify({'error': 'CA ID and amount required'}), 400
         
-        # Create adjustment transaction
-        transaction_response = sb.table('ca_earnings').insert({
-            'ca_id': ca_id,
-            'transaction_type': 'adjustment',
-            'amount': amount,
-            'title': 'Admin Adjustment',
-            'description': reason,
-            'status': 'completed',
-            'approved_by': current_user.id,
-            'approved_at': datetime.utcnow().isoformat(),
-            'processed_at': datetime.utcnow().isoformat()
-        }).execute()
+        # Adjustment row and its ledger entry are written together
+        adjustment = LedgerService.adjust(ca_id, amount, reason, current_user.id)
         
-        if not transaction_response.data:
+        if not adjustment or not adjustment.get('transaction'):
             return jsonify({'error': 'Failed to create adjustment'}), 500
         
         # Log admin action
@@ -2389,30 +2231,21 @@ def get_ca_consultations():
         sb = get_supabase()
         ca_id = session.get('user_id')
         
-        # Fetch all consultations for this CA with client profile data
-        result = sb.table('consultations').select(
-            '*, profiles!consultations_user_id_fkey(full_name, city, avatar_url)'
-        ).eq('ca_id', ca_id).order('created_at', desc=True).execute()
+        # Fetch the dashboard columns for this CA with client profile data
+        result = fetch_projected(ConsultationRow, lambda columns: sb.table('consultations').select(
+            f'{columns}, profiles!consultations_user_id_fkey(full_name, city, avatar_url)'
+        ).eq('ca_id', ca_id).order('created_at', desc=True).execute())
         
         # Enrich consultation data with client info
         consultations = []
         for item in result.data:
-            consultation = {
-                'id': item['id'],
-                'user_id': item['user_id'],
-                'service_type': item['service_type'],
-                'description': item['description'],
-                'min_budget': item['min_budget'],
-                'max_budget': item['max_budget'],
-                'status': item['status'],
-                'created_at': item['created_at'],
-                'accepted_at': item.get('accepted_at'),
-                'started_at': item.get('started_at'),
-                'completed_at': item.get('completed_at'),
-                'client_name': item['profiles']['full_name'] if item.get('profiles') else 'Unknown',
-                'client_city': item['profiles']['city'] if item.get('profiles') else 'Unknown',
-                'client_avatar': item['profiles']['avatar_url'] if item.get('profiles') else None
-            }
+            client = item.get('profiles')
+            consultation = ConsultationRow.from_row(item).to_dict()
+            consultation.update({
+                'client_name': client['full_name'] if client else 'Unknown',
+                'client_city': client['city'] if client else 'Unknown',
+                'client_avatar': client['avatar_url'] if client else None
+            })
             consultations.append(consultation)
         
         return jsonify(consultations)
@@ -2533,33 +2366,18 @@ def request_withdrawal():
         if not amount or amount < 500:
             return jsonify({'error': 'Minimum withdrawal amount is ₹500'}), 400
         
-        sb = get_supabase()
-        ca_id = session.get('user_id')
-        
-        # Check available balance
-        balance_response = sb.table('ca_earnings').select('amount, transaction_type').eq(
-            'ca_id', ca_id
-        ).eq('status', 'completed').execute()
-        
-        total_earned = sum(t['amount'] for t in balance_response.data if t['transaction_type'] == 'credit')
-        total_withdrawn = sum(t['amount'] for t in balance_response.data if t['transaction_type'] == 'debit')
-        available = total_earned - total_withdrawn
-        
-        if amount > available:
-            return jsonify({'error': f'Insufficient balance. Available: ₹{available}'}), 400
-        
-        # Create withdrawal record
-        withdrawal_data = {
-            'ca_id': ca_id,
-            'amount': amount,
-            'transaction_type': 'debit',
-            'status': 'pending',
-            'description': f'Withdrawal request - {note}' if note else 'Withdrawal request',
-            'bank_account_details': bank_account,
-            'created_at': 'now()'
-        }
+        ca_id = current_user.id
+        description = f'Withdrawal request - {note}' if note else 'Withdrawal request'
         
-        result = sb.table('ca_earnings').insert(withdrawal_data).execute()
+        # Balance check, debit row and funds hold happen atomically in the ledger
+        try:
+            LedgerService.request_withdrawal(ca_id, amount, bank_account, description)
+        except LedgerError as e:
+            if e.code == 'earnings_frozen':
+                return jsonify({'error': 'Earnings are frozen. Please contact support.'}), 403
+            if e.code == 'insufficient_funds':
+                return jsonify({'error': f'Insufficient balance. Available: ₹{e.available}'}), 400
+            raise
         
         return jsonify({
             'success': True,
@@ -2997,68 +2815,37 @@ def decline_client_request():
 @api_bp.route('/ca/dashboard-stats', methods=['GET'])
 @login_required
 def ca_dashboard_stats():
-    """Get CA dashboard statistics - REAL-TIME from Supabase."""
+    """Get CA dashboard statistics from server-side aggregates."""
     if not check_ca_access():
         return jsonify({'error': 'Access denied'}), 403
 
     try:
-        sb = get_supabase()
         ca_id = current_user.id
         
-        # Get total unique clients
-        clients_response = sb.table('consultations').select('client_id', count='exact').eq('ca_id', ca_id).execute()
-        unique_clients = set()
-        if clients_response.data:
-            unique_clients = {c['client_id'] for c in clients_response.data}
-        total_clients = len(unique_clients)
-        
-        # Get active consultations count (in_progress + accepted)
-        active_response = sb.table('consultations').select('id', count='exact').eq('ca_id', ca_id).in_('status', ['accepted', 'in_progress']).execute()
-        active_consultations = active_response.count if hasattr(active_response, 'count') else 0
-        
-        # Get pending requests
-        pending_response = sb.table('consultations').select('id', count='exact').eq('ca_id', ca_id).eq('status', 'pending').execute()
-        pending_requests = pending_response.count if hasattr(pending_response, 'count') else 0
-        
-        # Get total earnings (all completed credits)
-        earnings_response = sb.table('ca_earnings').select('amount').eq('ca_id', ca_id).eq('transaction_type', 'credit').eq('status', 'completed').execute()
-        total_earnings = sum(e['amount'] for e in earnings_response.data) if earnings_response.data else 0
-        
-        # Get this month's earnings
-        from datetime import datetime, timedelta
-        first_day_of_month = datetime.utcnow().replace(day=1, hour=0, minute=0, second=0, microsecond=0)
-        this_month_response = sb.table('ca_earnings').select('amount').eq('ca_id', ca_id).eq('transaction_type', 'credit').gte('created_at', first_day_of_month.isoformat()).execute()
-        this_month_earnings = sum(e['amount'] for e in this_month_response.data) if this_month_response.data else 0
-        
-        # Get average rating
-        reviews_response = sb.table('ca_reviews').select('rating').eq('ca_id', ca_id).eq('is_published', True).execute()
-        if reviews_response.data:
-            average_rating = round(sum(r['rating'] for r in reviews_response.data) / len(reviews_response.data), 1)
-            total_reviews = len(reviews_response.data)
-        else:
-            average_rating = 0.0
-            total_reviews = 0
-        
-        # Calculate response rate (consultations responded to within 24 hours)
-        all_consultations = sb.table('consultations').select('id, created_at, updated_at, status').eq('ca_id', ca_id).execute()
-        responded = 0
-        total_requests = 0
-        if all_consultations.data:
-            for c in all_consultations.data:
-                if c['status'] != 'pending':
-                    total_requests += 1
-                    created = datetime.fromisoformat(c['created_at'].replace('Z', '+00:00'))
-                    updated = datetime.fromisoformat(c['updated_at'].replace('Z', '+00:00'))
-                    if (updated - created) <= timedelta(hours=24):
-                        responded += 1
-        response_rate = round((responded / total_requests * 100)) if total_requests > 0 else 100
-        
-        # Calculate completion rate
-        completed_response = sb.table('consultations').select('id', count='exact').eq('ca_id', ca_id).eq('status', 'completed').execute()
-        completed = completed_response.count if hasattr(completed_response, 'count') else 0
-        total_accepted = sb.table('consultations').select('id', count='exact').eq('ca_id', ca_id).neq('status', 'pending').execute()
-        total = total_accepted.count if hasattr(total_accepted, 'count') else 0
-        completion_rate = round((completed / total * 100)) if total > 0 else 100
+        # Three one-row aggregate reads (server-side SUM/COUNT), fanned out
+        results = run_parallel({
+            'consultations': lambda: CAAggregates.consultations(ca_id),
+            'earnings': lambda: CAAggregates.earnings(ca_id),
+            'reviews': lambda: CAAggregates.reviews(ca_id),
+        }, defaults={
+            'consultations': ConsultationTotals(),
+            'earnings': EarningsTotals(),
+            'reviews': ReviewTotals(),
+        })
+        consultations = results['consultations']
+        earnings = results['earnings']
+        reviews = results['reviews']
+        
+        total_clients = consultations.total_clients
+        active_consultations = consultations.active
+        pending_requests = consultations.pending
+        total_earnings = earnings.total_earned
+        this_month_earnings = earnings.this_month_earned
+        average_rating = reviews.average_rating
+        total_reviews = reviews.total_reviews
+        # Consultations responded to within 24 hours / completed, out of all answered requests
+        response_rate = consultations.response_rate
+        completion_rate = consultations.completion_rate
 
         stats = {
             'total_clients': total_clients,
@@ -3096,7 +2883,7 @@ def ca_dashboard_stats():
 @api_bp.route('/ca/earnings-summary', methods=['GET'])
 @login_required
 def ca_earnings_summary():
-    """Get CA earnings summary - REAL-TIME from Supabase."""
+    """Get CA earnings summary from server-side aggregates."""
     if not check_ca_access():
         return jsonify({'error': 'Access denied'}), 403
 
@@ -3104,23 +2891,23 @@ def ca_earnings_summary():
         sb = get_supabase()
         ca_id = current_user.id
         
-        # Get all completed credits
-        credits_response = sb.table('ca_earnings').select('amount').eq('ca_id', ca_id).eq('transaction_type', 'credit').eq('status', 'completed').execute()
-        total_earned = sum(e['amount'] for e in credits_response.data) if credits_response.data else 0
-        
-        # Get all completed withdrawals
-        withdrawals_response = sb.table('ca_earnings').select('amount').eq('ca_id', ca_id).eq('transaction_type', 'debit').eq('status', 'completed').execute()
-        total_withdrawn = sum(e['amount'] for e in withdrawals_response.data) if withdrawals_response.data else 0
-        
-        # Get pending amounts (approved but not completed)
-        pending_response = sb.table('ca_earnings').select('amount').eq('ca_id', ca_id).eq('transaction_type', 'credit').eq('status', 'approved').execute()
-        pending_amount = sum(e['amount'] for e in pending_response.data) if pending_response.data else 0
-        
-        # Calculate available balance
-        available_balance = total_earned - total_withdrawn - pending_amount
-        
-        # Get recent transactions (last 10)
-        transactions_response = sb.table('ca_earnings').select('*').eq('ca_id', ca_id).order('created_at', desc=True).limit(10).execute()
+        results = run_parallel({
+            # Credit/debit/pending totals in one aggregate row
+            'totals': lambda: CAAggregates.earnings(ca_id),
+            # Recent transactions (last 10)
+            'recent': lambda: sb.table('ca_earnings').select('*').eq('ca_id', ca_id).order('created_at', desc=True).limit(10).execute(),
+            # O(1) available balance from the ledger
+            'ledger': lambda: LedgerService.balance(ca_id),
+        })
+        if 'totals' in results.errors or 'recent' in results.errors:
+            raise RuntimeError(f"earnings summary incomplete: {results.errors}")
+        totals = results['totals']
+        total_earned = totals.total_earned
+        total_withdrawn = totals.total_withdrawn
+        pending_amount = totals.pending_amount
+        ledger = results['ledger']
+        available_balance = ledger.balance if ledger is not None else totals.available_balance
+        transactions_response = results['recent']
         
         transactions = []
         if transactions_response.data:
@@ -3642,55 +3429,40 @@ def contact_form():
 
 @api_bp.route('/stats', methods=['GET'])
 def get_stats():
-    """Get platform statistics - REAL-TIME from Supabase."""
+    """Get platform statistics from the shared stats snapshot."""
     try:
-        sb = get_supabase()
+        # Served from the shared background snapshot; no table scans per page view
+        snapshot = PlatformStatsService.get_snapshot()
+        if not snapshot:
+            raise RuntimeError('platform stats snapshot unavailable')
+        data = snapshot['data']
         
-        # Get real counts from Supabase
-        # Total users count
-        users_response = sb.table('profiles').select('id', count='exact').execute()
-        total_users = users_response.count if hasattr(users_response, 'count') else 0
-        
-        # Total queries/questions answered
-        queries_response = sb.table('chat_queries').select('id', count='exact').execute()
-        total_queries = queries_response.count if hasattr(queries_response, 'count') else 0
-        
-        # Total CAs count
-        cas_response = sb.table('profiles').select('id', count='exact').eq('role', 'ca').execute()
-        total_cas = cas_response.count if hasattr(cas_response, 'count') else 0
-        
-        # Calculate accuracy rate from feedback
-        # Get queries with helpful feedback
-        helpful_response = sb.table('chat_queries').select('id', count='exact').eq('is_helpful', True).execute()
-        helpful_count = helpful_response.count if hasattr(helpful_response, 'count') else 0
-        
-        # Get queries with ratings
-        rated_response = sb.table('chat_queries').select('id', count='exact').not_.is_('rating', 'null').execute()
-        rated_count = rated_response.count if hasattr(rated_response, 'count') else 0
+        total_users = data.get('total_users', 0)
+        total_queries = data.get('total_queries', 0)
+        total_cas = data.get('total_cas', 0)
+        helpful_count = data.get('helpful_queries', 0)
+        rated_count = data.get('rated_queries', 0)
         
         # Calculate accuracy (percentage of helpful responses)
         accuracy = round((helpful_count / rated_count * 100), 1) if rated_count > 0 else 95.0
         
         # Calculate satisfaction from average rating
-        ratings_response = sb.table('chat_queries').select('rating').not_.is_('rating', 'null').execute()
-        if ratings_response.data and len(ratings_response.data) > 0:
-            ratings = [r['rating'] for r in ratings_response.data if r.get('rating')]
-            avg_rating = sum(ratings) / len(ratings) if ratings else 4.5
-            satisfaction = round((avg_rating / 5.0 * 100), 1)
-        else:
-            satisfaction = 90.0
+        avg_rating = PlatformStatsService.average_rating(data.get('query_ratings', {}))
+        satisfaction = round((avg_rating / 5.0 * 100), 1) if avg_rating else 90.0
         
-        # Get popular topics from actual queries (group by category)
-        topics_response = sb.table('chat_queries').select('category').execute()
+        # Popular topics from the per-category counts
         popular_topics = []
         
-        if topics_response.data:
+        if data.get('categories'):
             from collections import Counter
-            category_counts = Counter([q.get('category', 'general') for q in topics_response.data])
+            category_counts = Counter(data['categories'])
             
             # Map categories to display info
             category_map = {
                 'tax': {'topic': 'Tax Planning', 'icon': 'fa-calculator'},
+                'income_tax': {'topic': 'Income Tax', 'icon': 'fa-calculator'},
+                'business': {'topic': 'Business', 'icon': 'fa-briefcase'},
+                'insurance': {'topic': 'Insurance', 'icon': 'fa-shield-alt'},
                 'investment': {'topic': 'Investment', 'icon': 'fa-chart-line'},
                 'gst': {'topic': 'GST', 'icon': 'fa-file-invoice'},
                 'retirement': {'topic': 'Retirement', 'icon': 'fa-umbrella-beach'},
@@ -3722,7 +3494,7 @@ def get_stats():
             'cas': total_cas,
             'consultations': total_queries,  # Using queries count as consultations
             'popular_topics': popular_topics,
-            'last_updated': datetime.utcnow().isoformat()
+            'last_updated': snapshot['last_updated']
         }
         
         return jsonify({'success': True, 'data': stats})
@@ -0,0 +1,169 @@
+"""
+Compact Row Types - projection-aware records for hot tables
+Each type lists exactly the columns its readers need, so a query selects
+Row.columns() instead of '*', and keeps the result in a __slots__ object
+instead of a per-row dict. Rows still answer .get() and [] so code and
+templates written against plain dicts keep working.
+Author: Sumeet Sangwan
+"""
+
+from dataclasses import asdict, dataclass, fields
+from typing import Any, Dict, Iterable, List, Optional, Type, TypeVar
+
+from postgrest import APIError
+
+R = TypeVar('R', bound='Row')
+
+# Postgres "undefined column": the projection names a column this database lacks
+_UNDEFINED_COLUMN_CODES = {'42703', 'PGRST204'}
+_wide_fallbacks = set()
+
+
+class Row:
+    """Mixin for slotted dataclass rows"""
+    __slots__ = ()
+
+    @classmethod
+    def columns(cls) -> str:
+        """PostgREST select list for this row type"""
+        return ', '.join(f.name for f in fields(cls))
+
+    @classmethod
+    def from_row(cls: Type[R], row: Optional[Dict[str, Any]]) -> Optional[R]:
+        """Build from a PostgREST dict, ignoring columns the type does not carry"""
+        if row is None:
+            return None
+        return cls(**{f.name: row.get(f.name) for f in fields(cls)})
+
+    @classmethod
+    def from_rows(cls: Type[R], rows: Optional[Iterable[Dict[str, Any]]]) -> List[R]:
+        return [cls.from_row(row) for row in rows or ()]
+
+    def get(self, name: str, default: Any = None) -> Any:
+        value = getattr(self, name, None)
+        return default if value is None else value
+
+    def __getitem__(self, name: str) -> Any:
+        try:
+            return getattr(self, name)
+        except AttributeError:
+            raise KeyError(name) from None
+
+    def __contains__(self, name: str) -> bool:
+        return name in self.__slots__
+
+    def to_dict(self) -> Dict[str, Any]:
+        return asdict(self)
+
+
+def select_columns(row_type: Type[Row]) -> str:
+    """Projection for `row_type`, or '*' once this database proved to lack a column"""
+    return '*' if row_type in _wide_fallbacks else row_type.columns()
+
+
+def fetch_projected(row_type: Type[Row], run):
+    """
+    Run `run(columns)` with the row type's projection. If the database is
+    missing one of the columns (migration not applied yet), fall back to
+    '*' for this row type until restart instead of failing the read.
+    """
+    try:
+        return run(select_columns(row_type))
+    except APIError as e:
+        if str(getattr(e, 'code', '')) not in _UNDEFINED_COLUMN_CODES or row_type in _wide_fallbacks:
+            raise
+        _wide_fallbacks.add(row_type)
+        return run('*')
+
+
+# =====================================================================
+# HOT ENTITIES
+# =====================================================================
+
+@dataclass(slots=True)
+class ProfileRow(Row):
+    """profiles columns used by the session user (finucity.models.User, CA layout, decorators)"""
+    id: Optional[str] = None
+    email: Optional[str] = None
+    username: Optional[str] = None
+    first_name: Optional[str] = None
+    last_name: Optional[str] = None
+    phone: Optional[str] = None
+    profession: Optional[str] = None
+    city: Optional[str] = None
+    state: Optional[str] = None
+    role: Optional[str] = None
+    is_active: Optional[bool] = None
+    email_verified: Optional[bool] = None
+    created_at: Optional[str] = None
+    last_login: Optional[str] = None
+    last_seen: Optional[str] = None
+    history_cleared_at: Optional[str] = None
+    ca_status: Optional[str] = None
+    verification_status: Optional[str] = None
+
+
+@dataclass(slots=True)
+class ChatTitleRow(Row):
+    """chat_queries without the AI response (lists, sidebars, stats)"""
+    id: Optional[int] = None
+    session_id: Optional[str] = None
+    question: Optional[str] = None
+    category: Optional[str] = None
+    rating: Optional[int] = None
+    response_time: Optional[float] = None
+    created_at: Optional[str] = None
+
+
+@dataclass(slots=True)
+class ChatQueryRow(Row):
+    """A full chat_queries row, including the response"""
+    id: Optional[int] = None
+    user_id: Optional[str] = None
+    session_id: Optional[str] = None
+    question: Optional[str] = None
+    response: Optional[str] = None
+    category: Optional[str] = None
+    rating: Optional[int] = None
+    is_helpful: Optional[bool] = None
+    response_time: Optional[float] = None
+    created_at: Optional[str] = None
+
+
+@dataclass(slots=True)
+class ConsultationRow(Row):
+    """consultations columns shown on the CA dashboard"""
+    id: Optional[str] = None
+    user_id: Optional[str] = None
+    service_type: Optional[str] = None
+    description: Optional[str] = None
+    min_budget: Optional[float] = None
+    max_budget: Optional[float] = None
+    status: Optional[str] = None
+    created_at: Optional[str] = None
+    accepted_at: Optional[str] = None
+    started_at: Optional[str] = None
+    completed_at: Optional[str] = None
+
+
+@dataclass(slots=True)
+class BookingRow(Row):
+    """service_bookings columns needed to authorise and route a booking"""
+    id: Optional[str] = None
+    booking_number: Optional[str] = None
+    user_id: Optional[str] = None
+    assigned_ca_id: Optional[str] = None
+    status: Optional[str] = None
+    created_at: Optional[str] = None
+
+
+__all__ = [
+    'Row',
+    'ProfileRow',
+    'ChatTitleRow',
+    'ChatQueryRow',
+    'ConsultationRow',
+    'BookingRow',
+    'select_columns',
+    'fetch_projected',
+]
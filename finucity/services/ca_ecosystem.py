@@ -14,6 +14,9 @@ from supabase import Client
 from flask import current_app, g
 import re
 
+from finucity.database import UserService, run_parallel
+from finucity.bulk import bulk_buffer
+
 class CAEcosystemService:
     """Production-grade CA ecosystem management service"""
     
@@ -81,6 +84,7 @@ class CAEcosystemService:
             if result.data:
                 # Update user role to ca_pending
                 sb.table('profiles').update({'role': 'ca_pending'}).eq('id', user_id).execute()
+                UserService.invalidate_cache(user_id)
                 
                 # Log admin action
                 CAEcosystemService.log_admin_action(
@@ -172,6 +176,7 @@ class CAEcosystemService:
             }
             
             sb.table('profiles').update(user_update).eq('id', app['user_id']).execute()
+            UserService.invalidate_cache(app['user_id'])
             
             # Log admin action
             CAEcosystemService.log_admin_action(
@@ -216,6 +221,7 @@ class CAEcosystemService:
             
             # Update user role back to user
             sb.table('profiles').update({'role': 'user'}).eq('id', app['user_id']).execute()
+            UserService.invalidate_cache(app['user_id'])
             
             # Log admin action
             CAEcosystemService.log_admin_action(
@@ -257,6 +263,7 @@ class CAEcosystemService:
             }
             
             sb.table('profiles').update(update_data).eq('id', ca_id).execute()
+            UserService.invalidate_cache(ca_id)
             
             # Hold all pending withdrawals
             sb.table('withdrawal_requests').update({'status': 'held'}).eq('ca_id', ca_id).eq('status', 'pending').execute()
@@ -301,6 +308,7 @@ class CAEcosystemService:
             }
             
             sb.table('profiles').update(update_data).eq('id', ca_id).execute()
+            UserService.invalidate_cache(ca_id)
             
             # Release held withdrawals
             sb.table('withdrawal_requests').update({'status': 'pending'}).eq('ca_id', ca_id).eq('status', 'held').execute()
@@ -345,6 +353,7 @@ class CAEcosystemService:
             }
             
             sb.table('profiles').update(update_data).eq('id', ca_id).execute()
+            UserService.invalidate_cache(ca_id)
             
             # Reject all pending withdrawals
             sb.table('withdrawal_requests').update({
@@ -389,28 +398,27 @@ class CAEcosystemService:
         try:
             sb = CAEcosystemService.get_supabase_admin()
             
-            # Total CAs by status
-            total_cas = sb.table('profiles').select('id', count='exact').eq('role', 'ca').execute()
-            verified_cas = sb.table('profiles').select('id', count='exact').eq('role', 'ca').eq('verification_status', 'verified').execute()
-            suspended_cas = sb.table('profiles').select('id', count='exact').eq('role', 'ca').eq('is_suspended', True).execute()
-            
-            # Applications by status
-            pending_apps = sb.table('ca_applications').select('id', count='exact').eq('status', 'pending').execute()
-            approved_apps = sb.table('ca_applications').select('id', count='exact').eq('status', 'approved').execute()
-            rejected_apps = sb.table('ca_applications').select('id', count='exact').eq('status', 'rejected').execute()
-            
-            # Recent activity
-            recent_applications = sb.table('ca_applications').select('id, created_at, status').order('created_at', desc=True).limit(10).execute()
-            
-            return {
-                'total_cas': total_cas.count or 0,
-                'verified_cas': verified_cas.count or 0,
-                'suspended_cas': suspended_cas.count or 0,
-                'pending_applications': pending_apps.count or 0,
-                'approved_applications': approved_apps.count or 0,
-                'rejected_applications': rejected_apps.count or 0,
-                'recent_applications': recent_applications.data or []
-            }
+            ca_profiles = lambda: sb.table('profiles').select('id', count='exact').eq('role', 'ca')
+            applications = lambda: sb.table('ca_applications').select('id', count='exact')
+            
+            results = run_parallel({
+                # Total CAs by status
+                'total_cas': lambda: ca_profiles().execute(),
+                'verified_cas': lambda: ca_profiles().eq('verification_status', 'verified').execute(),
+                'suspended_cas': lambda: ca_profiles().eq('is_suspended', True).execute(),
+                # Applications by status
+                'pending_applications': lambda: applications().eq('status', 'pending').execute(),
+                'approved_applications': lambda: applications().eq('status', 'approved').execute(),
+                'rejected_applications': lambda: applications().eq('status', 'rejected').execute(),
+                # Recent activity
+                'recent_applications': lambda: sb.table('ca_applications').select('id, created_at, status').order('created_at', desc=True).limit(10).execute(),
+            })
+            
+            stats = {name: (response.count or 0) if response is not None else 0
+                     for name, response in results.items() if name != 'recent_applications'}
+            recent = results['recent_applications']
+            stats['recent_applications'] = (recent.data or []) if recent is not None else []
+            return stats
             
         except Exception as e:
             current_app.logger.error(f"Error getting CA statistics: {e}")
@@ -423,8 +431,6 @@ class CAEcosystemService:
                          new_values: Optional[Dict] = None) -> bool:
         """Log admin action for audit trail"""
         try:
-            sb = CAEcosystemService.get_supabase_admin()
-            
             log_data = {
                 'admin_id': admin_id,
                 'action_type': action_type,
@@ -439,8 +445,8 @@ class CAEcosystemService:
                 'user_agent': getattr(g, 'user_agent', None)
             }
             
-            sb.table('admin_logs').insert(log_data).execute()
-            return True
+            # Audit rows are write-only here; batch them with other requests' rows
+            return bulk_buffer.add('admin_logs', log_data)
             
         except Exception as e:
             current_app.logger.error(f"Error logging admin action: {e}")
@@ -0,0 +1,204 @@
+"""
+Calculator Batches - many calculator invocations in one request
+Evaluates a list of typed invocations ({"calculator": "income_tax",
+"income": 1200000, ...}) with the same inputs the single /calculators/api/*
+routes take. Income tax and regime comparison rows are computed together
+on the vectorized paths (finucity.services.tax_batch), SIP rows as one
+schedule matrix (finucity.services.sip_engine); the other calculators
+are cheap closed forms and run per row.
+
+Rows can also come from CSV (header row; nested inputs such as
+deductions as `deductions.80c` columns) or NDJSON (one JSON object per
+line). A bad row yields an error for that row only.
+Author: Sumeet Sangwan
+"""
+
+import csv
+import io
+import json
+from collections import defaultdict
+from typing import Any, Callable, Dict, Iterable, List, Optional
+
+import numpy as np
+
+from . import tax_batch
+from .calculators import FinancialCalculators
+from .sip_engine import SIPEngine
+from .tax_slabs import DEFAULT_FY
+
+
+def _flag(value: Any) -> bool:
+    """Booleans from JSON or from CSV text"""
+    if isinstance(value, str):
+        return value.strip().lower() in ('true', '1', 'yes', 'y')
+    return bool(value)
+
+
+def _checked(plan):
+    plan.validate()  # reject a bad plan on its own row, not for the whole group
+    return plan
+
+
+def _deductions(item: Dict) -> Dict[str, float]:
+    return {key: float(value) for key, value in (item.get('deductions') or {}).items()}
+
+
+# Per-row calculators: the same argument handling as the single routes
+SCALAR_CALCULATORS: Dict[str, Callable[[Dict], Dict]] = {
+    'hra': lambda d: FinancialCalculators.hra_calculator(
+        basic_salary=float(d.get('basic_salary', 0)),
+        hra_received=float(d.get('hra_received', 0)),
+        rent_paid=float(d.get('rent_paid', 0)),
+        is_metro=_flag(d.get('is_metro', False))),
+    'capital_gains': lambda d: FinancialCalculators.capital_gains_calculator(
+        purchase_price=float(d.get('purchase_price', 0)),
+        sale_price=float(d.get('sale_price', 0)),
+        holding_period_months=int(float(d.get('holding_period_months', 0))),
+        asset_type=d.get('asset_type', 'equity')),
+    'gst': lambda d: FinancialCalculators.gst_calculator(
+        amount=float(d.get('amount', 0)),
+        gst_rate=float(d.get('gst_rate', 18)),
+        calculation_type=d.get('calculation_type', 'exclusive')),
+    'tds': lambda d: FinancialCalculators.tds_calculator(
+        income=float(d.get('income', 0)),
+        tds_section=d.get('tds_section', '194J')),
+    'gratuity': lambda d: FinancialCalculators.gratuity_calculator(
+        basic_salary=float(d.get('basic_salary', 0)),
+        years_of_service=float(d.get('years_of_service', 0)),
+        is_covered=_flag(d.get('is_covered', True))),
+}
+
+VECTOR_CALCULATORS = ('income_tax', 'tax_regime', 'sip')
+CALCULATORS = VECTOR_CALCULATORS + tuple(SCALAR_CALCULATORS)
+
+
+# =====================================================
+# INPUT PARSING
+# =====================================================
+
+def _unflatten(row: Dict[str, Any]) -> Dict[str, Any]:
+    """CSV row -> item: empty cells dropped, `a.b` columns nested"""
+    item: Dict[str, Any] = {}
+    for key, value in row.items():
+        if key is None or value is None or value == '':
+            continue
+        key = key.strip()
+        if '.' in key:
+            parent, child = key.split('.', 1)
+            item.setdefault(parent, {})[child] = value
+        else:
+            item[key] = value
+    return item
+
+
+def parse_csv(text: str) -> List[Dict[str, Any]]:
+    return [_unflatten(row) for row in csv.DictReader(io.StringIO(text))]
+
+
+def parse_ndjson(text: str) -> List[Dict[str, Any]]:
+    return [json.loads(line) for line in text.splitlines() if line.strip()]
+
+
+# =====================================================
+# EVALUATION
+# =====================================================
+
+def _income_tax_rows(items: List[Dict], fy: str) -> List[Dict]:
+    n = len(items)
+    sections = sorted({key for item in items for key in (item.get('deductions') or {})})
+    deductions = {}
+    for section in sections:
+        default = tax_batch.STANDARD_DEDUCTION if section == 'standard_deduction' else 0.0
+        deductions[section] = np.fromiter(
+            (item['deductions'].get(section, default) for item in items), dtype=np.float64, count=n)
+    regimes = np.array([item['regime'] for item in items])
+    batch = tax_batch.compute(np.fromiter((item['income'] for item in items), dtype=np.float64, count=n),
+                              np.array([item['age_group'] for item in items]), regimes, deductions, fy)
+    rows = list(batch.rows())
+    for row, regime in zip(rows, regimes.tolist()):
+        row['tax_regime'] = 'Old' if regime == 'old' else 'New'
+        row['financial_year'] = fy
+    return rows
+
+
+def _tax_regime_rows(items: List[Dict], fy: str) -> List[Dict]:
+    incomes = np.fromiter((item['income'] for item in items), dtype=np.float64, count=len(items))
+    claimed = np.fromiter((sum(item['deductions'].values()) for item in items), dtype=np.float64, count=len(items))
+    comparison = tax_batch.compare_regimes(incomes, claimed, fy)
+    rows = []
+    for income, deducted, old_tax, new_tax, difference, new_wins in zip(
+            incomes.tolist(), claimed.tolist(), comparison['old_tax'].tolist(), comparison['new_tax'].tolist(),
+            comparison['difference'].tolist(), comparison['recommend_new'].tolist()):
+        recommended = 'new' if new_wins else 'old'
+        rows.append({
+            'old_regime': {
+                'taxable_income': income - deducted,
+                'tax_amount': old_tax,
+                'effective_rate': (old_tax / income * 100) if income > 0 else 0
+            },
+            'new_regime': {
+                'taxable_income': income,
+                'tax_amount': new_tax,
+                'effective_rate': (new_tax / income * 100) if income > 0 else 0
+            },
+            'financial_year': fy,
+            'difference': abs(difference),
+            'savings': max(difference, 0),
+            'recommended': recommended,
+            'recommendation_reason': f'You save ₹{abs(difference):,.0f} with {recommended} regime'
+        })
+    return rows
+
+
+def _sip_rows(items: List[Dict], granularity: str) -> List[Dict]:
+    return SIPEngine.results([item['plan'] for item in items], granularity)
+
+
+_VECTOR_INPUTS = {
+    'income_tax': lambda d: {'income': float(d.get('income', 0)), 'age_group': d.get('age_group', 'below_60'),
+                             'regime': d.get('regime', 'new'), 'deductions': _deductions(d)},
+    'tax_regime': lambda d: {'income': float(d.get('income', 0)), 'deductions': _deductions(d)},
+    'sip': lambda d: {'plan': _checked(SIPEngine.plan(
+        float(d.get('monthly_investment', 0)), float(d.get('expected_return', 12)),
+        int(float(d.get('tenure_years', 10))), float(d.get('step_up_percent', 0)),
+        float(d.get('step_up_amount', 0)), d.get('top_ups'), d.get('pauses')))},
+}
+_VECTOR_EVALUATORS = {'income_tax': _income_tax_rows, 'tax_regime': _tax_regime_rows, 'sip': _sip_rows}
+
+
+def evaluate(items: Iterable[Dict], default_calculator: Optional[str] = None) -> List[Dict]:
+    """[{'index', 'calculator', 'result'} or {'index', 'calculator', 'error'}] in input order"""
+    outcomes: List[Dict] = []
+    groups = defaultdict(list)  # (calculator, fy or granularity) -> [(index, parsed input)]
+    for index, item in enumerate(items):
+        if not isinstance(item, dict):
+            outcomes.append({'index': index, 'calculator': None, 'error': 'Each item must be an object'})
+            continue
+        name = item.get('calculator') or default_calculator
+        outcome = {'index': index, 'calculator': name}
+        outcomes.append(outcome)
+        try:
+            if name in _VECTOR_INPUTS:
+                option = item.get('granularity', 'yearly') if name == 'sip' else \
+                    item.get('financial_year') or DEFAULT_FY
+                groups[(name, option)].append((index, _VECTOR_INPUTS[name](item)))
+            elif name in SCALAR_CALCULATORS:
+                outcome['result'] = SCALAR_CALCULATORS[name](item)
+            else:
+                outcome['error'] = f"Unknown calculator: {name}"
+        except (TypeError, ValueError, AttributeError, ZeroDivisionError) as e:
+            outcome['error'] = f"Invalid input: {e}"
+
+    for (name, option), rows in groups.items():
+        try:
+            results = _VECTOR_EVALUATORS[name]([parsed for _, parsed in rows], option)
+        except ValueError as e:  # unsupported financial year or granularity: fails that group only
+            for index, _ in rows:
+                outcomes[index]['error'] = str(e)
+            continue
+        for (index, _), result in zip(rows, results):
+            outcomes[index]['result'] = result
+    return outcomes
+
+
+__all__ = ['CALCULATORS', 'SCALAR_CALCULATORS', 'evaluate', 'parse_csv', 'parse_ndjson']
@@ -7,80 +7,62 @@ Author: Sumeet Sangwan
 from typing import Dict, List
 import math
 
+from . import tax_batch
+from .sip_engine import SIPEngine
+from .tax_slabs import CESS_RATE, DEFAULT_FY, TaxSlabEngine
+
 class FinancialCalculators:
     """Collection of financial and tax calculators"""
     
     @staticmethod
     def income_tax_calculator(income: float, age_group: str = 'below_60',
-                             regime: str = 'new', deductions: Dict = None) -> Dict:
+                             regime: str = 'new', deductions: Dict = None,
+                             fy: str = DEFAULT_FY) -> Dict:
         """
         Calculate income tax
         age_group: 'below_60', '60_to_80', 'above_80'
         regime: 'old', 'new'
+        fy: financial year of the slabs, e.g. '2023-24'
         """
         if deductions is None:
             deductions = {}
         
         # Calculate based on regime
         if regime == 'old':
-            return FinancialCalculators._old_regime_tax(income, age_group, deductions)
+            return FinancialCalculators._old_regime_tax(income, age_group, deductions, fy)
         else:
-            return FinancialCalculators._new_regime_tax(income, age_group)
+            return FinancialCalculators._new_regime_tax(income, age_group, fy)
+    
+    @staticmethod
+    def income_tax_batch(incomes, age_groups='below_60', regimes='new',
+                         deductions: Dict = None, fy: str = DEFAULT_FY) -> tax_batch.TaxBatch:
+        """
+        Calculate income tax for many incomes at once (columnar results)
+        age_groups / regimes: one value or one per income
+        deductions: section -> value or one value per income (old regime)
+        """
+        return tax_batch.compute(incomes, age_groups, regimes, deductions, fy)
     
     @staticmethod
-    def _new_regime_tax(income: float, age_group: str) -> Dict:
+    def _new_regime_tax(income: float, age_group: str, fy: str = DEFAULT_FY) -> Dict:
         """Calculate tax under new regime"""
-        tax = 0
-        slabs = []
-        
-        if income <= 300000:
-            tax = 0
-            slabs.append({'range': '0 - 3,00,000', 'rate': '0%', 'tax': 0})
-        elif income <= 600000:
-            tax = (income - 300000) * 0.05
-            slabs.append({'range': '0 - 3,00,000', 'rate': '0%', 'tax': 0})
-            slabs.append({'range': '3,00,001 - 6,00,000', 'rate': '5%', 'tax': tax})
-        elif income <= 900000:
-            tax = 15000 + (income - 600000) * 0.10
-            slabs.append({'range': '0 - 3,00,000', 'rate': '0%', 'tax': 0})
-            slabs.append({'range': '3,00,001 - 6,00,000', 'rate': '5%', 'tax': 15000})
-            slabs.append({'range': '6,00,001 - 9,00,000', 'rate': '10%', 'tax': tax - 15000})
-        elif income <= 1200000:
-            tax = 45000 + (income - 900000) * 0.15
-            slabs.append({'range': '0 - 3,00,000', 'rate': '0%', 'tax': 0})
-            slabs.append({'range': '3,00,001 - 6,00,000', 'rate': '5%', 'tax': 15000})
-            slabs.append({'range': '6,00,001 - 9,00,000', 'rate': '10%', 'tax': 30000})
-            slabs.append({'range': '9,00,001 - 12,00,000', 'rate': '15%', 'tax': tax - 45000})
-        elif income <= 1500000:
-            tax = 90000 + (income - 1200000) * 0.20
-            slabs.append({'range': '0 - 3,00,000', 'rate': '0%', 'tax': 0})
-            slabs.append({'range': '3,00,001 - 6,00,000', 'rate': '5%', 'tax': 15000})
-            slabs.append({'range': '6,00,001 - 9,00,000', 'rate': '10%', 'tax': 30000})
-            slabs.append({'range': '9,00,001 - 12,00,000', 'rate': '15%', 'tax': 45000})
-            slabs.append({'range': '12,00,001 - 15,00,000', 'rate': '20%', 'tax': tax - 90000})
-        else:
-            tax = 150000 + (income - 1500000) * 0.30
-            slabs.append({'range': '0 - 3,00,000', 'rate': '0%', 'tax': 0})
-            slabs.append({'range': '3,00,001 - 6,00,000', 'rate': '5%', 'tax': 15000})
-            slabs.append({'range': '6,00,001 - 9,00,000', 'rate': '10%', 'tax': 30000})
-            slabs.append({'range': '9,00,001 - 12,00,000', 'rate': '15%', 'tax': 45000})
-            slabs.append({'range': '12,00,001 - 15,00,000', 'rate': '20%', 'tax': 60000})
-            slabs.append({'range': 'Above 15,00,000', 'rate': '30%', 'tax': tax - 150000})
+        table = TaxSlabEngine.table('new', age_group, fy)
+        tax = table.tax(income)
+        slabs = table.breakdown(income)
         
         # Rebate under section 87A
-        rebate = 0
-        if income <= 700000:
-            rebate = min(tax, 25000)
-            tax = tax - rebate
+        rebate = table.rebate(income, tax)
+        tax = tax - rebate
         
         # Cess 4%
-        cess = tax * 0.04
+        cess = tax * CESS_RATE
         total_tax = tax + cess
         
         return {
             'gross_income': income,
             'taxable_income': income,
             'tax_regime': 'New',
+            'financial_year': table.fy,
             'total_deductions': 0,
             'tax_before_rebate': tax + cess if rebate == 0 else tax + rebate,
             'rebate_87a': rebate,
@@ -94,7 +76,8 @@ class FinancialCalculators:
         }
     
     @staticmethod
-    def _old_regime_tax(income: float, age_group: str, deductions: Dict) -> Dict:
+    def _old_regime_tax(income: float, age_group: str, deductions: Dict,
+                        fy: str = DEFAULT_FY) -> Dict:
         """Calculate tax under old regime"""
         # Standard deduction
         standard_deduction = min(deductions.get('standard_deduction', 50000), 50000)
@@ -118,55 +101,24 @@ class FinancialCalculators:
         total_deductions = standard_deduction + sec_80c + sec_80d + other_deductions
         taxable_income = max(0, income - total_deductions)
         
-        # Tax calculation
-        tax = 0
-        slabs = []
-        
-        # Basic exemption based on age
-        basic_exemption = 250000
-        if age_group == '60_to_80':
-            basic_exemption = 300000
-        elif age_group == 'above_80':
-            basic_exemption = 500000
-        
-        if taxable_income <= basic_exemption:
-            tax = 0
-            slabs.append({'range': f'0 - {basic_exemption:,}', 'rate': '0%', 'tax': 0})
-        elif taxable_income <= 500000:
-            tax = (taxable_income - basic_exemption) * 0.05
-            slabs.append({'range': f'0 - {basic_exemption:,}', 'rate': '0%', 'tax': 0})
-            slabs.append({'range': f'{basic_exemption+1:,} - 5,00,000', 'rate': '5%', 'tax': tax})
-        elif taxable_income <= 1000000:
-            tax = (500000 - basic_exemption) * 0.05 + (taxable_income - 500000) * 0.20
-            slabs.append({'range': f'0 - {basic_exemption:,}', 'rate': '0%', 'tax': 0})
-            slabs.append({'range': f'{basic_exemption+1:,} - 5,00,000', 'rate': '5%', 
-                         'tax': (500000 - basic_exemption) * 0.05})
-            slabs.append({'range': '5,00,001 - 10,00,000', 'rate': '20%', 
-                         'tax': (taxable_income - 500000) * 0.20})
-        else:
-            tax = ((500000 - basic_exemption) * 0.05 + 500000 * 0.20 + 
-                   (taxable_income - 1000000) * 0.30)
-            slabs.append({'range': f'0 - {basic_exemption:,}', 'rate': '0%', 'tax': 0})
-            slabs.append({'range': f'{basic_exemption+1:,} - 5,00,000', 'rate': '5%', 
-                         'tax': (500000 - basic_exemption) * 0.05})
-            slabs.append({'range': '5,00,001 - 10,00,000', 'rate': '20%', 'tax': 100000})
-            slabs.append({'range': 'Above 10,00,000', 'rate': '30%', 
-                         'tax': (taxable_income - 1000000) * 0.30})
+        # Tax calculation (basic exemption depends on age)
+        table = TaxSlabEngine.table('old', age_group, fy)
+        tax = table.tax(taxable_income)
+        slabs = table.breakdown(taxable_income)
         
         # Rebate under section 87A
-        rebate = 0
-        if taxable_income <= 500000:
-            rebate = min(tax, 12500)
-            tax = tax - rebate
+        rebate = table.rebate(taxable_income, tax)
+        tax = tax - rebate
         
         # Cess 4%
-        cess = tax * 0.04
+        cess = tax * CESS_RATE
         total_tax = tax + cess
         
         return {
             'gross_income': income,
             'taxable_income': taxable_income,
             'tax_regime': 'Old',
+            'financial_year': table.fy,
             'total_deductions': total_deductions,
             'deduction_breakdown': {
                 'standard_deduction': standard_deduction,
@@ -293,52 +245,20 @@ class FinancialCalculators:
     
     @staticmethod
     def sip_calculator(monthly_investment: float, expected_return_annual: float,
-                      tenure_years: int) -> Dict:
-        """Calculate SIP returns"""
-        monthly_rate = expected_return_annual / 12 / 100
-        total_months = tenure_years * 12
-        
-        # Future value of SIP
-        if monthly_rate == 0:
-            future_value = monthly_investment * total_months
-        else:
-            future_value = monthly_investment * (
-                ((1 + monthly_rate) ** total_months - 1) / monthly_rate
-            ) * (1 + monthly_rate)
-        
-        total_invested = monthly_investment * total_months
-        total_returns = future_value - total_invested
-        
-        # Calculate yearly breakdown
-        yearly_breakdown = []
-        for year in range(1, tenure_years + 1):
-            months = year * 12
-            if monthly_rate == 0:
-                fv = monthly_investment * months
-            else:
-                fv = monthly_investment * (
-                    ((1 + monthly_rate) ** months - 1) / monthly_rate
-                ) * (1 + monthly_rate)
-            invested = monthly_investment * months
-            returns = fv - invested
-            
-            yearly_breakdown.append({
-                'year': year,
-                'invested': invested,
-                'value': fv,
-                'returns': returns
-            })
-        
-        return {
-            'monthly_investment': monthly_investment,
-            'tenure_years': tenure_years,
-            'expected_return': f'{expected_return_annual}%',
-            'total_invested': total_invested,
-            'total_returns': total_returns,
-            'maturity_value': future_value,
-            'roi_percentage': (total_returns / total_invested * 100) if total_invested > 0 else 0,
-            'yearly_breakdown': yearly_breakdown
-        }
+                      tenure_years: int, step_up_percent: float = 0,
+                      step_up_amount: float = 0, top_ups: List = None,
+                      pauses: List = None, granularity: str = 'yearly') -> Dict:
+        """
+        Calculate SIP returns
+        step_up_percent / step_up_amount: yearly increase of the monthly amount
+        top_ups: [{'month': 13, 'amount': 50000}], pauses: [{'from': 25, 'to': 30}]
+        granularity: 'yearly' (yearly_breakdown) or 'monthly' (monthly_breakdown)
+        """
+        plan = SIPEngine.plan(monthly_investment, expected_return_annual, tenure_years,
+                              step_up_percent, step_up_amount, top_ups, pauses)
+        result = SIPEngine.results([plan], granularity)[0]
+        result['expected_return'] = f'{expected_return_annual}%'
+        return result
     
     @staticmethod
     def gst_calculator(amount: float, gst_rate: float = 18, 
@@ -0,0 +1,164 @@
+"""
+Regime Sweep - old vs new regime across an income x deduction grid
+Evaluates TaxPlanningService.compare_tax_regimes for every cell of a grid
+(up to SWEEP_MAX_STEPS per axis) in one broadcast pass over the slab
+tables, and returns the savings matrix for the heatmap.
+
+- Savings are old regime tax minus new regime tax: positive cells are
+  where the new regime is cheaper.
+- The break-even curve is computed analytically per income, not read off
+  the grid. It is the smallest deduction at which the old regime costs no
+  more than the new one, found by inverting the old regime slab segment
+  that holds the new regime's tax (tax_batch.max_taxable).
+- Contours are the same inversion at fixed savings levels (the
+  deduction where old minus new regime tax crosses each level).
+- Results are cached per grid (TTLCache) as the encoded JSON body, so
+  repeated views of the same sweep skip the computation and encoding.
+  Grids are arbitrary client floats, so the cache is bounded by bytes
+  (SWEEP_CACHE_MAX_BYTES) as well as entries, and the route is rate
+  limited.
+Author: Sumeet Sangwan
+"""
+
+import json
+import os
+from dataclasses import astuple, dataclass
+from typing import Any, Dict, Mapping, Tuple
+
+import numpy as np
+
+from finucity.cache import TTLCache
+from finucity.metrics import metrics
+
+from . import tax_batch
+from .tax_slabs import DEFAULT_FY, TaxSlabEngine
+
+SWEEP_MAX_STEPS = int(os.getenv('SWEEP_MAX_STEPS', '400'))
+SWEEP_CACHE_TTL = float(os.getenv('SWEEP_CACHE_TTL', '3600'))
+SWEEP_CONTOUR_LEVELS = (-50000.0, -25000.0, -10000.0, 10000.0, 25000.0, 50000.0)
+
+sweep_cache = TTLCache('regime_sweeps', ttl=SWEEP_CACHE_TTL, negative_ttl=0,
+                       max_size=int(os.getenv('SWEEP_CACHE_MAX_SIZE', '256')),
+                       weigher=len, max_weight=int(os.getenv('SWEEP_CACHE_MAX_BYTES', str(32 * 1024 * 1024))))
+metrics.register_collector(sweep_cache.metric_samples)
+
+
+@dataclass(frozen=True)
+class SweepGrid:
+    """Grid parameters (also the cache key)"""
+    income_min: float = 300000
+    income_max: float = 5000000
+    income_steps: int = 200
+    deduction_min: float = 0
+    deduction_max: float = 1000000
+    deduction_steps: int = 200
+    fy: str = DEFAULT_FY
+    levels: Tuple[float, ...] = SWEEP_CONTOUR_LEVELS
+
+    @staticmethod
+    def from_params(params: Mapping[str, Any]) -> 'SweepGrid':
+        """Grid from request parameters; raises ValueError on bad input"""
+        defaults = SweepGrid()
+        levels = params.get('levels', defaults.levels)
+        if isinstance(levels, str):
+            levels = [level for level in levels.split(',') if level.strip()]
+        grid = SweepGrid(
+            income_min=float(params.get('income_min', defaults.income_min)),
+            income_max=float(params.get('income_max', defaults.income_max)),
+            income_steps=int(params.get('income_steps', defaults.income_steps)),
+            deduction_min=float(params.get('deduction_min', defaults.deduction_min)),
+            deduction_max=float(params.get('deduction_max', defaults.deduction_max)),
+            deduction_steps=int(params.get('deduction_steps', defaults.deduction_steps)),
+            fy=params.get('financial_year') or DEFAULT_FY,
+            levels=tuple(sorted(float(level) for level in levels)),
+        )
+        grid.validate()
+        return grid
+
+    def validate(self):
+        for axis in ('income', 'deduction'):
+            low, high = getattr(self, f'{axis}_min'), getattr(self, f'{axis}_max')
+            steps = getattr(self, f'{axis}_steps')
+            if not (np.isfinite(low) and np.isfinite(high)) or low < 0 or high <= low:
+                raise ValueError(f"{axis}_max must be greater than {axis}_min (both non-negative)")
+            if not 2 <= steps <= SWEEP_MAX_STEPS:
+                raise ValueError(f"{axis}_steps must be between 2 and {SWEEP_MAX_STEPS}")
+        if len(self.levels) > 20:
+            raise ValueError("At most 20 contour levels")
+        TaxSlabEngine.table('old', fy=self.fy)  # unsupported years raise here
+
+
+class RegimeSweep:
+    """Vectorized regime comparison over a grid"""
+
+    @staticmethod
+    def deduction_for_gap(incomes: np.ndarray, fy: str = DEFAULT_FY, gap: float = 0.0) -> np.ndarray:
+        """Smallest deduction at which old regime tax <= new regime tax + `gap` (negative: none needed)"""
+        target = tax_batch.tax_payable(incomes, 'new', fy=fy) + gap
+        return incomes - tax_batch.max_taxable(target, 'old', fy=fy)
+
+    @staticmethod
+    def break_even(incomes: np.ndarray, fy: str = DEFAULT_FY) -> np.ndarray:
+        """Smallest deduction at which the old regime is no dearer than the new one"""
+        return np.maximum(RegimeSweep.deduction_for_gap(incomes, fy), 0.0)
+
+    @staticmethod
+    def compute(grid: SweepGrid) -> Dict[str, Any]:
+        """Savings matrix (rows: incomes, columns: deductions), break-even curve, contours and summary"""
+        incomes = np.linspace(grid.income_min, grid.income_max, grid.income_steps)
+        deductions = np.linspace(grid.deduction_min, grid.deduction_max, grid.deduction_steps)
+        comparison = tax_batch.compare_regimes(incomes[:, None], deductions[None, :], grid.fy)
+        savings = comparison['difference']
+        new_wins = comparison['recommend_new']
+
+        # Contour at level L: deduction where savings cross L (NaN where no deduction >= 0 reaches it)
+        contours = {}
+        for level in grid.levels:
+            curve = RegimeSweep.deduction_for_gap(incomes, grid.fy, gap=level)
+            contours[f'{level:g}'] = np.where(curve >= 0, curve, np.nan)
+
+        return {
+            'financial_year': grid.fy,
+            'incomes': incomes,
+            'deductions': deductions,
+            'new_regime_tax': comparison['new_tax'][:, 0],
+            'savings': savings,
+            'break_even_deduction': RegimeSweep.break_even(incomes, grid.fy),
+            'contours': contours,
+            'summary': {
+                'cells': int(savings.size),
+                'new_regime_share': float(new_wins.mean()),
+                'old_regime_share': float(1 - new_wins.mean()),
+                'max_new_regime_savings': float(max(savings.max(), 0)),
+                'max_old_regime_savings': float(max(-savings.min(), 0)),
+            },
+        }
+
+    @staticmethod
+    def to_json(result: Dict[str, Any]) -> str:
+        """JSON body: amounts rounded to the rupee, unreachable contour points as null"""
+        def column(values: np.ndarray):
+            rounded = np.round(values).astype(object)
+            rounded[~np.isfinite(values)] = None
+            return rounded.tolist()
+
+        return json.dumps({
+            'success': True,
+            'financial_year': result['financial_year'],
+            'incomes': column(result['incomes']),
+            'deductions': column(result['deductions']),
+            'new_regime_tax': column(result['new_regime_tax']),
+            'savings': column(result['savings']),
+            'break_even_deduction': column(result['break_even_deduction']),
+            'contours': {level: column(curve) for level, curve in result['contours'].items()},
+            'summary': result['summary'],
+        }, separators=(',', ':'))
+
+    @staticmethod
+    def payload(grid: SweepGrid) -> str:
+        """Cached JSON body for a grid"""
+        return sweep_cache.get_or_load(astuple(grid),
+                                       lambda: RegimeSweep.to_json(RegimeSweep.compute(grid)))
+
+
+__all__ = ['RegimeSweep', 'SweepGrid', 'sweep_cache']
@@ -0,0 +1,145 @@
+"""
+SIP Engine - month-by-month SIP schedules in one vectorized pass
+Builds the contribution schedule of each plan (annual step-up, lump-sum
+top-ups, paused months) and values it at every month end with NumPy
+cumulative sums instead of recomputing (1 + r) ** months per reported
+period:
+
+    value[m] = (1 + r) ** (m + 1) * cumsum(contribution[k] * (1 + r) ** -k)[m]
+
+Expected returns are limited to SIP_RETURN_RANGE (percent a year), so the
+largest power over SIP_MAX_MONTHS, (12 / 11) ** 1200 ~ 1e45, is finite in
+float64; a schedule that still overflows (extreme amounts or step-ups) is
+rejected, so results are always finite.
+
+Contributions are made at the start of each month (annuity due), as in
+the original sip_calculator, so a flat plan gives the same maturity value.
+Many plans are simulated together as rows of one matrix (batch requests).
+Author: Sumeet Sangwan
+"""
+
+from dataclasses import dataclass
+from typing import Dict, Iterable, List, Optional, Sequence, Tuple
+
+import numpy as np
+
+GRANULARITIES = ('yearly', 'monthly')
+SIP_MAX_MONTHS = 100 * 12
+SIP_RETURN_RANGE = (-100.0, 100.0)
+
+
+@dataclass(frozen=True)
+class SIPPlan:
+    """One SIP; months are 1-based, pauses are inclusive month ranges"""
+    monthly_investment: float
+    annual_return: float                       # percent per year
+    months: int
+    step_up_percent: float = 0.0               # monthly amount grows by this % every 12 months
+    step_up_amount: float = 0.0                # ... or by this fixed amount
+    top_ups: Tuple[Tuple[int, float], ...] = ()
+    pauses: Tuple[Tuple[int, int], ...] = ()
+
+    @property
+    def monthly_rate(self) -> float:
+        return self.annual_return / 12 / 100
+
+    def validate(self):
+        if not 1 <= self.months <= SIP_MAX_MONTHS:
+            raise ValueError(f"Tenure must be between 1 and {SIP_MAX_MONTHS} months")
+        low, high = SIP_RETURN_RANGE
+        if not low <= self.annual_return <= high:
+            raise ValueError(f"Expected return must be between {low:g}% and {high:g}% a year")
+        for month, _ in self.top_ups:
+            if not 1 <= month <= self.months:
+                raise ValueError(f"Top-up month {month} is outside the tenure")
+        for start, end in self.pauses:
+            if start > end:
+                raise ValueError(f"Pause {start}-{end} ends before it starts")
+
+
+def _contributions(plan: SIPPlan, width: int) -> np.ndarray:
+    row = np.zeros(width)
+    years = np.arange(plan.months) // 12
+    row[:plan.months] = (plan.monthly_investment * (1 + plan.step_up_percent / 100) ** years
+                         + plan.step_up_amount * years)
+    for start, end in plan.pauses:
+        row[max(start, 1) - 1:min(end, plan.months)] = 0.0
+    for month, amount in plan.top_ups:
+        row[month - 1] += amount
+    return row
+
+
+class SIPEngine:
+    """Vectorized SIP schedules"""
+
+    @staticmethod
+    def simulate(plans: Sequence[SIPPlan]) -> Tuple[np.ndarray, np.ndarray]:
+        """(cumulative invested, value) at each month end: one row per plan, padded to the longest tenure"""
+        for plan in plans:
+            plan.validate()
+        width = max(plan.months for plan in plans)
+        contributions = np.vstack([_contributions(plan, width) for plan in plans])
+        growth = 1 + np.array([[plan.monthly_rate] for plan in plans])
+        k = np.arange(width)
+        with np.errstate(over='ignore', invalid='ignore'):
+            value = np.cumsum(contributions * growth ** -k, axis=1) * growth ** (k + 1)
+        if not np.isfinite(value).all():
+            raise ValueError("SIP value is out of range")
+        return np.cumsum(contributions, axis=1), value
+
+    @staticmethod
+    def results(plans: Sequence[SIPPlan], granularity: str = 'yearly') -> List[Dict]:
+        """sip_calculator results for many plans from one simulation"""
+        if granularity not in GRANULARITIES:
+            raise ValueError(f"Unknown granularity: {granularity}")
+        invested, value = SIPEngine.simulate(plans)
+        results = []
+        for row, plan in enumerate(plans):
+            last = plan.months - 1
+            total_invested, maturity = float(invested[row, last]), float(value[row, last])
+            if granularity == 'yearly':
+                # Year ends, plus the last month when the tenure is not whole years
+                ends = list(range(11, plan.months, 12))
+                if not ends or ends[-1] != last:
+                    ends.append(last)
+                period, key = 'year', 'yearly_breakdown'
+            else:
+                ends, period, key = list(range(plan.months)), 'month', 'monthly_breakdown'
+            points = np.asarray(ends)
+            breakdown = [{period: number, 'invested': paid, 'value': worth, 'returns': worth - paid}
+                         for number, paid, worth in zip(
+                             range(1, len(ends) + 1), invested[row, points].tolist(), value[row, points].tolist())]
+            results.append({
+                'monthly_investment': plan.monthly_investment,
+                'tenure_years': plan.months / 12 if plan.months % 12 else plan.months // 12,
+                'expected_return': f'{plan.annual_return}%',
+                'step_up_percent': plan.step_up_percent,
+                'total_invested': total_invested,
+                'total_returns': maturity - total_invested,
+                'maturity_value': maturity,
+                'roi_percentage': ((maturity - total_invested) / total_invested * 100) if total_invested > 0 else 0,
+                key: breakdown
+            })
+        return results
+
+    @staticmethod
+    def plan(monthly_investment: float, expected_return_annual: float, tenure_years: float,
+             step_up_percent: float = 0, step_up_amount: float = 0,
+             top_ups: Optional[Iterable] = None, pauses: Optional[Iterable] = None) -> SIPPlan:
+        """Plan from calculator inputs; top-ups as {'month', 'amount'}, pauses as {'from', 'to'} (or pairs)"""
+        def pairs(entries, first, second):
+            return tuple((int(e[first]), e[second]) if isinstance(e, dict) else (int(e[0]), e[1])
+                         for e in entries or ())
+
+        return SIPPlan(
+            monthly_investment=float(monthly_investment),
+            annual_return=float(expected_return_annual),
+            months=int(round(float(tenure_years) * 12)),
+            step_up_percent=float(step_up_percent or 0),
+            step_up_amount=float(step_up_amount or 0),
+            top_ups=tuple((month, float(amount)) for month, amount in pairs(top_ups, 'month', 'amount')),
+            pauses=tuple((start, int(end)) for start, end in pairs(pauses, 'from', 'to')),
+        )
+
+
+__all__ = ['GRANULARITIES', 'SIPEngine', 'SIPPlan']
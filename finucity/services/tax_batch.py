@@ -0,0 +1,222 @@
+"""
+Batch Income Tax - whole payrolls in one vectorized pass
+Computes what FinancialCalculators.income_tax_calculator returns for one
+income (deductions, slab tax, 87A rebate, cess, effective rate,
+take-home) over NumPy arrays. Slabs come from the same compiled tables
+(finucity.services.tax_slabs): each row's bracket is found with
+np.searchsorted over the table bounds, then one multiply-add against the
+cumulative tax at the bracket's lower bound.
+
+- Inputs broadcast: regime / age group may be one string or one per row,
+  deductions a dict of per-section columns (or scalars) with the same
+  caps as the scalar calculator.
+- Rows are grouped by slab table (at most regimes x age groups groups),
+  so a uniform payroll is a single searchsorted call.
+- Results are columnar (TaxBatch): one float64 array per output field.
+
+Run benchmarks/bench_tax_batch.py for throughput against the scalar path.
+Author: Sumeet Sangwan
+"""
+
+from functools import lru_cache
+from typing import Dict, Iterator, Optional, Sequence, Tuple, Union
+
+import numpy as np
+
+from .tax_slabs import AGE_GROUPS, CESS_RATE, DEFAULT_FY, REGIMES, SlabTable, TaxSlabEngine
+
+ArrayLike = Union[float, Sequence[float], np.ndarray]
+Labels = Union[str, Sequence[str], np.ndarray]
+
+# Old regime deduction caps (same as FinancialCalculators._old_regime_tax)
+STANDARD_DEDUCTION = 50000
+CAP_80C = 150000
+CAP_80D = 25000
+CAP_80D_SENIOR = 50000                  # any age group other than below_60
+CAP_80CCD_1B = 50000
+CAP_80G_SHARE = 0.10
+
+OUTPUT_FIELDS = ('gross_income', 'taxable_income', 'total_deductions', 'slab_tax', 'rebate_87a',
+                 'tax_after_rebate', 'cess_4_percent', 'total_tax', 'effective_rate', 'monthly_tax', 'take_home')
+
+
+@lru_cache(maxsize=None)
+def _arrays(table: SlabTable) -> Tuple[np.ndarray, np.ndarray, np.ndarray, np.ndarray]:
+    """NumPy views of a compiled slab table (built once per table)"""
+    return (np.asarray(table.lowers), np.asarray(table.uppers),
+            np.asarray(table.rates), np.asarray(table.cumulative))
+
+
+def _labels(values: Labels, n: int, known: Sequence[str]) -> Tuple[Sequence[str], np.ndarray]:
+    """(distinct labels, per-row index into them)"""
+    if isinstance(values, str):
+        return [values], np.zeros(n, dtype=np.intp)
+    values = np.asarray(values)
+    if values.shape != (n,):
+        raise ValueError(f"Expected {n} labels, got shape {values.shape}")
+    # A few equality scans beat np.unique's string sort on large payrolls
+    names, codes = list(known), np.full(n, -1, dtype=np.intp)
+    for code, name in enumerate(known):
+        codes[values == name] = code
+    unknown = codes < 0
+    if unknown.any():
+        extra, extra_codes = np.unique(values[unknown], return_inverse=True)
+        codes[unknown] = extra_codes + len(names)
+        names += [str(name) for name in extra]
+    return names, codes
+
+
+def _column(value: ArrayLike, n: int) -> np.ndarray:
+    return np.broadcast_to(np.asarray(value, dtype=np.float64), (n,))
+
+
+def slab_tax(table: SlabTable, taxable: np.ndarray) -> np.ndarray:
+    """Vectorized SlabTable.tax"""
+    lowers, uppers, rates, cumulative = _arrays(table)
+    taxable = np.maximum(taxable, 0.0)
+    i = np.searchsorted(uppers, taxable, side='left')  # brackets are (lower, upper]
+    return cumulative[i] + (taxable - lowers[i]) * rates[i]
+
+
+def rebate_87a(table: SlabTable, taxable: np.ndarray, tax: np.ndarray) -> np.ndarray:
+    """Vectorized SlabTable.rebate"""
+    return np.where(taxable <= table.rebate_limit, np.minimum(tax, table.rebate_max), 0.0)
+
+
+def old_regime_deductions(income: np.ndarray, age_senior: np.ndarray, deductions: Dict[str, ArrayLike]) -> np.ndarray:
+    """Capped old regime deductions per row"""
+    n = income.shape[0]
+    get = lambda key, default=0.0: _column(deductions.get(key, default), n)  # noqa: E731
+    cap_80d = np.where(age_senior, CAP_80D_SENIOR, CAP_80D)
+    return (np.minimum(get('standard_deduction', STANDARD_DEDUCTION), STANDARD_DEDUCTION)
+            + np.minimum(get('80c'), CAP_80C)
+            + np.minimum(get('80d'), cap_80d)
+            + np.minimum(get('80ccd_1b'), CAP_80CCD_1B)
+            + get('80e')
+            + np.minimum(get('80g'), income * CAP_80G_SHARE)
+            + get('hra')
+            + get('home_loan_interest'))
+
+
+class TaxBatch:
+    """Columnar batch results: one array per field of the scalar calculator"""
+
+    def __init__(self, columns: Dict[str, np.ndarray], fy: str):
+        self.columns = columns
+        self.fy = fy
+
+    def __len__(self) -> int:
+        return len(self.columns['gross_income'])
+
+    def __getitem__(self, field: str) -> np.ndarray:
+        return self.columns[field]
+
+    def to_dict(self) -> Dict[str, list]:
+        """JSON-ready columns"""
+        return {name: column.tolist() for name, column in self.columns.items()}
+
+    def rows(self) -> Iterator[Dict[str, float]]:
+        """Per-row dicts (for streaming responses)"""
+        names = list(self.columns)
+        for values in zip(*(self.columns[name].tolist() for name in names)):
+            yield dict(zip(names, values))
+
+
+def compute(incomes: ArrayLike, age_groups: Labels = 'below_60', regimes: Labels = 'new',
+            deductions: Optional[Dict[str, ArrayLike]] = None, fy: str = DEFAULT_FY) -> TaxBatch:
+    """Income tax for every row; regimes other than 'old' use the new regime (as the scalar path)"""
+    income = np.atleast_1d(np.asarray(incomes, dtype=np.float64))
+    n = income.shape[0]
+    deductions = deductions or {}
+    regime_names, regime_codes = _labels(regimes, n, REGIMES)
+    age_names, age_codes = _labels(age_groups, n, AGE_GROUPS)  # unknown groups get below-60 slabs from the engine
+
+    total_deductions = np.zeros(n)
+    if 'old' in regime_names and (regime_codes == regime_names.index('old')).any():
+        is_old = np.asarray([name == 'old' for name in regime_names])[regime_codes]
+        is_senior = np.asarray([name != 'below_60' for name in age_names])[age_codes]
+        total_deductions = np.where(is_old, old_regime_deductions(income, is_senior, deductions), 0.0)
+    taxable = np.maximum(income - total_deductions, 0.0)
+
+    tax = np.empty(n)
+    rebate = np.empty(n)
+    groups = [(r, a) for r in range(len(regime_names)) for a in range(len(age_names))]
+    for r, a in groups:
+        table = TaxSlabEngine.table(regime_names[r], age_names[a], fy)
+        if len(groups) == 1:
+            rows = slice(None)
+        else:
+            rows = np.flatnonzero((regime_codes == r) & (age_codes == a))
+            if not rows.size:
+                continue
+        tax[rows] = slab_tax(table, taxable[rows])
+        rebate[rows] = rebate_87a(table, taxable[rows], tax[rows])
+
+    after_rebate = tax - rebate
+    cess = after_rebate * CESS_RATE
+    total_tax = after_rebate + cess
+    with np.errstate(divide='ignore', invalid='ignore'):
+        effective_rate = np.where(income > 0, total_tax / income * 100, 0.0)
+    return TaxBatch({
+        'gross_income': income,
+        'taxable_income': taxable,
+        'total_deductions': total_deductions,
+        'slab_tax': tax,
+        'rebate_87a': rebate,
+        'tax_after_rebate': after_rebate,
+        'cess_4_percent': cess,
+        'total_tax': total_tax,
+        'effective_rate': effective_rate,
+        'monthly_tax': total_tax / 12,
+        'take_home': income - total_tax,
+    }, fy)
+
+
+def tax_payable(taxable: np.ndarray, regime: str, age_group: str = 'below_60', fy: str = DEFAULT_FY) -> np.ndarray:
+    """Vectorized TaxSlabEngine.tax_payable (slab tax less 87A rebate, plus cess)"""
+    table = TaxSlabEngine.table(regime, age_group, fy)
+    tax = slab_tax(table, taxable)
+    return (tax - rebate_87a(table, taxable, tax)) * (1 + CESS_RATE)
+
+
+def max_taxable(payable: ArrayLike, regime: str, age_group: str = 'below_60', fy: str = DEFAULT_FY) -> np.ndarray:
+    """Largest taxable income whose tax_payable is at most `payable` (NaN for negative amounts)
+
+    Inverts the slab table one linear segment at a time: the segment is
+    found with searchsorted over the cumulative tax at each upper bound.
+    Inside the 87A band the rebate is added back to the target first.
+    """
+    table = TaxSlabEngine.table(regime, age_group, fy)
+    lowers, uppers, rates, cumulative = _arrays(table)
+    at_upper = cumulative + np.where(np.isinf(uppers), np.inf, (uppers - lowers) * rates)
+
+    def inverse(slab: np.ndarray) -> np.ndarray:
+        i = np.searchsorted(at_upper, slab, side='right')  # flat segments resolve to their upper bound
+        i = np.minimum(i, len(rates) - 1)
+        with np.errstate(divide='ignore', invalid='ignore'):
+            return lowers[i] + (slab - cumulative[i]) / rates[i]
+
+    target = np.asarray(payable, dtype=np.float64) / (1 + CESS_RATE)
+    tax_at_limit = table.tax(table.rebate_limit)
+    taxable = np.where(target >= tax_at_limit, inverse(target),
+                       np.minimum(table.rebate_limit, inverse(target + table.rebate_max)))
+    return np.where(target < 0, np.nan, taxable)
+
+
+def compare_regimes(incomes: ArrayLike, deduction_totals: ArrayLike = 0.0, fy: str = DEFAULT_FY) -> Dict[str, np.ndarray]:
+    """Vectorized TaxPlanningService.compare_tax_regimes: old regime on income less deductions, new on income"""
+    income = np.asarray(incomes, dtype=np.float64)
+    deduction_totals = np.asarray(deduction_totals, dtype=np.float64)
+    old_tax = tax_payable(income - deduction_totals, 'old', fy=fy)
+    new_tax = tax_payable(np.broadcast_to(income, old_tax.shape), 'new', fy=fy)
+    difference = old_tax - new_tax
+    return {
+        'old_tax': old_tax,
+        'new_tax': new_tax,
+        'difference': difference,              # positive: the new regime is cheaper
+        'recommend_new': new_tax < old_tax,
+    }
+
+
+__all__ = ['OUTPUT_FIELDS', 'TaxBatch', 'compare_regimes', 'compute', 'old_regime_deductions', 'rebate_87a',
+           'max_taxable', 'slab_tax', 'tax_payable']
@@ -6,6 +6,8 @@ Author: Sumeet Sangwan
 
 from typing import Dict, List, Optional
 
+from .tax_slabs import DEFAULT_FY, TaxSlabEngine
+
 class TaxPlanningService:
     """Tax planning and optimization services"""
     
@@ -132,14 +134,14 @@ class TaxPlanningService:
         return services
     
     @staticmethod
-    def compare_tax_regimes(income: float, deductions: Dict) -> Dict:
+    def compare_tax_regimes(income: float, deductions: Dict, fy: str = DEFAULT_FY) -> Dict:
         """Compare old vs new tax regime"""
         
         # Old regime calculation
-        old_regime_tax = TaxPlanningService._calculate_old_regime(income, deductions)
+        old_regime_tax = TaxPlanningService._calculate_old_regime(income, deductions, fy)
         
         # New regime calculation (no deductions)
-        new_regime_tax = TaxPlanningService._calculate_new_regime(income)
+        new_regime_tax = TaxPlanningService._calculate_new_regime(income, fy)
         
         difference = old_regime_tax - new_regime_tax
         recommended = 'new' if new_regime_tax < old_regime_tax else 'old'
@@ -155,6 +157,7 @@ class TaxPlanningService:
                 'tax_amount': new_regime_tax,
                 'effective_rate': (new_regime_tax / income * 100) if income > 0 else 0
             },
+            'financial_year': fy,
             'difference': abs(difference),
             'savings': max(difference, 0),
             'recommended': recommended,
@@ -162,53 +165,16 @@ class TaxPlanningService:
         }
     
     @staticmethod
-    def _calculate_old_regime(income: float, deductions: Dict) -> float:
-        """Calculate tax under old regime"""
+    def _calculate_old_regime(income: float, deductions: Dict, fy: str = DEFAULT_FY) -> float:
+        """Calculate tax under old regime (87A rebate and cess included)"""
+        # Standard deduction, 80C, 80D, etc. are already in deductions
         taxable_income = income - sum(deductions.values())
-        
-        # Standard deduction (already in deductions)
-        # 80C, 80D, etc. (already in deductions)
-        
-        tax = 0
-        if taxable_income <= 250000:
-            tax = 0
-        elif taxable_income <= 500000:
-            tax = (taxable_income - 250000) * 0.05
-        elif taxable_income <= 1000000:
-            tax = 12500 + (taxable_income - 500000) * 0.20
-        else:
-            tax = 112500 + (taxable_income - 1000000) * 0.30
-        
-        # Add cess
-        tax = tax * 1.04
-        
-        return tax
+        return TaxSlabEngine.tax_payable(taxable_income, 'old', 'below_60', fy)
     
     @staticmethod
-    def _calculate_new_regime(income: float) -> float:
-        """Calculate tax under new regime (FY 2023-24)"""
-        tax = 0
-        if income <= 300000:
-            tax = 0
-        elif income <= 600000:
-            tax = (income - 300000) * 0.05
-        elif income <= 900000:
-            tax = 15000 + (income - 600000) * 0.10
-        elif income <= 1200000:
-            tax = 45000 + (income - 900000) * 0.15
-        elif income <= 1500000:
-            tax = 90000 + (income - 1200000) * 0.20
-        else:
-            tax = 150000 + (income - 1500000) * 0.30
-        
-        # Rebate under 87A if income <= 7 lakhs
-        if income <= 700000:
-            tax = max(0, tax - 25000)
-        
-        # Add cess
-        tax = tax * 1.04
-        
-        return tax
+    def _calculate_new_regime(income: float, fy: str = DEFAULT_FY) -> float:
+        """Calculate tax under new regime (87A rebate and cess included)"""
+        return TaxSlabEngine.tax_payable(income, 'new', 'below_60', fy)
     
     @staticmethod
     def calculate_hra_exemption(salary: float, hra_received: float, 
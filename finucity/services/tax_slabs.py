@@ -0,0 +1,186 @@
+"""
+Tax Slab Engine - one set of income tax slab tables for every calculator
+Slab tables are declared once per financial year and regime (old regime
+basic exemptions per age group) and compiled at import into sorted
+bracket bounds with the cumulative tax at each lower bound. Tax on an
+income is then a bisect over the bounds plus one multiply, and the slab
+breakdown shown to users is read from the same table, so the calculator
+pages, regime comparison and AI answers all quote the same numbers.
+
+- FY 2023-24 is the default (the slabs the calculators have always used).
+- 87A rebates live next to their slabs: full rebate up to `max` when
+  taxable income is at most `limit`. No marginal relief (unchanged).
+- Health & education cess (CESS_RATE) is applied by the callers.
+Author: Sumeet Sangwan
+"""
+
+from bisect import bisect_left
+from dataclasses import dataclass
+from typing import Dict, List, Optional, Tuple
+
+DEFAULT_FY = '2023-24'
+CESS_RATE = 0.04
+
+AGE_GROUPS = ('below_60', '60_to_80', 'above_80')
+REGIMES = ('old', 'new')
+
+# =====================================================
+# SLAB RULES
+# =====================================================
+# Brackets are (upper bound, rate); None is the open top bracket.
+
+_OLD_REGIME = {
+    'brackets': [(500000, 0.05), (1000000, 0.20), (None, 0.30)],
+    'exemption': {'below_60': 250000, '60_to_80': 300000, 'above_80': 500000},
+    'rebate': {'limit': 500000, 'max': 12500},
+}
+
+SLAB_RULES = {
+    '2023-24': {
+        'old': _OLD_REGIME,
+        'new': {
+            'brackets': [(300000, 0.0), (600000, 0.05), (900000, 0.10), (1200000, 0.15),
+                         (1500000, 0.20), (None, 0.30)],
+            'rebate': {'limit': 700000, 'max': 25000},
+        },
+    },
+    '2024-25': {
+        'old': _OLD_REGIME,
+        'new': {
+            'brackets': [(300000, 0.0), (700000, 0.05), (1000000, 0.10), (1200000, 0.15),
+                         (1500000, 0.20), (None, 0.30)],
+            'rebate': {'limit': 700000, 'max': 25000},
+        },
+    },
+    '2025-26': {
+        'old': _OLD_REGIME,
+        'new': {
+            'brackets': [(400000, 0.0), (800000, 0.05), (1200000, 0.10), (1600000, 0.15),
+                         (2000000, 0.20), (2400000, 0.25), (None, 0.30)],
+            'rebate': {'limit': 1200000, 'max': 60000},
+        },
+    },
+}
+
+
+def format_inr(amount: float) -> str:
+    """Indian digit grouping: 1500000 -> '15,00,000'"""
+    digits = str(int(amount))
+    if len(digits) <= 3:
+        return digits
+    head, tail = digits[:-3], digits[-3:]
+    groups = []
+    while len(head) > 2:
+        groups.insert(0, head[-2:])
+        head = head[:-2]
+    return ','.join([head] + groups + [tail])
+
+
+# =====================================================
+# COMPILED TABLES
+# =====================================================
+
+@dataclass(frozen=True)
+class SlabTable:
+    """Compiled slabs of one FY / regime / age group"""
+    fy: str
+    regime: str
+    age_group: str
+    lowers: Tuple[float, ...]       # lower bound of each bracket
+    uppers: Tuple[float, ...]       # upper bound (inf for the top bracket)
+    rates: Tuple[float, ...]
+    cumulative: Tuple[float, ...]   # tax on income up to each lower bound
+    rebate_limit: float
+    rebate_max: float
+
+    def _index(self, income: float) -> int:
+        # Bracket containing income, with brackets read as (lower, upper]
+        return bisect_left(self.uppers, income)
+
+    def tax(self, taxable_income: float) -> float:
+        """Slab tax before rebate and cess"""
+        income = max(0.0, taxable_income)
+        i = self._index(income)
+        return self.cumulative[i] + (income - self.lowers[i]) * self.rates[i]
+
+    def rebate(self, taxable_income: float, tax: float) -> float:
+        """Section 87A rebate on `tax`"""
+        if taxable_income <= self.rebate_limit:
+            return min(tax, self.rebate_max)
+        return 0
+
+    def breakdown(self, taxable_income: float) -> List[Dict]:
+        """Per-slab tax up to the bracket containing the income"""
+        income = max(0.0, taxable_income)
+        slabs = []
+        for i in range(self._index(income) + 1):
+            lower, upper, rate = self.lowers[i], self.uppers[i], self.rates[i]
+            if upper == float('inf'):
+                label = f'Above {format_inr(lower)}'
+            else:
+                label = f'{format_inr(lower + 1) if lower else 0} - {format_inr(upper)}'
+            slabs.append({
+                'range': label,
+                'rate': f'{rate * 100:g}%',
+                'tax': (min(income, upper) - lower) * rate
+            })
+        return slabs
+
+
+def _compile(fy: str, regime: str, age_group: str, rules: Dict) -> SlabTable:
+    exemption = float(rules.get('exemption', {}).get(age_group, 0))
+    brackets = ([(exemption, 0.0)] if exemption else []) + [
+        (float('inf') if upper is None else float(upper), rate) for upper, rate in rules['brackets']]
+    lowers, uppers, rates, cumulative = [], [], [], []
+    lower, total = 0.0, 0.0
+    for upper, rate in brackets:
+        if upper <= lower:
+            continue  # swallowed by a higher exemption (e.g. 5L for super seniors)
+        lowers.append(lower)
+        uppers.append(upper)
+        rates.append(rate)
+        cumulative.append(total)
+        if upper != float('inf'):
+            total += (upper - lower) * rate
+        lower = upper
+    return SlabTable(fy, regime, age_group, tuple(lowers), tuple(uppers), tuple(rates), tuple(cumulative),
+                     float(rules['rebate']['limit']), float(rules['rebate']['max']))
+
+
+_TABLES: Dict[Tuple[str, str, str], SlabTable] = {
+    (fy, regime, age_group): _compile(fy, regime, age_group, rules)
+    for fy, regimes in SLAB_RULES.items()
+    for regime, rules in regimes.items()
+    for age_group in AGE_GROUPS
+}
+
+
+class TaxSlabEngine:
+    """Lookup of compiled slab tables"""
+
+    @staticmethod
+    def table(regime: str = 'new', age_group: str = 'below_60', fy: Optional[str] = None) -> SlabTable:
+        """Slab table for a regime; unknown age groups use the below-60 slabs"""
+        fy = fy or DEFAULT_FY
+        if fy not in SLAB_RULES:
+            raise ValueError(f"Unsupported financial year: {fy}")
+        regime = 'old' if regime == 'old' else 'new'
+        if age_group not in AGE_GROUPS:
+            age_group = 'below_60'
+        return _TABLES[(fy, regime, age_group)]
+
+    @staticmethod
+    def financial_years() -> List[str]:
+        return list(SLAB_RULES)
+
+    @staticmethod
+    def tax_payable(taxable_income: float, regime: str = 'new', age_group: str = 'below_60',
+                    fy: Optional[str] = None) -> float:
+        """Slab tax less 87A rebate, plus cess"""
+        table = TaxSlabEngine.table(regime, age_group, fy)
+        tax = table.tax(taxable_income)
+        tax -= table.rebate(taxable_income, tax)
+        return tax * (1 + CESS_RATE)
+
+
+__all__ = ['CESS_RATE', 'DEFAULT_FY', 'SLAB_RULES', 'SlabTable', 'TaxSlabEngine', 'format_inr']
@@ -4,9 +4,12 @@ Handles all tax and financial service bookings, calculators, and tools
 Author: Sumeet Sangwan
 """
 
-from flask import Blueprint, render_template, request, jsonify, redirect, url_for, flash
+from flask import (Blueprint, Response, current_app, render_template, request, jsonify, redirect,
+                   stream_with_context, url_for, flash)
 from flask_login import login_required, current_user
 from datetime import datetime
+import json
+import os
 import uuid
 
 from finucity.services import (
@@ -18,8 +21,17 @@ from finucity.services import (
     TaxAI
 )
 from finucity.database import get_supabase
+from finucity.services.tax_slabs import DEFAULT_FY
+from finucity.services import calculator_batch
+from finucity.services.regime_sweep import RegimeSweep, SweepGrid
+from finucity.bulk import BulkWriter, bulk_buffer
+from finucity.ca_ecosystem_routes import rate_limit
 from finucity.ai import FinucityAI
 
+CALC_BATCH_MAX_ITEMS = int(os.getenv('CALC_BATCH_MAX_ITEMS', '10000'))
+CALC_BATCH_RATE_LIMIT = int(os.getenv('CALC_BATCH_RATE_LIMIT', '20'))  # batches per client per minute
+SWEEP_RATE_LIMIT = int(os.getenv('SWEEP_RATE_LIMIT', '30'))  # sweeps per client per minute
+
 services_bp = Blueprint('services', __name__, url_prefix='/services')
 calculators_bp = Blueprint('calculators', __name__, url_prefix='/calculators')
 
@@ -269,20 +281,20 @@ def calculate_income_tax():
             income=float(data.get('income', 0)),
             age_group=data.get('age_group', 'below_60'),
             regime=data.get('regime', 'new'),
-            deductions=data.get('deductions', {})
+            deductions=data.get('deductions', {}),
+            fy=data.get('financial_year') or DEFAULT_FY
         )
         
         # Save to history if user logged in
         if current_user.is_authenticated:
             try:
-                supabase = get_supabase()
-                supabase.table('calculator_history').insert({
+                bulk_buffer.add('calculator_history', {
                     'user_id': current_user.id,
                     'calculator_type': 'income_tax',
                     'input_data': data,
                     'output_data': result,
                     'financial_year': f"{datetime.now().year}-{str(datetime.now().year + 1)[-2:]}"
-                }).execute()
+                })
             except:
                 pass  # Don't fail if history save fails
         
@@ -346,7 +358,12 @@ def calculate_sip():
         result = calculators.sip_calculator(
             monthly_investment=float(data.get('monthly_investment', 0)),
             expected_return_annual=float(data.get('expected_return', 12)),
-            tenure_years=int(data.get('tenure_years', 10))
+            tenure_years=int(data.get('tenure_years', 10)),
+            step_up_percent=float(data.get('step_up_percent', 0)),
+            step_up_amount=float(data.get('step_up_amount', 0)),
+            top_ups=data.get('top_ups'),
+            pauses=data.get('pauses'),
+            granularity=data.get('granularity', 'yearly')
         )
         return jsonify(result)
     except Exception as e:
@@ -424,12 +441,86 @@ def compare_tax_regime():
         data = request.json
         result = tax_planner.compare_tax_regimes(
             income=float(data.get('income', 0)),
-            deductions=data.get('deductions', {})
+            deductions=data.get('deductions', {}),
+            fy=data.get('financial_year') or DEFAULT_FY
         )
         return jsonify(result)
     except Exception as e:
         return jsonify({'error': str(e)}), 400
 
+@calculators_bp.route('/api/tax-regime/sweep', methods=['GET', 'POST'])
+@rate_limit(max_requests=SWEEP_RATE_LIMIT, window=60)
+def tax_regime_sweep():
+    """API: Old vs new regime savings over an income x deduction grid (heatmap)"""
+    try:
+        params = request.get_json(silent=True) if request.method == 'POST' else None
+        grid = SweepGrid.from_params(params or request.args)
+    except (TypeError, ValueError) as e:
+        return jsonify({'success': False, 'error': str(e)}), 400
+    response = Response(RegimeSweep.payload(grid), mimetype='application/json')
+    response.headers['Cache-Control'] = 'public, max-age=3600'
+    return response
+
+def _batch_items():
+    """(items, default calculator) from a JSON body, a CSV/NDJSON body or a CSV/NDJSON upload"""
+    default = request.args.get('calculator')
+    upload = request.files.get('file')
+    if upload is not None:
+        text = upload.read().decode('utf-8-sig')
+        kind = upload.filename.rsplit('.', 1)[-1].lower() if upload.filename else ''
+        if kind in ('ndjson', 'jsonl') or upload.mimetype in ('application/x-ndjson', 'application/jsonl'):
+            return calculator_batch.parse_ndjson(text), default or request.form.get('calculator')
+        return calculator_batch.parse_csv(text), default or request.form.get('calculator')
+    if request.mimetype == 'text/csv':
+        return calculator_batch.parse_csv(request.get_data(as_text=True)), default
+    if request.mimetype in ('application/x-ndjson', 'application/jsonl'):
+        return calculator_batch.parse_ndjson(request.get_data(as_text=True)), default
+    data = request.get_json()
+    if isinstance(data, dict):
+        return data.get('items'), default or data.get('calculator')
+    return data, default
+
+@calculators_bp.route('/api/batch', methods=['POST'])
+@rate_limit(max_requests=CALC_BATCH_RATE_LIMIT, window=60)
+def calculate_batch():
+    """API: Evaluate many calculator invocations; streams one NDJSON line per item, then a summary"""
+    try:
+        items, default = _batch_items()
+    except Exception as e:
+        return jsonify({'error': f'Could not read batch: {e}'}), 400
+    if not isinstance(items, list) or not items:
+        return jsonify({'error': 'Expected a non-empty list of items'}), 400
+    if len(items) > CALC_BATCH_MAX_ITEMS:
+        return jsonify({'error': f'Batch too large (max {CALC_BATCH_MAX_ITEMS} items)'}), 413
+    
+    outcomes = calculator_batch.evaluate(items, default)
+    
+    def generate():
+        failed = 0
+        for outcome in outcomes:
+            failed += 'error' in outcome
+            yield json.dumps(outcome) + '\n'
+        
+        summary = {'items': len(outcomes), 'succeeded': len(outcomes) - failed, 'failed': failed}
+        # Income tax results go to history like /api/income-tax, as one bulk insert
+        if current_user.is_authenticated:
+            year = datetime.now().year
+            history = [{
+                'user_id': current_user.id,
+                'calculator_type': 'income_tax',
+                'input_data': items[outcome['index']],
+                'output_data': outcome['result'],
+                'financial_year': f"{year}-{str(year + 1)[-2:]}"
+            } for outcome in outcomes if outcome['calculator'] == 'income_tax' and 'result' in outcome]
+            if history:
+                try:
+                    summary['history'] = BulkWriter.insert('calculator_history', history).to_dict()
+                except Exception as e:
+                    current_app.logger.error(f"Batch history insert failed: {e}")
+        yield json.dumps({'summary': summary}) + '\n'
+    
+    return Response(stream_with_context(generate()), mimetype='application/x-ndjson')
+
 # =====================================================
 # AI-POWERED FEATURES
 # =====================================================
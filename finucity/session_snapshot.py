@@ -0,0 +1,231 @@
+"""
+Session Profile Snapshot - identity without a profile read per request
+Flask-Login calls load_user on every authenticated request. With
+ENABLE_SESSION_SNAPSHOT on, the fields pages need (id, email, username,
+names, role, is_active, email_verified, history cutoff, CA status and
+verification) are kept in the session as a compact signed token, and
+load_user rebuilds the user from it without touching Supabase.
+
+- Versioned: every token carries the user's session version. Profile
+  writes bump that version (UserService.invalidate_cache: role changes,
+  suspension, CA approval, names, history clears, logout), so the next
+  request of every session of that user sees a mismatch and reloads.
+- Versions live next to the profile (profiles.session_version, see
+  PERFORMANCE_MIGRATIONS.sql PART 6), so every host sees a bump and a
+  restart cannot reset them. Reads go through a per-worker TTLCache:
+  the worker that wrote sees the bump at once, other workers and hosts
+  within SESSION_VERSION_TTL seconds (the profile cache's bound), and a
+  miss is a one-column primary-key read. Tokens also expire after
+  SESSION_SNAPSHOT_MAX_AGE seconds.
+- Without the column (migration not applied) no snapshot is issued or
+  accepted; load_user reads the profile as before.
+- Reloads read the profile uncached, and the version is read before the
+  profile, so a write racing the reload can only make the new token stale,
+  never make a stale profile look current.
+- Fields outside the snapshot (phone, city, last_login...) still work:
+  the first access loads the full profile for that request.
+Author: Sumeet Sangwan
+"""
+
+import os
+import time
+from typing import Any, Dict, Optional
+
+from flask import current_app, session
+from flask_login import user_logged_in, user_logged_out
+from itsdangerous import BadSignature, SignatureExpired, URLSafeTimedSerializer
+from postgrest import APIError
+
+from finucity.cache import TTLCache
+from finucity.database import UserService, supabase_db
+from finucity.metrics import metrics
+from finucity.models import User
+from finucity.rows import _UNDEFINED_COLUMN_CODES
+
+SESSION_VERSION_TTL = float(os.getenv('SESSION_VERSION_TTL', '30'))  # seconds
+SESSION_SNAPSHOT_MAX_AGE = int(os.getenv('SESSION_SNAPSHOT_MAX_AGE', '900'))  # seconds
+SESSION_KEY = '_profile'
+
+# Profile fields carried in the token (everything templates and decorators read per request)
+SNAPSHOT_FIELDS = ('id', 'email', 'username', 'first_name', 'last_name', 'role',
+                   'is_active', 'email_verified', 'history_cleared_at', 'ca_status', 'verification_status')
+
+# User attributes that need the full profile
+_LAZY_FIELDS = frozenset(('phone', 'profession', 'city', 'state', 'created_at', 'last_login', 'last_seen'))
+
+
+class SessionVersions:
+    """Per-user session versions in profiles.session_version, cached per worker"""
+
+    def __init__(self, ttl: float = SESSION_VERSION_TTL):
+        self.cache = TTLCache('session_versions', ttl=ttl, negative_ttl=min(ttl, 5.0))
+
+    @staticmethod
+    def _fetch(user_id: str) -> Optional[int]:
+        sb = supabase_db.get_client()
+        try:
+            result = sb.table('profiles').select('session_version').eq('id', user_id).limit(1).execute()
+        except APIError as e:
+            if str(getattr(e, 'code', '')) not in _UNDEFINED_COLUMN_CODES:
+                raise
+            current_app.logger.warning("profiles.session_version is missing: session snapshots are off")
+            return None
+        if not result.data:
+            return None
+        return result.data[0].get('session_version') or 0
+
+    def get(self, user_id: str) -> Optional[int]:
+        """Current version, or None when it cannot be known (no profile or no column)"""
+        return self.cache.get_or_load(str(user_id), lambda: self._fetch(str(user_id)))
+
+    def bump(self, user_id: str) -> int:
+        # Tokens are compared for equality only: a fresh timestamp is a new version
+        # without a read-modify-write race between hosts
+        version = time.time_ns()
+        try:
+            supabase_db.get_client().table('profiles')\
+                .update({'session_version': version})\
+                .eq('id', str(user_id))\
+                .execute()
+        finally:
+            self.cache.invalidate(str(user_id))
+        return version
+
+
+class SnapshotUser(User):
+    """User rebuilt from a snapshot; fields outside it load the full profile on first access"""
+
+    def __init__(self, snapshot: Dict[str, Any]):
+        super().__init__(snapshot)
+        for name in _LAZY_FIELDS:
+            del self.__dict__[name]  # route these through __getattr__
+        self._full_loaded = False
+
+    def _load_full(self):
+        self._full_loaded = True
+        profile = UserService.get_by_id(self.id)
+        data = profile.to_dict() if profile else {}
+        data.update((k, v) for k, v in self._data.items() if k in SNAPSHOT_FIELDS)
+        super().__init__(data)  # identity fields stay as the session saw them
+
+    def __getattr__(self, name: str):
+        if name in _LAZY_FIELDS and not self.__dict__.get('_full_loaded', True):
+            self._load_full()
+            return getattr(self, name)
+        raise AttributeError(name)
+
+    def to_dict(self) -> Dict[str, Any]:
+        if not self._full_loaded:
+            self._load_full()
+        return self._data
+
+
+class SessionSnapshots:
+    """Issues and verifies session snapshots for the Flask-Login user loader"""
+
+    def __init__(self, app=None, versions: Optional[SessionVersions] = None):
+        self.app = None
+        self.versions = versions or SessionVersions()
+        self.stats = {'hits': 0, 'issued': 0, 'stale': 0, 'expired': 0, 'invalid': 0, 'bumps': 0}
+        if app:
+            self.init_app(app)
+
+    def init_app(self, app):
+        self.app = app
+        app.extensions['session_snapshots'] = self
+        UserService.register_invalidator(self.bump)
+        # A fresh login always starts from a fresh profile; logout drops the token
+        user_logged_in.connect(self._drop, app)
+        user_logged_out.connect(self._drop, app)
+        metrics.register_collector(self.metric_samples)
+
+    @property
+    def enabled(self) -> bool:
+        if self.app is None:
+            return False
+        return bool(self.app.config.get('ENABLE_SESSION_SNAPSHOT', False))
+
+    def _serializer(self) -> URLSafeTimedSerializer:
+        return URLSafeTimedSerializer(current_app.secret_key, salt='finucity.session-snapshot')
+
+    @staticmethod
+    def _drop(sender, user=None, **extra):
+        session.pop(SESSION_KEY, None)
+
+    def bump(self, user_id: str):
+        """Invalidate every snapshot of a user (registered as a profile invalidator)"""
+        if not self.enabled:
+            return  # no snapshots to invalidate: skip the profiles write
+        try:
+            self.versions.bump(user_id)
+            self.stats['bumps'] += 1
+        except Exception as e:
+            current_app.logger.error(f"Session version bump failed for {user_id}: {e}")
+
+    def _read(self, user_id: str) -> Optional[Dict[str, Any]]:
+        token = session.get(SESSION_KEY)
+        if not token:
+            return None
+        try:
+            snapshot = self._serializer().loads(token, max_age=SESSION_SNAPSHOT_MAX_AGE)
+        except SignatureExpired:
+            self.stats['expired'] += 1
+            return None
+        except BadSignature:
+            self.stats['invalid'] += 1
+            return None
+        if snapshot.get('id') != str(user_id):
+            self.stats['invalid'] += 1
+            return None
+        version = self.versions.get(user_id)
+        if version is None or snapshot.pop('v', None) != version:
+            self.stats['stale'] += 1
+            return None
+        return snapshot
+
+    def load_user(self, user_id: str) -> Optional[User]:
+        """Flask-Login user loader: snapshot when current, else one uncached profile read"""
+        try:
+            snapshot = self._read(user_id)
+        except Exception as e:
+            current_app.logger.error(f"Session version lookup failed: {e}")
+            snapshot = None
+        if snapshot is not None:
+            self.stats['hits'] += 1
+            metrics.inc('finucity_session_snapshot_total', help='Session user loads', result='hit')
+            return SnapshotUser(snapshot)
+
+        metrics.inc('finucity_session_snapshot_total', help='Session user loads', result='reload')
+        try:
+            version = self.versions.get(user_id)  # read before the profile (see module docstring)
+        except Exception:
+            version = None
+        try:
+            profile = UserService._fetch_by_id(user_id)
+        except Exception as e:
+            current_app.logger.error(f"Error loading user {user_id}: {e}")
+            return None
+        if profile is None:
+            session.pop(SESSION_KEY, None)
+            return None
+        user = User(profile)
+        if version is not None:
+            snapshot = {name: user._data.get(name) for name in SNAPSHOT_FIELDS if user._data.get(name) is not None}
+            snapshot['id'], snapshot['v'] = str(user.id), version
+            session[SESSION_KEY] = self._serializer().dumps(snapshot)
+            self.stats['issued'] += 1
+        return user
+
+    def metric_samples(self):
+        """Samples for finucity.metrics collectors"""
+        for outcome in ('stale', 'expired', 'invalid'):
+            yield ('finucity_session_snapshot_rejected_total', 'counter', 'Snapshots that forced a profile reload',
+                   self.stats[outcome], {'reason': outcome})
+        yield ('finucity_session_version_bumps_total', 'counter', 'Session version bumps', self.stats['bumps'], {})
+        yield from self.versions.cache.metric_samples()
+
+
+# Global instance
+session_snapshots = SessionSnapshots()
+
+__all__ = ['SessionSnapshots', 'SessionVersions', 'SnapshotUser', 'session_snapshots']
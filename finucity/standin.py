@@ -0,0 +1,945 @@
+"""
+Supabase Stand-in - PostgREST, Storage and Auth over SQLite
+A local replacement for the Supabase project so load tests and benchmarks
+run offline and reproducibly. It speaks the PostgREST wire protocol as an
+httpx transport, so the real postgrest builders, the pooled client manager,
+retries, identity map, query tracing and bulk writes all run unchanged.
+
+Enable with SUPABASE_URL=sqlite:// (in memory, per process) or
+SUPABASE_URL=sqlite:///instance/standin.sqlite (file, shared by workers).
+The Supabase keys app.py checks for can be placeholders; none are sent.
+
+- Relations are schemaless JSON rows created on first write; the views
+  declared in the repo's *.sql files answer 42P01 and unknown RPCs answer
+  PGRST202, so code paths with Python fallbacks take them.
+- UNIQUE constraints (DEFAULT_UNIQUE, add_unique()) answer 23505.
+- Latency and failures are injected per operation (read / write / rpc /
+  storage / auth): STANDIN_LATENCY_MS="read=5,write=12,rpc=20",
+  STANDIN_JITTER=0.2, STANDIN_ERROR_RATE="read=0.01" or configure().
+
+Supported: select (columns, alias:col, col::cast, embedded resources),
+eq/neq/gt/gte/lt/lte/like/ilike/match/imatch/in/is with not., or/and trees, order
+(nulls first/last), limit/offset/Range, count=exact, single(), insert,
+upsert (merge/ignore duplicates, on_conflict), update, delete, rpc.
+Author: Sumeet Sangwan
+"""
+
+import glob
+import hashlib
+import json
+import operator
+import os
+import random
+import re
+import sqlite3
+import threading
+import time
+import uuid
+from contextlib import contextmanager
+from datetime import datetime, timezone
+from types import SimpleNamespace
+from typing import Any, Callable, Dict, Iterable, List, Optional, Tuple
+
+import httpx
+from httpx import Headers, QueryParams
+from gotrue.errors import AuthApiError
+from postgrest import SyncRequestBuilder, SyncRPCFilterRequestBuilder
+from storage3.utils import StorageException
+
+STANDIN_LATENCY_MS = os.getenv('STANDIN_LATENCY_MS', '')   # "read=5,write=12" or "10" for every operation
+STANDIN_JITTER = float(os.getenv('STANDIN_JITTER', '0'))    # +/- fraction of the latency
+STANDIN_ERROR_RATE = os.getenv('STANDIN_ERROR_RATE', '')   # "read=0.01" or "0.01"
+STANDIN_SEED = os.getenv('STANDIN_SEED')
+
+STANDIN_BASE_URL = 'http://standin.local'
+OPERATIONS = ('read', 'write', 'rpc', 'storage', 'auth')
+
+# UNIQUE constraints from the SQL setup scripts that application code relies on
+DEFAULT_UNIQUE = {
+    'profiles': [('email',), ('username',)],
+    'ca_ledger_entries': [('ca_id', 'seq')],
+    'ca_ledger_snapshots': [('ca_id', 'seq')],
+}
+
+# Query-string keys that are not row filters
+_RESERVED_PARAMS = {'select', 'order', 'limit', 'offset', 'on_conflict', 'columns'}
+_REPO_ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+_VIEW_RE = re.compile(r'CREATE\s+(?:OR\s+REPLACE\s+)?(?:MATERIALIZED\s+)?VIEW\s+(?:IF\s+NOT\s+EXISTS\s+)?'
+                      r'(?:public\.)?"?(\w+)"?', re.IGNORECASE)
+_TIMESTAMP_RE = re.compile(r'^\d{4}-\d{2}-\d{2}([T ]\d{2}:\d{2}(:\d{2}(\.\d+)?)?)?(Z|[+-]\d{2}(:?\d{2})?)?$')
+_EMBED_RE = re.compile(r'^(?:(\w+):)?(\w+)((?:!\w+)*)\((.*)\)$', re.DOTALL)
+_OBJECT_MIME = 'application/vnd.pgrst.object+json'
+
+
+def is_standin_url(url: Optional[str]) -> bool:
+    return bool(url) and url.startswith('sqlite:')
+
+
+def sql_views(root: str = _REPO_ROOT) -> set:
+    """Names of the views created by the *.sql scripts in `root`"""
+    names = set()
+    for path in glob.glob(os.path.join(root, '*.sql')):
+        try:
+            with open(path, encoding='utf-8', errors='ignore') as f:
+                names.update(name.lower() for name in _VIEW_RE.findall(f.read()))
+        except OSError:
+            continue
+    return names
+
+
+def _parse_per_op(spec: str, scale: float = 1.0) -> Dict[str, float]:
+    """'read=5,write=10' -> {'read': 5 * scale, ...}; a bare number applies to every operation"""
+    values = {}
+    for part in filter(None, (p.strip() for p in (spec or '').split(','))):
+        if '=' in part:
+            op, value = part.split('=', 1)
+            values[op.strip()] = float(value) * scale
+        else:
+            values.update({op: float(part) * scale for op in OPERATIONS})
+    return values
+
+
+class StandInError(Exception):
+    """A PostgREST-shaped error response"""
+
+    def __init__(self, status: int, code: str, message: str, details: Optional[str] = None,
+                 hint: Optional[str] = None):
+        super().__init__(message)
+        self.status = status
+        self.code = code
+        self.message = message
+        self.details = details
+        self.hint = hint
+
+    def body(self) -> Dict[str, Any]:
+        return {'code': self.code, 'message': self.message, 'details': self.details, 'hint': self.hint}
+
+
+# =====================================================================
+# FILTER GRAMMAR (PostgREST query strings)
+# =====================================================================
+
+def _split_top(text: str, sep: str = ',') -> List[str]:
+    """Split on `sep` outside parentheses and double quotes"""
+    parts, current, depth, quoted, escaped = [], [], 0, False, False
+    for ch in text:
+        if escaped:
+            escaped = False
+        elif ch == '\\' and quoted:
+            escaped = True
+        elif ch == '"':
+            quoted = not quoted
+        elif not quoted and ch in '({':
+            depth += 1
+        elif not quoted and ch in ')}':
+            depth -= 1
+        elif not quoted and depth == 0 and ch == sep:
+            parts.append(''.join(current))
+            current = []
+            continue
+        current.append(ch)
+    if current or parts:
+        parts.append(''.join(current))
+    return parts
+
+
+def _unquote(value: str) -> str:
+    if len(value) >= 2 and value[0] == value[-1] == '"':
+        return value[1:-1].replace('\\"', '"').replace('\\\\', '\\')
+    return value
+
+
+def _timestamp(text: str) -> Optional[datetime]:
+    try:
+        moment = datetime.fromisoformat(text.replace(' ', 'T', 1))
+    except ValueError:
+        return None
+    return moment if moment.tzinfo else moment.replace(tzinfo=timezone.utc)
+
+
+def _coerce(raw: str, stored: Any) -> Any:
+    """The filter literal typed like the stored value, as Postgres would cast it"""
+    raw = _unquote(raw)
+    if isinstance(stored, bool):
+        return raw.lower() in ('true', 't', '1', 'yes', 'on')
+    if isinstance(stored, (int, float)):
+        try:
+            return int(raw) if isinstance(stored, int) and re.fullmatch(r'-?\d+', raw) else float(raw)
+        except ValueError:
+            return raw
+    if isinstance(stored, (dict, list)):
+        try:
+            return json.loads(raw)
+        except ValueError:
+            return raw
+    return raw
+
+
+def _comparable(stored: Any, value: Any) -> Tuple[Any, Any]:
+    if isinstance(stored, str) and isinstance(value, str) and \
+            _TIMESTAMP_RE.match(stored) and _TIMESTAMP_RE.match(value):
+        left, right = _timestamp(stored), _timestamp(value)
+        if left is not None and right is not None:
+            return left, right
+    return stored, value
+
+
+def _comparison(compare: Callable[[Any, Any], bool]) -> Callable[[Any, str], bool]:
+    def test(stored: Any, raw: str) -> bool:
+        try:
+            return compare(*_comparable(stored, _coerce(raw, stored)))
+        except TypeError:
+            return False
+    return test
+
+
+def _like(flags: int) -> Callable[[Any, str], bool]:
+    def test(stored: Any, raw: str) -> bool:
+        pattern = ''.join('.*' if c in '*%' else '.' if c == '_' else re.escape(c) for c in _unquote(raw))
+        return re.fullmatch(pattern, str(stored), flags | re.DOTALL) is not None
+    return test
+
+
+def _match(flags: int) -> Callable[[Any, str], bool]:
+    def test(stored: Any, raw: str) -> bool:
+        return re.search(_unquote(raw), str(stored), flags) is not None
+    return test
+
+
+def _in(stored: Any, raw: str) -> bool:
+    raw = raw.strip()
+    if raw.startswith('(') and raw.endswith(')'):
+        raw = raw[1:-1]
+    equals = _OPERATORS['eq']
+    return any(equals(stored, item) for item in _split_top(raw) if item != '')
+
+
+def _is(stored: Any, raw: str) -> bool:
+    literal = raw.lower()
+    if literal in ('null', 'unknown'):
+        return stored is None
+    if literal in ('true', 'false'):
+        return stored is (literal == 'true')
+    raise StandInError(400, 'PGRST100', f'"failed to parse filter (is.{raw})"')
+
+
+_OPERATORS: Dict[str, Callable[[Any, str], bool]] = {
+    'eq': _comparison(operator.eq),
+    'neq': _comparison(operator.ne),
+    'gt': _comparison(operator.gt),
+    'gte': _comparison(operator.ge),
+    'lt': _comparison(operator.lt),
+    'lte': _comparison(operator.le),
+    'like': _like(0),
+    'ilike': _like(re.IGNORECASE),
+    'match': _match(0),
+    'imatch': _match(re.IGNORECASE),
+    'in': _in,
+}
+
+Predicate = Callable[[Dict[str, Any]], bool]
+
+
+def _predicate(column: str, expression: str) -> Predicate:
+    """`column=[not.]op.value` as a row test with SQL NULL semantics"""
+    negate = expression.startswith('not.')
+    if negate:
+        expression = expression[4:]
+    op, _, raw = expression.partition('.')
+    if op != 'is' and op not in _OPERATORS:
+        raise StandInError(400, 'PGRST100', f'"failed to parse filter ({expression})"',
+                           hint=f'operator {op!r} is not supported by the stand-in')
+    if op == 'is':
+        _is(None, raw)  # validate the literal up front
+
+    def test(row: Dict[str, Any]) -> bool:
+        stored = row.get(column)
+        if op == 'is':
+            return _is(stored, raw) != negate
+        if stored is None:
+            return False  # NULL compares unknown, negated or not
+        return _OPERATORS[op](stored, raw) != negate
+    return test
+
+
+def _logic(kind: str, text: str) -> Predicate:
+    """or=(a.eq.1,and(b.gt.2,c.is.null)) and friends"""
+    negate = kind.startswith('not.')
+    kind = kind[4:] if negate else kind
+    text = text.strip()
+    if not (text.startswith('(') and text.endswith(')')):
+        raise StandInError(400, 'PGRST100', f'"failed to parse logic tree ({text})"')
+    tests = []
+    for item in _split_top(text[1:-1]):
+        item = item.strip()
+        nested = re.match(r'^(not\.)?(and|or)(\(.*\))$', item, re.DOTALL)
+        if nested:
+            tests.append(_logic((nested.group(1) or '') + nested.group(2), nested.group(3)))
+        else:
+            column, _, expression = item.partition('.')
+            tests.append(_predicate(column, expression))
+    combine = any if kind == 'or' else all
+    return lambda row: combine(test(row) for test in tests) != negate
+
+
+def _filters(params: QueryParams) -> Tuple[List[Predicate], List[Tuple[str, str]]]:
+    """Row predicates, plus the plain eq filters SQLite can pre-select on"""
+    tests, equalities = [], []
+    for key, value in params.multi_items():
+        if key in _RESERVED_PARAMS or key.endswith('.order') or key.endswith('.limit'):
+            continue
+        if key in ('or', 'and', 'not.or', 'not.and'):
+            tests.append(_logic(key, value))
+            continue
+        if '.' in key:
+            raise StandInError(400, 'PGRST100', f'"failed to parse filter ({key})"',
+                               hint='filters on embedded resources are not supported by the stand-in')
+        tests.append(_predicate(key, value))
+        if value.startswith('eq.') and not _TIMESTAMP_RE.match(_unquote(value[3:])):
+            equalities.append((key, _unquote(value[3:])))
+    return tests, equalities
+
+
+def _sort_key(value: Any):
+    if isinstance(value, (bool, int, float)):
+        return (0, float(value))
+    if isinstance(value, str):
+        moment = _timestamp(value) if _TIMESTAMP_RE.match(value) else None
+        return (1, moment.timestamp()) if moment else (2, value)
+    return (3, json.dumps(value, sort_keys=True, default=str))
+
+
+def _sort(rows: List[Dict], orders: Iterable[str]) -> List[Dict]:
+    specs = []
+    for param in orders:
+        for term in param.split(','):
+            column, *modifiers = term.strip().split('.')
+            desc = 'desc' in modifiers
+            nulls_first = 'nullsfirst' in modifiers or (desc and 'nullslast' not in modifiers)
+            specs.append((column, desc, nulls_first))
+    for column, desc, nulls_first in reversed(specs):  # stable sorts, least significant key first
+        present = [row for row in rows if row.get(column) is not None]
+        missing = [row for row in rows if row.get(column) is None]
+        present.sort(key=lambda row: _sort_key(row[column]), reverse=desc)
+        rows = missing + present if nulls_first else present + missing
+    return rows
+
+
+def _singular(name: str) -> str:
+    return name[:-1] if name.endswith('s') else name
+
+
+# =====================================================================
+# DATABASE
+# =====================================================================
+
+class StandIn:
+    """One SQLite-backed database; thread-safe, shared by every client in the process"""
+
+    def __init__(self, path: str = ':memory:', views: Optional[Iterable[str]] = None,
+                 unique: Optional[Dict[str, List[Tuple[str, ...]]]] = None, seed: Optional[int] = None):
+        self.path = path
+        self.views = set(sql_views() if views is None else views)
+        self.unique = {table: list(keys) for table, keys in (DEFAULT_UNIQUE if unique is None else unique).items()}
+        self._rpcs: Dict[str, Callable[[Dict], Any]] = {}
+        self._view_sources: Dict[str, Callable[['StandIn'], List[Dict]]] = {}
+        self._lock = threading.RLock()
+        self._random = random.Random(seed)
+        self.latency: Dict[str, float] = _parse_per_op(STANDIN_LATENCY_MS, scale=0.001)
+        self.jitter = STANDIN_JITTER
+        self.error_rate: Dict[str, float] = _parse_per_op(STANDIN_ERROR_RATE)
+        self.error_status = 503
+        self.error_code = 'PGRST001'
+        self.error_mode = 'status'
+        self._fail_next: List[Dict[str, Any]] = []
+        self.stats: Dict[str, Any] = {'requests': {}, 'injected_errors': 0, 'injected_seconds': 0.0}
+
+        if path != ':memory:' and os.path.dirname(path):
+            os.makedirs(os.path.dirname(path), exist_ok=True)
+        self._conn = sqlite3.connect(path, check_same_thread=False, isolation_level=None)
+        if path != ':memory:':
+            self._conn.execute('PRAGMA journal_mode=WAL')
+            self._conn.execute('PRAGMA busy_timeout=5000')
+        self._conn.executescript("""
+            CREATE TABLE IF NOT EXISTS rows (
+                rid INTEGER PRIMARY KEY AUTOINCREMENT,
+                tbl TEXT NOT NULL,
+                doc TEXT NOT NULL
+            );
+            CREATE INDEX IF NOT EXISTS rows_tbl ON rows (tbl);
+            CREATE TABLE IF NOT EXISTS objects (
+                bucket TEXT NOT NULL,
+                path TEXT NOT NULL,
+                content BLOB NOT NULL,
+                content_type TEXT,
+                created_at TEXT NOT NULL,
+                PRIMARY KEY (bucket, path)
+            );
+            CREATE TABLE IF NOT EXISTS auth_users (
+                id TEXT PRIMARY KEY,
+                email TEXT UNIQUE NOT NULL,
+                password_hash TEXT NOT NULL,
+                metadata TEXT NOT NULL,
+                created_at TEXT NOT NULL
+            );
+        """)
+
+    # ----- configuration -----
+
+    def configure(self, latency: Optional[Dict[str, float]] = None, jitter: Optional[float] = None,
+                  errors: Optional[Dict[str, float]] = None, error_status: Optional[int] = None,
+                  error_code: Optional[str] = None, error_mode: Optional[str] = None) -> 'StandIn':
+        """
+        Latency in seconds and error rates (0..1) per operation.
+        error_mode 'status' answers error_status/error_code; 'timeout'
+        raises httpx.ReadTimeout like a dropped connection would.
+        """
+        with self._lock:
+            if latency is not None:
+                self.latency = dict(latency)
+            if jitter is not None:
+                self.jitter = jitter
+            if errors is not None:
+                self.error_rate = dict(errors)
+            if error_status is not None:
+                self.error_status = error_status
+            if error_code is not None:
+                self.error_code = error_code
+            if error_mode is not None:
+                self.error_mode = error_mode
+        return self
+
+    def fail_next(self, count: int = 1, op: Optional[str] = None, status: Optional[int] = None,
+                  code: Optional[str] = None, mode: Optional[str] = None):
+        """Fail the next `count` operations (of kind `op`, or any)"""
+        with self._lock:
+            self._fail_next.extend({'op': op, 'status': status, 'code': code, 'mode': mode} for _ in range(count))
+
+    def add_unique(self, table: str, *columns: str):
+        self.unique.setdefault(table, []).append(tuple(columns))
+
+    def register_rpc(self, name: str, fn: Callable[[Dict], Any]):
+        """Serve POST /rpc/<name>; fn(params) returns the JSON result or raises StandInError"""
+        self._rpcs[name] = fn
+
+    def register_view(self, name: str, source: Callable[['StandIn'], List[Dict]]):
+        """Back a read-only relation (normally one of the SQL views) with source(standin)"""
+        self._view_sources[name] = source
+
+    def inject(self, op: str, request: Optional[httpx.Request] = None):
+        """Apply the configured latency, then maybe fail this operation"""
+        with self._lock:
+            counts = self.stats['requests']
+            counts[op] = counts.get(op, 0) + 1
+            delay = self.latency.get(op, 0.0)
+            if delay and self.jitter:
+                delay = max(0.0, delay * (1 + self._random.uniform(-self.jitter, self.jitter)))
+            failure = next((f for f in self._fail_next if f['op'] in (None, op)), None)
+            if failure is not None:
+                self._fail_next.remove(failure)
+            elif self._random.random() < self.error_rate.get(op, 0.0):
+                failure = {}
+            if failure is not None:
+                self.stats['injected_errors'] += 1
+            self.stats['injected_seconds'] += delay
+        if delay:
+            time.sleep(delay)
+        if failure is None:
+            return
+        if (failure.get('mode') or self.error_mode) == 'timeout':
+            raise httpx.ReadTimeout(f'stand-in: injected {op} timeout', request=request)
+        raise StandInError(failure.get('status') or self.error_status, failure.get('code') or self.error_code,
+                           f'stand-in: injected {op} failure')
+
+    # ----- row storage -----
+
+    def _load(self, table: str, equalities: Iterable[Tuple[str, str]] = ()) -> List[Tuple[int, Dict]]:
+        sql, args = 'SELECT rid, doc FROM rows WHERE tbl = ?', [table]
+        for column, value in equalities:
+            # Superset pre-selection; the Python predicates decide the exact match
+            candidates = [value]
+            if re.fullmatch(r'-?\d+(\.\d+)?', value):
+                candidates.append(float(value))
+            elif value.lower() in ('true', 'false'):
+                candidates.append(1 if value.lower() == 'true' else 0)
+            sql += f" AND json_extract(doc, ?) IN ({', '.join('?' * len(candidates))})"
+            args += [f'$."{column}"', *candidates]
+        with self._lock:
+            return [(rid, json.loads(doc)) for rid, doc in self._conn.execute(sql + ' ORDER BY rid', args)]
+
+    def _relation(self, table: str, equalities: Iterable[Tuple[str, str]] = ()) -> List[Tuple[int, Dict]]:
+        if table in self._view_sources:
+            return list(enumerate(self._view_sources[table](self)))
+        if table.lower() in self.views:
+            raise StandInError(404, '42P01', f'relation "public.{table}" does not exist')
+        return self._load(table, equalities)
+
+    def rows(self, table: str) -> List[Dict]:
+        """Every row of `table` in insertion order (for tests and benchmarks)"""
+        return [row for _, row in self._load(table)]
+
+    def seed(self, table: str, rows: Iterable[Dict]) -> List[Dict]:
+        """Insert rows directly, without latency, faults or constraint checks"""
+        stored = []
+        with self._lock, self._transaction():
+            for row in rows:
+                row = self._with_defaults(table, dict(row))
+                self._conn.execute('INSERT INTO rows (tbl, doc) VALUES (?, ?)',
+                                   (table, json.dumps(row, default=str)))
+                stored.append(row)
+        return stored
+
+    def reset(self):
+        with self._lock:
+            self._conn.executescript('DELETE FROM rows; DELETE FROM objects; DELETE FROM auth_users;')
+            self._fail_next.clear()
+
+    @contextmanager
+    def _transaction(self):
+        """One SQLite transaction; callers hold self._lock"""
+        self._conn.execute('BEGIN IMMEDIATE')
+        try:
+            yield self._conn
+        except BaseException:
+            self._conn.execute('ROLLBACK')
+            raise
+        self._conn.execute('COMMIT')
+
+    def _with_defaults(self, table: str, row: Dict) -> Dict:
+        if row.get('id') is None:
+            last = self._conn.execute(
+                "SELECT json_type(doc, '$.id'), json_extract(doc, '$.id') FROM rows WHERE tbl = ? "
+                "ORDER BY rid DESC LIMIT 1", (table,)).fetchone()
+            if last and last[0] == 'integer':
+                top = self._conn.execute("SELECT MAX(json_extract(doc, '$.id')) FROM rows WHERE tbl = ?",
+                                         (table,)).fetchone()[0]
+                row['id'] = int(top) + 1
+            else:
+                row['id'] = str(uuid.uuid4())
+        row.setdefault('created_at', datetime.now(timezone.utc).isoformat())
+        return row
+
+    def _check_unique(self, table: str, changed: List[Tuple[Optional[int], Dict]]):
+        """Raise 23505 if `changed` rows collide with each other or with stored rows"""
+        ignore = {rid for rid, _ in changed if rid is not None}
+        for columns in self.unique.get(table, ()):
+            seen = set()
+            for _, row in changed:
+                values = tuple(row.get(column) for column in columns)
+                if any(value is None for value in values):
+                    continue
+                clash = values in seen
+                if not clash:
+                    seen.add(values)
+                    sql = 'SELECT rid FROM rows WHERE tbl = ?' + \
+                          ''.join(' AND json_extract(doc, ?) = ?' for _ in columns)
+                    args = [table]
+                    for column, value in zip(columns, values):
+                        args += [f'$."{column}"', int(value) if isinstance(value, bool) else
+                                 value if isinstance(value, (str, int, float)) else json.dumps(value)]
+                    clash = any(rid not in ignore for (rid,) in self._conn.execute(sql, args))
+                if clash:
+                    name = f"{table}_{'_'.join(columns)}_key"
+                    raise StandInError(409, '23505', f'duplicate key value violates unique constraint "{name}"',
+                                       details=f"Key ({', '.join(columns)})=({', '.join(map(str, values))}) "
+                                               f"already exists.")
+
+    # ----- projection -----
+
+    def _project(self, table: str, row: Dict, select: str) -> Optional[Dict]:
+        """Apply a select list; None when an !inner embed is empty"""
+        items = [item.strip() for item in _split_top(select or '*') if item.strip()]
+        result: Dict[str, Any] = {}
+        for item in items:
+            if item == '*':
+                result.update(row)
+                continue
+            embed = _EMBED_RE.match(item)
+            if embed:
+                alias, target, hints, inner = embed.groups()
+                hints = [h for h in hints.split('!') if h]
+                value = self._embed(table, row, target, hints, inner)
+                if 'inner' in hints and not value:
+                    return None
+                result[alias or target] = value
+                continue
+            head = item.split('::')[0]
+            alias, _, column = head.partition(':') if ':' in head else ('', '', head)
+            result[alias or column] = row.get(column)
+        return result
+
+    def _embed(self, table: str, row: Dict, target: str, hints: List[str], select: str):
+        hints = [h for h in hints if h not in ('inner', 'left')]
+        parent_column = child_column = None
+        for hint in hints:
+            if hint in row:
+                parent_column = hint
+            elif hint.startswith(f'{table}_') and hint.endswith('_fkey'):
+                parent_column = hint[len(table) + 1:-len('_fkey')]
+            elif hint.startswith(f'{target}_') and hint.endswith('_fkey'):
+                child_column = hint[len(target) + 1:-len('_fkey')]
+        if parent_column is None and child_column is None:
+            for column in row:
+                stem = column[:-3] if column.endswith('_id') else None
+                if stem and (target.startswith(stem) or _singular(target).endswith(stem)):
+                    parent_column = column
+                    break
+            else:
+                if target == 'profiles' and 'user_id' in row:
+                    parent_column = 'user_id'
+                else:
+                    child_column = f'{_singular(table.split("_")[-1])}_id'
+        try:
+            if parent_column is not None:
+                if row.get(parent_column) is None:
+                    return None
+                matches = self._relation(target, [('id', str(row[parent_column]))])
+                found = next((r for _, r in matches if str(r.get('id')) == str(row[parent_column])), None)
+                return self._project(target, found, select) if found is not None else None
+            matches = self._relation(target, [(child_column, str(row.get('id')))])
+            return [p for p in (self._project(target, r, select) for _, r in matches
+                                if str(r.get(child_column)) == str(row.get('id'))) if p is not None]
+        except StandInError:
+            return None
+
+    # ----- PostgREST -----
+
+    def handle(self, method: str, path: str, params: QueryParams, headers: Headers,
+               body: Any) -> Tuple[int, Dict[str, str], Any]:
+        """One PostgREST request -> (status, headers, JSON body or None)"""
+        if path.startswith('/rpc/'):
+            return self._rpc(path[len('/rpc/'):], body if isinstance(body, dict) else {})
+        table = path.strip('/')
+        prefer = headers.get('prefer', '')
+        with self._lock:
+            if method in ('GET', 'HEAD'):
+                return self._read(table, params, headers, prefer, head=method == 'HEAD')
+            if table in self._view_sources:
+                raise StandInError(405, '42809', f'cannot modify view "{table}"')
+            if method == 'POST':
+                return self._insert(table, params, prefer, body)
+            if method == 'PATCH':
+                return self._update(table, params, prefer, body)
+            if method == 'DELETE':
+                return self._delete(table, params, prefer)
+        raise StandInError(405, 'PGRST117', f'Unsupported HTTP method: {method}')
+
+    def _matching(self, table: str, params: QueryParams) -> List[Tuple[int, Dict]]:
+        tests, equalities = _filters(params)
+        return [(rid, row) for rid, row in self._relation(table, equalities) if all(test(row) for test in tests)]
+
+    def _read(self, table, params, headers, prefer, head=False):
+        matched = [row for _, row in self._matching(table, params)]
+        matched = _sort(matched, params.get_list('order'))
+        select = params.get('select', '*')
+        if any(_EMBED_RE.match(item.strip()) and '!inner' in item for item in _split_top(select)):
+            matched = [row for row in matched if self._project(table, row, select) is not None]
+        total = len(matched)
+        offset = int(params.get('offset') or 0)
+        limit = int(params['limit']) if params.get('limit') else None
+        window = headers.get('range')
+        if window and '-' in window:
+            first, _, last = window.partition('-')
+            offset += int(first or 0)
+            if last:
+                limit = min(limit, int(last) - int(first or 0) + 1) if limit is not None \
+                    else int(last) - int(first or 0) + 1
+        page = matched[offset:offset + limit if limit is not None else None]
+        rows = [self._project(table, row, select) for row in page]
+        response_headers = {'content-range': self._content_range(offset, len(rows), total, prefer)}
+        if _OBJECT_MIME in headers.get('accept', ''):
+            if len(rows) != 1:
+                raise StandInError(406, 'PGRST116', 'JSON object requested, multiple (or no) rows returned',
+                                   details=f'The result contains {len(rows)} rows')
+            return 200, response_headers, None if head else rows[0]
+        return 200, response_headers, None if head else rows
+
+    @staticmethod
+    def _content_range(offset: int, count: int, total: int, prefer: str) -> str:
+        window = f'{offset}-{offset + count - 1}' if count else '*'
+        return f"{window}/{total if 'count=' in prefer else '*'}"
+
+    def _respond(self, table, params, prefer, rows, status):
+        headers = {'content-range': self._content_range(0, len(rows), len(rows), prefer)}
+        if 'return=representation' not in prefer:
+            return 204 if status == 200 else status, headers, None
+        select = params.get('select')
+        return status, headers, [self._project(table, row, select) for row in rows] if select else rows
+
+    def _insert(self, table, params, prefer, body):
+        if table.lower() in self.views:
+            raise StandInError(404, '42P01', f'relation "public.{table}" does not exist')
+        payload = body if isinstance(body, list) else [body or {}]
+        upsert = 'resolution=' in prefer
+        ignore = 'resolution=ignore-duplicates' in prefer
+        conflict = [c.strip() for c in (params.get('on_conflict') or 'id').split(',')]
+        existing = self._load(table) if upsert else []
+        changed: List[Tuple[Optional[int], Dict]] = []
+        for row in payload:
+            if not isinstance(row, dict):
+                raise StandInError(400, 'PGRST102', 'Invalid body: expected an object or an array of objects')
+            match = None
+            if upsert and all(row.get(c) is not None for c in conflict):
+                match = next((pair for pair in existing + changed
+                              if all(str(pair[1].get(c)) == str(row[c]) for c in conflict)), None)
+            if match is None:
+                changed.append((None, dict(row)))
+            elif not ignore:
+                merged = {**match[1], **row}
+                changed = [pair for pair in changed if pair is not match]
+                changed.append((match[0], merged))
+        self._check_unique(table, changed)
+        with self._transaction():
+            for rid, row in changed:
+                if rid is None:
+                    self._with_defaults(table, row)  # in place, so the response carries id/created_at
+                    self._conn.execute('INSERT INTO rows (tbl, doc) VALUES (?, ?)',
+                                       (table, json.dumps(row, default=str)))
+                else:
+                    self._conn.execute('UPDATE rows SET doc = ? WHERE rid = ?', (json.dumps(row, default=str), rid))
+        return self._respond(table, params, prefer, [row for _, row in changed], 201)
+
+    def _update(self, table, params, prefer, body):
+        if not isinstance(body, dict):
+            raise StandInError(400, 'PGRST102', 'Invalid body: expected an object')
+        changed = [(rid, {**row, **body}) for rid, row in self._matching(table, params)]
+        self._check_unique(table, changed)
+        with self._transaction():
+            self._conn.executemany('UPDATE rows SET doc = ? WHERE rid = ?',
+                                   [(json.dumps(row, default=str), rid) for rid, row in changed])
+        return self._respond(table, params, prefer, [row for _, row in changed], 200)
+
+    def _delete(self, table, params, prefer):
+        removed = self._matching(table, params)
+        with self._transaction():
+            self._conn.executemany('DELETE FROM rows WHERE rid = ?', [(rid,) for rid, _ in removed])
+        return self._respond(table, params, prefer, [row for _, row in removed], 200)
+
+    def _rpc(self, name: str, params: Dict):
+        fn = self._rpcs.get(name)
+        if fn is None:
+            raise StandInError(404, 'PGRST202',
+                               f'Could not find the function public.{name}({", ".join(sorted(params))}) '
+                               f'in the schema cache')
+        with self._lock:
+            return 200, {}, fn(params)
+
+
+# =====================================================================
+# HTTP TRANSPORT + CLIENT
+# =====================================================================
+
+class StandInTransport(httpx.BaseTransport):
+    """httpx transport answering PostgREST requests from a StandIn"""
+
+    def __init__(self, standin: StandIn):
+        self.standin = standin
+
+    @staticmethod
+    def operation(request: httpx.Request) -> str:
+        if '/rpc/' in request.url.path:
+            return 'rpc'
+        return 'read' if request.method in ('GET', 'HEAD') else 'write'
+
+    def handle_request(self, request: httpx.Request) -> httpx.Response:
+        path = request.url.path
+        if path.startswith('/rest/v1'):
+            path = path[len('/rest/v1'):]
+        try:
+            self.standin.inject(self.operation(request), request)
+            content = request.read()
+            body = json.loads(content) if content else None
+            status, headers, payload = self.standin.handle(request.method, path, request.url.params,
+                                                           request.headers, body)
+        except StandInError as e:
+            return httpx.Response(e.status, json=e.body(), request=request)
+        except ValueError as e:
+            return httpx.Response(400, json=StandInError(400, 'PGRST102', f'Invalid body: {e}').body(),
+                                  request=request)
+        content = b'' if payload is None else json.dumps(payload, default=str).encode()
+        return httpx.Response(status, headers={'content-type': 'application/json', **headers},
+                              content=content, request=request)
+
+
+class StandInBucket:
+    """storage.from_(bucket) with the storage3 method names"""
+
+    def __init__(self, standin: StandIn, bucket: str):
+        self.standin = standin
+        self.bucket = bucket
+
+    def _error(self, status: int, error: str, message: str):
+        return StorageException({'statusCode': status, 'error': error, 'message': message})
+
+    def upload(self, path: str, file, file_options: Optional[Dict] = None) -> httpx.Response:
+        self.standin.inject('storage')
+        if hasattr(file, 'read'):
+            content = file.read()
+        elif isinstance(file, (bytes, bytearray)):
+            content = bytes(file)
+        else:
+            with open(file, 'rb') as f:
+                content = f.read()
+        options = {k.lower(): v for k, v in (file_options or {}).items()}
+        upsert = str(options.get('upsert', options.get('x-upsert', 'false'))).lower() == 'true'
+        with self.standin._lock, self.standin._transaction():
+            exists = self.standin._conn.execute('SELECT 1 FROM objects WHERE bucket = ? AND path = ?',
+                                                (self.bucket, path)).fetchone()
+            if exists and not upsert:
+                raise self._error(409, 'Duplicate', 'The resource already exists')
+            self.standin._conn.execute(
+                'INSERT OR REPLACE INTO objects (bucket, path, content, content_type, created_at) '
+                'VALUES (?, ?, ?, ?, ?)',
+                (self.bucket, path, content, options.get('content-type'), datetime.now(timezone.utc).isoformat()))
+        return httpx.Response(200, json={'Key': f'{self.bucket}/{path}'})
+
+    def download(self, path: str, options: Optional[Dict] = None) -> bytes:
+        self.standin.inject('storage')
+        with self.standin._lock:
+            row = self.standin._conn.execute('SELECT content FROM objects WHERE bucket = ? AND path = ?',
+                                             (self.bucket, path)).fetchone()
+        if row is None:
+            raise self._error(404, 'not_found', 'Object not found')
+        return bytes(row[0])
+
+    def get_public_url(self, path: str, options: Optional[Dict] = None) -> str:
+        return f'{STANDIN_BASE_URL}/storage/v1/object/public/{self.bucket}/{path}'
+
+    def remove(self, paths: List[str]) -> List[Dict[str, Any]]:
+        self.standin.inject('storage')
+        removed = []
+        with self.standin._lock, self.standin._transaction():
+            for path in paths:
+                if self.standin._conn.execute('DELETE FROM objects WHERE bucket = ? AND path = ?',
+                                              (self.bucket, path)).rowcount:
+                    removed.append({'bucket_id': self.bucket, 'name': path})
+        return removed
+
+    def list(self, path: Optional[str] = None, options: Optional[Dict] = None) -> List[Dict[str, Any]]:
+        prefix = f"{path.rstrip('/')}/" if path else ''
+        with self.standin._lock:
+            rows = self.standin._conn.execute(
+                'SELECT path, length(content), created_at FROM objects WHERE bucket = ? ORDER BY path',
+                (self.bucket,)).fetchall()
+        return [{'name': name[len(prefix):], 'created_at': created, 'metadata': {'size': size}}
+                for name, size, created in rows if name.startswith(prefix)]
+
+
+class StandInStorage:
+    def __init__(self, standin: StandIn):
+        self.standin = standin
+
+    def from_(self, bucket: str) -> StandInBucket:
+        return StandInBucket(self.standin, bucket)
+
+
+class StandInAuth:
+    """Email/password subset of the gotrue client"""
+
+    def __init__(self, standin: StandIn):
+        self.standin = standin
+        self.current = None
+
+    @staticmethod
+    def _hash(password: str, salt: str) -> str:
+        return hashlib.sha256(f'{salt}:{password}'.encode()).hexdigest()
+
+    def _response(self, user_id: str, email: str, metadata: Dict):
+        user = SimpleNamespace(id=user_id, email=email, user_metadata=metadata)
+        session = SimpleNamespace(access_token=uuid.uuid4().hex, refresh_token=uuid.uuid4().hex, user=user)
+        self.current = SimpleNamespace(user=user, session=session)
+        return self.current
+
+    def _error(self, message: str, status: int, code: str):
+        return AuthApiError(message, status, code)
+
+    def sign_up(self, credentials: Dict):
+        self.standin.inject('auth')
+        email = (credentials.get('email') or '').lower()
+        metadata = (credentials.get('options') or {}).get('data') or {}
+        user_id, salt = str(uuid.uuid4()), uuid.uuid4().hex
+        try:
+            with self.standin._lock, self.standin._transaction():
+                self.standin._conn.execute(
+                    'INSERT INTO auth_users (id, email, password_hash, metadata, created_at) VALUES (?, ?, ?, ?, ?)',
+                    (user_id, email, f"{salt}${self._hash(credentials.get('password') or '', salt)}",
+                     json.dumps(metadata), datetime.now(timezone.utc).isoformat()))
+        except sqlite3.IntegrityError:
+            raise self._error('User already registered', 422, 'user_already_exists') from None
+        return self._response(user_id, email, metadata)
+
+    def sign_in_with_password(self, credentials: Dict):
+        self.standin.inject('auth')
+        email = (credentials.get('email') or '').lower()
+        with self.standin._lock:
+            row = self.standin._conn.execute('SELECT id, password_hash, metadata FROM auth_users WHERE email = ?',
+                                             (email,)).fetchone()
+        if row:
+            salt, _, digest = row[1].partition('$')
+            if self._hash(credentials.get('password') or '', salt) == digest:
+                return self._response(row[0], email, json.loads(row[2]))
+        raise self._error('Invalid login credentials', 400, 'invalid_credentials')
+
+    def sign_out(self, options: Optional[Dict] = None):
+        self.current = None
+
+    def get_user(self, jwt: Optional[str] = None):
+        return self.current
+
+
+class StandInClient:
+    """Duck-typed supabase.Client backed by a StandIn"""
+
+    def __init__(self, standin: StandIn, key: str = ''):
+        self.standin = standin
+        self.transport = StandInTransport(standin)
+        headers = {'apikey': key, 'Authorization': f'Bearer {key}'} if key else {}
+        self.postgrest = SimpleNamespace(session=httpx.Client(
+            base_url=f'{STANDIN_BASE_URL}/rest/v1', headers=headers, transport=self.transport))
+        self.storage = StandInStorage(standin)
+        self.auth = StandInAuth(standin)
+
+    def table(self, table_name: str) -> SyncRequestBuilder:
+        return SyncRequestBuilder(self.postgrest.session, f'/{table_name}')
+
+    from_ = table
+
+    def rpc(self, fn: str, params: Dict[Any, Any]) -> SyncRPCFilterRequestBuilder:
+        return SyncRPCFilterRequestBuilder(self.postgrest.session, f'/rpc/{fn}', 'POST', Headers(), QueryParams(),
+                                           json=params)
+
+
+_instances: Dict[Tuple[str, int], StandIn] = {}
+_instances_lock = threading.Lock()
+
+
+def get_standin(url: str = 'sqlite://') -> StandIn:
+    """
+    The process-wide database for `url`: sqlite:// (memory), or
+    sqlite:///relative.db / sqlite:////absolute.db. In-memory databases
+    are per process and do not survive a fork.
+    """
+    path = url[len('sqlite://'):] if url.startswith('sqlite://') else url[len('sqlite:'):]
+    path = ':memory:' if path in ('', '/', ':memory:', '/:memory:') else path[1:] if path.startswith('/') else path
+    key = (path, os.getpid())
+    with _instances_lock:
+        if key not in _instances:
+            _instances[key] = StandIn(path, seed=int(STANDIN_SEED) if STANDIN_SEED else None)
+        return _instances[key]
+
+
+def create_standin(url: str, key: str = '') -> StandInClient:
+    """create_client() counterpart for sqlite: URLs"""
+    return StandInClient(get_standin(url), key)
+
+
+__all__ = [
+    'StandIn',
+    'StandInClient',
+    'StandInError',
+    'StandInTransport',
+    'create_standin',
+    'get_standin',
+    'is_standin_url',
+    'sql_views',
+]
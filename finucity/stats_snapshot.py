@@ -0,0 +1,227 @@
+"""
+Shared Stats Snapshots
+Expensive platform aggregates are recomputed in the background and stored
+in a small SQLite file that every gunicorn worker on the host reads, so a
+page view costs one primary-key lookup instead of exact-count scans over
+profiles and chat_queries.
+
+Only one worker recomputes a snapshot at a time (a lease row guards it);
+the others keep serving the previous copy with its last_updated stamp.
+Author: Sumeet Sangwan
+"""
+
+import json
+import logging
+import os
+import sqlite3
+import threading
+import time
+from datetime import datetime, timezone
+from typing import Callable, Dict, Optional
+
+from finucity.database import PlatformStatsService
+from finucity.metrics import metrics
+
+STATS_REFRESH_INTERVAL = float(os.getenv('STATS_REFRESH_INTERVAL', '300'))  # seconds
+STATS_MIN_REFRESH_GAP = float(os.getenv('STATS_MIN_REFRESH_GAP', '30'))     # floor for on-change refreshes
+STATS_LEASE_SECONDS = float(os.getenv('STATS_LEASE_SECONDS', '60'))
+STATS_FIRST_LOAD_WAIT = 3.0  # how long a cold read waits for another worker's first refresh
+
+_SCHEMA = """
+CREATE TABLE IF NOT EXISTS stats_snapshots (
+    name TEXT PRIMARY KEY,
+    payload TEXT NOT NULL,
+    updated_at REAL NOT NULL,
+    stale INTEGER NOT NULL DEFAULT 0
+);
+CREATE TABLE IF NOT EXISTS stats_leases (
+    name TEXT PRIMARY KEY,
+    owner TEXT NOT NULL,
+    expires_at REAL NOT NULL
+);
+"""
+
+
+class StatsSnapshot:
+    """Host-wide snapshot store with a per-process refresh thread"""
+
+    def __init__(self, app=None, path: Optional[str] = None,
+                 interval: float = STATS_REFRESH_INTERVAL, min_gap: float = STATS_MIN_REFRESH_GAP):
+        self.app = None
+        self.path = path
+        self.interval = interval
+        self.min_gap = min_gap
+        self._computers: Dict[str, Callable[[], Dict]] = {}
+        self._local = threading.local()
+        self._lock = threading.Lock()
+        self._wake = threading.Event()
+        self._thread: Optional[threading.Thread] = None
+        self._pid = None
+        self.stats = {'refreshes': 0, 'refresh_errors': 0, 'lease_conflicts': 0, 'reads': 0}
+        if app:
+            self.init_app(app)
+
+    def init_app(self, app):
+        """Resolve the store path and take over PlatformStatsService reads"""
+        self.app = app
+        if not self.path:
+            self.path = os.getenv('STATS_SNAPSHOT_PATH') or os.path.join(app.instance_path, 'stats_snapshot.sqlite')
+        os.makedirs(os.path.dirname(self.path) or '.', exist_ok=True)
+        self.register('platform', PlatformStatsService.compute_snapshot)
+        PlatformStatsService.snapshot = self
+        app.extensions['stats_snapshot'] = self
+        metrics.register_collector(self.metric_samples)
+
+    def register(self, name: str, compute: Callable[[], Dict]):
+        """Register a zero-argument callable producing a JSON-serialisable dict"""
+        self._computers[name] = compute
+
+    # ----- storage primitives -----
+
+    def _db(self) -> sqlite3.Connection:
+        conn = getattr(self._local, 'conn', None)
+        if conn is None or getattr(self._local, 'pid', None) != os.getpid():
+            conn = sqlite3.connect(self.path, timeout=10, isolation_level=None)
+            conn.execute('PRAGMA journal_mode=WAL')
+            conn.execute('PRAGMA synchronous=NORMAL')
+            conn.executescript(_SCHEMA)
+            self._local.conn = conn
+            self._local.pid = os.getpid()
+        return conn
+
+    def _row(self, name: str) -> Optional[tuple]:
+        return self._db().execute(
+            'SELECT payload, updated_at, stale FROM stats_snapshots WHERE name = ?', (name,)
+        ).fetchone()
+
+    def _acquire(self, name: str) -> bool:
+        owner = f"{os.getpid()}:{threading.get_ident()}"
+        now = time.time()
+        conn = self._db()
+        conn.execute('BEGIN IMMEDIATE')
+        try:
+            row = conn.execute('SELECT expires_at FROM stats_leases WHERE name = ?', (name,)).fetchone()
+            if row and row[0] > now:
+                conn.execute('ROLLBACK')
+                return False
+            conn.execute('INSERT OR REPLACE INTO stats_leases (name, owner, expires_at) VALUES (?, ?, ?)',
+                         (name, owner, now + STATS_LEASE_SECONDS))
+            conn.execute('COMMIT')
+            return True
+        except Exception:
+            conn.execute('ROLLBACK')
+            raise
+
+    def _release(self, name: str):
+        self._db().execute('DELETE FROM stats_leases WHERE name = ?', (name,))
+
+    # ----- public API -----
+
+    def read(self, name: str = 'platform') -> Optional[Dict]:
+        """{'data': ..., 'last_updated': iso} from the shared store"""
+        self._ensure_thread()
+        self.stats['reads'] += 1
+        row = self._row(name)
+        if row is None:
+            # Cold store: compute once (or wait briefly for the worker that is)
+            if not self.refresh(name):
+                deadline = time.monotonic() + STATS_FIRST_LOAD_WAIT
+                while row is None and time.monotonic() < deadline:
+                    time.sleep(0.1)
+                    row = self._row(name)
+            row = row or self._row(name)
+            if row is None:
+                return None
+        payload, updated_at, _ = row
+        return {
+            'data': json.loads(payload),
+            'last_updated': datetime.fromtimestamp(updated_at, timezone.utc).isoformat(),
+        }
+
+    def refresh(self, name: str = 'platform') -> bool:
+        """Recompute a snapshot now; False if another worker holds the lease or it failed"""
+        if not self._acquire(name):
+            self.stats['lease_conflicts'] += 1
+            return False
+        try:
+            data = self._computers[name]()
+            self._db().execute(
+                'INSERT OR REPLACE INTO stats_snapshots (name, payload, updated_at, stale) VALUES (?, ?, ?, 0)',
+                (name, json.dumps(data, default=str), time.time())
+            )
+            self.stats['refreshes'] += 1
+            return True
+        except Exception as e:
+            # Keep serving the previous snapshot
+            self.stats['refresh_errors'] += 1
+            self._log('error', f"Stats snapshot '{name}' refresh failed: {e}")
+            return False
+        finally:
+            self._release(name)
+
+    def mark_stale(self, name: str = 'platform'):
+        """Flag a snapshot for refresh (no sooner than min_gap after the last one)"""
+        self._db().execute('UPDATE stats_snapshots SET stale = 1 WHERE name = ?', (name,))
+        self._ensure_thread()
+        self._wake.set()
+
+    def due(self, name: str) -> bool:
+        """Whether a snapshot is missing, expired, or stale past the minimum gap"""
+        row = self._row(name)
+        if row is None:
+            return True
+        age = time.time() - row[1]
+        return age >= self.interval or (bool(row[2]) and age >= self.min_gap)
+
+    def age_seconds(self, name: str = 'platform') -> Optional[float]:
+        row = self._row(name)
+        return time.time() - row[1] if row else None
+
+    # ----- worker -----
+
+    def _ensure_thread(self):
+        # Threads do not survive a gunicorn fork, so check the owning PID too
+        if self._thread and self._thread.is_alive() and self._pid == os.getpid():
+            return
+        with self._lock:
+            if self._thread and self._thread.is_alive() and self._pid == os.getpid():
+                return
+            self._pid = os.getpid()
+            self._thread = threading.Thread(target=self._run, name='stats-snapshot', daemon=True)
+            self._thread.start()
+
+    def _run(self):
+        poll = max(min(self.interval, self.min_gap) / 2, 1.0)
+        while True:
+            self._wake.wait(timeout=poll)
+            self._wake.clear()
+            for name in list(self._computers):
+                try:
+                    if self.due(name):
+                        with self.app.app_context():
+                            self.refresh(name)
+                except Exception as e:
+                    self._log('error', f"Stats snapshot worker error for '{name}': {e}")
+
+    def metric_samples(self):
+        """Samples for finucity.metrics collectors"""
+        yield ('finucity_stats_snapshot_refreshes_total', 'counter', 'Snapshot recomputations by this worker',
+               self.stats['refreshes'], {})
+        yield ('finucity_stats_snapshot_refresh_errors_total', 'counter', 'Failed snapshot recomputations',
+               self.stats['refresh_errors'], {})
+        yield ('finucity_stats_snapshot_reads_total', 'counter', 'Snapshot reads served', self.stats['reads'], {})
+        for name in self._computers:
+            age = self.age_seconds(name)
+            if age is not None:
+                yield ('finucity_stats_snapshot_age_seconds', 'gauge', 'Seconds since the snapshot was computed',
+                       round(age, 3), {'snapshot': name})
+
+    def _log(self, level: str, message: str):
+        logger = self.app.logger if self.app else logging.getLogger(__name__)
+        getattr(logger, level)(message)
+
+
+# Global instance
+stats_snapshot = StatsSnapshot()
+
+__all__ = ['StatsSnapshot', 'stats_snapshot']
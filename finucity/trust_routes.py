@@ -4,20 +4,28 @@ CA ratings, reviews, secure messaging, verification badges
 Author: Sumeet Sangwan
 """
 
+import os
+
 from flask import Blueprint, render_template, request, jsonify, redirect, url_for, flash
 from flask_login import login_required, current_user
 from datetime import datetime
 from finucity.database import get_supabase
+from finucity.aggregates import CAAggregates
+from finucity.rows import BookingRow, select_columns
+from finucity.bulk import bulk_buffer
 
 trust_bp = Blueprint('trust', __name__, url_prefix='/trust')
 
+REVIEWS_PAGE_SIZE = int(os.getenv('REVIEWS_PAGE_SIZE', '20'))
+
 # =====================================================
 # CA RATINGS & REVIEWS
 # =====================================================
 
 @trust_bp.route('/ca/<ca_id>/reviews')
 def ca_reviews(ca_id):
-    """View all reviews for a CA"""
+    """View a CA's reviews, one page at a time"""
+    page = max(request.args.get('page', 1, type=int), 1)
     try:
         supabase = get_supabase()
         
@@ -34,45 +42,35 @@ def ca_reviews(ca_id):
         
         ca = ca_result.data
         
-        # Get reviews
+        # Only the visible page of reviews; counts and averages come from the aggregate
+        start = (page - 1) * REVIEWS_PAGE_SIZE
         reviews_result = supabase.table('ca_ratings')\
             .select('*, profiles!ca_ratings_user_id_fkey(first_name, last_name), service_bookings(booking_number)')\
             .eq('ca_id', ca_id)\
             .eq('is_published', True)\
             .order('created_at', desc=True)\
+            .range(start, start + REVIEWS_PAGE_SIZE - 1)\
             .execute()
         
         reviews = reviews_result.data if reviews_result.data else []
         
-        # Calculate statistics
-        if reviews:
-            avg_overall = sum(r['overall_rating'] for r in reviews) / len(reviews)
-            avg_communication = sum(r['communication_rating'] for r in reviews if r['communication_rating']) / len(reviews)
-            avg_expertise = sum(r['expertise_rating'] for r in reviews if r['expertise_rating']) / len(reviews)
-            avg_timeliness = sum(r['timeliness_rating'] for r in reviews if r['timeliness_rating']) / len(reviews)
-            avg_value = sum(r['value_rating'] for r in reviews if r['value_rating']) / len(reviews)
-            
-            rating_distribution = {1: 0, 2: 0, 3: 0, 4: 0, 5: 0}
-            for review in reviews:
-                rating_distribution[review['overall_rating']] += 1
-        else:
-            avg_overall = avg_communication = avg_expertise = avg_timeliness = avg_value = 0
-            rating_distribution = {1: 0, 2: 0, 3: 0, 4: 0, 5: 0}
-        
+        totals = CAAggregates.ratings(ca_id, published_only=True)
         stats = {
-            'total_reviews': len(reviews),
-            'average_rating': avg_overall,
-            'communication': avg_communication,
-            'expertise': avg_expertise,
-            'timeliness': avg_timeliness,
-            'value': avg_value,
-            'distribution': rating_distribution
+            'total_reviews': totals.total_reviews,
+            'average_rating': totals.average_rating,
+            'communication': totals.average_of('communication'),
+            'expertise': totals.average_of('expertise'),
+            'timeliness': totals.average_of('timeliness'),
+            'value': totals.average_of('value'),
+            'distribution': totals.distribution
         }
         
         return render_template('trust/ca_reviews.html',
                              ca=ca,
                              reviews=reviews,
                              stats=stats,
+                             page=page,
+                             pages=max((totals.total_reviews + REVIEWS_PAGE_SIZE - 1) // REVIEWS_PAGE_SIZE, 1),
                              page_title=f'{ca["first_name"]} {ca["last_name"]} - Reviews')
     except Exception as e:
         flash(f'Error loading reviews: {str(e)}', 'error')
@@ -90,7 +88,7 @@ def submit_review(booking_id):
             
             # Verify booking belongs to user and is completed
             booking = supabase.table('service_bookings')\
-                .select('*')\
+                .select(select_columns(BookingRow))\
                 .eq('id', booking_id)\
                 .eq('user_id', current_user.id)\
                 .eq('status', 'completed')\
@@ -141,13 +139,13 @@ def submit_review(booking_id):
                     .execute()
                 
                 # Notify CA
-                supabase.table('notifications').insert({
+                bulk_buffer.add('notifications', {
                     'user_id': booking.data['assigned_ca_id'],
                     'notification_type': 'review_received',
                     'title': 'New Review Received',
                     'message': f'You received a {data["overall_rating"]}-star review',
                     'booking_id': booking_id
-                }).execute()
+                })
                 
                 return jsonify({'success': True, 'review': result.data[0]})
             else:
@@ -353,13 +351,13 @@ def send_message(booking_id):
         
         # Send notification
         recipient_id = booking.data['assigned_ca_id'] if not is_ca else booking.data['user_id']
-        supabase.table('notifications').insert({
+        bulk_buffer.add('notifications', {
             'user_id': recipient_id,
             'notification_type': 'message_received',
             'title': 'New Message',
             'message': f'You have a new message in booking {booking_id}',
             'booking_id': booking_id
-        }).execute()
+        })
         
         return jsonify({'success': True, 'message': 'Message sent'})
         
@@ -407,25 +405,15 @@ def ca_verification_status(ca_id):
             'response_time': 0
         }
         
-        # Get ratings
-        ratings = supabase.table('ca_ratings')\
-            .select('overall_rating')\
-            .eq('ca_id', ca_id)\
-            .execute()
-        
-        if ratings.data:
-            verification['rating'] = sum(r['overall_rating'] for r in ratings.data) / len(ratings.data)
-            verification['total_reviews'] = len(ratings.data)
-        
-        # Get completion rate
-        bookings = supabase.table('service_bookings')\
-            .select('status')\
-            .eq('assigned_ca_id', ca_id)\
-            .execute()
+        # Ratings (published or not) and booking completion, aggregated server-side
+        ratings = CAAggregates.ratings(ca_id, published_only=False)
+        if ratings.total_reviews:
+            verification['rating'] = ratings.average_rating
+            verification['total_reviews'] = ratings.total_reviews
         
-        if bookings.data:
-            completed = len([b for b in bookings.data if b['status'] == 'completed'])
-            verification['completion_rate'] = (completed / len(bookings.data)) * 100
+        bookings = CAAggregates.bookings(ca_id)
+        if bookings.total_bookings:
+            verification['completion_rate'] = bookings.completion_rate
         
         # Calculate trust score (0-100)
         trust_score = 0
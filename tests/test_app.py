@@ -20,6 +20,8 @@ os.environ.setdefault('MAIL_USERNAME', 'test@test.com')
 os.environ.setdefault('MAIL_PASSWORD', 'test-password')
 os.environ.setdefault('GITHUB_TOKEN', 'test-github-token')
 os.environ.setdefault('WTF_CSRF_ENABLED', 'false')
+os.environ.setdefault('OUTBOX_PATH', ':memory:')
+os.environ.setdefault('RATE_LIMIT_PATH', ':memory:')
 
 
 @pytest.fixture
@@ -408,5 +410,2322 @@ class TestMiddleware:
             assert status == 400
 
 
+# =====================================================================
+# CONVERSATION EXPORT TESTS
+# =====================================================================
+
+class TestConversationExport:
+    """Test streaming conversation export"""
+    
+    ROWS = [
+        {'id': i, 'session_id': f'conv_{i // 2}', 'category': 'tax',
+         'question': f'Question {i} (80C)', 'response': 'Answer ₹1,50,000 ' * 40,
+         'created_at': f'2025-01-01T00:00:{i:02d}+00:00'}
+        for i in range(1, 41)
+    ]
+    
+    def test_cursor_round_trip(self):
+        """Cursor should encode the keyset position of a row"""
+        from finucity.exports import encode_cursor, decode_cursor
+        row = dict(self.ROWS[4], id='0b5e1c5a-8f5e-4a8e-9d0e-3c1f2a4b5c6d')
+        token = encode_cursor(row)
+        assert decode_cursor(token) == {'created_at': row['created_at'], 'id': row['id']}
+        assert decode_cursor(None) is None
+        with pytest.raises(ValueError):
+            decode_cursor('not-a-cursor')
+    
+    def test_cursor_rejects_filter_injection(self):
+        """Cursor values must be a timestamp and a UUID"""
+        from finucity.exports import encode_cursor, decode_cursor
+        good = {'created_at': '2025-01-01T00:00:04+00:00', 'id': '0b5e1c5a-8f5e-4a8e-9d0e-3c1f2a4b5c6d'}
+        for bad in ({'created_at': '2025-01-01",user_id.neq."x', 'id': good['id']},
+                    {'created_at': good['created_at'], 'id': '1",user_id.neq."x'},
+                    {'created_at': good['created_at'], 'id': 5}):
+            with pytest.raises(ValueError):
+                decode_cursor(encode_cursor(bad))
+    
+    def test_export_rejects_bad_cursor(self, client):
+        """Export should answer 400 before touching the database"""
+        from finucity.exports import encode_cursor
+        token = encode_cursor({'created_at': 'x",id.gt."0', 'id': 'y'})
+        with patch('finucity.database.UserService.get_by_id', return_value={'id': 'u-1', 'email': 'a@b.c'}), \
+                patch('finucity.chat_routes.ChatService.iter_user_queries') as rows:
+            with client.session_transaction() as sess:
+                sess['_user_id'] = 'u-1'
+                sess['_fresh'] = True
+            response = client.get(f'/chat/api/export?cursor={token}')
+        assert response.status_code == 400
+        assert not rows.called
+    
+    def test_ndjson_and_csv_stream_per_row(self):
+        """Text writers should yield one chunk per row with a cursor"""
+        from finucity.exports import stream_ndjson, stream_csv
+        lines = list(stream_ndjson(iter(self.ROWS)))
+        assert len(lines) == len(self.ROWS)
+        assert json.loads(lines[0])['id'] == 1 and 'cursor' in json.loads(lines[0])
+        chunks = list(stream_csv(iter(self.ROWS)))
+        assert len(chunks) == len(self.ROWS) + 1
+        assert chunks[0].startswith('id,session_id')
+    
+    def test_pdf_is_emitted_page_by_page(self):
+        """PDF writer should emit pages before the end and a valid xref"""
+        import re
+        from finucity.exports import stream_pdf
+        chunks = list(stream_pdf(iter(self.ROWS)))
+        assert len(chunks) > 3
+        pdf = b''.join(chunks)
+        assert pdf.startswith(b'%PDF-1.4') and pdf.endswith(b'%%EOF\n')
+        startxref = int(re.search(rb'startxref\n(\d+)', pdf).group(1))
+        assert pdf[startxref:startxref + 4] == b'xref'
+        offsets = re.findall(rb'(\d{10}) 00000 n', pdf)
+        for obj_id, offset in enumerate(offsets, start=1):
+            assert pdf[int(offset):].startswith(f'{obj_id} 0 obj'.encode())
+    
+    def test_iter_user_queries_pages_by_keyset(self, app):
+        """Iterator should request pages after the last row it saw"""
+        from finucity.database import ChatService
+        pages = [self.ROWS[:2], self.ROWS[2:3]]
+        calls = []
+        
+        def fake_page(user_id, after=None, page_size=200):
+            calls.append(after)
+            return pages[len(calls) - 1]
+        
+        with patch.object(ChatService, 'get_user_queries_page', side_effect=fake_page):
+            rows = list(ChatService.iter_user_queries('u1', page_size=2))
+        assert [r['id'] for r in rows] == [1, 2, 3]
+        assert calls == [None, {'created_at': self.ROWS[1]['created_at'], 'id': 2}]
+    
+    def test_export_unauthenticated(self, client):
+        """Export endpoint should reject unauthenticated requests"""
+        response = client.get('/chat/api/export?format=csv')
+        assert response.status_code in (302, 401)
+
+
+# =====================================================================
+# CLEAR HISTORY TESTS
+# =====================================================================
+
+class TestClearHistory:
+    """Test tombstoned, batched clear-history"""
+    
+    def test_purge_deletes_in_bounded_batches(self, app):
+        """Worker should delete in batches and report progress"""
+        from finucity.history_purge import HistoryPurgeWorker
+        from finucity.database import ChatService
+        
+        remaining = list(range(1, 8))
+        deleted_batches = []
+        invalidated = []
+        
+        def fake_ids(user_id, cutoff, limit):
+            return remaining[:limit]
+        
+        def fake_delete(user_id, ids):
+            deleted_batches.append(list(ids))
+            del remaining[:len(ids)]
+            return len(ids)
+        
+        worker = HistoryPurgeWorker(batch_size=3, pause=0)
+        worker.init_app(app)
+        worker.register_invalidator(invalidated.append)
+        worker._jobs['u1'] = {'user_id': 'u1', 'state': 'queued', 'cutoff': '2025-01-01T00:00:00+00:00',
+                              'deleted': 0, 'batches': 0}
+        with patch.object(ChatService, 'get_query_ids_before', side_effect=fake_ids), \
+             patch.object(ChatService, 'delete_by_ids', side_effect=fake_delete):
+            worker.purge('u1')
+        
+        assert deleted_batches == [[1, 2, 3], [4, 5, 6], [7]]
+        status = worker.status('u1')
+        assert status['state'] == 'completed'
+        assert status['deleted'] == 7 and status['batches'] == 3
+        assert invalidated == ['u1', 'u1', 'u1']
+    
+    def test_tombstone_hides_rows(self, app):
+        """Rows at or before the cutoff should be hidden immediately"""
+        from finucity.database import ChatService, _history_cutoffs
+        _history_cutoffs['u-hidden'] = '2025-01-01T00:00:00+00:00'
+        try:
+            assert ChatService._is_hidden({'user_id': 'u-hidden', 'created_at': '2024-12-31T23:59:59Z'})
+            assert not ChatService._is_hidden({'user_id': 'u-hidden', 'created_at': '2025-01-01T00:00:01+00:00'})
+            assert not ChatService._is_hidden({'user_id': 'other', 'created_at': '2020-01-01T00:00:00'})
+        finally:
+            _history_cutoffs.pop('u-hidden', None)
+    
+    def test_clear_history_unauthenticated(self, client):
+        """Clear history should reject unauthenticated requests"""
+        response = client.post('/chat/api/clear-history')
+        assert response.status_code in (302, 401)
+
+
+# =====================================================================
+# CHAT ARCHIVE TESTS
+# =====================================================================
+
+class TestChatArchive:
+    """Test cold-tier chat archival"""
+    
+    @staticmethod
+    def _rows(user_id, session_id, start, count):
+        return [{'id': f'q{i}', 'user_id': user_id, 'session_id': session_id,
+                 'question': f'Q{i}', 'response': 'A' * 200, 'category': 'tax',
+                 'created_at': f'2024-01-01T00:00:{i:02d}+00:00'} for i in range(start, start + count)]
+    
+    def test_append_and_rehydrate(self, tmp_path):
+        """Archived conversations should be readable by ID and by session"""
+        from finucity.archive import ChatArchive
+        archive = ChatArchive(directory=str(tmp_path))
+        archive.append(self._rows('u1', 's1', 0, 3) + self._rows('u2', 's2', 3, 2))
+        archive.append(self._rows('u1', 's1', 5, 2) + self._rows('u1', 's1', 0, 1))  # q0 is a re-run duplicate
+        
+        assert archive.get_query('q4')['user_id'] == 'u2'
+        assert [r['id'] for r in archive.get_session('u1', 's1')] == ['q0', 'q1', 'q2', 'q5', 'q6']
+        assert archive.stats()['rows'] == 7
+    
+    def test_forget_and_compact(self, tmp_path):
+        """Forgotten users should be unreachable and compacted away"""
+        from finucity.archive import ChatArchive
+        archive = ChatArchive(directory=str(tmp_path))
+        archive.append(self._rows('u1', 's1', 0, 3) + self._rows('u2', 's2', 3, 2))
+        before = archive.stats()['bytes']
+        archive.forget_user('u1')
+        assert archive.get_query('q0') is None
+        result = archive.compact()
+        assert result['bytes_reclaimed'] > 0
+        assert archive.stats()['bytes'] < before
+        assert archive.get_query('q4')['session_id'] == 's2'
+    
+    def test_archive_job_deletes_after_writing(self, app, tmp_path):
+        """With the opt-in, the job should archive each batch before deleting the hot rows"""
+        from finucity.archive import ChatArchive
+        from finucity.database import ChatService
+        archive = ChatArchive(directory=str(tmp_path))
+        batches = [self._rows('u1', 's1', 0, 2), self._rows('u2', 's2', 2, 1), []]
+        deleted = []
+        with app.app_context(), \
+             patch.object(ChatArchive, '_fetch_cold_batch', side_effect=batches), \
+             patch.object(ChatService, 'delete_by_ids',
+                          side_effect=lambda uid, ids: deleted.append((uid, ids)) or len(ids)):
+            result = archive.archive_older_than(months=6, batch_size=2, delete_hot=True)
+        assert result == {'archived': 3, 'batches': 2, 'deleted': 3}
+        assert deleted == [('u1', ['q0', 'q1']), ('u2', ['q2'])]
+        assert archive.get_query('q2') is not None
+    
+    def test_archive_job_copies_only_by_default(self, app, tmp_path):
+        """Without the opt-in hot rows stay in chat_queries and the job pages past each batch"""
+        from finucity.archive import ChatArchive
+        from finucity.database import ChatService
+        archive = ChatArchive(directory=str(tmp_path))
+        batches = [self._rows('u1', 's1', 0, 2), self._rows('u2', 's2', 2, 1), []]
+        with app.app_context(), \
+             patch.object(ChatArchive, '_fetch_cold_batch', side_effect=batches) as fetch, \
+             patch.object(ChatService, 'delete_by_ids') as delete:
+            result = archive.archive_older_than(months=6, batch_size=2)
+        assert result == {'archived': 3, 'batches': 2, 'deleted': 0}
+        delete.assert_not_called()
+        assert [c.args[2] for c in fetch.call_args_list] == [
+            None, {'created_at': '2024-01-01T00:00:01+00:00', 'id': 'q1'},
+            {'created_at': '2024-01-01T00:00:02+00:00', 'id': 'q2'}]
+        assert archive.stats()['rows'] == 3
+    
+    def test_get_query_falls_back_to_archive(self, app, tmp_path):
+        """ChatService should rehydrate from the archive on a hot miss"""
+        from finucity.archive import ChatArchive
+        from finucity.database import ChatService
+        archive = ChatArchive(directory=str(tmp_path))
+        archive.append(self._rows('u1', 's1', 0, 1))
+        sb = MagicMock()
+        sb.table.return_value.select.return_value.eq.return_value.limit.return_value.execute.return_value.data = []
+        with app.app_context(), patch('finucity.database.get_supabase', return_value=sb), \
+             patch.object(ChatService, 'cold_store', archive):
+            assert ChatService.get_query_by_id('q0')['question'] == 'Q0'
+    
+    def test_user_reads_merge_sessions_in_order(self, tmp_path):
+        """Newest-first and keyset reads should interleave overlapping sessions"""
+        from finucity.archive import ChatArchive
+        archive = ChatArchive(directory=str(tmp_path))
+        rows = self._rows('u1', 's1', 0, 6)
+        for row in rows[1::2]:
+            row['session_id'] = 's2'
+        archive.append(rows + self._rows('u2', 's3', 9, 1))
+        archive.append(self._rows('u1', 's1', 6, 2))
+        
+        assert [r['id'] for r in archive.recent_queries('u1', 4)] == ['q7', 'q6', 'q5', 'q4']
+        assert [r['id'] for r in archive.iter_user_queries('u1')] == [f'q{i}' for i in range(8)]
+        after = {'created_at': '2024-01-01T00:00:03+00:00', 'id': 'q3'}
+        assert [r['id'] for r in archive.iter_user_queries('u1', after)] == ['q4', 'q5', 'q6', 'q7']
+    
+    def test_history_readers_include_archived_rows(self, app, tmp_path):
+        """Titles, history and export should continue into the archive"""
+        from finucity.archive import ChatArchive
+        from finucity.database import ChatService
+        archive = ChatArchive(directory=str(tmp_path))
+        archive.append(self._rows('u1', 's1', 0, 3))
+        hot = [{'id': 'q9', 'user_id': 'u1', 'session_id': 's2', 'question': 'Q9',
+                'created_at': '2024-06-01T00:00:00+00:00'}]
+        sb = MagicMock()
+        query = sb.table.return_value.select.return_value.eq.return_value
+        query.order.return_value.limit.return_value.execute.return_value.data = hot
+        with app.app_context(), patch('finucity.database.get_supabase', return_value=sb), \
+             patch.object(ChatService, 'cold_store', archive), \
+             patch.object(ChatService, 'get_user_queries_page', return_value=hot) as page:
+            assert [r.id for r in ChatService.list_titles('u1', limit=3)] == ['q9', 'q2', 'q1']
+            assert [r['id'] for r in ChatService.get_user_history('u1', limit=10)] == ['q9', 'q2', 'q1', 'q0']
+            assert [r['id'] for r in ChatService.iter_user_queries('u1')] == ['q0', 'q1', 'q2', 'q9']
+        assert page.call_args[0][1] == {'created_at': '2024-01-01T00:00:02+00:00', 'id': 'q2'}
+    
+    def test_history_page_mixes_archived_and_hot_rows(self, client, tmp_path):
+        """A /chat/history page spanning the archive should render the archived rows too"""
+        from finucity.archive import ChatArchive
+        from finucity.database import ChatService
+        archive = ChatArchive(directory=str(tmp_path))
+        archive.append(self._rows('u1', 's1', 0, 2) + self._rows('u2', 's2', 2, 1))
+        hot = [{'id': 'q9', 'user_id': 'u1', 'session_id': 's3', 'question': 'Q9', 'response': 'A9',
+                'created_at': '2024-06-01T00:00:00+00:00'}]
+        sb = MagicMock()
+        query = sb.table.return_value.select.return_value.eq.return_value
+        query.order.return_value.limit.return_value.execute.return_value.data = hot
+        query.in_.return_value.execute.return_value.data = hot  # the hot table only has q9
+        with patch('finucity.database.UserService.get_by_id', return_value={'id': 'u1', 'email': 'a@b.c'}), \
+                patch('finucity.database.get_supabase', return_value=sb), \
+                patch.object(ChatService, 'cold_store', archive), \
+                patch('finucity.chat_routes.render_template', return_value='ok') as render:
+            with client.session_transaction() as sess:
+                sess['_user_id'] = 'u1'
+                sess['_fresh'] = True
+            assert client.get('/chat/history').status_code == 200
+            assert ChatService.get_queries_by_ids('u1', ['q2']) == []  # another user's archived row
+        conversations = render.call_args.kwargs['conversations']
+        assert conversations.total == 3
+        assert [(q.id, q.response) for q in conversations.items] == [
+            ('q9', 'A9'), ('q1', 'A' * 200), ('q0', 'A' * 200)]
+
+
+# =====================================================================
+# PROFILE CACHE & METRICS TESTS
+# =====================================================================
+
+class TestProfileCache:
+    """Test the per-worker profile cache on the load_user path"""
+    
+    def test_hits_negative_caching_and_invalidation(self):
+        """Found and not-found results are cached until invalidated"""
+        from finucity.cache import TTLCache
+        cache = TTLCache('test', ttl=60, negative_ttl=60)
+        loads = []
+        
+        def loader():
+            loads.append(1)
+            return None if len(loads) == 1 else {'id': 'u1'}
+        
+        assert cache.get_or_load('u1', loader) is None
+        assert cache.get_or_load('u1', loader) is None  # negative hit
+        cache.invalidate('u1')
+        assert cache.get_or_load('u1', loader) == {'id': 'u1'}
+        assert cache.get_or_load('u1', loader) == {'id': 'u1'}
+        assert len(loads) == 2
+        assert cache.stats['negative_hits'] == 1 and cache.stats['hits'] == 1
+    
+    def test_weight_bound_evicts_oldest(self):
+        """With a weigher, total weight stays under max_weight and oversized values are not kept"""
+        from finucity.cache import TTLCache
+        cache = TTLCache('test', weigher=len, max_weight=10)
+        cache.set('a', 'xxxx')
+        cache.set('b', 'yyyy')
+        cache.set('c', 'zzzz')
+        assert cache.get('a') is None and cache.get('c') == 'zzzz' and cache.weight == 8
+        assert cache.get_or_load('big', lambda: 'w' * 11) == 'w' * 11
+        assert cache.get('big') is None and cache.weight == 8
+        cache.set('b', 'yy')
+        cache.invalidate('c')
+        assert cache.weight == 2 and cache.stats['evictions'] == 1
+    
+    def test_errors_are_not_cached(self):
+        """Loader exceptions propagate and the next call retries"""
+        from finucity.cache import TTLCache
+        cache = TTLCache('test')
+        with pytest.raises(RuntimeError):
+            cache.get_or_load('k', lambda: (_ for _ in ()).throw(RuntimeError('db down')))
+        assert cache.get_or_load('k', lambda: 42) == 42
+    
+    def test_stampede_protection(self):
+        """Concurrent misses on one key should share a single load"""
+        import threading
+        import time as _time
+        from finucity.cache import TTLCache
+        cache = TTLCache('test')
+        calls = []
+        
+        def slow_loader():
+            calls.append(1)
+            _time.sleep(0.05)
+            return 'profile'
+        
+        results = []
+        threads = [threading.Thread(target=lambda: results.append(cache.get_or_load('u', slow_loader)))
+                   for _ in range(8)]
+        for t in threads:
+            t.start()
+        for t in threads:
+            t.join()
+        assert results == ['profile'] * 8
+        assert len(calls) == 1
+    
+    def test_update_invalidates_cached_profile(self, app):
+        """UserService.update should drop the cached profile"""
+        from finucity.database import UserService, profile_cache
+        profile_cache.set('u-upd', {'id': 'u-upd', 'role': 'user'})
+        with app.app_context():
+            UserService.update('u-upd', {'role': 'ca'})
+        assert profile_cache.get('u-upd') is None
+    
+    def test_metrics_endpoint_exports_cache_stats(self, client):
+        """/metrics should expose the profile cache hit ratio"""
+        response = client.get('/metrics')
+        assert response.status_code == 200
+        body = response.data.decode()
+        assert 'finucity_cache_hit_ratio{cache="profiles"' in body
+        assert 'finucity_cache_saved_seconds_total' in body
+    
+    def test_metrics_endpoint_denied_by_default(self, client):
+        """/metrics should need the token, or a direct loopback scrape when none is set"""
+        with patch.dict(os.environ, {'METRICS_TOKEN': ''}):
+            assert client.get('/metrics', environ_base={'REMOTE_ADDR': '203.0.113.7'}).status_code == 403
+            assert client.get('/metrics', headers={'X-Forwarded-For': '203.0.113.7'}).status_code == 403
+        with patch.dict(os.environ, {'METRICS_TOKEN': 's3cret'}):
+            assert client.get('/metrics').status_code == 401
+            assert client.get('/metrics', headers={'Authorization': 'Bearer s3cret'},
+                              environ_base={'REMOTE_ADDR': '203.0.113.7'}).status_code == 200
+
+
+# =====================================================================
+# MANAGED CLIENT TESTS
+# =====================================================================
+
+class TestManagedClient:
+    """Test pooled Supabase client manager"""
+    
+    @staticmethod
+    def _manager(handler):
+        import httpx
+        from types import SimpleNamespace
+        import finucity.database as database
+        raw = SimpleNamespace(postgrest=SimpleNamespace(session=httpx.Client(
+            base_url='https://test.supabase.co/rest/v1', headers={'apikey': 'service-key'})))
+        with patch('finucity.database.create_client', return_value=raw):
+            manager = database.SupabaseClientManager('https://test.supabase.co', 'service-key')
+            manager._ensure()
+        manager._transport = httpx.MockTransport(handler)
+        return manager
+    
+    def test_reads_retry_with_backoff(self):
+        """Idempotent reads should be retried on gateway errors"""
+        import httpx
+        calls = []
+        
+        def handler(request):
+            calls.append(request)
+            return httpx.Response(503, text='busy') if len(calls) < 3 else httpx.Response(200, json=[{'id': 1}])
+        
+        manager = self._manager(handler)
+        with patch('finucity.database.SUPABASE_RETRY_BASE_DELAY', 0):
+            result = manager.client().table('profiles').select('id').eq('id', '1').execute()
+        assert result.data == [{'id': 1}]
+        assert len(calls) == 3
+        assert calls[0].headers['apikey'] == 'service-key'
+        assert manager.pool_stats()['retries'] == 2
+    
+    def test_writes_are_not_replayed(self):
+        """Writes should run once and use the write timeout"""
+        import httpx
+        from postgrest import APIError
+        calls = []
+        
+        def handler(request):
+            calls.append(request)
+            return httpx.Response(503, text='busy')
+        
+        manager = self._manager(handler)
+        with pytest.raises(APIError):
+            manager.client().table('profiles').insert({'id': '1'}).execute()
+        assert len(calls) == 1
+        assert calls[0].extensions['timeout']['read'] == manager.pool_stats()['timeouts']['write']
+    
+    def test_explicit_timeout_override(self):
+        """with_timeout should use a dedicated session on the same pool"""
+        import httpx
+        seen = []
+        
+        def handler(request):
+            seen.append(request.extensions['timeout']['read'])
+            return httpx.Response(200, json=[])
+        
+        manager = self._manager(handler)
+        manager.client().table('chat_queries').select('id').with_timeout(2.5).execute()
+        assert seen == [2.5]
+
+
+
+# =====================================================================
+# PARALLEL QUERY FAN-OUT TESTS
+# =====================================================================
+
+class TestParallelQueries:
+    """Test run_parallel used by the dashboard/stats endpoints"""
+    
+    def test_latency_is_max_not_sum(self, app):
+        """Independent queries should overlap"""
+        import time
+        from finucity.database import run_parallel
+        
+        def slow(value):
+            time.sleep(0.2)
+            return value
+        
+        with app.app_context():
+            started = time.monotonic()
+            results = run_parallel({name: (lambda n=name: slow(n)) for name in 'abcd'})
+            elapsed = time.monotonic() - started
+        assert results == {'a': 'a', 'b': 'b', 'c': 'c', 'd': 'd'}
+        assert results.ok
+        assert elapsed < 0.6
+    
+    def test_failures_and_timeouts_use_defaults(self, app):
+        """One bad query should not fail the batch"""
+        import time
+        from finucity.database import run_parallel
+        
+        def boom():
+            raise RuntimeError('db down')
+        
+        with app.app_context():
+            results = run_parallel({
+                'good': lambda: 1,
+                'bad': boom,
+                'slow': (lambda: time.sleep(0.5) or 3, 0.05),
+            }, defaults={'bad': 0, 'slow': -1})
+        assert results['good'] == 1
+        assert results['bad'] == 0
+        assert results['slow'] == -1
+        assert set(results.errors) == {'bad', 'slow'}
+        assert 'db down' in results.errors['bad']
+    
+    def test_nested_fanout_runs_inline(self, app):
+        """A fan-out inside a worker should not wait on the same pool"""
+        import threading
+        from finucity.database import run_parallel
+        
+        def inner():
+            outer_thread = threading.current_thread().name
+            nested = run_parallel({'x': lambda: threading.current_thread().name,
+                                   'y': lambda: threading.current_thread().name})
+            return outer_thread, nested['x'], nested['y']
+        
+        with app.app_context():
+            results = run_parallel({'one': inner, 'two': inner})
+        for outer_thread, x, y in results.values():
+            assert outer_thread == x == y
+    
+    def test_request_id_propagates(self, app):
+        """Workers should see the parent request id and have an app context"""
+        from flask import g, current_app
+        from finucity.database import run_parallel
+        
+        with app.test_request_context('/'):
+            g.request_id = 'req-123'
+            results = run_parallel({'a': lambda: (g.request_id, current_app.name),
+                                    'b': lambda: g.request_id})
+        assert results['a'] == ('req-123', app.name)
+        assert results['b'] == 'req-123'
+
+
+
+# =====================================================================
+# STATS SNAPSHOT TESTS
+# =====================================================================
+
+SAMPLE_STATS = {
+    'total_users': 120, 'total_queries': 900, 'total_cas': 7, 'pending_cas': 2,
+    'helpful_queries': 45, 'rated_queries': 50,
+    'query_ratings': {'1': 0, '2': 0, '3': 10, '4': 20, '5': 20},
+    'feedback_total': 10, 'feedback_ratings': {'1': 0, '2': 0, '3': 0, '4': 4, '5': 4},
+    'categories': {'tax': 500, 'gst': 300, 'investment': 80, 'crypto': 20},
+}
+
+
+class TestStatsSnapshot:
+    """Test the shared, background-refreshed platform stats"""
+    
+    @staticmethod
+    def _store(tmp_path, compute, **kwargs):
+        from finucity.stats_snapshot import StatsSnapshot
+        store = StatsSnapshot(path=str(tmp_path / 'stats.sqlite'), **kwargs)
+        store.register('platform', compute)
+        store._ensure_thread = lambda: None  # drive refreshes by hand
+        return store
+    
+    def test_cold_read_computes_once(self, tmp_path):
+        """First read fills the store; later reads do not recompute"""
+        calls = []
+        store = self._store(tmp_path, lambda: calls.append(1) or dict(SAMPLE_STATS))
+        first = store.read('platform')
+        second = store.read('platform')
+        assert first['data']['total_users'] == 120
+        assert first['last_updated'] == second['last_updated']
+        assert len(calls) == 1
+    
+    def test_store_is_shared_between_instances(self, tmp_path):
+        """Another worker reads the same file without computing"""
+        self._store(tmp_path, lambda: dict(SAMPLE_STATS)).refresh('platform')
+        other = self._store(tmp_path, lambda: pytest.fail('should not recompute'))
+        assert other.read('platform')['data']['total_queries'] == 900
+    
+    def test_lease_blocks_concurrent_refresh(self, tmp_path):
+        """Only one worker recomputes while the lease is held"""
+        store = self._store(tmp_path, lambda: dict(SAMPLE_STATS))
+        assert store._acquire('platform')
+        assert store.refresh('platform') is False
+        store._release('platform')
+        assert store.refresh('platform') is True
+    
+    def test_failed_refresh_keeps_previous_snapshot(self, tmp_path):
+        """A failing recompute must not replace good data"""
+        results = [dict(SAMPLE_STATS)]
+        
+        def compute():
+            if not results:
+                raise RuntimeError('db down')
+            return results.pop()
+        
+        store = self._store(tmp_path, compute)
+        assert store.refresh('platform')
+        assert store.refresh('platform') is False
+        assert store.read('platform')['data']['total_cas'] == 7
+        assert store.stats['refresh_errors'] == 1
+    
+    def test_mark_stale_respects_min_gap(self, tmp_path):
+        """On-change refreshes are due only after the minimum gap"""
+        store = self._store(tmp_path, lambda: dict(SAMPLE_STATS), interval=300, min_gap=0)
+        store.refresh('platform')
+        assert not store.due('platform')
+        store.mark_stale('platform')
+        assert store.due('platform')
+        store.min_gap = 60
+        assert not store.due('platform')
+    
+    def test_compute_snapshot_uses_counts(self, app):
+        """compute_snapshot aggregates head counts, not downloaded rows"""
+        from types import SimpleNamespace
+        from finucity.database import PlatformStatsService
+        sb = MagicMock()
+        response = SimpleNamespace(count=3, data=[])
+        for chain in ('select.return_value.limit', 'select.return_value.eq.return_value.limit',
+                      'select.return_value.not_.is_.return_value.limit'):
+            mock = sb.table.return_value
+            for part in chain.split('.'):
+                mock = getattr(mock, part)
+            mock.return_value.execute.return_value = response
+        with app.app_context(), patch('finucity.database.supabase_db.get_client', return_value=sb):
+            data = PlatformStatsService.compute_snapshot()
+        assert data['total_users'] == 3
+        assert data['query_ratings'] == {str(r): 3 for r in range(1, 6)}
+        assert data['categories'] == {category: 3 for category in
+                                      ('gst', 'income_tax', 'investment', 'business', 'insurance', 'tax', 'general')}
+        assert not sb.table.return_value.select.return_value.not_.in_.called  # no open-ended category scan
+    
+    def test_endpoints_read_snapshot(self, client, tmp_path):
+        """Public stats endpoints derive their payloads from the snapshot"""
+        from finucity.database import PlatformStatsService
+        store = self._store(tmp_path, lambda: dict(SAMPLE_STATS))
+        with patch.object(PlatformStatsService, 'snapshot', store), \
+             patch.object(PlatformStatsService, 'compute_snapshot', side_effect=AssertionError):
+            stats = client.get('/api/stats').get_json()['data']
+            home = client.get('/api/homepage-stats').get_json()
+        assert stats['users'] == 120
+        assert stats['accuracy'] == 90.0
+        assert stats['satisfaction'] == 84.0
+        assert [t['topic'] for t in stats['popular_topics']] == ['Tax Planning', 'GST', 'Investment', 'Crypto']
+        assert home['verified_cas'] == 7
+        assert home['accuracy_rate'] == 72.0
+        assert home['last_updated'] == stats['last_updated']
+
+
+
+# =====================================================================
+# CA AGGREGATE TESTS
+# =====================================================================
+
+class TestCAAggregates:
+    """Test server-side aggregate accessors and their Python fallback"""
+    
+    @staticmethod
+    def _client(views=None, tables=None, view_error=None):
+        """Fake Supabase client: view reads return `views[name]`, base tables `tables[name]`"""
+        from types import SimpleNamespace
+        calls = []
+        
+        def table(name):
+            def execute():
+                calls.append(name)
+                if views is not None and name in views:
+                    return SimpleNamespace(data=views[name])
+                if name.endswith('_totals') and view_error:
+                    raise view_error
+                return SimpleNamespace(data=(tables or {}).get(name, []))
+            query = MagicMock()
+            query.select.return_value.eq.return_value.execute.side_effect = execute
+            return query
+        
+        return SimpleNamespace(table=table), calls
+    
+    @pytest.fixture(autouse=True)
+    def _reset_missing(self):
+        import finucity.aggregates as aggregates
+        aggregates._missing_views.clear()
+        yield
+        aggregates._missing_views.clear()
+    
+    def test_view_rows_are_typed(self, app):
+        """One aggregate row becomes a typed result"""
+        from finucity.aggregates import CAAggregates
+        sb, calls = self._client(views={'ca_earnings_totals': [{
+            'ca_id': 'ca1', 'total_earned': 5000, 'total_withdrawn': 1000,
+            'pending_amount': 500, 'this_month_earned': 800, 'transaction_count': 12}]})
+        with app.app_context(), patch('finucity.aggregates.get_supabase', return_value=sb):
+            totals = CAAggregates.earnings('ca1')
+        assert totals.available_balance == 3500
+        assert totals.this_month_earned == 800
+        assert calls == ['ca_earnings_totals']
+    
+    def test_missing_view_falls_back_once(self, app):
+        """A missing view is folded in Python and not retried"""
+        from datetime import datetime
+        from postgrest import APIError
+        from finucity.aggregates import CAAggregates
+        now = datetime.utcnow().isoformat()
+        rows = [
+            {'amount': 1000, 'transaction_type': 'credit', 'status': 'completed', 'created_at': '2020-01-01T00:00:00Z'},
+            {'amount': 300, 'transaction_type': 'credit', 'status': 'approved', 'created_at': now},
+            {'amount': 200, 'transaction_type': 'debit', 'status': 'completed', 'created_at': now},
+        ]
+        sb, calls = self._client(tables={'ca_earnings': rows},
+                                 view_error=APIError({'code': '42P01', 'message': 'missing'}))
+        with app.app_context(), patch('finucity.aggregates.get_supabase', return_value=sb):
+            first = CAAggregates.earnings('ca1')
+            second = CAAggregates.earnings('ca1')
+        assert first == second
+        assert (first.total_earned, first.pending_amount, first.total_withdrawn) == (1000, 300, 200)
+        assert first.this_month_earned == 300
+        assert calls == ['ca_earnings_totals', 'ca_earnings', 'ca_earnings']
+    
+    def test_other_errors_propagate(self, app):
+        """Only a missing relation triggers the fallback"""
+        from postgrest import APIError
+        from finucity.aggregates import CAAggregates
+        sb, _ = self._client(view_error=APIError({'code': '57014', 'message': 'timeout'}))
+        with app.app_context(), patch('finucity.aggregates.get_supabase', return_value=sb):
+            with pytest.raises(APIError):
+                CAAggregates.reviews('ca1')
+    
+    def test_ratings_merge_published_groups(self, app):
+        """published_only picks groups; distribution and aspect averages survive"""
+        from finucity.aggregates import CAAggregates
+        group = {'total_reviews': 2, 'sum_overall': 9, 'sum_communication': 8, 'sum_expertise': 5,
+                 'sum_timeliness': 0, 'sum_value': 10, 'rating_1': 0, 'rating_2': 0,
+                 'rating_3': 0, 'rating_4': 1, 'rating_5': 1}
+        sb, _ = self._client(views={'ca_rating_totals': [
+            dict(group, is_published=True),
+            dict(group, is_published=False, total_reviews=1, sum_overall=1, rating_1=1, rating_4=0, rating_5=0),
+        ]})
+        with app.app_context(), patch('finucity.aggregates.get_supabase', return_value=sb):
+            published = CAAggregates.ratings('ca1')
+            everything = CAAggregates.ratings('ca1', published_only=False)
+        assert published.average_rating == 4.5
+        assert published.average_of('expertise') == 2.5
+        assert published.distribution == {1: 0, 2: 0, 3: 0, 4: 1, 5: 1}
+        assert everything.total_reviews == 3
+        assert everything.distribution[1] == 1
+    
+    def test_consultation_fallback_rates(self):
+        """Python fold matches the view's response/completion definitions"""
+        from finucity.aggregates import _fold_consultations, _build, ConsultationTotals
+        rows = [
+            {'client_id': 'a', 'status': 'completed', 'created_at': '2024-01-01T00:00:00Z', 'updated_at': '2024-01-01T05:00:00Z'},
+            {'client_id': 'a', 'status': 'accepted', 'created_at': '2024-01-01T00:00:00Z', 'updated_at': '2024-01-03T00:00:00Z'},
+            {'client_id': 'b', 'status': 'pending', 'created_at': '2024-01-01T00:00:00Z', 'updated_at': '2024-01-01T00:00:00Z'},
+        ]
+        totals = _build(ConsultationTotals, _fold_consultations(rows)[0])
+        assert (totals.total_clients, totals.active, totals.pending) == (2, 1, 1)
+        assert totals.response_rate == 50
+        assert totals.completion_rate == 50
+    
+    def test_reviews_page_reads_one_page(self, client):
+        """Review list should fetch one page; counts come from the aggregate"""
+        from finucity.aggregates import RatingTotals
+        from finucity.trust_routes import REVIEWS_PAGE_SIZE
+        sb = MagicMock()
+        sb.table.return_value.select.return_value.eq.return_value.single.return_value.execute.return_value.data = \
+            {'id': 'ca-1', 'first_name': 'Asha', 'last_name': 'Rao'}
+        reviews = sb.table.return_value.select.return_value.eq.return_value.eq.return_value.order.return_value
+        reviews.range.return_value.execute.return_value.data = [{'id': 'r-1', 'overall_rating': 5}]
+        totals = RatingTotals(total_reviews=45, sum_overall=180)
+        with patch('finucity.trust_routes.get_supabase', return_value=sb), \
+                patch('finucity.trust_routes.CAAggregates.ratings', return_value=totals), \
+                patch('finucity.trust_routes.render_template', return_value='ok') as render:
+            response = client.get('/trust/ca/ca-1/reviews?page=2')
+        assert response.status_code == 200
+        reviews.range.assert_called_once_with(REVIEWS_PAGE_SIZE, 2 * REVIEWS_PAGE_SIZE - 1)
+        assert not reviews.execute.called
+        kwargs = render.call_args.kwargs
+        assert kwargs['stats']['total_reviews'] == 45 and kwargs['stats']['average_rating'] == 4
+        assert (kwargs['page'], kwargs['pages']) == (2, -(-45 // REVIEWS_PAGE_SIZE))
+
+
+
+# =====================================================================
+# EARNINGS LEDGER TESTS
+# =====================================================================
+
+class _FakeQuery:
+    """Just enough of the PostgREST builder for the ledger's local fallback"""
+    
+    def __init__(self, rows, op='select', payload=None):
+        self.rows, self.op, self.payload = rows, op, payload
+        self.filters, self.order_key, self.desc, self.max_rows = [], None, False, None
+    
+    def select(self, *args, **kwargs):
+        return self
+    
+    def eq(self, column, value):
+        self.filters.append(lambda row: row.get(column) == value)
+        return self
+    
+    def gt(self, column, value):
+        self.filters.append(lambda row: row.get(column) is not None and row[column] > value)
+        return self
+    
+    def order(self, column, desc=False):
+        self.order_key, self.desc = column, desc
+        return self
+    
+    def limit(self, count):
+        self.max_rows = count
+        return self
+    
+    def execute(self):
+        from types import SimpleNamespace
+        if self.op == 'insert':
+            row = dict(self.payload, id=self.payload.get('id') or f"row-{len(self.rows) + 1}")
+            self.rows.append(row)
+            return SimpleNamespace(data=[dict(row)])
+        matched = [row for row in self.rows if all(f(row) for f in self.filters)]
+        if self.op == 'update':
+            for row in matched:
+                row.update(self.payload)
+        if self.order_key:
+            matched.sort(key=lambda row: row[self.order_key], reverse=self.desc)
+        return SimpleNamespace(data=[dict(row) for row in matched[:self.max_rows]])
+
+
+class _FakeLedgerDB:
+    """Tables as lists; every RPC reports "function not found" so the fallback runs"""
+    
+    def __init__(self, **tables):
+        from collections import defaultdict
+        self.tables = defaultdict(list, tables)
+    
+    def table(self, name):
+        rows = self.tables[name]
+        fake = MagicMock()
+        fake.select.side_effect = lambda *a, **k: _FakeQuery(rows)
+        fake.insert.side_effect = lambda payload: _FakeQuery(rows, 'insert', payload)
+        fake.update.side_effect = lambda payload: _FakeQuery(rows, 'update', payload)
+        return fake
+    
+    def rpc(self, name, params):
+        from postgrest import APIError
+        raise APIError({'code': 'PGRST202', 'message': f'function {name} not found'})
+
+
+class TestLedger:
+    """Test the append-only CA earnings ledger (local fallback path)"""
+    
+    @pytest.fixture(autouse=True)
+    def _reset(self):
+        import finucity.ledger as ledger
+        ledger._missing_rpcs.clear()
+        ledger._ledger_tables.clear()
+        yield
+        ledger._missing_rpcs.clear()
+        ledger._ledger_tables.clear()
+    
+    def test_withdrawal_holds_funds_and_blocks_overdraw(self, app):
+        """A second withdrawal cannot spend funds already held"""
+        from finucity.ledger import LedgerService, LedgerError
+        db = _FakeLedgerDB(profiles=[{'id': 'ca1', 'earnings_frozen': False}])
+        with app.app_context(), patch('finucity.ledger.get_supabase', return_value=db):
+            LedgerService.post('ca1', 'credit', 1000, 'e1')
+            LedgerService.request_withdrawal('ca1', 700, description='first')
+            with pytest.raises(LedgerError) as err:
+                LedgerService.request_withdrawal('ca1', 700, description='second')
+            assert err.value.code == 'insufficient_funds'
+            assert err.value.available == 300
+            assert LedgerService.balance('ca1').balance == 300
+        assert [row['status'] for row in db.tables['ca_earnings']] == ['pending']
+    
+    def test_frozen_earnings_block_withdrawals(self, app):
+        """set_frozen is honoured by request_withdrawal"""
+        from finucity.ledger import LedgerService, LedgerError
+        db = _FakeLedgerDB(profiles=[{'id': 'ca1', 'role': 'ca', 'earnings_frozen': False}])
+        with app.app_context(), patch('finucity.ledger.get_supabase', return_value=db):
+            LedgerService.post('ca1', 'credit', 5000, 'e1')
+            assert LedgerService.set_frozen('ca1', True, role='ca')['earnings_frozen'] is True
+            with pytest.raises(LedgerError) as err:
+                LedgerService.request_withdrawal('ca1', 600)
+        assert err.value.code == 'earnings_frozen'
+    
+    def test_snapshots_bound_balance_reads(self, app):
+        """Balance = latest snapshot + entries after it"""
+        from finucity.ledger import LedgerService
+        db = _FakeLedgerDB()
+        with app.app_context(), patch('finucity.ledger.get_supabase', return_value=db), \
+             patch('finucity.ledger.LEDGER_SNAPSHOT_EVERY', 5):
+            for i in range(12):
+                LedgerService.post('ca1', 'credit', 10, f'e{i}')
+            balance = LedgerService.balance('ca1')
+        assert [s['seq'] for s in db.tables['ca_ledger_snapshots']] == [5, 10]
+        assert (balance.balance, balance.seq, balance.snapshot_seq) == (120, 12, 10)
+    
+    def test_posts_are_idempotent_per_reference(self, app):
+        """Replaying a rejection does not release funds twice"""
+        from finucity.ledger import LedgerService
+        db = _FakeLedgerDB(profiles=[{'id': 'ca1'}])
+        with app.app_context(), patch('finucity.ledger.get_supabase', return_value=db):
+            LedgerService.post('ca1', 'credit', 1000, 'e1')
+            transaction = LedgerService.request_withdrawal('ca1', 600)['transaction']
+            LedgerService.release_withdrawal(transaction)
+            LedgerService.release_withdrawal(transaction)
+            assert LedgerService.balance('ca1').balance == 1000
+        assert len(db.tables['ca_ledger_entries']) == 3
+    
+    def test_reconcile_and_backfill(self, app):
+        """Reconciliation flags unposted earnings; backfill repairs them"""
+        from finucity.ledger import LedgerService
+        db = _FakeLedgerDB(ca_earnings=[
+            {'id': 'c1', 'ca_id': 'ca1', 'transaction_type': 'credit', 'status': 'completed', 'amount': 2000, 'created_at': '2024-01-01'},
+            {'id': 'd1', 'ca_id': 'ca1', 'transaction_type': 'debit', 'status': 'rejected', 'amount': 500, 'created_at': '2024-01-02'},
+            {'id': 'd2', 'ca_id': 'ca1', 'transaction_type': 'debit', 'status': 'pending', 'amount': 700, 'created_at': '2024-01-03'},
+        ])
+        with app.app_context(), patch('finucity.ledger.get_supabase', return_value=db):
+            before = LedgerService.reconcile('ca1')
+            assert not before['ok'] and before['missing'] == 4
+            assert LedgerService.backfill('ca1') == 4
+            after = LedgerService.reconcile('ca1')
+        assert after['ok'], after['issues']
+        assert after['balance'] == after['expected_balance'] == 1300
+    
+    def test_reconcile_detects_tampering(self, app):
+        """A running balance that does not replay is reported"""
+        from finucity.ledger import LedgerService
+        db = _FakeLedgerDB()
+        with app.app_context(), patch('finucity.ledger.get_supabase', return_value=db):
+            LedgerService.post('ca1', 'adjustment', 100)
+            db.tables['ca_ledger_entries'][0]['balance_after'] = 999
+            report = LedgerService.reconcile('ca1')
+        assert not report['ok']
+        assert any('balance_after' in issue for issue in report['issues'])
+    
+    def test_completed_credits_count_without_the_trigger(self, app):
+        """Credits completed in ca_earnings are available even though no trigger posted them"""
+        from finucity.ledger import LedgerService
+        db = _FakeLedgerDB(profiles=[{'id': 'ca1'}], ca_earnings=[
+            {'id': 'c1', 'ca_id': 'ca1', 'transaction_type': 'credit', 'status': 'completed', 'amount': 1500},
+            {'id': 'c2', 'ca_id': 'ca1', 'transaction_type': 'credit', 'status': 'pending', 'amount': 900},
+        ])
+        with app.app_context(), patch('finucity.ledger.get_supabase', return_value=db):
+            LedgerService.post('ca1', 'credit', 200, 'e1')
+            assert LedgerService.balance('ca1').balance == 1700
+            LedgerService.request_withdrawal('ca1', 1000)
+            assert LedgerService.balance('ca1').balance == 700
+            LedgerService.post('ca1', 'credit', 1500, 'c1')  # posted late: not counted twice
+            assert LedgerService.balance('ca1').balance == 700
+    
+    def test_missing_ledger_tables_fall_back_to_earnings(self, app):
+        """Without the PART 3 tables the balance is the sum over ca_earnings"""
+        from postgrest import APIError
+        from finucity.ledger import LedgerService, LedgerError
+        
+        class NoLedgerDB(_FakeLedgerDB):
+            def table(self, name):
+                if name.startswith('ca_ledger'):
+                    raise APIError({'code': 'PGRST205', 'message': f'table {name} not found'})
+                return super().table(name)
+        
+        db = NoLedgerDB(profiles=[{'id': 'ca1', 'earnings_frozen': False}], ca_earnings=[
+            {'id': 'c1', 'ca_id': 'ca1', 'transaction_type': 'credit', 'status': 'completed', 'amount': 1000},
+            {'id': 'd1', 'ca_id': 'ca1', 'transaction_type': 'debit', 'status': 'rejected', 'amount': 400},
+        ])
+        with app.app_context(), patch('finucity.ledger.get_supabase', return_value=db):
+            assert LedgerService.balance('ca1').balance == 1000
+            result = LedgerService.request_withdrawal('ca1', 600)
+            assert result['entry'] is None and result['transaction']['status'] == 'pending'
+            with pytest.raises(LedgerError) as err:
+                LedgerService.request_withdrawal('ca1', 600)
+            assert err.value.available == 400
+            LedgerService.adjust('ca1', 50, 'goodwill', 'admin-1')
+            assert LedgerService.balance('ca1').balance == 450
+    
+    def test_rpc_business_errors_are_mapped(self):
+        """Errors raised inside the SQL functions become LedgerError"""
+        from postgrest import APIError
+        from finucity.ledger import _raise_business_error, LedgerError
+        with pytest.raises(LedgerError) as err:
+            _raise_business_error(APIError({'code': 'P0001', 'message': 'insufficient_funds: available 250.50'}))
+        assert err.value.available == 250.5
+
+
+# =====================================================================
+# IDENTITY MAP TESTS
+# =====================================================================
+
+class TestIdentityMap:
+    """Test request-scoped dedupe of identical reads"""
+    
+    @staticmethod
+    def _client():
+        import httpx
+        calls = []
+        
+        def handler(request):
+            calls.append((request.method, request.url.path, str(request.url.query)))
+            if request.method == 'GET':
+                return httpx.Response(200, json=[{'id': '1', 'username': 'asha'}])
+            return httpx.Response(201, json=[{'id': '1'}])
+        
+        return TestManagedClient._manager(handler).client(), calls
+    
+    def test_identical_reads_hit_once(self, app):
+        """The same table/filter/projection should be fetched once per request"""
+        client, calls = self._client()
+        with app.test_request_context('/'):
+            first = client.table('profiles').select('id, username').eq('id', '1').execute()
+            first.data[0]['username'] = 'mutated'
+            second = client.table('profiles').select('id, username').eq('id', '1').execute()
+            from flask import g
+            assert g._identity_map.stats()['saved'] == 1
+        assert len(calls) == 1
+        assert second.data == [{'id': '1', 'username': 'asha'}]
+    
+    def test_projection_and_filters_are_part_of_key(self, app):
+        """Different projections or filters are separate reads"""
+        client, calls = self._client()
+        with app.test_request_context('/'):
+            client.table('profiles').select('id').eq('id', '1').execute()
+            client.table('profiles').select('id, username').eq('id', '1').execute()
+            client.table('profiles').select('id').eq('id', '2').execute()
+            client.table('profiles').select('id').eq('id', '1').single().execute()
+        assert len(calls) == 4
+    
+    def test_write_invalidates_same_table_only(self, app):
+        """A write should drop cached reads for its table, not others"""
+        client, calls = self._client()
+        with app.test_request_context('/'):
+            client.table('profiles').select('*').eq('id', '1').execute()
+            client.table('chat_queries').select('*').eq('id', '1').execute()
+            client.table('profiles').update({'username': 'b'}).eq('id', '1').execute()
+            client.table('profiles').select('*').eq('id', '1').execute()
+            client.table('chat_queries').select('*').eq('id', '1').execute()
+            client.table('profiles').select('*').eq('id', '1').fresh().execute()
+        assert [c[1] for c in calls] == ['/rest/v1/profiles', '/rest/v1/chat_queries',
+                                         '/rest/v1/profiles', '/rest/v1/profiles', '/rest/v1/profiles']
+    
+    def test_only_primary_key_lookups_are_kept(self, app):
+        """List reads and no_identity() reads always hit the database and are not stored"""
+        client, calls = self._client()
+        with app.test_request_context('/'):
+            for _ in range(2):
+                client.table('chat_queries').select('*').eq('user_id', '1').order('created_at').limit(200).execute()
+                client.table('profiles').select('*').eq('id', '1').limit(1).no_identity().execute()
+            from flask import g
+            assert len(g._identity_map) == 0
+        assert len(calls) == 4
+    
+    def test_entries_are_capped(self, app):
+        """The oldest lookups are dropped past the entry cap"""
+        client, calls = self._client()
+        with app.test_request_context('/'), patch('finucity.database.IDENTITY_MAP_MAX_ENTRIES', 2):
+            for user_id in ('1', '2', '3', '3', '1'):
+                client.table('profiles').select('*').eq('id', user_id).execute()
+            from flask import g
+            assert len(g._identity_map) == 2
+        assert len(calls) == 4
+    
+    def test_no_dedupe_outside_request(self):
+        """Background jobs without a request context always hit the database"""
+        client, calls = self._client()
+        client.table('profiles').select('*').execute()
+        client.table('profiles').select('*').execute()
+        assert len(calls) == 2
+    
+    def test_debug_header_reports_saved_round_trips(self, app):
+        """after_request should expose the saved count when debug headers are on"""
+        from flask import Response
+        from finucity.database import current_identity_map, report_identity_map
+        with patch('finucity.database.DB_DEBUG_HEADERS', True), app.test_request_context('/'):
+            identity = current_identity_map()
+            identity.put(('profiles',), {'data': []})
+            identity.get(('profiles',))
+            response = report_identity_map(Response('ok'))
+        assert response.headers['X-DB-Roundtrips-Saved'] == '1'
+
+
+# =====================================================================
+# QUERY TRACE TESTS
+# =====================================================================
+
+class TestQueryTrace:
+    """Test per-request PostgREST instrumentation"""
+    
+    @staticmethod
+    def _client():
+        import httpx
+        
+        def handler(request):
+            return httpx.Response(200, json=[{'id': '1'}, {'id': '2'}])
+        
+        return TestManagedClient._manager(handler).client()
+    
+    def test_records_table_rows_bytes_and_shape(self, app):
+        """Each execute should be accounted against the request"""
+        from finucity.query_trace import query_tracer
+        client = self._client()
+        with app.test_request_context('/'):
+            from flask import g
+            g.request_id = 'rid-1'
+            client.table('profiles').select('id').eq('username', 'asha').limit(1).execute()
+            client.table('profiles').select('id').eq('username', 'asha').limit(1).execute()
+            trace = query_tracer.current()
+            summary = trace.summary()
+        assert summary['request_id'] == 'rid-1'
+        assert summary['queries'] == 1 and summary['deduped'] == 1
+        assert summary['rows'] == 2
+        assert summary['bytes'] > 0
+        record = trace.records[0]
+        assert record.table == 'profiles' and record.op == 'read'
+        assert record.shape == ('username=eq',)
+    
+    def test_n_plus_one_is_flagged_once(self, app):
+        """Repeating one query shape past the threshold should warn once"""
+        from finucity.query_trace import query_tracer
+        client = self._client()
+        with patch('finucity.query_trace.QUERY_N1_THRESHOLD', 3), app.test_request_context('/'), \
+                patch.object(app.logger, 'warning') as warning:
+            for candidate in ['a', 'b', 'c', 'd', 'e']:
+                client.table('profiles').select('id').eq('username', candidate).limit(1).execute()
+            summary = query_tracer.current().summary()
+        assert summary['n_plus_one'] == [{'table': 'profiles', 'method': 'GET',
+                                          'shape': ['username=eq'], 'count': 5}]
+        assert sum('Possible N+1' in str(c) for c in warning.call_args_list) == 1
+    
+    def test_keyset_export_paging_is_not_flagged(self, app):
+        """Pages fetched inside expect_repeats() are counted but never flagged as N+1"""
+        import httpx
+        import uuid
+        from finucity.database import ChatService
+        from finucity.query_trace import query_tracer
+        served = []
+        
+        def handler(request):
+            served.append(request.url.query)
+            if len(served) > 6:
+                return httpx.Response(200, json=[])
+            return httpx.Response(200, json=[
+                {'id': str(uuid.UUID(int=2 * len(served) + i)), 'created_at': f'2025-01-01T00:00:{len(served):02d}+00:00'}
+                for i in range(2)])
+        
+        client = TestManagedClient._manager(handler).client()
+        with patch('finucity.query_trace.QUERY_N1_THRESHOLD', 3), app.test_request_context('/'), \
+                patch('finucity.database.get_supabase', return_value=client), \
+                patch.object(app.logger, 'warning') as warning:
+            rows = list(ChatService.iter_user_queries('u1', page_size=2))
+            summary = query_tracer.current().summary()
+        assert len(rows) == 12 and summary['queries'] == 7
+        assert summary['n_plus_one'] == []
+        assert not any('Possible N+1' in str(c) for c in warning.call_args_list)
+    
+    def test_fanout_workers_share_the_request_trace(self, app):
+        """run_parallel queries should count toward the parent request"""
+        from finucity.database import run_parallel
+        from finucity.query_trace import query_tracer
+        client = self._client()
+        with app.test_request_context('/'):
+            run_parallel({
+                'a': lambda: client.table('profiles').select('id').execute(),
+                'b': lambda: client.table('chat_queries').select('id').execute(),
+            })
+            assert query_tracer.current().queries == 2
+    
+    def test_slow_queries_are_sampled(self, app):
+        """Slow queries are always counted, logged at the sample rate"""
+        from finucity.metrics import metrics
+        client = self._client()
+        before = metrics.value('finucity_db_slow_queries_total', table='slow_table') or 0
+        with patch('finucity.query_trace.QUERY_SLOW_MS', 0), \
+                patch('finucity.query_trace.QUERY_SLOW_SAMPLE_RATE', 0), \
+                patch.object(app.logger, 'warning') as warning, app.app_context():
+            client.table('slow_table').select('id').execute()
+        assert metrics.value('finucity_db_slow_queries_total', table='slow_table') == before + 1
+        assert not any('Slow query' in str(c) for c in warning.call_args_list)
+    
+    def test_request_totals_emitted(self, app):
+        """after_request should log totals and expose debug headers"""
+        from flask import Response
+        from finucity.query_trace import query_tracer
+        client = self._client()
+        with patch('finucity.query_trace.DB_DEBUG_HEADERS', True), app.test_request_context('/'), \
+                patch.object(app.logger, 'debug') as debug:
+            client.table('profiles').select('id').execute()
+            response = query_tracer.emit(Response('ok'))
+        assert response.headers['X-DB-Queries'] == '1'
+        assert response.headers['Server-Timing'].startswith('db;dur=')
+        assert any('1 queries' in str(c) for c in debug.call_args_list)
+
+
+# =====================================================================
+# PROJECTION / ROW TYPE TESTS
+# =====================================================================
+
+class TestProjectedRows:
+    """Test projection-aware accessors and compact row types"""
+    
+    def test_ca_layout_sees_suspension_through_projection(self, app):
+        """The CA workspace banner reads ca_status / verification_status from the projected profile"""
+        from flask import render_template
+        from flask_login import login_user
+        from finucity.models import User
+        from finucity.rows import ProfileRow
+        profile = {'id': 'ca-1', 'email': 'ca@x.com', 'first_name': 'Asha', 'last_name': 'Rao', 'role': 'ca',
+                   'ca_status': 'suspended', 'verification_status': 'pending', 'bio': 'not projected'}
+        assert 'ca_status' in ProfileRow.columns() and 'verification_status' in ProfileRow.columns()
+        user = User(ProfileRow.from_row(profile))
+        with app.test_request_context('/ca/dashboard'):
+            login_user(user)
+            html = render_template('ca/layout.html')
+        assert 'Your account has been suspended' in html
+        assert 'window.CA_STATUS = "suspended"' in html and 'window.CA_VERIFIED = false' in html
+        assert user.ca_verification_status == 'pending'
+    
+    def test_rows_are_slotted_and_dict_compatible(self):
+        """Rows should drop unknown columns, have no __dict__ and answer .get()"""
+        from finucity.rows import ChatTitleRow
+        row = ChatTitleRow.from_row({'id': 7, 'question': 'Q?', 'response': 'x' * 5000, 'category': None})
+        assert not hasattr(row, '__dict__')
+        assert not hasattr(row, 'response')
+        assert row['question'] == 'Q?' and row.get('category', 'general') == 'general'
+        assert 'question' in row and 'response' not in row
+        assert row.to_dict()['id'] == 7
+    
+    def test_list_titles_selects_no_response(self, app):
+        """list_titles should project away the AI response"""
+        import httpx
+        from finucity.database import ChatService
+        from finucity.rows import ChatTitleRow
+        seen = []
+        
+        def handler(request):
+            seen.append(request.url.params['select'])
+            return httpx.Response(200, json=[{'id': 1, 'question': 'Q?', 'created_at': '2024-01-01'}])
+        
+        client = TestManagedClient._manager(handler).client()
+        with app.app_context(), patch('finucity.database.get_supabase', return_value=client):
+            titles = ChatService.list_titles('u-1', limit=5)
+        assert 'response' not in seen[0].split(', ')
+        assert seen[0] == ChatTitleRow.columns()
+        assert isinstance(titles[0], ChatTitleRow) and titles[0].question == 'Q?'
+    
+    def test_missing_column_falls_back_to_wide_select(self, app):
+        """An undefined-column error should retry with '*' once and stick"""
+        import httpx
+        import finucity.rows as rows
+        from finucity.database import UserService
+        seen = []
+        
+        def handler(request):
+            seen.append(request.url.params['select'])
+            if request.url.params['select'] != '*':
+                return httpx.Response(400, json={'code': '42703', 'message': 'column does not exist'})
+            return httpx.Response(200, json=[{'id': 'u-1', 'role': 'user', 'bio': 'long'}])
+        
+        manager = TestManagedClient._manager(handler)
+        with app.app_context(), patch.object(rows, '_wide_fallbacks', set()), \
+                patch('finucity.database.supabase_db.get_client', return_value=manager.client()):
+            first = UserService._fetch_by_id('u-1')
+            UserService._fetch_by_id('u-2')
+        assert seen == [rows.ProfileRow.columns(), '*', '*']
+        assert first.role == 'user' and first.get('is_active', True) is True
+    
+    def test_history_page_fetches_full_rows_for_page_only(self, client, app):
+        """The history page should list titles and load responses for one page"""
+        from finucity.rows import ChatQueryRow, ChatTitleRow
+        titles = [ChatTitleRow(id=i, question=f'Q{i}', rating=5, created_at='2024-01-01') for i in range(30)]
+        with patch('finucity.database.UserService.get_by_id', return_value={'id': 'u-1', 'email': 'a@b.c'}), \
+                patch('finucity.chat_routes.ChatService.list_titles', return_value=titles), \
+                patch('finucity.chat_routes.ChatService.get_queries_by_ids',
+                      return_value=[ChatQueryRow(id=0, question='Q0', response='A0')]) as by_ids, \
+                patch('finucity.chat_routes.render_template', return_value='ok') as render:
+            with client.session_transaction() as sess:
+                sess['_user_id'] = 'u-1'
+                sess['_fresh'] = True
+            response = client.get('/chat/history')
+        assert response.status_code == 200
+        assert by_ids.call_args[0][1] == list(range(20))
+        assert render.call_args.kwargs['five_star_count'] == 30
+
+
+# =====================================================================
+# BULK WRITE TESTS
+# =====================================================================
+
+class _FakeBulkDB:
+    """Counts round trips; rows with 'bad' set are rejected like a constraint violation"""
+    
+    def __init__(self, existing=(), rpc_missing=False):
+        self.calls = []
+        self.rows = {row['id']: dict(row) for row in existing}
+        self.rpc_missing = rpc_missing
+    
+    def _reject(self, rows):
+        from postgrest import APIError
+        if any(row.get('bad') for row in rows):
+            raise APIError({'code': '23514', 'message': 'check constraint violated'})
+    
+    def table(self, name):
+        from types import SimpleNamespace
+        db = self
+        
+        class Query:
+            def insert(self, rows):
+                rows = rows if isinstance(rows, list) else [rows]
+                
+                def execute():
+                    db.calls.append(('insert', name, len(rows)))
+                    db._reject(rows)
+                    return SimpleNamespace(data=[dict(r) for r in rows])
+                return SimpleNamespace(execute=execute)
+            
+            def update(self, changes):
+                def eq(column, value):
+                    def execute():
+                        db.calls.append(('update', name, value))
+                        db._reject([changes])
+                        if value not in db.rows:
+                            return SimpleNamespace(data=[])
+                        db.rows[value].update(changes)
+                        return SimpleNamespace(data=[db.rows[value]])
+                    return SimpleNamespace(execute=execute)
+                return SimpleNamespace(eq=eq)
+        return Query()
+    
+    def rpc(self, fn, params):
+        from types import SimpleNamespace
+        from postgrest import APIError
+        
+        def execute():
+            self.calls.append(('rpc', fn, len(params['p_rows'])))
+            if self.rpc_missing:
+                raise APIError({'code': 'PGRST202', 'message': 'not found'})
+            updated = []
+            for row in params['p_rows']:
+                if row[params['p_key']] in self.rows:
+                    self.rows[row[params['p_key']]].update(row)
+                    updated.append(row[params['p_key']])
+            return SimpleNamespace(data=updated)
+        return SimpleNamespace(execute=execute)
+
+
+class TestBulkWrites:
+    """Test chunked bulk writes with per-row errors"""
+    
+    def test_insert_chunks_and_isolates_bad_rows(self, app):
+        """A rejected chunk should be replayed row by row to pin the error"""
+        from finucity.bulk import BulkWriter
+        db = _FakeBulkDB()
+        rows = [{'id': i, 'bad': i == 3} for i in range(5)]
+        with app.app_context(), patch('finucity.bulk.get_supabase', return_value=db):
+            result = BulkWriter.insert('notifications', rows, chunk_size=2)
+        assert result.succeeded == 4
+        assert list(result.errors) == [3] and 'constraint' in result.errors[3]
+        # chunks [0,1] ok, [2,3] rejected then replayed as 2 singles, [4] ok
+        assert result.round_trips == 5
+    
+    def test_update_many_is_one_rpc_per_chunk(self, app):
+        """Batched updates should cost a constant number of round trips"""
+        from finucity.bulk import BulkWriter
+        db = _FakeBulkDB(existing=[{'id': f's{i}', 'base_price': 0} for i in range(10)])
+        updates = [{'id': f's{i}', 'base_price': 100 + i} for i in range(10)] + [{'id': 'nope', 'base_price': 1}]
+        with app.app_context(), patch('finucity.bulk.get_supabase', return_value=db):
+            result = BulkWriter.update_many('service_catalog', updates)
+        assert db.calls == [('rpc', 'bulk_update_rows', 11)]
+        assert result.succeeded == 10 and result.errors == {10: 'not found'}
+        assert db.rows['s4']['base_price'] == 104
+    
+    def test_update_many_falls_back_when_rpc_missing(self, app):
+        """Without the migration, updates run row by row (and remember that)"""
+        import finucity.bulk as bulk
+        db = _FakeBulkDB(existing=[{'id': 'a'}, {'id': 'b'}], rpc_missing=True)
+        with app.app_context(), patch('finucity.bulk.get_supabase', return_value=db), \
+                patch.object(bulk, '_missing_rpcs', set()):
+            first = bulk.BulkWriter.update_many('service_catalog', [{'id': 'a', 'x': 1}, {'id': 'b', 'x': 2}])
+            bulk.BulkWriter.update_many('service_catalog', [{'id': 'a', 'x': 3}])
+        assert first.ok and first.succeeded == 2
+        assert [c[0] for c in db.calls] == ['rpc', 'update', 'update', 'update']
+    
+    def test_disabled_flag_writes_row_by_row(self, app):
+        """ENABLE_BULK_OPERATIONS=false should keep per-row writes"""
+        from finucity.bulk import BulkWriter
+        db = _FakeBulkDB()
+        app.config['ENABLE_BULK_OPERATIONS'] = False
+        try:
+            with app.app_context(), patch('finucity.bulk.get_supabase', return_value=db):
+                result = BulkWriter.insert('calculator_history', [{'id': 1}, {'id': 2}, {'id': 3}])
+        finally:
+            app.config['ENABLE_BULK_OPERATIONS'] = True
+        assert result.ok and result.round_trips == 3
+    
+    def test_buffer_coalesces_rows_per_table(self, app):
+        """Queued rows from many handlers should flush as one insert per table"""
+        from finucity.bulk import BulkBuffer
+        db = _FakeBulkDB()
+        buffer = BulkBuffer(interval=3600)
+        buffer.app = app
+        with patch('finucity.bulk.get_supabase', return_value=db), \
+                patch.object(BulkBuffer, '_ensure_thread'):
+            for i in range(3):
+                assert buffer.add('notifications', {'user_id': f'u{i}'})
+            buffer.add('admin_logs', {'action_type': 'x'})
+            assert buffer.pending() == 4
+            results = buffer.flush()
+        assert sorted(db.calls) == [('insert', 'admin_logs', 1), ('insert', 'notifications', 3)]
+        assert results['notifications'].succeeded == 3 and buffer.pending() == 0
+
+
+# =====================================================================
+# SUPABASE STAND-IN TESTS
+# =====================================================================
+
+def _standin_manager():
+    """Manager on a freshly emptied in-memory stand-in"""
+    from finucity.database import SupabaseClientManager
+    manager = SupabaseClientManager('sqlite://', '')
+    manager.client()
+    manager.raw.standin.reset()
+    manager.raw.standin.configure(latency={}, errors={})
+    return manager
+
+
+class TestSupabaseStandIn:
+    """Test the SQLite-backed PostgREST stand-in behind the managed client"""
+    
+    def test_crud_and_filters(self, app):
+        """Builders round-trip through the stand-in with PostgREST semantics"""
+        sb = _standin_manager().client()
+        sb.table('profiles').insert([
+            {'email': 'a@x.com', 'username': 'asha', 'role': 'ca', 'age': 41, 'city': 'Pune'},
+            {'email': 'b@x.com', 'username': 'ravi', 'role': 'user', 'age': 29, 'city': None},
+            {'email': 'c@x.com', 'username': 'meera', 'role': 'user', 'age': 35, 'city': 'Delhi'},
+        ]).execute()
+        
+        older = sb.table('profiles').select('username', count='exact').gte('age', 30).order('age').execute()
+        assert [r['username'] for r in older.data] == ['meera', 'asha'] and older.count == 2
+        assert [r['username'] for r in sb.table('profiles').select('username')
+                .in_('username', ['ravi', 'nobody']).execute().data] == ['ravi']
+        assert len(sb.table('profiles').select('id').not_.is_('city', 'null').execute().data) == 2
+        either = sb.table('profiles').select('username').or_('age.lt.30,role.eq.ca')\
+            .order('username').execute().data
+        assert [r['username'] for r in either] == ['asha', 'ravi']
+        page = sb.table('profiles').select('username', count='exact').order('age', desc=True).range(1, 3).execute()
+        assert [r['username'] for r in page.data] == ['meera', 'ravi'] and page.count == 3
+        assert sb.table('profiles').select('*').eq('username', 'asha').single().execute().data['age'] == 41
+        
+        updated = sb.table('profiles').update({'role': 'admin'}).eq('username', 'ravi').execute().data
+        assert updated[0]['role'] == 'admin' and updated[0]['id']
+        sb.table('profiles').delete().eq('role', 'user').execute()
+        assert sorted(r['username'] for r in sb.table('profiles').select('username').execute().data) == \
+            ['asha', 'ravi']
+    
+    def test_unique_views_and_rpcs_answer_like_postgres(self, app):
+        """UNIQUE columns, SQL views and unknown RPCs return real PostgREST errors"""
+        from postgrest import APIError
+        sb = _standin_manager().client()
+        sb.table('profiles').insert({'email': 'a@x.com', 'username': 'asha'}).execute()
+        with pytest.raises(APIError) as dup:
+            sb.table('profiles').insert({'email': 'z@x.com', 'username': 'asha'}).execute()
+        assert dup.value.code == '23505'
+        with pytest.raises(APIError) as view:
+            sb.table('ca_earnings_totals').select('*').eq('ca_id', 'ca1').execute()
+        assert view.value.code == '42P01'
+        with pytest.raises(APIError) as rpc:
+            sb.rpc('bulk_update_rows', {'p_table': 'profiles'}).execute()
+        assert rpc.value.code == 'PGRST202'
+    
+    def test_aggregates_and_ledger_fall_back(self, app):
+        """Views and RPCs absent from the stand-in route to the Python fallbacks"""
+        import finucity.aggregates as aggregates
+        import finucity.ledger as ledger
+        sb = _standin_manager().client()
+        sb.table('ca_reviews').insert([
+            {'ca_id': 'ca1', 'rating': 5, 'is_published': True},
+            {'ca_id': 'ca1', 'rating': 3, 'is_published': True},
+            {'ca_id': 'ca2', 'rating': 1, 'is_published': True},
+        ]).execute()
+        with app.app_context(), patch('finucity.aggregates.get_supabase', return_value=sb), \
+                patch('finucity.ledger.get_supabase', return_value=sb), \
+                patch.object(aggregates, '_missing_views', set()), patch.object(ledger, '_missing_rpcs', set()):
+            reviews = aggregates.CAAggregates.reviews('ca1')
+            ledger.LedgerService.post('ca1', 'credit', 1500)
+            balance = ledger.LedgerService.balance('ca1')
+        assert reviews.total_reviews == 2 and reviews.average_rating == 4.0
+        assert balance.balance == 1500 and balance.seq == 1
+    
+    def test_injected_read_failures_are_retried(self, app):
+        """Injected 503s and timeouts exercise the manager's read retries"""
+        from postgrest import APIError
+        manager = _standin_manager()
+        sb = manager.client()
+        sb.table('notifications').insert({'user_id': 'u1'}).execute()
+        manager.raw.standin.fail_next(1, 'read')
+        manager.raw.standin.fail_next(1, 'read', mode='timeout')
+        with patch('finucity.database.SUPABASE_RETRY_BASE_DELAY', 0):
+            assert len(sb.table('notifications').select('*').execute().data) == 1
+        assert manager.stats['retries'] == 2
+        
+        manager.raw.standin.fail_next(1, 'write')
+        with pytest.raises(APIError):
+            sb.table('notifications').insert({'user_id': 'u2'}).execute()
+        assert len(manager.raw.standin.rows('notifications')) == 1  # writes are never replayed
+    
+    def test_latency_injection_per_operation(self, app):
+        """Configured latency applies only to its operation kind"""
+        import time
+        manager = _standin_manager()
+        sb = manager.client()
+        manager.raw.standin.configure(latency={'write': 0.05})
+        started = time.perf_counter()
+        sb.table('notifications').select('*').execute()
+        read_seconds = time.perf_counter() - started
+        started = time.perf_counter()
+        sb.table('notifications').insert({'user_id': 'u1'}).execute()
+        assert time.perf_counter() - started >= 0.05 > read_seconds
+        assert manager.raw.standin.stats['requests']['write'] >= 1
+    
+    def test_storage_upload(self, app):
+        """storage.from_().upload stores objects; duplicates need upsert"""
+        from storage3.utils import StorageException
+        bucket = _standin_manager().client().storage.from_('ca_documents')
+        bucket.upload('u1/pan.pdf', b'%PDF-1.4')
+        with pytest.raises(StorageException):
+            bucket.upload('u1/pan.pdf', b'again')
+        bucket.upload('u1/pan.pdf', b'%PDF-1.7', {'upsert': 'true'})
+        assert bucket.download('u1/pan.pdf') == b'%PDF-1.7'
+        assert [o['name'] for o in bucket.list('u1')] == ['pan.pdf']
+
+
+# =====================================================================
+# WRITE OUTBOX TESTS
+# =====================================================================
+
+class TestWriteOutbox:
+    """Test the SQLite outbox and its dispatcher against the stand-in"""
+    
+    @pytest.fixture
+    def box(self, app):
+        from finucity.outbox import Outbox
+        manager = _standin_manager()
+        outbox = Outbox(path=':memory:')
+        outbox.app = app
+        outbox.standin = manager.raw.standin
+        with patch('finucity.outbox.get_supabase', return_value=manager.client()), \
+                patch.object(Outbox, '_ensure_thread'), patch('finucity.outbox.OUTBOX_RETRY_BASE_DELAY', 0):
+            yield outbox
+    
+    def test_chat_rows_are_written_synchronously(self, app):
+        """Chats and their feedback are readable on the next call, not after the outbox drains"""
+        from finucity.database import ChatService, FeedbackService
+        from finucity.outbox import outbox
+        manager = _standin_manager()
+        with app.test_request_context('/'), patch('finucity.database.get_supabase', return_value=manager.client()), \
+                patch.dict(app.config, {'ENABLE_WRITE_OUTBOX': True}):
+            assert outbox.enabled
+            before = outbox.pending()
+            saved = ChatService.create_query('u1', 'Is 80C capped?', 'Yes, at 1.5 lakh', session_id='s1')
+            FeedbackService.create_feedback('u1', saved['id'], rating=5, is_helpful=True)
+            row = ChatService.get_query_by_id(saved['id'])
+            assert outbox.pending() == before
+        assert row['question'] == 'Is 80C capped?' and row['rating'] == 5
+    
+    def test_inserts_are_batched_and_entities_stay_ordered(self, box):
+        """Independent inserts share a round trip; an entity's update follows its insert"""
+        for i in range(3):
+            box.enqueue('notifications', {'user_id': f'u{i}', 'title': 'hi'})
+        box.enqueue('chat_queries', {'id': 'q1', 'user_id': 'u1', 'question': 'q', 'response': 'r'},
+                    entity='chat_queries:q1')
+        box.enqueue('chat_queries', {'rating': 5}, op='update', entity='chat_queries:q1',
+                    match={'id': 'q1', 'user_id': 'u1'})
+        assert box.pending() == 5 and box.lag_seconds() >= 0
+        
+        writes = box.standin.stats['requests'].get('write', 0)
+        first = box.drain()
+        assert first['delivered'] == 4  # the update waits for its entity's insert
+        assert box.standin.stats['requests']['write'] - writes == 2
+        assert box.drain()['delivered'] == 1
+        assert box.standin.rows('chat_queries')[0]['rating'] == 5
+        assert len(box.standin.rows('notifications')) == 3
+        assert box.pending() == 0 and box.lag_seconds() == 0
+    
+    def test_outage_is_retried_then_delivered(self, box):
+        """While Supabase fails, entries stay queued and lag grows; they land once it recovers"""
+        box.enqueue('admin_logs', {'action_type': 'login'})
+        box.standin.configure(errors={'write': 1.0})
+        result = box.drain()
+        assert result == {'delivered': 0, 'retried': 1, 'dead': 0}
+        assert box.pending() == 1 and box.standin.rows('admin_logs') == []
+        box.standin.configure(errors={})
+        assert box.drain()['delivered'] == 1
+        assert len(box.standin.rows('admin_logs')) == 1
+    
+    def test_poison_rows_are_dead_lettered_and_requeued(self, box):
+        """A row Postgres rejects is isolated from its batch and kept with its error"""
+        box.standin.seed('profiles', [{'id': 'p0', 'email': 'taken@x.com'}])
+        box.enqueue('profiles', {'email': 'new@x.com'})
+        box.enqueue('profiles', {'email': 'taken@x.com'})
+        result = box.drain()
+        assert result['delivered'] == 1 and result['dead'] == 1
+        dead = box.dead_letters()
+        assert dead[0]['row'] == {'email': 'taken@x.com'} and 'duplicate key' in dead[0]['error']
+        box.standin.reset()
+        assert box.requeue() == 1 and box.drain()['delivered'] == 1
+    
+    def test_disabled_outbox_writes_through(self, box, app):
+        """ENABLE_WRITE_OUTBOX=false keeps the direct write"""
+        app.config['ENABLE_WRITE_OUTBOX'] = False
+        try:
+            with app.app_context():
+                assert box.enqueue('notifications', {'user_id': 'u1'}) is None
+        finally:
+            app.config['ENABLE_WRITE_OUTBOX'] = True
+        assert box.pending() == 0 and len(box.standin.rows('notifications')) == 1
+
+
+# =====================================================================
+# JWKS KEY STORE TESTS
+# =====================================================================
+
+class TestJWKSKeyStore:
+    """Test cached, header-driven Supabase token verification"""
+    
+    @pytest.fixture
+    def signer(self):
+        """An RSA key pair published as a one-key JWKS"""
+        import jwt
+        from cryptography.hazmat.primitives.asymmetric import rsa
+        private_key = rsa.generate_private_key(public_exponent=65537, key_size=2048)
+        jwk = json.loads(jwt.algorithms.RSAAlgorithm.to_jwk(private_key.public_key()))
+        jwk.update(kid='key-1', alg='RS256', use='sig')
+        return private_key, {'keys': [jwk]}
+    
+    @staticmethod
+    def _store(jwks):
+        from finucity.jwks import JWKSKeyStore
+        calls = []
+        
+        def fake_get(url, **kwargs):
+            calls.append(url)
+            response = MagicMock()
+            response.json.return_value = jwks
+            return response
+        return JWKSKeyStore(url='https://test.supabase.co/auth/v1/jwks'), calls, fake_get
+    
+    def test_keys_are_fetched_once_and_reused(self, signer):
+        """Only the first verification touches the network"""
+        import jwt
+        from finucity.jwks import decode_supabase_token
+        private_key, jwks = signer
+        store, calls, fake_get = self._store(jwks)
+        token = jwt.encode({'sub': 'u1', 'email': 'a@x.com'}, private_key, algorithm='RS256',
+                           headers={'kid': 'key-1'})
+        with patch('finucity.jwks.httpx.get', side_effect=fake_get):
+            for _ in range(5):
+                claims, err = decode_supabase_token(token, store)
+                assert err is None and claims['sub'] == 'u1'
+        assert len(calls) == 1 and store.stats['hits'] == 4
+    
+    def test_unknown_kid_refetch_is_rate_limited(self, signer):
+        """Forged kids cannot make every request refetch the JWKS"""
+        import jwt
+        from finucity.jwks import decode_supabase_token
+        private_key, jwks = signer
+        store, calls, fake_get = self._store(jwks)
+        forged = jwt.encode({'sub': 'x'}, private_key, algorithm='RS256', headers={'kid': 'rotated'})
+        with patch('finucity.jwks.httpx.get', side_effect=fake_get):
+            for _ in range(3):
+                claims, err = decode_supabase_token(forged, store)
+                assert claims is None and 'no signing key' in err
+        assert len(calls) == 1 and store.stats['refetch_throttled'] == 2
+    
+    def test_algorithm_comes_from_header(self, signer):
+        """HS256 tokens use the legacy secret without a JWKS fetch; 'none' is refused"""
+        import jwt
+        from finucity.jwks import decode_supabase_token
+        store, calls, fake_get = self._store(signer[1])
+        legacy = jwt.encode({'sub': 'u2'}, os.environ['SUPABASE_JWT_SECRET'], algorithm='HS256')
+        unsigned = jwt.encode({'sub': 'u3'}, None, algorithm='none')
+        with patch('finucity.jwks.httpx.get', side_effect=fake_get):
+            assert decode_supabase_token(legacy, store)[0]['sub'] == 'u2'
+            claims, err = decode_supabase_token(unsigned, store)
+        assert claims is None and 'unsupported algorithm' in err
+        assert calls == []
+
+
+# =====================================================================
+# SESSION PROFILE SNAPSHOT
+# =====================================================================
+
+class TestSessionSnapshot:
+    """Signed, versioned profile snapshot behind the Flask-Login user loader"""
+
+    PROFILE = {'id': 'u-1', 'email': 'asha@example.com', 'username': 'asha', 'first_name': 'Asha',
+               'last_name': 'Rao', 'role': 'user', 'is_active': True, 'phone': '98100'}
+
+    @pytest.fixture
+    def standin(self):
+        from finucity.database import supabase_db
+        manager = _standin_manager()
+        manager.raw.standin.seed('profiles', [{'id': 'u-1', 'email': 'asha@example.com', 'session_version': 0}])
+        with patch.object(supabase_db, 'manager', manager):
+            yield manager.raw.standin
+    
+    @pytest.fixture
+    def snapshots(self, app, standin):
+        from finucity.session_snapshot import SessionSnapshots, SessionVersions
+        snapshots = SessionSnapshots(versions=SessionVersions())
+        snapshots.init_app(app)
+        app.config['ENABLE_SESSION_SNAPSHOT'] = True
+        yield snapshots
+        app.config['ENABLE_SESSION_SNAPSHOT'] = False
+        from finucity.database import UserService
+        UserService._invalidators.remove(snapshots.bump)
+
+    def _fetch(self, profile=None):
+        from finucity.rows import ProfileRow
+        return patch('finucity.database.UserService._fetch_by_id',
+                     return_value=ProfileRow.from_row(profile or self.PROFILE))
+
+    def test_second_load_needs_no_profile_read(self, app, snapshots):
+        """The first load issues a snapshot, later loads rebuild the user from it"""
+        from finucity.session_snapshot import SnapshotUser
+        with app.test_request_context('/'), self._fetch() as fetch:
+            first = snapshots.load_user('u-1')
+            second = snapshots.load_user('u-1')
+        assert fetch.call_count == 1
+        assert isinstance(second, SnapshotUser)
+        assert (second.id, second.full_name, second.role, second.is_active) == ('u-1', 'Asha Rao', 'user', True)
+        assert first.email == second.email
+
+    def test_role_change_bumps_version(self, app, snapshots):
+        """A profile write invalidates the snapshot of every session of that user"""
+        from finucity.database import UserService
+        with app.test_request_context('/'), self._fetch() as fetch:
+            snapshots.load_user('u-1')
+            UserService.invalidate_cache('u-1')
+            fetch.return_value = fetch.return_value.__class__.from_row({**self.PROFILE, 'role': 'ca'})
+            user = snapshots.load_user('u-1')
+            assert snapshots.load_user('u-1').role == 'ca'
+        assert user.role == 'ca'
+        assert fetch.call_count == 2
+        assert snapshots.stats['stale'] == 1
+
+    def test_snapshot_carries_ca_status(self, app, snapshots):
+        """CA suspension and verification survive the snapshot for the CA layout banners"""
+        profile = {**self.PROFILE, 'role': 'ca', 'ca_status': 'suspended', 'verification_status': 'verified'}
+        with app.test_request_context('/'), self._fetch(profile) as fetch:
+            snapshots.load_user('u-1')
+            user = snapshots.load_user('u-1')
+        assert fetch.call_count == 1
+        assert user._data.get('ca_status') == 'suspended' and user.verification_status == 'verified'
+
+    def test_tampered_or_foreign_snapshot_is_rejected(self, app, snapshots):
+        """Edited tokens and tokens issued for another user force a reload"""
+        from flask import session
+        from finucity.session_snapshot import SESSION_KEY
+        with app.test_request_context('/'), self._fetch() as fetch:
+            snapshots.load_user('u-1')
+            token = session[SESSION_KEY]
+            session[SESSION_KEY] = token[:-2] + ('A' if token[-2] != 'A' else 'B') + token[-1]
+            assert snapshots.load_user('u-1').role == 'user'
+            snapshots.load_user('u-2')
+        assert fetch.call_count == 3
+        assert snapshots.stats['invalid'] == 2
+
+    def test_fields_outside_snapshot_load_lazily(self, app, snapshots):
+        """Attributes not carried in the token fetch the full profile once, on demand"""
+        from finucity.rows import ProfileRow
+        with app.test_request_context('/'), self._fetch():
+            snapshots.load_user('u-1')
+            user = snapshots.load_user('u-1')
+        assert 'phone' not in user._data
+        with app.app_context(), patch('finucity.database.UserService.get_by_id',
+                                      return_value=ProfileRow.from_row(self.PROFILE)) as full:
+            assert user.phone == '98100'
+            assert user.city is None
+        assert full.call_count == 1
+    
+    def test_bump_reaches_other_hosts_and_survives_restart(self, app, snapshots):
+        """The version lives in profiles: a bump elsewhere and a fresh store both reject old tokens"""
+        from finucity.database import supabase_db
+        from finucity.session_snapshot import SessionVersions
+        with app.test_request_context('/'), self._fetch() as fetch:
+            snapshots.load_user('u-1')
+            other_host = SessionVersions()
+            other_host.bump('u-1')  # e.g. a suspension handled by another host
+            snapshots.versions.cache.clear()  # this worker's cache entry expired
+            snapshots.load_user('u-1')
+            assert fetch.call_count == 2 and snapshots.stats['stale'] == 1
+            snapshots.versions = SessionVersions()  # restart: nothing host-local to lose
+            snapshots.load_user('u-1')
+            assert fetch.call_count == 2
+        stored = supabase_db.get_client().table('profiles').select('session_version').eq('id', 'u-1').execute()
+        assert stored.data[0]['session_version'] > 0
+    
+    def test_missing_column_disables_snapshots(self, app, snapshots):
+        """Before the migration every load reads the profile instead of trusting a token"""
+        from postgrest import APIError
+        sb = MagicMock()
+        sb.table.return_value.select.return_value.eq.return_value.limit.return_value.execute.side_effect = APIError(
+            {'code': '42703', 'message': 'column profiles.session_version does not exist'})
+        with app.test_request_context('/'), self._fetch() as fetch, \
+                patch('finucity.session_snapshot.supabase_db.get_client', return_value=sb):
+            snapshots.load_user('u-1')
+            snapshots.load_user('u-1')
+        assert fetch.call_count == 2
+        assert snapshots.versions.get('u-1') is None and snapshots.stats['issued'] == 0
+
+
+# =====================================================================
+# USERNAME ALLOCATION
+# =====================================================================
+
+class TestUsernameAllocation:
+    """Single-query username allocation with unique-violation retry"""
+    
+    @pytest.fixture
+    def manager(self):
+        from finucity.database import supabase_db
+        manager = _standin_manager()
+        with patch.object(supabase_db, 'manager', manager):
+            yield manager
+    
+    def test_lowest_free_suffix_in_one_query(self, app, manager):
+        """Taken names come back from one prefix query; look-alike names are ignored"""
+        from finucity.database import UserService
+        standin = manager.raw.standin
+        standin.seed('profiles', [{'email': f'{name}@x.com', 'username': name}
+                                  for name in ('rahul', 'rahul1', 'rahul3', 'rahulsharma', 'xrahul')])
+        reads = standin.stats['requests'].get('read', 0)
+        with app.app_context():
+            assert UserService.allocate_username('Rahul') == 'rahul2'
+            assert standin.stats['requests']['read'] - reads == 1
+            assert UserService.allocate_username('rahul', first_suffix=3) == 'rahul4'
+            assert UserService.allocate_username('meera') == 'meera'
+    
+    def test_lost_race_rescans(self, app, manager):
+        """A signup that loses its name to a concurrent one takes the next free name"""
+        from finucity.database import UserService
+        allocate = UserService.allocate_username
+        
+        def racing(base, first_suffix=1, taken=None):
+            name = allocate(base, first_suffix, taken)
+            if not taken:  # another signup commits the same name first
+                manager.client().table('profiles').insert({'email': 'other@x.com', 'username': name}).execute()
+            return name
+        
+        with app.app_context(), patch.object(UserService, 'allocate_username', side_effect=racing):
+            created = UserService.create_with_username({'id': 'u-9', 'email': 'rahul@x.com'}, 'rahul')
+        assert created['username'] == 'rahul1'
+        assert sorted(row['username'] for row in manager.raw.standin.rows('profiles')) == ['rahul', 'rahul1']
+    
+    def test_concurrent_signups_get_distinct_names(self, app, manager):
+        """Parallel signups from one email prefix never share a username"""
+        from concurrent.futures import ThreadPoolExecutor
+        from finucity.database import UserService
+        
+        def signup(index):
+            with app.app_context():
+                return UserService.create_with_username({'email': f'rahul.{index}@x.com'}, 'rahul')
+        
+        with ThreadPoolExecutor(max_workers=8) as pool:
+            created = list(pool.map(signup, range(24)))
+        assert all(created)
+        assert len({row['username'] for row in created}) == 24
+
+
+# =====================================================================
+# SHARED RATE LIMITER
+# =====================================================================
+
+class TestSharedRateLimiter:
+    """Sliding-window limiter shared by workers, behind both rate-limit decorators"""
+    
+    def test_sliding_window_weighs_previous_window(self):
+        """Counts of the previous window decay as the sliding window moves on"""
+        from finucity.ratelimit import SlidingWindowLimiter
+        limiter = SlidingWindowLimiter(':memory:')
+        with patch('finucity.ratelimit.time.time', return_value=1000.0):  # window [960, 1020)
+            assert [limiter.hit('k', 4, 60).allowed for _ in range(5)] == [True] * 4 + [False]
+        with patch('finucity.ratelimit.time.time', return_value=1030.0):  # 5/6 of previous window inside
+            assert limiter.hit('k', 4, 60).allowed  # floor(4 * 5/6) + 1 <= 4
+            result = limiter.hit('k', 4, 60)
+            assert not result.allowed and result.retry_after == pytest.approx(5.0)
+        with patch('finucity.ratelimit.time.time', return_value=1065.0):  # 25% inside: 1 + 1 <= 4
+            assert limiter.hit('k', 4, 60).allowed
+    
+    def test_workers_share_one_budget(self, tmp_path):
+        """Two limiter instances on one file (two workers) draw from the same counter"""
+        from finucity.ratelimit import SlidingWindowLimiter
+        path = str(tmp_path / 'ratelimit.sqlite')
+        first, second = SlidingWindowLimiter(path), SlidingWindowLimiter(path)
+        outcomes = [(first if i % 2 else second).hit('ip:1', 5, 60).allowed for i in range(8)]
+        assert outcomes.count(True) == 5
+    
+    def test_idle_keys_are_evicted(self):
+        """Memory stays bounded: expired keys go first, then the least recently used"""
+        from finucity.ratelimit import SlidingWindowLimiter
+        limiter = SlidingWindowLimiter(':memory:', max_keys=3)
+        with patch('finucity.ratelimit.time.time', return_value=1000.0):
+            limiter.hit('stale', 10, 1)
+        for moment, key in enumerate(['a', 'b', 'c', 'd'], start=1001):
+            with patch('finucity.ratelimit.time.time', return_value=float(moment)):
+                limiter.hit(key, 10, 60)
+        assert limiter.sweep(1005.0) == 2
+        assert len(limiter) == 3
+        with patch('finucity.ratelimit.time.time', return_value=1005.0):
+            assert limiter.window_state('a', 60)[2] == 0
+            assert limiter.window_state('d', 60)[2] == 1
+    
+    def test_client_ip_trusts_only_proxy_hops(self, app):
+        """Only the hop our proxy appended counts; client-supplied entries are ignored"""
+        from finucity.ratelimit import client_ip
+        with app.test_request_context('/', headers={'X-Forwarded-For': '6.6.6.6, 203.0.113.7'},
+                                      environ_base={'REMOTE_ADDR': '10.0.0.2'}):
+            assert client_ip() == '203.0.113.7'
+        with app.test_request_context('/', environ_base={'REMOTE_ADDR': '10.0.0.2'}):
+            assert client_ip() == '10.0.0.2'
+    
+    def test_decorators_use_shared_backend(self, app):
+        """rate_limit answers 429 with Retry-After; flask-limiter uses the same storage"""
+        from flask import Flask
+        from finucity.ca_ecosystem_routes import rate_limit
+        from finucity.ratelimit import SharedLimiterStorage
+        tiny = Flask('limited')
+        
+        @tiny.route('/ping')
+        @rate_limit(max_requests=2, window=60)
+        def ping():
+            return 'pong'
+        
+        client = tiny.test_client()
+        codes = [client.get('/ping', environ_base={'REMOTE_ADDR': '198.51.100.9'}).status_code for _ in range(3)]
+        assert codes == [200, 200, 429]
+        assert int(client.get('/ping', environ_base={'REMOTE_ADDR': '198.51.100.9'}).headers['Retry-After']) >= 1
+        assert client.get('/ping', environ_base={'REMOTE_ADDR': '198.51.100.10'}).status_code == 200
+        assert all(isinstance(ext.storage, SharedLimiterStorage) for ext in app.extensions['limiter'])
+
+
+# =====================================================================
+# LOGIN FLOW
+# =====================================================================
+
+class TestLoginFlow:
+    """Concurrent auth + profile read, single profile fetch, bounded hash checks"""
+    
+    @pytest.fixture
+    def standin(self):
+        from finucity.database import supabase_db
+        manager = _standin_manager()
+        with patch.object(supabase_db, 'manager', manager):
+            yield manager.raw.standin
+    
+    @staticmethod
+    def _login(client, email, password):
+        return client.post('/auth/flask-login', json={'email': email, 'password': password})
+    
+    def test_supabase_login_reads_profile_once(self, client, standin):
+        """Auth and the profile read overlap; the profile is read once"""
+        from finucity.database import supabase_db
+        user_id = supabase_db.manager.client().auth.sign_up({'email': 'asha@x.com', 'password': 'pw-123456'}).user.id
+        standin.seed('profiles', [{'id': user_id, 'email': 'asha@x.com', 'username': 'asha', 'role': 'ca'}])
+        reads = standin.stats['requests'].get('read', 0)
+        response = self._login(client, 'asha@x.com', 'pw-123456')
+        assert response.status_code == 200
+        assert response.get_json()['role'] == 'ca'
+        assert standin.stats['requests']['read'] - reads == 1
+    
+    def test_missing_profile_gets_a_unique_username(self, client, standin):
+        """An auth user without a profile gets one even when the email prefix is taken"""
+        from finucity.database import supabase_db
+        supabase_db.manager.client().auth.sign_up({'email': 'asha@y.com', 'password': 'pw-123456'})
+        standin.seed('profiles', [{'id': 'u-other', 'email': 'asha@x.com', 'username': 'asha', 'role': 'user'}])
+        with patch('finucity.database.PlatformStatsService.mark_stale'):  # no background refresh on the stand-in
+            response = self._login(client, 'asha@y.com', 'pw-123456')
+        assert response.status_code == 200
+        created = supabase_db.manager.client().table('profiles').select('username').eq('email', 'asha@y.com').execute()
+        assert created.data == [{'username': 'asha2'}]
+    
+    def test_password_hash_fallback_reuses_profile(self, client, standin):
+        """Rejected by Supabase Auth, the already-fetched profile's hash is checked"""
+        from werkzeug.security import generate_password_hash
+        standin.seed('profiles', [{'id': 'u-hash', 'email': 'ravi@x.com', 'username': 'ravi', 'role': 'user',
+                                   'password_hash': generate_password_hash('secret-1', method='pbkdf2:sha256:1000')}])
+        reads = standin.stats['requests'].get('read', 0)
+        assert self._login(client, 'ravi@x.com', 'secret-1').status_code == 200
+        assert standin.stats['requests']['read'] - reads == 1
+        assert self._login(client, 'ravi@x.com', 'wrong').status_code == 401
+        body = client.get('/metrics').data.decode()
+        assert 'finucity_login_stage_seconds_bucket{' in body and 'stage="hash"' in body
+    
+    def test_stages_overlap(self, app, standin):
+        """Total latency is close to the slower stage, not the sum"""
+        from finucity.database import supabase_db
+        from finucity.login_flow import authenticate
+        supabase_db.manager.client().auth.sign_up({'email': 'meera@x.com', 'password': 'pw-654321'})
+        standin.configure(latency={'auth': 0.1, 'read': 0.1})
+        with app.app_context():
+            result = authenticate('meera@x.com', 'pw-654321')
+        assert result.method == 'supabase'
+        assert result.timings['auth'] >= 0.1 and result.timings['profile'] >= 0.1
+        assert result.timings['total'] < result.timings['auth'] + result.timings['profile'] - 0.05
+    
+    def test_saturated_hash_pool_sheds(self, client, standin):
+        """With every hash slot taken the login is refused with 503, not queued"""
+        import threading
+        from werkzeug.security import generate_password_hash
+        standin.seed('profiles', [{'id': 'u-shed', 'email': 'shed@x.com', 'username': 'shed',
+                                   'password_hash': generate_password_hash('pw', method='pbkdf2:sha256:1000')}])
+        with patch('finucity.login_flow._hash_slots', threading.BoundedSemaphore(1)) as slots:
+            slots.acquire()
+            assert self._login(client, 'shed@x.com', 'pw').status_code == 503
+    
+    def test_admin_login_statuses(self, client, standin):
+        """Admin path: wrong password and unknown email both 401, non-admin 403, admin 200"""
+        from werkzeug.security import generate_password_hash
+        hashed = lambda pw: generate_password_hash(pw, method='pbkdf2:sha256:1000')  # noqa: E731
+        standin.seed('profiles', [
+            {'id': 'u-admin', 'email': 'root@x.com', 'username': 'root', 'role': 'admin', 'password_hash': hashed('adm-1')},
+            {'id': 'u-plain', 'email': 'plain@x.com', 'username': 'plain', 'role': 'user', 'password_hash': hashed('usr-1')},
+        ])
+        login = lambda email, pw: client.post('/admin/auth/login', json={'email': email, 'password': pw})  # noqa: E731
+        for email, pw in (('root@x.com', 'wrong'), ('nobody@x.com', 'adm-1')):
+            response = login(email, pw)
+            assert response.status_code == 401
+            assert response.get_json()['error'] == 'Invalid admin credentials'
+        assert login('plain@x.com', 'usr-1').status_code == 403
+        response = login('root@x.com', 'adm-1')
+        assert response.status_code == 200 and response.get_json()['success'] is True
+
+
+# =====================================================================
+# TAX SLAB ENGINE
+# =====================================================================
+
+class TestTaxSlabEngine:
+    """Compiled slab tables shared by the calculators and regime comparison"""
+    
+    def test_new_regime_matches_fy_2023_24_slabs(self):
+        from finucity.services.tax_slabs import TaxSlabEngine
+        table = TaxSlabEngine.table('new')
+        expected = {0: 0, 300000: 0, 600000: 15000, 750000: 30000, 900000: 45000,
+                    1200000: 90000, 1500000: 150000, 2000000: 300000}
+        for income, tax in expected.items():
+            assert table.tax(income) == pytest.approx(tax)
+        slabs = table.breakdown(600000)
+        assert [s['range'] for s in slabs] == ['0 - 3,00,000', '3,00,001 - 6,00,000']
+        assert sum(s['tax'] for s in table.breakdown(1750000)) == pytest.approx(table.tax(1750000))
+    
+    def test_old_regime_exemption_by_age(self):
+        from finucity.services.tax_slabs import TaxSlabEngine
+        assert TaxSlabEngine.table('old', 'below_60').tax(500000) == pytest.approx(12500)
+        assert TaxSlabEngine.table('old', '60_to_80').tax(500000) == pytest.approx(10000)
+        super_senior = TaxSlabEngine.table('old', 'above_80')
+        assert super_senior.tax(500000) == 0
+        assert super_senior.tax(1200000) == pytest.approx(100000 + 60000)
+        # The 5% slab is fully exempt for super seniors and is not listed
+        assert [s['rate'] for s in super_senior.breakdown(1200000)] == ['0%', '20%', '30%']
+    
+    def test_calculators_and_regime_comparison_agree(self):
+        from finucity.services import FinancialCalculators, TaxPlanningService
+        for income in (450000, 700000, 700001, 1300000, 2600000):
+            calc = FinancialCalculators.income_tax_calculator(income, regime='new')
+            assert TaxPlanningService._calculate_new_regime(income) == pytest.approx(calc['total_tax'])
+            calc = FinancialCalculators.income_tax_calculator(income, regime='old',
+                                                             deductions={'standard_deduction': 50000})
+            planned = TaxPlanningService._calculate_old_regime(income, {'standard_deduction': 50000})
+            assert planned == pytest.approx(calc['total_tax'])
+    
+    def test_financial_year_selects_slabs_and_rebate(self):
+        from finucity.services import FinancialCalculators
+        result = FinancialCalculators.income_tax_calculator(1200000, fy='2025-26')
+        assert result['financial_year'] == '2025-26'
+        assert result['rebate_87a'] == pytest.approx(60000)
+        assert result['total_tax'] == 0
+        assert FinancialCalculators.income_tax_calculator(1200000)['total_tax'] == pytest.approx(90000 * 1.04)
+        with pytest.raises(ValueError):
+            FinancialCalculators.income_tax_calculator(1200000, fy='1999-00')
+
+
+# =====================================================================
+# BATCH INCOME TAX
+# =====================================================================
+
+class TestTaxBatch:
+    """Vectorized income tax matches the scalar calculator row for row"""
+    
+    def test_batch_matches_scalar_calculator(self):
+        import numpy as np
+        from finucity.services import FinancialCalculators
+        rng = np.random.default_rng(3)
+        incomes = np.concatenate([[0, 300000, 500000, 700000, 700001, 1000000, 1500000],
+                                  rng.uniform(0, 5e6, 200).round()])
+        n = len(incomes)
+        ages = rng.choice(['below_60', '60_to_80', 'above_80', 'unknown'], n)
+        regimes = rng.choice(['new', 'old'], n)
+        deductions = {'80c': rng.uniform(0, 2e5, n), '80d': 40000, 'hra': rng.uniform(0, 1e5, n)}
+        batch = FinancialCalculators.income_tax_batch(incomes, ages, regimes, deductions)
+        assert len(batch) == n
+        for i in range(n):
+            claims = {'80c': deductions['80c'][i], '80d': 40000, 'hra': deductions['hra'][i]}
+            scalar = FinancialCalculators.income_tax_calculator(incomes[i], ages[i], regimes[i], claims)
+            for field in ('taxable_income', 'total_deductions', 'rebate_87a', 'cess_4_percent',
+                          'total_tax', 'effective_rate', 'take_home'):
+                assert batch[field][i] == pytest.approx(scalar[field], abs=1e-6), (i, field)
+    
+    def test_scalar_labels_and_columnar_output(self):
+        from finucity.services import FinancialCalculators
+        from finucity.services.tax_batch import OUTPUT_FIELDS
+        batch = FinancialCalculators.income_tax_batch([600000, 1800000], fy='2025-26')
+        columns = batch.to_dict()
+        assert tuple(columns) == OUTPUT_FIELDS
+        assert columns['total_tax'][0] == 0
+        rows = list(batch.rows())
+        assert rows[1]['total_tax'] == pytest.approx(
+            FinancialCalculators.income_tax_calculator(1800000, fy='2025-26')['total_tax'])
+
+
+# =====================================================================
+# CALCULATOR BATCH API
+# =====================================================================
+
+class TestCalculatorBatchAPI:
+    """Bulk calculator invocations: vectorized evaluation, streamed NDJSON, one history insert"""
+    
+    @staticmethod
+    def _lines(response):
+        return [json.loads(line) for line in response.get_data(as_text=True).splitlines()]
+    
+    def test_mixed_batch_matches_single_routes(self, client):
+        items = [
+            {'calculator': 'income_tax', 'income': 1250000, 'regime': 'old', 'age_group': '60_to_80',
+             'deductions': {'80c': 150000, '80d': 40000}},
+            {'calculator': 'hra', 'basic_salary': 600000, 'hra_received': 240000, 'rent_paid': 300000,
+             'is_metro': True},
+            {'calculator': 'tax_regime', 'income': 900000, 'deductions': {'80c': 150000}},
+            {'calculator': 'lottery'},
+            {'calculator': 'income_tax', 'income': 'lots'},
+        ]
+        response = client.post('/calculators/api/batch', json={'items': items})
+        assert response.status_code == 200
+        assert response.mimetype == 'application/x-ndjson'
+        lines = self._lines(response)
+        assert [line.get('index') for line in lines[:-1]] == [0, 1, 2, 3, 4]
+        single = client.post('/calculators/api/income-tax', json=items[0]).get_json()
+        for field in ('total_tax', 'rebate_87a', 'taxable_income', 'take_home'):
+            assert lines[0]['result'][field] == pytest.approx(single[field])
+        assert lines[1]['result'] == client.post('/calculators/api/hra', json=items[1]).get_json()
+        single = client.post('/calculators/api/tax-regime', json=items[2]).get_json()
+        assert lines[2]['result']['savings'] == pytest.approx(single['savings'])
+        assert lines[2]['result']['recommended'] == single['recommended']
+        assert 'Unknown calculator' in lines[3]['error'] and 'Invalid input' in lines[4]['error']
+        assert lines[-1]['summary'] == {'items': 5, 'succeeded': 3, 'failed': 2}
+    
+    def test_csv_upload_with_nested_columns(self, client):
+        import io
+        csv_text = ('income,regime,deductions.80c,deductions.hra\n'
+                    '800000,old,150000,\n'
+                    '1800000,new,,\n')
+        response = client.post('/calculators/api/batch?calculator=income_tax',
+                               data={'file': (io.BytesIO(csv_text.encode()), 'payroll.csv')},
+                               content_type='multipart/form-data')
+        lines = self._lines(response)
+        from finucity.services import FinancialCalculators
+        expected = FinancialCalculators.income_tax_calculator(800000, regime='old', deductions={'80c': 150000})
+        assert lines[0]['result']['total_tax'] == pytest.approx(expected['total_tax'])
+        assert lines[1]['result']['tax_regime'] == 'New'
+        ndjson = '\n'.join(json.dumps({'calculator': 'gst', 'amount': a}) for a in (100, 200))
+        lines = self._lines(client.post('/calculators/api/batch', data=ndjson,
+                                        content_type='application/x-ndjson'))
+        assert [line['result']['gst_amount'] for line in lines[:-1]] == [18, 36]
+    
+    def test_rate_limit_counts_batches_not_items(self, client):
+        from finucity.ratelimit import rate_limiter
+        from finucity.services_routes import CALC_BATCH_MAX_ITEMS
+        rate_limiter.clear()
+        items = [{'calculator': 'tds', 'income': i} for i in range(500)]
+        client.post('/calculators/api/batch', json=items)
+        (count,) = rate_limiter._db().execute('SELECT curr FROM rate_windows WHERE key LIKE ?',
+                                              ('calculators.calculate_batch:%',)).fetchone()
+        assert count == 1
+        too_many = client.post('/calculators/api/batch',
+                               json=[{'calculator': 'tds'}] * (CALC_BATCH_MAX_ITEMS + 1))
+        assert too_many.status_code == 413
+    
+    def test_history_written_in_one_bulk_insert(self, client):
+        from finucity.bulk import BulkResult
+        items = [{'income': income} for income in (500000, 900000, 1500000)] + [{'calculator': 'gst', 'amount': 1}]
+        with patch('finucity.database.UserService.get_by_id', return_value={'id': 'u-1', 'email': 'a@b.c'}), \
+                patch('finucity.services_routes.BulkWriter.insert', return_value=BulkResult()) as insert:
+            with client.session_transaction() as sess:
+                sess['_user_id'] = 'u-1'
+                sess['_fresh'] = True
+            response = client.post('/calculators/api/batch', json={'calculator': 'income_tax', 'items': items})
+            self._lines(response)
+        assert insert.call_count == 1
+        table, rows = insert.call_args[0]
+        assert table == 'calculator_history' and len(rows) == 3
+        assert rows[2]['input_data'] == {'income': 1500000}
+
+
+# =====================================================================
+# REGIME SWEEP
+# =====================================================================
+
+class TestRegimeSweep:
+    """Income x deduction heatmap: vectorized grid, analytic break-even, cached body"""
+    
+    def test_grid_matches_point_comparisons(self):
+        from finucity.services import TaxPlanningService
+        from finucity.services.regime_sweep import RegimeSweep, SweepGrid
+        result = RegimeSweep.compute(SweepGrid(income_steps=7, deduction_steps=5))
+        for i in (0, 3, 6):
+            for j in (0, 2, 4):
+                point = TaxPlanningService.compare_tax_regimes(
+                    result['incomes'][i], {'total': result['deductions'][j]})
+                assert result['savings'][i, j] == pytest.approx(
+                    point['old_regime']['tax_amount'] - point['new_regime']['tax_amount'])
+    
+    def test_break_even_is_exact_crossing(self):
+        """At the analytic break-even the regimes cost the same; just below it the new one wins"""
+        import numpy as np
+        from finucity.services import TaxPlanningService
+        from finucity.services.regime_sweep import RegimeSweep
+        incomes = np.array([800000.0, 1000000.0, 1550000.0, 3000000.0])
+        for income, deduction in zip(incomes, RegimeSweep.break_even(incomes)):
+            at = TaxPlanningService.compare_tax_regimes(income, {'total': deduction})
+            before = TaxPlanningService.compare_tax_regimes(income, {'total': deduction - 100})
+            assert at['recommended'] == 'old' or at['difference'] == pytest.approx(0, abs=1e-6)
+            assert before['recommended'] == 'new'
+    
+    def test_sweep_api_validates_and_caches(self, client):
+        from finucity.services.regime_sweep import sweep_cache
+        sweep_cache.clear()
+        response = client.get('/calculators/api/tax-regime/sweep?income_steps=50&deduction_steps=40')
+        assert response.status_code == 200
+        body = response.get_json()
+        assert len(body['savings']) == 50 and len(body['savings'][0]) == 40
+        assert len(body['break_even_deduction']) == 50 and set(body['contours']) >= {'10000', '-10000'}
+        assert body['summary']['cells'] == 2000
+        misses = sweep_cache.stats['misses']
+        again = client.post('/calculators/api/tax-regime/sweep', json={'income_steps': 50, 'deduction_steps': 40})
+        assert again.data == response.data and sweep_cache.stats['misses'] == misses
+        bad = client.get('/calculators/api/tax-regime/sweep?income_steps=100000')
+        assert bad.status_code == 400 and not bad.get_json()['success']
+    
+    def test_sweep_api_is_rate_limited_and_cache_bounded_by_bytes(self, client):
+        """Distinct client grids cannot grow the cache past its byte budget or outrun the limit"""
+        from finucity.services.regime_sweep import sweep_cache
+        from finucity.services_routes import SWEEP_RATE_LIMIT
+        assert sweep_cache.max_weight is not None
+        sweep_cache.clear()
+        codes = [client.get(f'/calculators/api/tax-regime/sweep?income_steps=10&deduction_steps=10&income_max={5000000 + i}',
+                            environ_base={'REMOTE_ADDR': '198.51.100.77'}).status_code
+                 for i in range(SWEEP_RATE_LIMIT + 1)]
+        assert codes == [200] * SWEEP_RATE_LIMIT + [429]
+        assert sweep_cache.weight == sum(len(value) for value, _ in sweep_cache._data.values())
+
+
+# =====================================================================
+# SIP ENGINE
+# =====================================================================
+
+class TestSIPEngine:
+    """Vectorized SIP schedules: step-up, top-ups, pauses, monthly/yearly breakdowns"""
+    
+    def test_flat_plan_matches_closed_form(self):
+        from finucity.services import FinancialCalculators
+        result = FinancialCalculators.sip_calculator(5000, 12, 10)
+        r, n = 0.01, 120
+        assert result['maturity_value'] == pytest.approx(5000 * ((1 + r) ** n - 1) / r * (1 + r))
+        assert result['expected_return'] == '12%' and result['tenure_years'] == 10
+        year_3 = result['yearly_breakdown'][2]
+        assert year_3['year'] == 3 and year_3['invested'] == 180000
+        assert year_3['value'] == pytest.approx(5000 * ((1 + r) ** 36 - 1) / r * (1 + r))
+        assert FinancialCalculators.sip_calculator(1000, 0, 2)['maturity_value'] == pytest.approx(24000)
+    
+    def test_step_up_top_ups_and_pauses_match_month_loop(self):
+        from finucity.services import FinancialCalculators
+        result = FinancialCalculators.sip_calculator(
+            5000, 12, 3, step_up_percent=10, top_ups=[{'month': 13, 'amount': 50000}],
+            pauses=[{'from': 5, 'to': 7}], granularity='monthly')
+        value = invested = 0
+        for month in range(1, 37):
+            paid = 0 if 5 <= month <= 7 else 5000 * 1.1 ** ((month - 1) // 12)
+            paid += 50000 if month == 13 else 0
+            invested += paid
+            value = (value + paid) * 1.01
+        assert len(result['monthly_breakdown']) == 36
+        assert result['monthly_breakdown'][6]['invested'] == 20000  # months 5-7 paused
+        assert result['total_invested'] == pytest.approx(invested)
+        assert result['maturity_value'] == pytest.approx(value)
+    
+    def test_batch_plans_share_one_simulation(self, client):
+        from finucity.services.sip_engine import SIPEngine, SIPPlan
+        plans = [SIPPlan(5000, 12, 480, step_up_percent=10), SIPPlan(2000, 8, 24)]
+        invested, value = SIPEngine.simulate(plans)
+        assert invested.shape == value.shape == (2, 480)
+        items = [{'calculator': 'sip', 'monthly_investment': 2000, 'expected_return': 8, 'tenure_years': 2},
+                 {'calculator': 'sip', 'monthly_investment': 100, 'tenure_years': 1,
+                  'top_ups': [{'month': 99, 'amount': 1}]}]
+        lines = [json.loads(line) for line in
+                 client.post('/calculators/api/batch', json=items).get_data(as_text=True).splitlines()]
+        assert lines[0]['result']['maturity_value'] == pytest.approx(value[1, 23])
+        assert 'outside the tenure' in lines[1]['error']
+    
+    def test_extreme_returns_rejected_and_values_stay_finite(self, client):
+        """Returns outside SIP_RETURN_RANGE are a 400; the widest allowed plans stay finite JSON"""
+        import math
+        from finucity.services.sip_engine import SIPEngine, SIPPlan
+        for rate in (-1000, 1000, float('nan')):
+            response = client.post('/calculators/api/sip', data=json.dumps(
+                {'monthly_investment': 5000, 'expected_return': rate, 'tenure_years': 100}),
+                content_type='application/json')
+            assert response.status_code == 400
+            assert 'Expected return' in json.loads(response.get_data(as_text=True))['error']
+        for rate in (-100, 100):
+            response = client.post('/calculators/api/sip', json={
+                'monthly_investment': 5000, 'expected_return': rate, 'tenure_years': 100, 'granularity': 'monthly'})
+            assert response.status_code == 200
+            body = json.loads(response.get_data(as_text=True), parse_constant=pytest.fail)
+            assert all(math.isfinite(point['value']) for point in body['monthly_breakdown'])
+        with pytest.raises(ValueError, match='out of range'):
+            SIPEngine.simulate([SIPPlan(1e300, 100, 1200)])
+
+
 if __name__ == '__main__':
     pytest.main([__file__, '-v', '--tb=short'])